@@ -3,8 +3,11 @@
 import os
 import logging
 import math
+import multiprocessing
+import numbers
 import itertools
 import time
+import threading
 import re
 import pandas
 
@@ -22,6 +25,15 @@ NODATA_FLOAT = -16777216
 
 LOGGER = logging.getLogger(__name__)
 
+# Largest number of pixels of the lulc rasters the model calculates at once.
+LARGEST_BLOCK = 2**10
+
+# Number of blocks read ahead of the writer per worker process.
+_BLOCKS_PER_WORKER = 2
+
+# Model inputs of the worker processes, set by ``_init_block_calculator``.
+_BLOCK_STATE = {}
+
 ARGS_SPEC = {
     "model_name": "InVEST Coastal Blue Carbon",
     "module": __name__,
@@ -267,6 +279,9 @@ def execute(args):
         args['discount_rate'] (float): the discount rate on future valuations of
             sequestered carbon, compounded yearly.  Provided as a percentage
             (e.g. 3.0 for 3%).
+        args['n_workers'] (int): (optional) The number of worker processes to
+            calculate blocks of the rasters on.  If omitted, computation will
+            take place in the current process.
 
     Example Args::
 
@@ -293,251 +308,348 @@ def execute(args):
     LOGGER.info("Starting Coastal Blue Carbon model run...")
     d = get_inputs(args)
 
-    # Setup Logging
-    num_blocks = get_num_blocks(d['C_prior_raster'])
-    blocks_processed = 0.
+    try:
+        n_workers = int(args['n_workers'])
+    except (KeyError, ValueError, TypeError):
+        # KeyError when n_workers is not present in args
+        # ValueError when n_workers is an empty string.
+        # TypeError when n_workers is None.
+        n_workers = -1  # single process mode.
+
+    _calculate_transient_analysis(d, n_workers=n_workers)
+    LOGGER.info("...Coastal Blue Carbon model run complete.")
+
+
+def _get_output_raster_paths(d):
+    """List the output rasters in the order their blocks are calculated.
+
+    Args:
+        d (dict): the model inputs returned by ``get_inputs``.
+
+    Returns:
+        list of the paths of the T_s, A_r, E_r, N_r, total net sequestration
+        and, if there is an economic analysis, NPV rasters, in the order of
+        the arrays returned by ``_calculate_block``.
+    """
+    output_raster_paths = list(itertools.chain(
+        *[d['File_Registry'][key] for key in [
+            'T_s_rasters', 'A_r_rasters', 'E_r_rasters', 'N_r_rasters']]))
+    output_raster_paths.append(d['File_Registry']['N_total_raster'])
+    if d['do_economic_analysis']:
+        output_raster_paths.extend(
+            d['File_Registry']['NPV_transition_rasters'])
+    return output_raster_paths
+
+
+def _calculate_transient_analysis(
+        d, n_workers=-1, largest_block=LARGEST_BLOCK):
+    """Calculate the model's outputs a block of the lulc rasters at a time.
+
+    Blocks of the baseline and transition rasters are read by the pool's
+    task feeder thread, their carbon is calculated on ``n_workers``
+    processes, and the results are written as they come back.  Every input
+    and output raster is opened once for the whole analysis.
+
+    Args:
+        d (dict): the model inputs returned by ``get_inputs``.  The output
+            rasters must already exist.
+        n_workers (int): number of worker processes to calculate blocks on.
+            If less than 1, blocks are calculated in this process.
+        largest_block (int): the largest number of pixels to read from a
+            raster at once.  The memory a block takes grows with the number
+            of its valid pixels times the number of transitions.
+
+    Returns:
+        None
+    """
+    C_prior_info = pygeoprocessing.get_raster_info(d['C_prior_raster'])
+    C_nodata = C_prior_info['nodata'][0]
+    n_cells = C_prior_info['raster_size'][0] * C_prior_info['raster_size'][1]
+    n_cells_processed = 0
     last_time = time.time()
 
-    # Limit block size here to try to improve memory usage of the application.
-    block_iterator = enumerate(pygeoprocessing.iterblocks(
-        (d['C_prior_raster'], 1), largest_block=2**10))
-    C_nodata = pygeoprocessing.get_raster_info(
-        d['C_prior_raster'])['nodata'][0]
-
-    for block_idx, (offset_dict, C_prior) in block_iterator:
-        current_time = time.time()
-        blocks_processed += 1.
-        if (current_time - last_time >= 5 or
-                blocks_processed in [0, num_blocks-1]):
-            LOGGER.info('Processing model, about %.2f%% complete',
-                        (blocks_processed/num_blocks) * 100)
-            last_time = current_time
-
-        # Initialization
-        valid_mask = C_prior != C_nodata
-        valid_C_prior = C_prior[valid_mask]
-
-        timesteps = d['timesteps']
-
-        valid_shape = valid_C_prior.shape
-
-        # timesteps+1 to include initial conditions
-        stock_shape = (timesteps+1,) + valid_shape
-        S_biomass = numpy.zeros(stock_shape, dtype=numpy.float32)  # Stock
-        S_soil = numpy.zeros(stock_shape, dtype=numpy.float32)
-        T = numpy.zeros(stock_shape, dtype=numpy.float32)  # Total Carbon Stock
-
-        timestep_shape = (timesteps,) + valid_shape
-        A_biomass = numpy.zeros(timestep_shape,
-                                dtype=numpy.float32)  # Accumulation
-        A_soil = numpy.zeros(timestep_shape, dtype=numpy.float32)
-        E_biomass = numpy.zeros(timestep_shape,
-                                dtype=numpy.float32)  # Emissions
-        E_soil = numpy.zeros(timestep_shape, dtype=numpy.float32)
-        # Net Sequestration
-        N_biomass = numpy.zeros(timestep_shape, dtype=numpy.float32)
-        N_soil = numpy.zeros(timestep_shape, dtype=numpy.float32)
-        V = numpy.zeros(timestep_shape, dtype=numpy.float32)  # Valuation
-
-        snapshot_shape = (d['transitions']+1,) + valid_shape
-        L = numpy.zeros(snapshot_shape, dtype=numpy.float32)  # Litter
-
-        transition_shape = (d['transitions'],) + valid_shape
-        # Yearly Accumulation
-        Y_biomass = numpy.zeros(transition_shape, dtype=numpy.float32)
-        Y_soil = numpy.zeros(transition_shape, dtype=numpy.float32)
-        # Disturbance Percentage
-        D_biomass = numpy.zeros(transition_shape, dtype=numpy.float32)
-        D_soil = numpy.zeros(transition_shape, dtype=numpy.float32)
-        H_biomass = numpy.zeros(transition_shape,
-                                dtype=numpy.float32)  # Half-life
-        H_soil = numpy.zeros(transition_shape, dtype=numpy.float32)
-        # Total Disturbed Carbon
-        R_biomass = numpy.zeros(transition_shape, dtype=numpy.float32)
-        R_soil = numpy.zeros(transition_shape, dtype=numpy.float32)
-
-        # Set Accumulation and Disturbance Values
-        C_r = [read_from_raster(i, offset_dict)[valid_mask]
-               for i in d['C_r_rasters']]
-        if C_r:
-            # final transition out to analysis year
-            C_list = [valid_C_prior] + C_r + [C_r[-1]]
-        else:
-            C_list = [valid_C_prior]*2  # allow for a final analysis
-        for i in range(0, d['transitions']):
-            D_biomass[i] = reclass_transition(
-                C_list[i],
-                C_list[i+1],
-                d['lulc_trans_to_Db'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-            D_soil[i] = reclass_transition(
-                C_list[i],
-                C_list[i+1],
-                d['lulc_trans_to_Ds'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-            H_biomass[i] = reclass(
-                C_list[i],
-                d['lulc_to_Hb'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-            H_soil[i] = reclass(
-                C_list[i], d['lulc_to_Hs'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-            Y_biomass[i] = reclass(
-                C_list[i+1], d['lulc_to_Yb'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-            Y_soil[i] = reclass(
-                C_list[i+1],
-                d['lulc_to_Ys'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-
-        S_biomass[0] = reclass(
-            valid_C_prior,
-            d['lulc_to_Sb'],
-            out_dtype=numpy.float32,
-            nodata_mask=C_nodata)
-        S_soil[0] = reclass(
-            valid_C_prior,
-            d['lulc_to_Ss'],
-            out_dtype=numpy.float32,
-            nodata_mask=C_nodata)
-
-        for i in range(0, len(C_list)):
-            L[i] = reclass(
-                C_list[i],
-                d['lulc_to_L'],
-                out_dtype=numpy.float32,
-                nodata_mask=C_nodata)
-
-        T[0] = S_biomass[0] + S_soil[0]
-
-        R_biomass[0] = D_biomass[0] * S_biomass[0]
-        R_soil[0] = D_soil[0] * S_soil[0]
-
-        # Transient Analysis
-        for i in range(0, timesteps):
-            transition_idx = timestep_to_transition_idx(
-                d['snapshot_years'], d['transitions'], i)
-
-            if is_transition_year(d['snapshot_years'], d['transitions'], i):
-                # Set disturbed stock values
-                R_biomass[transition_idx] = \
-                    D_biomass[transition_idx] * S_biomass[i]
-                R_soil[transition_idx] = D_soil[transition_idx] * S_soil[i]
-
-            # Accumulation
-            A_biomass[i] = Y_biomass[transition_idx]
-            A_soil[i] = Y_soil[transition_idx]
-
-            # Emissions
-            for transition_idx in range(0, timestep_to_transition_idx(
-                    d['snapshot_years'], d['transitions'], i)+1):
-
-                try:
-                    j = (d['transition_years'][transition_idx] -
-                         d['transition_years'][0])
-                except IndexError:
-                    # When we're at the analysis year, we're out of transition
-                    # years to calculate for.  Transition years represent years
-                    # for which we have LULC rasters, and the analysis year
-                    # doesn't have a transition LULC associated with it.
-                    break
-
-                E_biomass[i] += R_biomass[transition_idx] * \
-                    (0.5**(i-j) - 0.5**(i-j+1))
-                E_soil[i] += R_soil[transition_idx] * \
-                    (0.5**(i-j) - 0.5**(i-j+1))
-
-            # Net Sequestration
-            N_biomass[i] = A_biomass[i] - E_biomass[i]
-            N_soil[i] = A_soil[i] - E_soil[i]
-
-            # Next Stock
-            S_biomass[i+1] = S_biomass[i] + N_biomass[i]
-            S_soil[i+1] = S_soil[i] + N_soil[i]
-            T[i+1] = S_biomass[i+1] + S_soil[i+1]
-
-            # Net Present Value
-            if d['do_economic_analysis']:
-                V[i] = (N_biomass[i] + N_soil[0]) * d['price_t'][i]
-
-        # Write outputs: T_s, A_r, E_r, N_r, NPV
-        s_years = d['snapshot_years']
-        num_snapshots = len(s_years)
-
-        A = A_biomass + A_soil
-        E = E_biomass + E_soil
-        N = N_biomass + N_soil
+    transition_raster_list = [
+        gdal.OpenEx(raster_path, gdal.OF_RASTER)
+        for raster_path in d['C_r_rasters']]
+    transition_band_list = [
+        raster.GetRasterBand(1) for raster in transition_raster_list]
+    output_raster_list = [
+        gdal.OpenEx(raster_path, gdal.OF_RASTER | gdal.GA_Update)
+        for raster_path in _get_output_raster_paths(d)]
+    output_band_list = [
+        raster.GetRasterBand(1) for raster in output_raster_list]
+
+    # limits the blocks read ahead of the writer so memory use stays bounded
+    # if the writer falls behind
+    n_blocks_in_flight = max(1, n_workers) * _BLOCKS_PER_WORKER
+    block_semaphore = threading.Semaphore(n_blocks_in_flight)
+
+    def _read_lulc_blocks():
+        """Yield blocks of the baseline and transition rasters."""
+        for offset_dict, C_prior in pygeoprocessing.iterblocks(
+                (d['C_prior_raster'], 1), largest_block=largest_block):
+            block_semaphore.acquire()
+            yield offset_dict, C_prior, [
+                band.ReadAsArray(**offset_dict)
+                for band in transition_band_list]
+
+    if n_workers > 0:
+        worker_pool = multiprocessing.Pool(
+            n_workers, initializer=_init_block_calculator,
+            initargs=(d, C_nodata))
+        block_result_iter = worker_pool.imap(
+            _calculate_block, _read_lulc_blocks())
+    else:
+        worker_pool = None
+        _init_block_calculator(d, C_nodata)
+        block_result_iter = (
+            _calculate_block(block_args)
+            for block_args in _read_lulc_blocks())
 
-        A_r = [sum(A[s_to_timestep(s_years, i):s_to_timestep(s_years, i+1)])
-               for i in range(0, num_snapshots-1)]
-        E_r = [sum(E[s_to_timestep(s_years, i):s_to_timestep(s_years, i+1)])
-               for i in range(0, num_snapshots-1)]
-        N_r = [sum(N[s_to_timestep(s_years, i):s_to_timestep(s_years, i+1)])
-               for i in range(0, num_snapshots-1)]
+    try:
+        for offset_dict, output_array_list in block_result_iter:
+            for band, output_array in zip(
+                    output_band_list, output_array_list):
+                band.WriteArray(
+                    output_array, offset_dict['xoff'], offset_dict['yoff'])
+            block_semaphore.release()
+            n_cells_processed += (
+                offset_dict['win_xsize'] * offset_dict['win_ysize'])
+            current_time = time.time()
+            if current_time - last_time >= 5:
+                LOGGER.info('Processing model, about %.2f%% complete',
+                            (n_cells_processed / float(n_cells)) * 100)
+                last_time = current_time
+    finally:
+        if worker_pool is not None:
+            # unblock the reader so the pool can stop its feeder thread
+            for _ in range(n_blocks_in_flight):
+                block_semaphore.release()
+            worker_pool.terminate()
+            worker_pool.join()
+        _BLOCK_STATE.clear()
+
+    for band in output_band_list:
+        band.FlushCache()
+    output_band_list = None
+    output_raster_list = None
+    transition_band_list = None
+    transition_raster_list = None
+
+
+def _init_block_calculator(d, C_nodata):
+    """Set the model inputs used by ``_calculate_block``.
+
+    This is the initializer of the worker processes of
+    ``_calculate_transient_analysis``.
 
-        T_s = [T[s_to_timestep(s_years, i)] for i in range(0, num_snapshots)]
+    Args:
+        d (dict): the model inputs returned by ``get_inputs``.
+        C_nodata (number): the nodata value of the lulc rasters.
+
+    Returns:
+        None
+    """
+    _BLOCK_STATE.update({
+        'd': d,
+        'C_nodata': C_nodata,
+    })
 
-        # Add litter to total carbon stock
-        if len(T_s) == len(L):
-            T_s = numpy.add(T_s, L)
-        else:
-            T_s = numpy.add(T_s, L[:-1])
 
-        N_total = numpy.sum(N, axis=0)
+def _to_output_block(valid_array, valid_mask):
+    """Fill a block of an output raster with the values of valid pixels.
 
-        raster_tuples = [
+    Args:
+        valid_array (numpy.array): the output's values on the valid pixels.
+        valid_mask (numpy.array): the block's mask of valid lulc pixels.
+
+    Returns:
+        out_array (numpy.array): float32 block that is ``NODATA_FLOAT``
+            where the lulc is not valid or the value is NaN.
+    """
+    out_array = numpy.empty(valid_mask.shape, dtype=numpy.float32)
+    out_array[:] = NODATA_FLOAT
+    out_array[valid_mask] = valid_array
+    out_array[numpy.isnan(out_array)] = NODATA_FLOAT
+    return out_array
+
+
+def _calculate_block(block_args):
+    """Calculate the model's outputs on a block of the lulc rasters.
+
+    The stocks are carried forward a timestep at a time, and each output
+    is accumulated as the timesteps it covers are reached, so the memory
+    used grows with the number of transitions and snapshots rather than
+    the number of timesteps.  The total carbon disturbed by a transition is
+    kept for the rest of the analysis, as its emissions in a timestep are
+    that carbon decayed by half for each year since the transition.
+
+    ``_init_block_calculator`` must have been called in this process.
+
+    Args:
+        block_args (tuple): the offset dict of the block, the block of the
+            baseline lulc raster, and a list of the blocks of each
+            transition lulc raster.
+
+    Returns:
+        a tuple of the block's offset dict and a list of a float32 array per
+        path of ``_get_output_raster_paths``.
+    """
+    offset_dict, C_prior, C_r_block_list = block_args
+    d = _BLOCK_STATE['d']
+    C_nodata = _BLOCK_STATE['C_nodata']
+    snapshot_years = d['snapshot_years']
+    transitions = d['transitions']
+
+    # Initialization
+    valid_mask = C_prior != C_nodata
+    valid_C_prior = C_prior[valid_mask]
+    valid_shape = valid_C_prior.shape
+
+    C_r = [C_r_block[valid_mask] for C_r_block in C_r_block_list]
+    if C_r:
+        # final transition out to analysis year
+        C_list = [valid_C_prior] + C_r + [C_r[-1]]
+    else:
+        C_list = [valid_C_prior]*2  # allow for a final analysis
+
+    def _reclass_lulc(lulc_array, lookup_key):
+        """Reclassify valid lulc pixels with one of the model's maps."""
+        return reclass(
+            lulc_array, d[lookup_key], out_dtype=numpy.float32,
+            nodata_mask=C_nodata).astype(numpy.float32)
+
+    def _disturbance(transition_idx, lookup_key):
+        """Get the disturbance percentage of a transition's pixels."""
+        return numpy.ma.getdata(reclass_transition(
+            C_list[transition_idx], C_list[transition_idx+1],
+            d[lookup_key], out_dtype=numpy.float32, nodata_mask=C_nodata))
+
+    # Stock
+    S_biomass = _reclass_lulc(valid_C_prior, 'lulc_to_Sb')
+    S_soil = _reclass_lulc(valid_C_prior, 'lulc_to_Ss')
+    T = S_biomass + S_soil  # Total Carbon Stock
+
+    # Total Disturbed Carbon of each transition
+    R_biomass = numpy.zeros(
+        (transitions,) + valid_shape, dtype=numpy.float32)
+    R_soil = numpy.zeros((transitions,) + valid_shape, dtype=numpy.float32)
+    R_biomass[0] = _disturbance(0, 'lulc_trans_to_Db') * S_biomass
+    R_soil[0] = _disturbance(0, 'lulc_trans_to_Ds') * S_soil
+
+    # Outputs, accumulated over the timesteps between snapshots
+    snapshot_timesteps = [
+        s_to_timestep(snapshot_years, i)
+        for i in range(0, len(snapshot_years))]
+    n_intervals = len(snapshot_years) - 1
+    A_r = numpy.zeros((n_intervals,) + valid_shape, dtype=numpy.float32)
+    E_r = numpy.zeros((n_intervals,) + valid_shape, dtype=numpy.float32)
+    N_r = numpy.zeros((n_intervals,) + valid_shape, dtype=numpy.float32)
+    N_total = numpy.zeros(valid_shape, dtype=numpy.float32)
+    T_s = [None] * len(snapshot_years)
+    NPV = numpy.zeros(valid_shape, dtype=numpy.float32)  # Valuation
+    NPV_s = [None] * len(snapshot_years)
+    for snapshot_idx, snapshot_timestep in enumerate(snapshot_timesteps):
+        if snapshot_timestep == 0:
+            T_s[snapshot_idx] = T
+
+    # Transient Analysis
+    yearly_transition_idx = None
+    for i in range(0, d['timesteps']):
+        transition_idx = timestep_to_transition_idx(
+            snapshot_years, transitions, i)
+        if transition_idx != yearly_transition_idx:
+            # Yearly Accumulation
+            Y_biomass = _reclass_lulc(
+                C_list[transition_idx+1], 'lulc_to_Yb')
+            Y_soil = _reclass_lulc(C_list[transition_idx+1], 'lulc_to_Ys')
+            yearly_transition_idx = transition_idx
+
+        if is_transition_year(snapshot_years, transitions, i):
+            # Set disturbed stock values
+            R_biomass[transition_idx] = _disturbance(
+                transition_idx, 'lulc_trans_to_Db') * S_biomass
+            R_soil[transition_idx] = _disturbance(
+                transition_idx, 'lulc_trans_to_Ds') * S_soil
+
+        # Emissions
+        E_biomass = numpy.zeros(valid_shape, dtype=numpy.float32)
+        E_soil = numpy.zeros(valid_shape, dtype=numpy.float32)
+        for emission_idx in range(0, transition_idx+1):
+            try:
+                j = (d['transition_years'][emission_idx] -
+                     d['transition_years'][0])
+            except IndexError:
+                # When we're at the analysis year, we're out of transition
+                # years to calculate for.  Transition years represent years
+                # for which we have LULC rasters, and the analysis year
+                # doesn't have a transition LULC associated with it.
+                break
+
+            E_biomass += R_biomass[emission_idx] * \
+                (0.5**(i-j) - 0.5**(i-j+1))
+            E_soil += R_soil[emission_idx] * \
+                (0.5**(i-j) - 0.5**(i-j+1))
+
+        # Net Sequestration
+        N_biomass = Y_biomass - E_biomass
+        N_soil = Y_soil - E_soil
+        if i == 0:
+            first_N_soil = N_soil
+
+        # Next Stock
+        S_biomass = S_biomass + N_biomass
+        S_soil = S_soil + N_soil
+        T = S_biomass + S_soil
+
+        N = N_biomass + N_soil
+        for interval_idx in range(0, n_intervals):
+            if (snapshot_timesteps[interval_idx] <= i <
+                    snapshot_timesteps[interval_idx+1]):
+                A_r[interval_idx] += Y_biomass + Y_soil
+                E_r[interval_idx] += E_biomass + E_soil
+                N_r[interval_idx] += N
+        N_total += N
+
+        # Net Present Value
+        if d['do_economic_analysis']:
+            NPV += (
+                (N_biomass + first_N_soil) *
+                d['price_t'][i]).astype(numpy.float32)
+
+        for snapshot_idx, snapshot_timestep in enumerate(snapshot_timesteps):
+            if snapshot_timestep == i:
+                # Including the year of the snapshot as well
+                NPV_s[snapshot_idx] = NPV.copy()
+            if snapshot_timestep == i+1:
+                T_s[snapshot_idx] = T
+
+    # Write outputs: T_s, A_r, E_r, N_r, NPV
+    # Add litter to total carbon stock
+    T_s = [
+        T_s[i] + _reclass_lulc(C_list[i], 'lulc_to_L')
+        for i in range(0, len(snapshot_years))]
+
+    output_array_list = []
+    for key, array in [
             ('T_s_rasters', T_s),
             ('A_r_rasters', A_r),
             ('E_r_rasters', E_r),
-            ('N_r_rasters', N_r)]
-
-        for key, array in raster_tuples:
-            for i in range(0, len(d['File_Registry'][key])):
-                out_array = numpy.empty_like(C_prior, dtype=numpy.float32)
-                out_array[:] = NODATA_FLOAT
-                out_array[valid_mask] = array[i]
-                write_to_raster(
-                    d['File_Registry'][key][i],
-                    out_array,
-                    offset_dict['xoff'],
-                    offset_dict['yoff'])
-
-        N_total_out_array = numpy.empty_like(C_prior, dtype=numpy.float32)
-        N_total_out_array[:] = NODATA_FLOAT
-        N_total_out_array[valid_mask] = N_total
-        write_to_raster(
-            d['File_Registry']['N_total_raster'],
-            N_total_out_array,
-            offset_dict['xoff'],
-            offset_dict['yoff'])
+            ('N_r_rasters', N_r)]:
+        for i in range(0, len(d['File_Registry'][key])):
+            output_array_list.append(
+                _to_output_block(array[i], valid_mask))
+    output_array_list.append(_to_output_block(N_total, valid_mask))
 
-        if d['do_economic_analysis']:
-            NPV = numpy.sum(V, axis=0)
-            NPV_out_array = numpy.empty_like(C_prior, dtype=numpy.float32)
-            NPV_out_array[:] = NODATA_FLOAT
-            NPV_out_array[valid_mask] = NPV
-
-            for snapshot_year, snapshot_raster_path in zip(
-                    d['snapshot_years'], d['File_Registry']['NPV_transition_rasters']):
-                # Including the year of the snapshot as well (hence the +1)
-                # Baseline year will also be in d['snapshot_years'] at index 0.
-                end_timestep_index = snapshot_year - int(args['lulc_baseline_year']) + 1
-                snapshot_npv = numpy.empty_like(C_prior, dtype=numpy.float32)
-                snapshot_npv[:] = NODATA_FLOAT
-                snapshot_npv[valid_mask] = numpy.sum(V[:end_timestep_index], axis=0)
-                write_to_raster(
-                    snapshot_raster_path,
-                    snapshot_npv,
-                    offset_dict['xoff'],
-                    offset_dict['yoff'])
+    if d['do_economic_analysis']:
+        for snapshot_npv in NPV_s:
+            # snapshots after the last timestep have the whole analysis
+            if snapshot_npv is None:
+                snapshot_npv = NPV
+            output_array_list.append(
+                _to_output_block(snapshot_npv, valid_mask))
 
-    LOGGER.info("...Coastal Blue Carbon model run complete.")
+    return offset_dict, output_array_list
 
 
 def timestep_to_transition_idx(snapshot_years, transitions, timestep):
@@ -665,10 +777,73 @@ def reclass(array, d, out_dtype=None, nodata_mask=None):
     return reclass_array
 
 
+def _build_transition_lookup(trans_dict):
+    """Build a dense lookup array of the values of lulc transitions.
+
+    Args:
+        trans_dict (dict): map of (previous lulc, next lulc) tuples to the
+            value of that transition.  Transitions between codes that are
+            not numbers can't be found in a lulc array and are left out.
+
+    Returns:
+        prev_codes (numpy.array): sorted previous lulc codes
+        next_codes (numpy.array): sorted next lulc codes
+        value_array (numpy.array): 2D array of the value of the transition
+            from ``prev_codes[i]`` to ``next_codes[j]`` at ``[i, j]``
+        has_value_array (numpy.array): 2D boolean array that is True where
+            ``value_array`` holds the value of a transition in `trans_dict`
+    """
+    transition_list = [
+        (transition_tuple, value)
+        for transition_tuple, value in trans_dict.items()
+        if all(isinstance(code, numbers.Number)
+               for code in transition_tuple)]
+    code_array = numpy.array(
+        [transition_tuple for transition_tuple, _ in transition_list],
+        dtype=numpy.float64).reshape((-1, 2))
+    prev_codes, prev_index = numpy.unique(
+        code_array[:, 0], return_inverse=True)
+    next_codes, next_index = numpy.unique(
+        code_array[:, 1], return_inverse=True)
+
+    value_array = numpy.zeros((prev_codes.size, next_codes.size))
+    has_value_array = numpy.zeros(value_array.shape, dtype=bool)
+    value_array[prev_index, next_index] = numpy.array(
+        [value for _, value in transition_list], dtype=numpy.float64)
+    has_value_array[prev_index, next_index] = True
+    return prev_codes, next_codes, value_array, has_value_array
+
+
+def _find_codes(code_array, sorted_codes):
+    """Find the index of each value of an array in a sorted array of codes.
+
+    Args:
+        code_array (numpy.array): 1D array of lulc codes
+        sorted_codes (numpy.array): sorted 1D array of float64 codes
+
+    Returns:
+        index_array (numpy.array): the index of each code of `code_array`
+            in `sorted_codes`, or 0 where the code isn't found
+        found_mask (numpy.array): boolean array that is True where the code
+            was found
+    """
+    code_array = code_array.astype(numpy.float64)
+    if sorted_codes.size == 0:
+        return (numpy.zeros(code_array.shape, dtype=numpy.intp),
+                numpy.zeros(code_array.shape, dtype=bool))
+    index_array = numpy.searchsorted(sorted_codes, code_array)
+    index_array[index_array == sorted_codes.size] = 0
+    found_mask = sorted_codes[index_array] == code_array
+    index_array[~found_mask] = 0
+    return index_array, found_mask
+
+
 def reclass_transition(a_prev, a_next, trans_dict, out_dtype=None,
                        nodata_mask=None):
     """Reclass arrays based on element-wise combinations between two arrays.
 
+    Pixels whose transition is not in `trans_dict` are masked.
+
     Args:
         a_prev (numpy.array): previous lulc array
         a_next (numpy.array): next lulc array
@@ -678,19 +853,32 @@ def reclass_transition(a_prev, a_next, trans_dict, out_dtype=None,
             if provided to make reclass_array nodata values consistent
 
     Returns:
-        reclass_array (numpy.array): reclassified array
+        reclass_array (numpy.ma.masked_array): reclassified array
     """
     a = a_prev.flatten()
     b = a_next.flatten()
-    c = numpy.ma.masked_array(numpy.zeros(a.shape))
+    prev_codes, next_codes, value_array, has_value_array = (
+        _build_transition_lookup(trans_dict))
+    prev_index, prev_found = _find_codes(a, prev_codes)
+    next_index, next_found = _find_codes(b, next_codes)
+    # each (previous, next) pair is encoded as the flat index of its cell in
+    # the lookup arrays
+    transition_index = prev_index * next_codes.size + next_index
+    if has_value_array.size == 0:
+        found_mask = numpy.zeros(a.shape, dtype=bool)
+        c = numpy.zeros(a.shape)
+    else:
+        found_mask = (
+            prev_found & next_found &
+            has_value_array.ravel()[transition_index])
+        c = numpy.where(
+            found_mask, value_array.ravel()[transition_index], 0.0)
     if out_dtype:
         c = c.astype(out_dtype)
-
-    for index, transition_tuple in enumerate(zip(a, b)):
-        if transition_tuple in trans_dict:
-            c[index] = trans_dict[transition_tuple]
-        else:
-            c[index] = numpy.ma.masked
+    if found_mask.all():
+        c = numpy.ma.masked_array(c)
+    else:
+        c = numpy.ma.masked_array(c, mask=~found_mask)
 
     if nodata_mask and numpy.issubdtype(c.dtype, numpy.floating):
         c[a == nodata_mask] = numpy.nan
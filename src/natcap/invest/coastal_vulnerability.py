@@ -3,6 +3,7 @@ import time
 import os
 import math
 import logging
+import multiprocessing
 import pickle
 
 import numpy
@@ -207,6 +208,12 @@ ARGS_SPEC = {
 
 
 _N_FETCH_RAYS = 16
+_FETCH_RAY_OFFSET = 1  # meters from the shore point to start each ray
+_FETCH_RAY_BLOCK_SIZE = 2**6  # shore points to cast rays from at once
+# largest number of ray and line segment pairs to intersect at once
+_MAX_RAY_SEGMENT_PAIRS = 2**20
+# state of the ray caster in this process, see ``_init_fetch_ray_caster``
+_FETCH_RAY_CASTER_STATE = {}
 SHORE_ID_FIELD = 'shore_id'
 
 
@@ -432,7 +439,7 @@ def execute(args):
               target_rtree_path, target_lines_pickle_path,
               target_bathy_raster_path, target_fetch_rays_path,
               max_fetch_distance, fetch_point_vector_path,
-              target_wind_exposure_pickle_path),
+              target_wind_exposure_pickle_path, n_workers),
         target_path_list=[fetch_point_vector_path,
                           target_fetch_rays_path,
                           target_wind_exposure_pickle_path],
@@ -1041,9 +1048,14 @@ def calculate_wind_exposure(
         base_shore_point_vector_path, landmass_polygon_pickle_path,
         landmass_line_rtree_path, landmass_lines_pickle_path,
         bathymetry_raster_path, target_fetch_rays_path, max_fetch_distance,
-        target_shore_point_vector_path, target_wind_exposure_pickle_path):
+        target_shore_point_vector_path, target_wind_exposure_pickle_path,
+        n_workers=-1):
     """Calculate wind exposure for each shore point.
 
+    Fetch rays are cast from blocks of ``_FETCH_RAY_BLOCK_SIZE`` shore points
+    at a time by intersecting all of a block's rays with the landmass line
+    segments near the block in numpy.
+
     Args:
         base_shore_point_vector_path (string): path to a point vector
             with WWIII variables in the table.
@@ -1065,6 +1077,8 @@ def calculate_wind_exposure(
             an 'REI' (relative exposure index) field added.
         target_wind_exposure_pickle_path (string): path to pickle file storing
             dict keyed by shore point fid, with wind exposure values.
+        n_workers (int): number of worker processes to cast blocks of rays
+            on.  If less than 1, rays are cast in this process.
 
     Returns:
         None
@@ -1080,18 +1094,6 @@ def calculate_wind_exposure(
 
     gpkg_driver = ogr.GetDriverByName('GPKG')
 
-    # Get prepared polygon geom for point-in-poly checks
-    with open(landmass_polygon_pickle_path, 'rb') as polygon_pickle_file:
-        landmass_shapely = pickle.load(polygon_pickle_file)
-    landmass_shapely_prep = shapely.prepared.prep(landmass_shapely)
-
-    with open(landmass_lines_pickle_path, 'rb') as lines_pickle_file:
-        shapely_line_index = pickle.load(lines_pickle_file)
-
-    # load an existing rtree from disk
-    polygon_line_rtree = rtree.index.Index(
-        os.path.splitext(landmass_line_rtree_path)[0])
-
     # create fetch rays
     temp_fetch_rays_vector = gpkg_driver.CreateDataSource(
         target_fetch_rays_path)
@@ -1129,136 +1131,102 @@ def calculate_wind_exposure(
         target_shore_point_layer.CreateField(
             ogr.FieldDefn('fdepth_%d' % compass_degree, ogr.OFTReal))
 
+    # Cast every ray of a block of shore points at once, either here or on
+    # a pool of worker processes that each load the landmass and bathymetry
+    LOGGER.info("Casting rays and extracting bathymetry values")
+    fid_list = []
+    shore_point_coord_list = []
+    for shore_point_feature in target_shore_point_layer:
+        shore_point_geometry = shore_point_feature.GetGeometryRef()
+        fid_list.append(shore_point_feature.GetFID())
+        shore_point_coord_list.append(
+            (shore_point_geometry.GetX(), shore_point_geometry.GetY()))
+        shore_point_geometry = None
+    target_shore_point_layer.ResetReading()
+    shore_point_coord_array = numpy.array(
+        shore_point_coord_list, dtype=numpy.float64).reshape((-1, 2))
+    shore_point_coord_list = None
+    block_slice_list = [
+        slice(block_start, block_start + _FETCH_RAY_BLOCK_SIZE)
+        for block_start in range(
+            0, len(fid_list), _FETCH_RAY_BLOCK_SIZE)]
+    caster_args = (
+        landmass_polygon_pickle_path, landmass_line_rtree_path,
+        landmass_lines_pickle_path, bathymetry_raster_path,
+        max_fetch_distance)
+    if n_workers > 0:
+        worker_pool = multiprocessing.Pool(
+            n_workers, initializer=_init_fetch_ray_caster,
+            initargs=caster_args)
+        ray_block_iter = worker_pool.imap(
+            _cast_fetch_rays, [
+                shore_point_coord_array[block_slice]
+                for block_slice in block_slice_list])
+    else:
+        worker_pool = None
+        _init_fetch_ray_caster(*caster_args)
+        ray_block_iter = (
+            _cast_fetch_rays(shore_point_coord_array[block_slice])
+            for block_slice in block_slice_list)
+
+    direction_array = _fetch_ray_directions()
     shore_point_logger = _make_logger_callback(
         "Wind exposure %.2f%% complete.", LOGGER)
-    # Iterate over every shore point
-    LOGGER.info("Casting rays and extracting bathymetry values")
     result_REI = {}
-    bathy_raster = gdal.OpenEx(
-        bathymetry_raster_path, gdal.OF_RASTER | gdal.GA_ReadOnly)
-    bathy_band = bathy_raster.GetRasterBand(1)
-    bathy_raster_info = pygeoprocessing.get_raster_info(bathymetry_raster_path)
-    bathy_gt = bathy_raster_info['geotransform']
-    bathy_nodata = bathy_raster_info['nodata']
-
     target_shore_point_layer.StartTransaction()
     temp_fetch_rays_layer.StartTransaction()
-    for shore_point_feature in target_shore_point_layer:
-        shore_id = shore_point_feature.GetField(SHORE_ID_FIELD)
-        shore_point_logger(
-            float(shore_id) /
-            target_shore_point_layer.GetFeatureCount())
-        rei_value = 0.0
-        # Iterate over every ray direction
-        for sample_index in range(_N_FETCH_RAYS):
-            compass_degree = int(sample_index * 360 / 16.)
-            compass_theta = float(sample_index) / _N_FETCH_RAYS * 360
-            rei_pct = shore_point_feature.GetField(
-                'REI_PCT%d' % int(compass_theta))
-            rei_v = shore_point_feature.GetField(
-                'REI_V%d' % int(compass_theta))
-            cartesian_theta = -(compass_theta - 90)
-
-            # Determine the direction the ray will point
-            delta_x = math.cos(cartesian_theta * math.pi / 180)
-            delta_y = math.sin(cartesian_theta * math.pi / 180)
-
-            # Start a ray offset from the shore point
-            # so that rays start outside of the landmass.
-            # Shore points are interpolated onto the coastline,
-            # but floating point error results in points being just
-            # barely inside/outside the landmass.
-            offset = 1  # 1 meter should be plenty
-            shore_point_geometry = shore_point_feature.GetGeometryRef()
-            point_a_x = (
-                shore_point_geometry.GetX() + delta_x * offset)
-            point_a_y = (
-                shore_point_geometry.GetY() + delta_y * offset)
-            point_b_x = point_a_x + delta_x * (
-                max_fetch_distance)
-            point_b_y = point_a_y + delta_y * (
-                max_fetch_distance)
-            shore_point_geometry = None
-
-            # build ray geometry so we can intersect it later
-            ray_geometry = ogr.Geometry(ogr.wkbLineString)
-            ray_geometry.AddPoint(point_a_x, point_a_y)
-            ray_geometry.AddPoint(point_b_x, point_b_y)
-
-            # keep a shapely version of the ray so we can do fast intersection
-            # with it and the entire landmass
-            ray_point_origin_shapely = shapely.geometry.Point(
-                point_a_x, point_a_y)
-
-            ray_length = 0.0
-            bathy_values = []
-            if not landmass_shapely_prep.intersects(
-                    ray_point_origin_shapely):
-                # the origin is in ocean, so we'll get a ray length > 0.0
-
-                # This algorithm searches for intersections, if one is found
-                # the ray updates and a smaller intersection set is determined
-                # by experimentation I've found this is significant, but not
-                # an order of magnitude, faster than looping through all
-                # original possible intersections.  Since this algorithm
-                # will be run for a long time, it's worth the additional
-                # complexity
-                tested_indexes = set()
-                while True:
-                    intersection = False
-                    ray_envelope = ray_geometry.GetEnvelope()
-                    for poly_line_index in polygon_line_rtree.intersection(
-                            [ray_envelope[i] for i in [0, 2, 1, 3]]):
-                        if poly_line_index in tested_indexes:
-                            continue
-                        tested_indexes.add(poly_line_index)
-                        line_shapely = (
-                            shapely_line_index[poly_line_index])
-                        line_segment = ogr.CreateGeometryFromWkb(line_shapely.wkb)
-                        if ray_geometry.Intersects(line_segment):
-                            # if the ray intersects the poly line, test if
-                            # the intersection is closer than any known
-                            # intersection so far
-                            intersection_point = ray_geometry.Intersection(
-                                line_segment)
-                            # replace the ray geometry with the new endpoint
-                            ray_geometry = ogr.Geometry(ogr.wkbLineString)
-                            ray_geometry.AddPoint(point_a_x, point_a_y)
-                            ray_geometry.AddPoint(
-                                intersection_point.GetX(),
-                                intersection_point.GetY())
-                            intersection = True
-                            break
-                    if not intersection:
-                        break
-                # when we get here, we have the final ray geometry
-                ray_length = ray_geometry.Length()
-
-                bathy_values = extract_bathymetry_along_ray(
-                    ray_geometry, bathy_gt, bathy_nodata, bathy_band)
-
-                ray_feature = ogr.Feature(temp_fetch_rays_defn)
-                ray_feature.SetField('fetch_dist', ray_length)
-                ray_feature.SetField('direction', compass_degree)
-                ray_feature.SetGeometry(ray_geometry)
-                temp_fetch_rays_layer.CreateFeature(ray_feature)
-
-            # For rays of length 0, we have no bathy values
-            # this avoids numpy's RuntimeWarning on numpy.mean([])
-            if not bathy_values:
-                avg_fetch_depth = numpy.nan
-            else:
-                avg_fetch_depth = numpy.mean(bathy_values)
-            shore_point_feature.SetField(
-                'fdist_%d' % compass_degree, float(ray_length))
-            shore_point_feature.SetField(
-                'fdepth_%d' % compass_degree, float(avg_fetch_depth))
-            ray_feature = None
-            ray_geometry = None
-            rei_value += ray_length * rei_pct * rei_v
-        shore_point_feature.SetField('REI', rei_value)
-        target_shore_point_layer.SetFeature(shore_point_feature)
-        result_REI[shore_id] = rei_value
+    try:
+        for block_slice, (
+                ray_length_array, avg_depth_array,
+                in_ocean_array) in zip(block_slice_list, ray_block_iter):
+            for point_index, fid in enumerate(fid_list[block_slice]):
+                shore_point_feature = target_shore_point_layer.GetFeature(
+                    fid)
+                shore_id = shore_point_feature.GetField(SHORE_ID_FIELD)
+                point_x, point_y = shore_point_coord_array[
+                    block_slice.start + point_index]
+                rei_value = 0.0
+                for sample_index in range(_N_FETCH_RAYS):
+                    compass_degree = int(sample_index * 360 / 16.)
+                    compass_theta = float(sample_index) / _N_FETCH_RAYS * 360
+                    rei_pct = shore_point_feature.GetField(
+                        'REI_PCT%d' % int(compass_theta))
+                    rei_v = shore_point_feature.GetField(
+                        'REI_V%d' % int(compass_theta))
+                    ray_length = ray_length_array[point_index, sample_index]
+                    if in_ocean_array[point_index, sample_index]:
+                        delta_x, delta_y = direction_array[sample_index]
+                        point_a_x = point_x + delta_x * _FETCH_RAY_OFFSET
+                        point_a_y = point_y + delta_y * _FETCH_RAY_OFFSET
+                        ray_geometry = ogr.Geometry(ogr.wkbLineString)
+                        ray_geometry.AddPoint(point_a_x, point_a_y)
+                        ray_geometry.AddPoint(
+                            point_a_x + delta_x * ray_length,
+                            point_a_y + delta_y * ray_length)
+                        ray_feature = ogr.Feature(temp_fetch_rays_defn)
+                        ray_feature.SetField('fetch_dist', ray_length)
+                        ray_feature.SetField('direction', compass_degree)
+                        ray_feature.SetGeometry(ray_geometry)
+                        temp_fetch_rays_layer.CreateFeature(ray_feature)
+                        ray_feature = None
+                        ray_geometry = None
+                    shore_point_feature.SetField(
+                        'fdist_%d' % compass_degree, float(ray_length))
+                    shore_point_feature.SetField(
+                        'fdepth_%d' % compass_degree,
+                        float(avg_depth_array[point_index, sample_index]))
+                    rei_value += ray_length * rei_pct * rei_v
+                shore_point_feature.SetField('REI', rei_value)
+                target_shore_point_layer.SetFeature(shore_point_feature)
+                shore_point_feature = None
+                result_REI[shore_id] = rei_value
+            shore_point_logger(
+                float(min(block_slice.stop, len(fid_list))) / len(fid_list))
+    finally:
+        if worker_pool is not None:
+            worker_pool.terminate()
+            worker_pool.join()
+        _FETCH_RAY_CASTER_STATE.clear()
 
     target_shore_point_layer.CommitTransaction()
     target_shore_point_layer.SyncToDisk()
@@ -1268,14 +1236,184 @@ def calculate_wind_exposure(
     temp_fetch_rays_layer.SyncToDisk()
     temp_fetch_rays_layer = None
     temp_fetch_rays_vector = None
-    bathy_raster = None
-    bathy_band = None
 
     with open(target_wind_exposure_pickle_path, 'wb') as pickle_file:
         pickle.dump(result_REI, pickle_file)
     LOGGER.info("Finished calculating wind exposure")
 
 
+def _fetch_ray_directions():
+    """Return an (_N_FETCH_RAYS, 2) array of the unit vectors of the rays.
+
+    Ray ``i`` points ``i * 360 / _N_FETCH_RAYS`` degrees clockwise from
+    north.
+    """
+    compass_theta = numpy.arange(_N_FETCH_RAYS) * 360.0 / _N_FETCH_RAYS
+    cartesian_theta = numpy.radians(-(compass_theta - 90))
+    return numpy.column_stack(
+        (numpy.cos(cartesian_theta), numpy.sin(cartesian_theta)))
+
+
+def _ray_segment_distances(
+        origin_array, direction_array, max_distance, segment_array):
+    """Find the distance along each ray to its nearest line segment.
+
+    Args:
+        origin_array (numpy.ndarray): (n, 2) array of the ray origins.
+        direction_array (numpy.ndarray): (n, 2) array of the unit vectors of
+            the ray directions.
+        max_distance (float): the length of each ray.
+        segment_array (numpy.ndarray): (m, 4) array of line segments as
+            (x0, y0, x1, y1) rows.
+
+    Returns:
+        A length n array of the distance from each ray's origin to the first
+        segment it crosses or touches, or ``max_distance`` if it crosses
+        none.  Segments parallel to a ray are not counted as crossing it.
+
+    """
+    distance_array = numpy.full(
+        origin_array.shape[0], max_distance, dtype=numpy.float64)
+    if origin_array.shape[0] == 0 or segment_array.shape[0] == 0:
+        return distance_array
+    ray_x = origin_array[:, 0:1]
+    ray_y = origin_array[:, 1:2]
+    ray_dx = direction_array[:, 0:1]
+    ray_dy = direction_array[:, 1:2]
+    n_segments_per_pass = max(
+        1, _MAX_RAY_SEGMENT_PAIRS // origin_array.shape[0])
+    for segment_start in range(
+            0, segment_array.shape[0], n_segments_per_pass):
+        segments = segment_array[
+            segment_start:segment_start+n_segments_per_pass]
+        segment_dx = segments[:, 2] - segments[:, 0]
+        segment_dy = segments[:, 3] - segments[:, 1]
+        offset_x = segments[:, 0] - ray_x
+        offset_y = segments[:, 1] - ray_y
+        # solve origin + t * direction = segment start + u * segment vector
+        denominator = ray_dx * segment_dy - ray_dy * segment_dx
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            ray_t = (offset_x * segment_dy - offset_y * segment_dx) / (
+                denominator)
+            segment_u = (offset_x * ray_dy - offset_y * ray_dx) / (
+                denominator)
+            crosses = (
+                (denominator != 0) & (ray_t >= 0) & (ray_t <= max_distance) &
+                (segment_u >= 0) & (segment_u <= 1))
+        if not crosses.any():
+            continue
+        distance_array = numpy.minimum(
+            distance_array,
+            numpy.where(crosses, ray_t, max_distance).min(axis=1))
+    return distance_array
+
+
+def _init_fetch_ray_caster(
+        landmass_polygon_pickle_path, landmass_line_rtree_path,
+        landmass_lines_pickle_path, bathymetry_raster_path,
+        max_fetch_distance):
+    """Load the landmass and bathymetry used by ``_cast_fetch_rays``.
+
+    This is the initializer of the worker processes of
+    ``calculate_wind_exposure``, and its arguments are as described there.
+
+    Returns:
+        None
+
+    """
+    with open(landmass_polygon_pickle_path, 'rb') as polygon_pickle_file:
+        landmass_shapely = pickle.load(polygon_pickle_file)
+    with open(landmass_lines_pickle_path, 'rb') as lines_pickle_file:
+        shapely_line_index = pickle.load(lines_pickle_file)
+    bathy_raster = gdal.OpenEx(
+        bathymetry_raster_path, gdal.OF_RASTER | gdal.GA_ReadOnly)
+    bathy_raster_info = pygeoprocessing.get_raster_info(
+        bathymetry_raster_path)
+    _FETCH_RAY_CASTER_STATE.update({
+        'landmass_prep': shapely.prepared.prep(landmass_shapely),
+        # load an existing rtree from disk
+        'line_rtree': rtree.index.Index(
+            os.path.splitext(landmass_line_rtree_path)[0]),
+        # every landmass line is a single segment
+        'segment_array': numpy.array(
+            [line.coords[0] + line.coords[1]
+             for line in shapely_line_index],
+            dtype=numpy.float64).reshape((-1, 4)),
+        'bathy_raster': bathy_raster,
+        'bathy_band': bathy_raster.GetRasterBand(1),
+        'bathy_gt': bathy_raster_info['geotransform'],
+        'bathy_nodata': bathy_raster_info['nodata'],
+        'max_fetch_distance': max_fetch_distance,
+    })
+
+
+def _cast_fetch_rays(shore_point_coord_array):
+    """Cast the fetch rays of a block of shore points.
+
+    Args:
+        shore_point_coord_array (numpy.ndarray): (n, 2) array of the x and y
+            coordinates of shore points.
+
+    Returns:
+        A tuple of three (n, _N_FETCH_RAYS) arrays: the length of each ray,
+        the mean bathymetry along each ray, and whether each ray starts in
+        the ocean.  Rays that start on land have a length of 0 and a depth
+        of NaN.
+
+    """
+    state = _FETCH_RAY_CASTER_STATE
+    max_fetch_distance = state['max_fetch_distance']
+    n_points = shore_point_coord_array.shape[0]
+    direction_array = _fetch_ray_directions()
+    # Start a ray offset from the shore point so that rays start outside of
+    # the landmass.  Shore points are interpolated onto the coastline, but
+    # floating point error results in points being just barely inside or
+    # outside the landmass.
+    origin_array = (
+        shore_point_coord_array[:, numpy.newaxis, :] +
+        direction_array[numpy.newaxis, :, :] * _FETCH_RAY_OFFSET).reshape(
+            (-1, 2))
+    ray_direction_array = numpy.tile(direction_array, (n_points, 1))
+
+    in_ocean_array = numpy.array([
+        not state['landmass_prep'].intersects(
+            shapely.geometry.Point(origin_x, origin_y))
+        for origin_x, origin_y in origin_array], dtype=bool)
+    ray_length_array = numpy.zeros(origin_array.shape[0])
+    avg_depth_array = numpy.full(origin_array.shape[0], numpy.nan)
+    if in_ocean_array.any():
+        ocean_origin_array = origin_array[in_ocean_array]
+        candidate_line_ids = numpy.fromiter(
+            state['line_rtree'].intersection([
+                ocean_origin_array[:, 0].min() - max_fetch_distance,
+                ocean_origin_array[:, 1].min() - max_fetch_distance,
+                ocean_origin_array[:, 0].max() + max_fetch_distance,
+                ocean_origin_array[:, 1].max() + max_fetch_distance]),
+            dtype=numpy.int64)
+        ray_length_array[in_ocean_array] = _ray_segment_distances(
+            ocean_origin_array, ray_direction_array[in_ocean_array],
+            max_fetch_distance,
+            state['segment_array'][numpy.sort(candidate_line_ids)])
+
+    for ray_index in numpy.flatnonzero(in_ocean_array):
+        origin_x, origin_y = origin_array[ray_index]
+        delta_x, delta_y = ray_direction_array[ray_index]
+        ray_geometry = ogr.Geometry(ogr.wkbLineString)
+        ray_geometry.AddPoint(origin_x, origin_y)
+        ray_geometry.AddPoint(
+            origin_x + delta_x * ray_length_array[ray_index],
+            origin_y + delta_y * ray_length_array[ray_index])
+        avg_depth_array[ray_index] = numpy.mean(extract_bathymetry_along_ray(
+            ray_geometry, state['bathy_gt'], state['bathy_nodata'],
+            state['bathy_band']))
+        ray_geometry = None
+
+    return (
+        ray_length_array.reshape((n_points, _N_FETCH_RAYS)),
+        avg_depth_array.reshape((n_points, _N_FETCH_RAYS)),
+        in_ocean_array.reshape((n_points, _N_FETCH_RAYS)))
+
+
 def extract_bathymetry_along_ray(
         ray_geometry, bathy_gt, bathy_nodata, bathy_band):
     """Extract valid raster values along a ray.
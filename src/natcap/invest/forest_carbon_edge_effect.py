@@ -5,6 +5,8 @@ near tropical forest edges', by Chaplin-Kramer et. al (2015).
 """
 import os
 import logging
+import multiprocessing
+import threading
 import time
 import uuid
 
@@ -27,6 +29,13 @@ DISTANCE_UPPER_BOUND = 500e3
 # helpful to have a global nodata defined for all the carbon map rasters
 CARBON_MAP_NODATA = -9999
 
+# number of edge distance blocks that may be read ahead of the writer per
+# worker process
+_EDGE_CARBON_BLOCKS_PER_WORKER = 4
+
+# the spatial index and model parameters loaded in each worker process
+_EDGE_CARBON_STATE = {}
+
 ARGS_SPEC = {
     "model_name": "Forest Carbon Edge Effect Model",
     "module": __name__,
@@ -353,7 +362,8 @@ def execute(args):
                   output_file_registry['spatial_index_pickle'],
                   int(args['n_nearest_model_points']),
                   float(args['biomass_to_carbon_conversion_factor']),
-                  output_file_registry['tropical_forest_edge_carbon_map']),
+                  output_file_registry['tropical_forest_edge_carbon_map'],
+                  n_workers),
             target_path_list=[
                 output_file_registry['tropical_forest_edge_carbon_map']],
             task_name='calculate_forest_edge_carbon_map',
@@ -694,10 +704,14 @@ def _build_spatial_index(
 def _calculate_tropical_forest_edge_carbon_map(
         edge_distance_path, spatial_index_pickle_path, n_nearest_model_points,
         biomass_to_carbon_conversion_factor,
-        tropical_forest_edge_carbon_map_path):
+        tropical_forest_edge_carbon_map_path, n_workers=-1):
     """Calculates the carbon on the forest pixels accounting for their global
     position with respect to precalculated edge carbon models.
 
+    Blocks of the edge distance raster are read by the pool's task feeder
+    thread, their carbon is calculated on ``n_workers`` processes, and the
+    results are written in order as they come back.
+
     Parameters:
         edge_distance_path (string): path to the a raster where each pixel
             contains the pixel distance to forest edge.
@@ -719,16 +733,13 @@ def _calculate_tropical_forest_edge_carbon_map(
         tropical_forest_edge_carbon_map_path (string): a filepath to the output
             raster which will contain total carbon stocks per cell of forest
             type.
+        n_workers (int): number of worker processes to calculate blocks on.
+            If less than 1, blocks are calculated in this process.
 
     Returns:
         None
 
     """
-
-    # load spatial indeces from pickle file
-    kd_tree, theta_model_parameters, method_model_parameter = pickle.load(
-        open(spatial_index_pickle_path, 'rb'))
-
     # create output raster and open band for writing
     # fill nodata, in case we skip entire memory blocks that are non-forest
     pygeoprocessing.new_raster_from_base(
@@ -753,132 +764,227 @@ def _calculate_tropical_forest_edge_carbon_map(
     cell_size_km = (abs(cell_xsize) + abs(cell_ysize))/2 / 1000.0
     cell_area_ha = (abs(cell_xsize) * abs(cell_ysize)) / 10000.0
 
-    # Loop memory block by memory block, calculating the forest edge carbon
-    # for every forest pixel.
-    for edge_distance_data, edge_distance_block in pygeoprocessing.iterblocks(
-            (edge_distance_path, 1), largest_block=2**12):
-        current_time = time.time()
-        if current_time - last_time > 5.0:
-            LOGGER.info(
-                'Carbon edge calculation approx. %.2f%% complete',
-                (n_cells_processed / float(n_cells) * 100.0))
-            last_time = current_time
-        n_cells_processed += (
-            edge_distance_data['win_xsize'] * edge_distance_data['win_ysize'])
-        valid_edge_distance_mask = (edge_distance_block > 0)
-
-        # if no valid forest pixels to calculate, skip to the next block
-        if not valid_edge_distance_mask.any():
-            continue
-
-        # calculate local coordinates for each pixel so we can test for
-        # distance to the nearest carbon model points
-        col_range = numpy.linspace(
-            edge_carbon_geotransform[0] +
-            edge_carbon_geotransform[1] * edge_distance_data['xoff'],
-            edge_carbon_geotransform[0] +
-            edge_carbon_geotransform[1] * (
-                edge_distance_data['xoff'] + edge_distance_data['win_xsize']),
-            num=edge_distance_data['win_xsize'], endpoint=False)
-        row_range = numpy.linspace(
-            edge_carbon_geotransform[3] +
-            edge_carbon_geotransform[5] * edge_distance_data['yoff'],
-            edge_carbon_geotransform[3] +
-            edge_carbon_geotransform[5] * (
-                edge_distance_data['yoff'] + edge_distance_data['win_ysize']),
-            num=edge_distance_data['win_ysize'], endpoint=False)
-        col_coords, row_coords = numpy.meshgrid(col_range, row_range)
-
-        # query nearest points for every point in the grid
-        # n_jobs=-1 means use all available CPUs
-        coord_points = list(zip(
-            row_coords[valid_edge_distance_mask].ravel(),
-            col_coords[valid_edge_distance_mask].ravel()))
-        # note, the 'n_jobs' parameter was introduced in SciPy 0.16.0
-        distances, indexes = kd_tree.query(
-            coord_points, k=n_nearest_model_points,
-            distance_upper_bound=DISTANCE_UPPER_BOUND, n_jobs=-1)
-
-        if n_nearest_model_points == 1:
-            distances = distances.reshape(distances.shape[0], 1)
-            indexes = indexes.reshape(indexes.shape[0], 1)
-
-        # the 3 is for the 3 thetas in the carbon model
-        thetas = numpy.zeros((indexes.shape[0], indexes.shape[1], 3))
-        valid_index_mask = (indexes != kd_tree.n)
-        thetas[valid_index_mask] = theta_model_parameters[
-            indexes[valid_index_mask]]
-
-        # the 3 is for the 3 models (asym, exp, linear)
-        biomass_model = numpy.zeros(
-            (indexes.shape[0], indexes.shape[1], 3))
-        # reshape to an N,nearest_points so we can multiply by thetas
-        valid_edge_distances_km = numpy.repeat(
-            edge_distance_block[valid_edge_distance_mask] * cell_size_km,
-            n_nearest_model_points).reshape(-1, n_nearest_model_points)
-
-        # asymptotic model
-        # biomass_1 = t1 - t2 * exp(-t3 * edge_dist_km)
-        biomass_model[:, :, 0] = (
-            thetas[:, :, 0] - thetas[:, :, 1] * numpy.exp(
-                -thetas[:, :, 2] * valid_edge_distances_km)
-            ) * cell_area_ha
-
-        # logarithmic model
-        # biomass_2 = t1 + t2 * numpy.log(edge_dist_km)
-        biomass_model[:, :, 1] = (
-            thetas[:, :, 0] + thetas[:, :, 1] * numpy.log(
-                valid_edge_distances_km)) * cell_area_ha
-
-        # linear regression
-        # biomass_3 = t1 + t2 * edge_dist_km
-        biomass_model[:, :, 2] = (
-            (thetas[:, :, 0] + thetas[:, :, 1] * valid_edge_distances_km) *
-            cell_area_ha)
-
-        # Collapse the biomass down to the valid models
-        model_index = numpy.zeros(indexes.shape, dtype=numpy.int8)
-        model_index[valid_index_mask] = (
-            method_model_parameter[indexes[valid_index_mask]] - 1)
-
-        # reduce the axis=1 dimensionality of the model by selecting the
-        # appropriate value via the model_index array. Got this trick from
-        # http://stackoverflow.com/questions/18702746/reduce-a-dimension-of-numpy-array-by-selecting
-        biomass_y, biomass_x = numpy.meshgrid(
-            numpy.arange(biomass_model.shape[1]),
-            numpy.arange(biomass_model.shape[0]))
-        biomass = biomass_model[biomass_x, biomass_y, model_index]
-
-        # reshape the array so that each set of points is in a separate
-        # dimension, here distances are distances to each valid model
-        # point, not distance to edge of forest
-        weights = numpy.zeros(distances.shape)
-        valid_distance_mask = (distances > 0) & (distances < numpy.inf)
-        weights[valid_distance_mask] = (
-            n_nearest_model_points / distances[valid_distance_mask])
-
-        # Denominator is the sum of the weights per nearest point (axis 1)
-        denom = numpy.sum(weights, axis=1)
-        # To avoid a divide by 0
-        valid_denom = denom != 0
-        average_biomass = numpy.zeros(distances.shape[0])
-        average_biomass[valid_denom] = (
-            numpy.sum(weights[valid_denom] *
-                      biomass[valid_denom], axis=1) / denom[valid_denom])
-
-        # Ensure the result has nodata everywhere the distance was invalid
-        result = numpy.empty(
-            edge_distance_block.shape, dtype=numpy.float32)
-        result[:] = CARBON_MAP_NODATA
-        # convert biomass to carbon in this stage
-        result[valid_edge_distance_mask] = (
-            average_biomass * biomass_to_carbon_conversion_factor)
-        edge_carbon_band.WriteArray(
-            result, xoff=edge_distance_data['xoff'],
-            yoff=edge_distance_data['yoff'])
+    # limits the blocks read ahead of the writer so memory use stays bounded
+    # if the writer falls behind
+    n_blocks_in_flight = max(1, n_workers) * _EDGE_CARBON_BLOCKS_PER_WORKER
+    block_semaphore = threading.Semaphore(n_blocks_in_flight)
+
+    def _read_forest_blocks():
+        """Yield the blocks of the edge distance raster with forest."""
+        for offset_dict, edge_distance_block in pygeoprocessing.iterblocks(
+                (edge_distance_path, 1), largest_block=2**12):
+            # if no valid forest pixels to calculate, skip to the next block
+            if not (edge_distance_block > 0).any():
+                continue
+            block_semaphore.acquire()
+            yield offset_dict, edge_distance_block
+
+    # pool workers each query the kd-tree on one thread, in this process the
+    # query may use all available CPUs
+    calculator_args = (
+        spatial_index_pickle_path, n_nearest_model_points,
+        edge_carbon_geotransform, cell_size_km, cell_area_ha,
+        biomass_to_carbon_conversion_factor)
+    if n_workers > 0:
+        worker_pool = multiprocessing.Pool(
+            n_workers, initializer=_init_edge_carbon_calculator,
+            initargs=calculator_args + (1,))
+        block_result_iter = worker_pool.imap(
+            _calculate_edge_carbon_block, _read_forest_blocks())
+    else:
+        worker_pool = None
+        _init_edge_carbon_calculator(*calculator_args + (-1,))
+        block_result_iter = (
+            _calculate_edge_carbon_block(block_args)
+            for block_args in _read_forest_blocks())
+
+    # Loop memory block by memory block, writing the forest edge carbon in
+    # the order the blocks were read.
+    try:
+        for offset_dict, result in block_result_iter:
+            edge_carbon_band.WriteArray(
+                result, xoff=offset_dict['xoff'], yoff=offset_dict['yoff'])
+            block_semaphore.release()
+            n_cells_processed += (
+                offset_dict['win_xsize'] * offset_dict['win_ysize'])
+            current_time = time.time()
+            if current_time - last_time > 5.0:
+                LOGGER.info(
+                    'Carbon edge calculation approx. %.2f%% complete',
+                    (n_cells_processed / float(n_cells) * 100.0))
+                last_time = current_time
+    finally:
+        if worker_pool is not None:
+            # unblock the reader so the pool can stop its feeder thread
+            for _ in range(n_blocks_in_flight):
+                block_semaphore.release()
+            worker_pool.terminate()
+            worker_pool.join()
+        _EDGE_CARBON_STATE.clear()
+    edge_carbon_band = None
+    edge_carbon_raster = None
     LOGGER.info('Carbon edge calculation 100.0% complete')
 
 
+def _init_edge_carbon_calculator(
+        spatial_index_pickle_path, n_nearest_model_points,
+        edge_carbon_geotransform, cell_size_km, cell_area_ha,
+        biomass_to_carbon_conversion_factor, kd_tree_n_jobs):
+    """Load the spatial index used by ``_calculate_edge_carbon_block``.
+
+    This is the initializer of the worker processes of
+    ``_calculate_tropical_forest_edge_carbon_map``.
+
+    Parameters:
+        spatial_index_pickle_path (string): path to the pickle file of the
+            kd-tree and model parameters.
+        n_nearest_model_points (int): number of nearest model points to search
+            for.
+        edge_carbon_geotransform (list): geotransform of the edge distance
+            raster.
+        cell_size_km (float): mean pixel size in kilometers.
+        cell_area_ha (float): pixel area in hectares.
+        biomass_to_carbon_conversion_factor (float): number by which to
+            multiply the biomass by to get carbon.
+        kd_tree_n_jobs (int): number of threads each kd-tree query uses, -1
+            for all available CPUs.
+
+    Returns:
+        None
+
+    """
+    with open(spatial_index_pickle_path, 'rb') as spatial_index_file:
+        kd_tree, theta_model_parameters, method_model_parameter = (
+            pickle.load(spatial_index_file))
+    _EDGE_CARBON_STATE.update({
+        'kd_tree': kd_tree,
+        # one row per theta so each is a contiguous array
+        'theta_model_parameters': numpy.ascontiguousarray(
+            theta_model_parameters.astype(numpy.float32).T),
+        'method_model_parameter': method_model_parameter,
+        'n_nearest_model_points': n_nearest_model_points,
+        'edge_carbon_geotransform': edge_carbon_geotransform,
+        'cell_size_km': cell_size_km,
+        'cell_area_ha': cell_area_ha,
+        'biomass_to_carbon_conversion_factor': (
+            biomass_to_carbon_conversion_factor),
+        'kd_tree_n_jobs': kd_tree_n_jobs,
+    })
+
+
+def _calculate_edge_carbon_block(block_args):
+    """Calculate the forest edge carbon of a block of edge distances.
+
+    ``_init_edge_carbon_calculator`` must have been called in this process.
+
+    Parameters:
+        block_args (tuple): the offset dict and the edge distance array of a
+            block as yielded by ``pygeoprocessing.iterblocks``.
+
+    Returns:
+        a tuple of the block's offset dict and a float32 array of its carbon,
+        with ``CARBON_MAP_NODATA`` where the edge distance isn't positive.
+
+    """
+    offset_dict, edge_distance_block = block_args
+    state = _EDGE_CARBON_STATE
+    kd_tree = state['kd_tree']
+    n_nearest_model_points = state['n_nearest_model_points']
+    edge_carbon_geotransform = state['edge_carbon_geotransform']
+    valid_edge_distance_mask = (edge_distance_block > 0)
+
+    # calculate local coordinates for each pixel so we can test for
+    # distance to the nearest carbon model points
+    valid_row_index, valid_col_index = numpy.nonzero(
+        valid_edge_distance_mask)
+    coord_points = numpy.empty((valid_row_index.size, 2))
+    # kd-tree points are in row/col order
+    coord_points[:, 0] = edge_carbon_geotransform[3] + (
+        edge_carbon_geotransform[5] * (
+            offset_dict['yoff'] + valid_row_index))
+    coord_points[:, 1] = edge_carbon_geotransform[0] + (
+        edge_carbon_geotransform[1] * (
+            offset_dict['xoff'] + valid_col_index))
+
+    # note, the 'n_jobs' parameter was introduced in SciPy 0.16.0
+    distances, indexes = kd_tree.query(
+        coord_points, k=n_nearest_model_points,
+        distance_upper_bound=DISTANCE_UPPER_BOUND,
+        n_jobs=state['kd_tree_n_jobs'])
+    coord_points = None
+    if n_nearest_model_points == 1:
+        distances = distances.reshape(distances.shape[0], 1)
+        indexes = indexes.reshape(indexes.shape[0], 1)
+
+    # missing neighbors are index kd_tree.n, which is pointed at the first
+    # model point so it can be indexed and masked out below
+    valid_index_mask = (indexes != kd_tree.n)
+    indexes[~valid_index_mask] = 0
+    theta_1, theta_2, theta_3 = (
+        theta_array[indexes]
+        for theta_array in state['theta_model_parameters'])
+    model_index = state['method_model_parameter'][indexes] - 1
+    indexes = None
+
+    # broadcast to N,nearest_points so we can index it like the thetas
+    valid_edge_distances_km = numpy.broadcast_to((
+        edge_distance_block[valid_edge_distance_mask].astype(numpy.float32) *
+        numpy.float32(state['cell_size_km']))[:, numpy.newaxis],
+        model_index.shape)
+
+    # each point's biomass is calculated with its own model only, and is 0
+    # where there's no model point
+    biomass = numpy.zeros(model_index.shape, dtype=numpy.float32)
+
+    # asymptotic model
+    # biomass_1 = t1 - t2 * exp(-t3 * edge_dist_km)
+    model_mask = valid_index_mask & (model_index == 0)
+    biomass[model_mask] = (
+        theta_1[model_mask] - theta_2[model_mask] * numpy.exp(
+            -theta_3[model_mask] * valid_edge_distances_km[model_mask]))
+
+    # logarithmic model
+    # biomass_2 = t1 + t2 * numpy.log(edge_dist_km)
+    model_mask = valid_index_mask & (model_index == 1)
+    biomass[model_mask] = (
+        theta_1[model_mask] + theta_2[model_mask] * numpy.log(
+            valid_edge_distances_km[model_mask]))
+
+    # linear regression
+    # biomass_3 = t1 + t2 * edge_dist_km
+    model_mask = valid_index_mask & (model_index == 2)
+    biomass[model_mask] = (
+        theta_1[model_mask] +
+        theta_2[model_mask] * valid_edge_distances_km[model_mask])
+    model_mask = None
+    biomass *= numpy.float32(state['cell_area_ha'])
+
+    # here distances are distances to each valid model point, not distance
+    # to edge of forest
+    weights = numpy.zeros(distances.shape, dtype=numpy.float32)
+    valid_distance_mask = (
+        valid_index_mask & (distances > 0) & (distances < numpy.inf))
+    weights[valid_distance_mask] = (
+        n_nearest_model_points / distances[valid_distance_mask])
+
+    # Denominator is the sum of the weights per nearest point (axis 1)
+    denom = numpy.sum(weights, axis=1)
+    # To avoid a divide by 0
+    valid_denom = denom != 0
+    average_biomass = numpy.zeros(distances.shape[0], dtype=numpy.float32)
+    average_biomass[valid_denom] = (
+        numpy.sum(weights[valid_denom] * biomass[valid_denom], axis=1) /
+        denom[valid_denom])
+
+    # Ensure the result has nodata everywhere the distance was invalid
+    result = numpy.full(
+        edge_distance_block.shape, CARBON_MAP_NODATA, dtype=numpy.float32)
+    # convert biomass to carbon in this stage
+    result[valid_edge_distance_mask] = (
+        average_biomass * state['biomass_to_carbon_conversion_factor'])
+    return offset_dict, result
+
+
 @validation.invest_validator
 def validate(args, limit_to=None):
     """Validate args to ensure they conform to `execute`'s contract.
@@ -1,12 +1,13 @@
 """InVEST Habitat Quality model."""
-import collections
 import os
 import logging
+import collections
 
 import numpy
 from osgeo import gdal
 from osgeo import osr
 import pygeoprocessing
+import taskgraph
 
 from . import utils
 from . import validation
@@ -220,6 +221,10 @@ def execute(args):
             (required)
         results_suffix (string): a python string that will be inserted into all
             raster path paths just before the file extension.
+        n_workers (int): if present, indicates how many worker processes
+            should be used in parallel processing. -1 indicates single
+            process mode, 0 is single process but non-blocking mode, and
+            >= 1 is number of processes.
 
     Example Args Dictionary::
 
@@ -360,10 +365,27 @@ def execute(args):
             'to see if they are missing: %s. \n\n' %
             ', '.join([str(x) for x in sorted(missing_lucodes)]))
 
+    # check that each threat's decay is one we can build a kernel for before
+    # any of the work is scheduled
+    for threat, threat_data in threat_dict.items():
+        if threat_data['DECAY'] not in ('linear', 'exponential'):
+            raise ValueError(
+                "Unknown type of decay in biophysical table, should be "
+                "either 'linear' or 'exponential'. Input was %s for threat"
+                " %s." % (threat_data['DECAY'], threat))
+
+    try:
+        n_workers = int(args['n_workers'])
+    except (KeyError, ValueError, TypeError):
+        # KeyError when n_workers is not present in args
+        # ValueError when n_workers is an empty string.
+        # TypeError when n_workers is None.
+        n_workers = -1  # Synchronous mode.
+    task_graph = taskgraph.TaskGraph(
+        os.path.join(inter_dir, '_taskgraph_working_dir'), n_workers)
+
     # Align and resize all the land cover and threat rasters,
     # and tore them in the intermediate folder
-    LOGGER.info('Starting aligning and resizing land cover and threat rasters')
-
     lulc_raster_info = pygeoprocessing.get_raster_info(args['lulc_cur_path'])
     lulc_pixel_size = lulc_raster_info['pixel_size']
     lulc_bbox = lulc_raster_info['bounding_box']
@@ -372,12 +394,16 @@ def execute(args):
         os.path.join(inter_dir, os.path.basename(path).replace(
             '.tif', '_aligned.tif')) for path in lulc_and_threat_raster_list]
 
-    pygeoprocessing.align_and_resize_raster_stack(
-        lulc_and_threat_raster_list, aligned_raster_list,
-        ['near']*len(lulc_and_threat_raster_list), lulc_pixel_size,
-        lulc_bbox)
-
-    LOGGER.info('Finished aligning and resizing land cover and threat rasters')
+    align_task = task_graph.add_task(
+        func=pygeoprocessing.align_and_resize_raster_stack,
+        args=(
+            lulc_and_threat_raster_list, aligned_raster_list,
+            ['near']*len(lulc_and_threat_raster_list), lulc_pixel_size,
+            lulc_bbox),
+        hash_algorithm='md5',
+        copy_duplicate_artifact=True,
+        target_path_list=aligned_raster_list,
+        task_name='align input rasters')
 
     # Modify paths in lulc_path_dict and threat_path_dict to be aligned rasters
     for lulc_key, lulc_path in lulc_path_dict.items():
@@ -387,63 +413,24 @@ def execute(args):
         for threat in threat_dict:
             threat_path = threat_path_dict['threat' + lulc_key][threat]
             if threat_path in lulc_and_threat_raster_list:
-                aligned_threat_path = os.path.join(
+                threat_path_dict['threat' + lulc_key][threat] = os.path.join(
                     inter_dir, os.path.basename(threat_path).replace(
                         '.tif', '_aligned.tif'))
-                threat_path_dict['threat' + lulc_key][threat] = (
-                    aligned_threat_path)
-
-                # Iterate though the threat raster and update pixel values
-                # as needed so that:
-                #  * Nodata values are replaced with 0
-                #  * Anything other than 0 or nodata is replaced with 1
-                LOGGER.info('Preprocessing threat values for %s',
-                            aligned_threat_path)
-                threat_nodata = pygeoprocessing.get_raster_info(
-                    aligned_threat_path)['nodata'][0]
-                threat_raster = gdal.OpenEx(aligned_threat_path,
-                                            gdal.OF_RASTER | gdal.GA_Update)
-                threat_band = threat_raster.GetRasterBand(1)
-                for block_offset in pygeoprocessing.iterblocks(
-                        (aligned_threat_path, 1), offset_only=True):
-                    block = threat_band.ReadAsArray(**block_offset)
-
-                    # First check if we actually need to set anything.
-                    # No need to perform unnecessary writes!
-                    if set(numpy.unique(block)) == set([0, 1]):
-                        continue
-
-                    zero_threat = numpy.isclose(block, threat_nodata)
-                    block[zero_threat] = 0
-                    block[~numpy.isclose(block, 0)] = 1
-
-                    threat_band.WriteArray(
-                        block, yoff=block_offset['yoff'],
-                        xoff=block_offset['xoff'])
-                threat_band = None
-                threat_raster = None
 
     LOGGER.info('Starting habitat_quality biophysical calculations')
 
     # Rasterize access vector, if value is null set to 1 (fully accessible),
     # else set to the value according to the ACCESS attribute
-    cur_lulc_path = lulc_path_dict['_c']
-    fill_value = 1.0
-    try:
-        LOGGER.info('Handling Access Shape')
-        access_raster_path = os.path.join(
-            inter_dir, 'access_layer%s.tif' % suffix)
-        # create a new raster based on the raster info of current land cover
-        pygeoprocessing.new_raster_from_base(
-            cur_lulc_path, access_raster_path, gdal.GDT_Float32,
-            [_OUT_NODATA], fill_value_list=[fill_value])
-        pygeoprocessing.rasterize(
-            args['access_vector_path'], access_raster_path, burn_values=None,
-            option_list=['ATTRIBUTE=ACCESS'])
-
-    except KeyError:
-        LOGGER.info(
-            'No Access Shape Provided, access raster filled with 1s.')
+    access_raster_path = os.path.join(
+        inter_dir, 'access_layer%s.tif' % suffix)
+    access_task = task_graph.add_task(
+        func=_create_access_raster,
+        args=(
+            lulc_path_dict['_c'], args.get('access_vector_path', None),
+            access_raster_path),
+        target_path_list=[access_raster_path],
+        dependent_task_list=[align_task],
+        task_name='create access raster')
 
     # calculate the weight sum which is the sum of all the threats' weights
     weight_sum = 0.0
@@ -451,53 +438,75 @@ def execute(args):
         # Sum weight of threats
         weight_sum = weight_sum + threat_data['WEIGHT']
 
+    # the kernels are sized by the pixel size of the aligned threat rasters,
+    # which is that of the current land cover.  Pixel size tuple could have
+    # negative value
+    mean_threat_pixel_size = (
+        abs(lulc_pixel_size[0]) + abs(lulc_pixel_size[1]))/2.0
+
+    # ksq: a term used below to compute habitat quality
+    ksq = half_saturation**_SCALING_PARAM
+
     LOGGER.debug('lulc_path_dict : %s', lulc_path_dict)
 
     # for each land cover raster provided compute habitat quality
     for lulc_key, lulc_path in lulc_path_dict.items():
-        LOGGER.info('Calculating habitat quality for landuse: %s', lulc_path)
+        LOGGER.info('Scheduling habitat quality for landuse: %s', lulc_path)
+
+        # check to see if a threat raster is missing and if so then we want
+        # to skip to the next landcover
+        missing_threat_list = [
+            threat for threat in threat_dict
+            if threat_path_dict['threat' + lulc_key][threat] is None]
+        if missing_threat_list:
+            LOGGER.info(
+                'The threat raster for %s could not be found for the land '
+                'cover %s. Skipping Habitat Quality calculation for this '
+                'land cover.' % (missing_threat_list[0], lulc_key))
+            continue
 
         # Create raster of habitat based on habitat field
         habitat_raster_path = os.path.join(
             inter_dir, 'habitat%s%s.tif' % (lulc_key, suffix))
-        map_raster_to_dict_values(
-            lulc_path, habitat_raster_path, sensitivity_dict, 'HABITAT',
-            _OUT_NODATA, values_required=False)
+        habitat_task = task_graph.add_task(
+            func=pygeoprocessing.reclassify_raster,
+            args=(
+                (lulc_path, 1),
+                _get_lulc_value_map(sensitivity_dict, 'HABITAT'),
+                habitat_raster_path, gdal.GDT_Float32, _OUT_NODATA),
+            kwargs={'values_required': False},
+            target_path_list=[habitat_raster_path],
+            dependent_task_list=[align_task],
+            task_name='habitat raster%s' % lulc_key)
 
         # initialize a list that will store all the threat/threat rasters
         # after they have been adjusted for distance, weight, and access
         deg_raster_list = []
+        deg_task_list = [access_task]
 
         # a list to keep track of the normalized weight for each threat
-        weight_list = numpy.array([])
-
-        # variable to indicate whether we should break out of calculations
-        # for a land cover because a threat raster was not found
-        exit_landcover = False
+        weight_list = []
 
         # adjust each threat/threat raster for distance, weight, and access
         for threat, threat_data in threat_dict.items():
-            LOGGER.info('Calculating threat: %s.\nThreat data: %s' %
+            LOGGER.info('Scheduling threat: %s.\nThreat data: %s' %
                         (threat, threat_data))
 
             # get the threat raster for the specific threat
             threat_raster_path = threat_path_dict['threat' + lulc_key][threat]
             LOGGER.info('threat_raster_path %s', threat_raster_path)
-            if threat_raster_path is None:
-                LOGGER.info(
-                    'The threat raster for %s could not be found for the land '
-                    'cover %s. Skipping Habitat Quality calculation for this '
-                    'land cover.' % (threat, lulc_key))
-                exit_landcover = True
-                break
-
-            # need the pixel size for the threat raster so we can create
-            # an appropriate kernel for convolution
-            threat_pixel_size = pygeoprocessing.get_raster_info(
-                threat_raster_path)['pixel_size']
-            # pixel size tuple could have negative value
-            mean_threat_pixel_size = (
-                abs(threat_pixel_size[0]) + abs(threat_pixel_size[1]))/2.0
+
+            # Set the threat raster's values so that:
+            #  * Nodata values are replaced with 0
+            #  * Anything other than 0 or nodata is replaced with 1
+            binary_threat_raster_path = os.path.join(
+                inter_dir, 'threat_%s%s%s.tif' % (threat, lulc_key, suffix))
+            binary_threat_task = task_graph.add_task(
+                func=_preprocess_threat_raster,
+                args=(threat_raster_path, binary_threat_raster_path),
+                target_path_list=[binary_threat_raster_path],
+                dependent_task_list=[align_task],
+                task_name='preprocess threat %s%s' % (threat, lulc_key))
 
             # convert max distance (given in KM) to meters
             max_dist_m = threat_data['MAX_DIST'] * 1000.0
@@ -509,85 +518,56 @@ def execute(args):
 
             # blur the threat raster based on the effect of the threat over
             # distance
-            decay_type = threat_data['DECAY']
             kernel_path = os.path.join(
                 kernel_dir, 'kernel_%s%s%s.tif' % (threat, lulc_key, suffix))
-            if decay_type == 'linear':
-                make_linear_decay_kernel_path(max_dist_pixel, kernel_path)
-            elif decay_type == 'exponential':
-                utils.exponential_decay_kernel_raster(
-                    max_dist_pixel, kernel_path)
+            if threat_data['DECAY'] == 'linear':
+                kernel_func = make_linear_decay_kernel_path
             else:
-                raise ValueError(
-                    "Unknown type of decay in biophysical table, should be "
-                    "either 'linear' or 'exponential'. Input was %s for threat"
-                    " %s." % (decay_type, threat))
+                kernel_func = utils.exponential_decay_kernel_raster
+            kernel_task = task_graph.add_task(
+                func=kernel_func,
+                args=(max_dist_pixel, kernel_path),
+                target_path_list=[kernel_path],
+                task_name='decay kernel %s%s' % (threat, lulc_key))
 
             filtered_threat_raster_path = os.path.join(
                 inter_dir, 'filtered_%s%s%s.tif' % (threat, lulc_key, suffix))
-            pygeoprocessing.convolve_2d(
-                (threat_raster_path, 1), (kernel_path, 1),
-                filtered_threat_raster_path,
-                ignore_nodata=True)
-
-            # create sensitivity raster based on threat
+            convolve_task = task_graph.add_task(
+                func=pygeoprocessing.convolve_2d,
+                args=(
+                    (binary_threat_raster_path, 1), (kernel_path, 1),
+                    filtered_threat_raster_path),
+                kwargs={'ignore_nodata': True},
+                target_path_list=[filtered_threat_raster_path],
+                dependent_task_list=[binary_threat_task, kernel_task],
+                task_name='convolve threat %s%s' % (threat, lulc_key))
+
+            # create sensitivity raster based on threat.  Only this threat's
+            # column of the sensitivity table is passed so that editing
+            # another column doesn't invalidate this raster.
             sens_raster_path = os.path.join(
                 inter_dir, 'sens_%s%s%s.tif' % (threat, lulc_key, suffix))
-            map_raster_to_dict_values(
-                lulc_path, sens_raster_path, sensitivity_dict, 'L_' + threat,
-                _OUT_NODATA, values_required=True)
-
-            # get the normalized weight for each threat
-            weight_avg = threat_data['WEIGHT'] / weight_sum
+            sens_task = task_graph.add_task(
+                func=pygeoprocessing.reclassify_raster,
+                args=(
+                    (lulc_path, 1),
+                    _get_lulc_value_map(sensitivity_dict, 'L_' + threat),
+                    sens_raster_path, gdal.GDT_Float32, _OUT_NODATA),
+                kwargs={'values_required': True},
+                target_path_list=[sens_raster_path],
+                dependent_task_list=[align_task],
+                task_name='sensitivity raster %s%s' % (threat, lulc_key))
 
             # add the threat raster adjusted by distance and the raster
             # representing sensitivity to the list to be past to
             # vectorized_rasters below
             deg_raster_list.append(filtered_threat_raster_path)
             deg_raster_list.append(sens_raster_path)
+            deg_task_list.extend([convolve_task, sens_task])
 
             # store the normalized weight for each threat in a list that
             # will be used below in total_degradation
-            weight_list = numpy.append(weight_list, weight_avg)
-
-        # check to see if we got here because a threat raster was missing
-        # and if so then we want to skip to the next landcover
-        if exit_landcover:
-            continue
-
-        def total_degradation(*raster):
-            """A vectorized function that computes the degradation value for
-                each pixel based on each threat and then sums them together
-
-                *rasters - a list of floats depicting the adjusted threat
-                    value per pixel based on distance and sensitivity.
-                    The values are in pairs so that the values for each threat
-                    can be tracked:
-                    [filtered_val_threat1, sens_val_threat1,
-                     filtered_val_threat2, sens_val_threat2, ...]
-                    There is an optional last value in the list which is the
-                    access_raster value, but it is only present if
-                    access_raster is not None.
-
-                returns - the total degradation score for the pixel"""
-
-            # we can not be certain how many threats the user will enter,
-            # so we handle each filtered threat and sensitivity raster
-            # in pairs
-            sum_degradation = numpy.zeros(raster[0].shape)
-            for index in range(len(raster) // 2):
-                step = index * 2
-                sum_degradation += (
-                    raster[step] * raster[step + 1] * weight_list[index])
-
-            nodata_mask = numpy.empty(raster[0].shape, dtype=numpy.int8)
-            nodata_mask[:] = 0
-            for array in raster:
-                nodata_mask = nodata_mask | (array == _OUT_NODATA)
-
-            # the last element in raster is access
-            return numpy.where(
-                    nodata_mask, _OUT_NODATA, sum_degradation * raster[-1])
+            weight_list.append(threat_data['WEIGHT'] / weight_sum)
 
         # add the access_raster onto the end of the collected raster list. The
         # access_raster will be values from the shapefile if provided or a
@@ -596,147 +576,354 @@ def execute(args):
 
         deg_sum_raster_path = os.path.join(
             out_dir, 'deg_sum' + lulc_key + suffix + '.tif')
+        deg_sum_task = task_graph.add_task(
+            func=_calculate_total_degradation,
+            args=(deg_raster_list, weight_list, deg_sum_raster_path),
+            target_path_list=[deg_sum_raster_path],
+            dependent_task_list=deg_task_list,
+            task_name='total degradation%s' % lulc_key)
 
-        LOGGER.info('Starting raster calculation on total_degradation')
+        # Compute habitat quality
+        quality_path = os.path.join(
+            out_dir, 'quality' + lulc_key + suffix + '.tif')
+        task_graph.add_task(
+            func=_calculate_habitat_quality,
+            args=(deg_sum_raster_path, habitat_raster_path, ksq,
+                  quality_path),
+            target_path_list=[quality_path],
+            dependent_task_list=[deg_sum_task, habitat_task],
+            task_name='habitat quality%s' % lulc_key)
 
-        deg_raster_band_list = [(path, 1) for path in deg_raster_list]
-        pygeoprocessing.raster_calculator(
-            deg_raster_band_list, total_degradation,
-            deg_sum_raster_path, gdal.GDT_Float32, _OUT_NODATA)
+    # Compute Rarity if user supplied baseline raster
+    if '_b' not in lulc_path_dict:
+        LOGGER.info('Baseline not provided to compute Rarity')
+    else:
+        # compute rarity for current landscape and future (if provided)
+        lulc_key_list = [
+            lulc_key for lulc_key in ['_c', '_f']
+            if lulc_key in lulc_path_dict]
+        rarity_path_list = [
+            os.path.join(out_dir, 'rarity' + lulc_key + suffix + '.tif')
+            for lulc_key in lulc_key_list]
+        task_graph.add_task(
+            func=_compute_rarity,
+            args=(lulc_path_dict['_b'],
+                  [lulc_path_dict[lulc_key] for lulc_key in lulc_key_list],
+                  rarity_path_list),
+            target_path_list=rarity_path_list,
+            dependent_task_list=[align_task],
+            task_name='rarity')
+
+    task_graph.close()
+    task_graph.join()
+    LOGGER.info('Finished habitat_quality biophysical calculations')
 
-        LOGGER.info('Finished raster calculation on total_degradation')
 
-        # Compute habitat quality
-        # ksq: a term used below to compute habitat quality
-        ksq = half_saturation**_SCALING_PARAM
+def _create_access_raster(base_lulc_path, access_vector_path, target_path):
+    """Create the access raster.
+
+    Parameters:
+        base_lulc_path (string): path to the land cover raster to take the
+            size and projection of the access raster from.
+        access_vector_path (string): path to a polygon vector with an
+            ``ACCESS`` field, or None.
+        target_path (string): path to the raster to create.  Pixels are the
+            ``ACCESS`` value of the polygon they are in, or 1 (fully
+            accessible) outside of any polygon or if no vector is given.
+
+    Returns:
+        None
+    """
+    # create a new raster based on the raster info of current land cover
+    pygeoprocessing.new_raster_from_base(
+        base_lulc_path, target_path, gdal.GDT_Float32,
+        [_OUT_NODATA], fill_value_list=[1.0])
+    if access_vector_path:
+        LOGGER.info('Handling Access Shape')
+        pygeoprocessing.rasterize(
+            access_vector_path, target_path, burn_values=None,
+            option_list=['ATTRIBUTE=ACCESS'])
+    else:
+        LOGGER.info(
+            'No Access Shape Provided, access raster filled with 1s.')
 
-        def quality_op(degradation, habitat):
-            """Vectorized function that computes habitat quality given
-                a degradation and habitat value.
 
-                degradation - a float from the created degradation
-                    raster above.
-                habitat - a float indicating habitat suitability from
-                    from the habitat raster created above.
+def _preprocess_threat_raster(base_threat_path, target_threat_path):
+    """Convert a threat raster to threat presence.
 
-                returns - a float representing the habitat quality
-                    score for a pixel
-            """
-            degredataion_clamped = numpy.where(degradation < 0, 0, degradation)
+    Parameters:
+        base_threat_path (string): path to an aligned threat raster.
+        target_threat_path (string): path to the raster to create, with the
+            datatype and nodata value of the base.  Nodata pixels of the base
+            are 0, and anything other than 0 or nodata is 1.
 
-            return numpy.where(
-                    (degradation == _OUT_NODATA) | (habitat == _OUT_NODATA),
-                    _OUT_NODATA,
-                    (habitat * (1.0 - ((degredataion_clamped**_SCALING_PARAM) /
-                     (degredataion_clamped**_SCALING_PARAM + ksq)))))
+    Returns:
+        None
+    """
+    LOGGER.info('Preprocessing threat values for %s', base_threat_path)
+    threat_raster_info = pygeoprocessing.get_raster_info(base_threat_path)
+    threat_nodata = threat_raster_info['nodata'][0]
 
-        quality_path = os.path.join(
-            out_dir, 'quality' + lulc_key + suffix + '.tif')
+    def _threat_presence_op(threat_array):
+        """Set nodata to 0 and any other non-zero value to 1."""
+        presence_mask = ~numpy.isclose(threat_array, 0)
+        if threat_nodata is not None:
+            presence_mask &= ~numpy.isclose(threat_array, threat_nodata)
+        return presence_mask.astype(threat_array.dtype)
 
-        LOGGER.info('Starting raster calculation on quality_op')
+    pygeoprocessing.raster_calculator(
+        [(base_threat_path, 1)], _threat_presence_op, target_threat_path,
+        threat_raster_info['datatype'], threat_nodata)
 
-        deg_hab_raster_list = [deg_sum_raster_path, habitat_raster_path]
 
-        deg_hab_raster_band_list = [
-            (path, 1) for path in deg_hab_raster_list]
-        pygeoprocessing.raster_calculator(
-            deg_hab_raster_band_list, quality_op, quality_path,
-            gdal.GDT_Float32, _OUT_NODATA)
+def _get_lulc_value_map(sensitivity_dict, field):
+    """Map each lulc code of the sensitivity table to a field's value.
 
-        LOGGER.info('Finished raster calculation on quality_op')
+    Parameters:
+        sensitivity_dict (dict): the sensitivity table, as returned by
+            ``utils.build_lookup_from_csv``.
+        field (string): the column of the table to map the codes to.
 
-    # Compute Rarity if user supplied baseline raster
-    if '_b' not in lulc_path_dict:
-        LOGGER.info('Baseline not provided to compute Rarity')
-    else:
-        lulc_base_path = lulc_path_dict['_b']
+    Returns:
+        dict of int lulc code to the float value of ``field``.
+    """
+    return dict(
+        (int(lucode), float(row[field]))
+        for lucode, row in sensitivity_dict.items())
 
-        # get the area of a base pixel to use for computing rarity where the
-        # pixel sizes are different between base and cur/fut rasters
-        base_pixel_size = pygeoprocessing.get_raster_info(
-            lulc_base_path)['pixel_size']
-        base_area = float(abs(base_pixel_size[0]) * abs(base_pixel_size[1]))
-        base_nodata = pygeoprocessing.get_raster_info(
-            lulc_base_path)['nodata'][0]
 
-        lulc_code_count_b = raster_pixel_count(lulc_base_path)
+def _calculate_total_degradation(
+        deg_raster_path_list, weight_list, target_path):
+    """Sum the degradation of each threat.
 
-        # compute rarity for current landscape and future (if provided)
-        for lulc_key in ['_c', '_f']:
-            if lulc_key not in lulc_path_dict:
-                continue
-            lulc_path = lulc_path_dict[lulc_key]
-            lulc_time = 'current' if lulc_key == '_c' else 'future'
-
-            # get the area of a cur/fut pixel
-            lulc_pixel_size = pygeoprocessing.get_raster_info(
-                lulc_path)['pixel_size']
-            lulc_area = float(abs(lulc_pixel_size[0]) * abs(lulc_pixel_size[1]))
-            lulc_nodata = pygeoprocessing.get_raster_info(
-                lulc_path)['nodata'][0]
-
-            def trim_op(base, cover_x):
-                """Trim cover_x to the mask of base.
-
-                Parameters:
-                    base (numpy.ndarray): base raster from 'lulc_base'
-                    cover_x (numpy.ndarray): either future or current land
-                        cover raster from 'lulc_path' above
-
-                Returns:
-                    _OUT_NODATA where either array has nodata, otherwise
-                    cover_x.
-                """
-                return numpy.where(
-                    (base == base_nodata) | (cover_x == lulc_nodata),
-                    base_nodata, cover_x)
-
-            LOGGER.info('Create new cover for %s', lulc_path)
-
-            new_cover_path = os.path.join(
-                inter_dir, 'new_cover' + lulc_key + suffix + '.tif')
-
-            LOGGER.info('Starting masking %s land cover to base land cover.'
-                        % lulc_time)
-
-            pygeoprocessing.raster_calculator(
-                [(lulc_base_path, 1), (lulc_path, 1)], trim_op, new_cover_path,
-                gdal.GDT_Float32, _OUT_NODATA)
-
-            LOGGER.info('Finished masking %s land cover to base land cover.'
-                        % lulc_time)
-
-            LOGGER.info('Starting rarity computation on %s land cover.'
-                        % lulc_time)
-
-            lulc_code_count_x = raster_pixel_count(new_cover_path)
-
-            # a dictionary to map LULC types to a number that depicts how
-            # rare they are considered
-            code_index = {}
-
-            # compute rarity index for each lulc code
-            # define 0.0 if an lulc code is found in the cur/fut landcover
-            # but not the baseline
-            for code in lulc_code_count_x:
-                if code in lulc_code_count_b:
-                    numerator = lulc_code_count_x[code] * lulc_area
-                    denominator = lulc_code_count_b[code] * base_area
-                    ratio = 1.0 - (numerator / denominator)
-                    code_index[code] = ratio
-                else:
-                    code_index[code] = 0.0
-
-            rarity_path = os.path.join(
-                out_dir, 'rarity' + lulc_key + suffix + '.tif')
-
-            pygeoprocessing.reclassify_raster(
-                (new_cover_path, 1), code_index, rarity_path, gdal.GDT_Float32,
-                _RARITY_NODATA)
-
-            LOGGER.info('Finished rarity computation on %s land cover.'
-                        % lulc_time)
-    LOGGER.info('Finished habitat_quality biophysical calculations')
+    Parameters:
+        deg_raster_path_list (list): paths to the filtered threat and the
+            sensitivity raster of each threat, in pairs, followed by the path
+            to the access raster:
+            [filtered_threat1, sens_threat1, filtered_threat2, ...,
+             access].
+        weight_list (list): the normalized weight of each threat.
+        target_path (string): path to the degradation raster to create.
+
+    Returns:
+        None
+    """
+    weight_array = numpy.array(weight_list)
+
+    def total_degradation(*raster):
+        """Compute the degradation value of each pixel.
+
+        The values of each threat are multiplied by its weight and summed,
+        and the sum is multiplied by the last array, access.
+        """
+        # we can not be certain how many threats the user will enter,
+        # so we handle each filtered threat and sensitivity raster
+        # in pairs
+        sum_degradation = numpy.zeros(raster[0].shape)
+        for index in range(len(raster) // 2):
+            step = index * 2
+            sum_degradation += (
+                raster[step] * raster[step + 1] * weight_array[index])
+
+        nodata_mask = numpy.empty(raster[0].shape, dtype=numpy.int8)
+        nodata_mask[:] = 0
+        for array in raster:
+            nodata_mask = nodata_mask | (array == _OUT_NODATA)
+
+        # the last element in raster is access
+        return numpy.where(
+                nodata_mask, _OUT_NODATA, sum_degradation * raster[-1])
+
+    LOGGER.info('Starting raster calculation on total_degradation')
+    pygeoprocessing.raster_calculator(
+        [(path, 1) for path in deg_raster_path_list], total_degradation,
+        target_path, gdal.GDT_Float32, _OUT_NODATA)
+    LOGGER.info('Finished raster calculation on total_degradation')
+
+
+def _calculate_habitat_quality(
+        deg_sum_raster_path, habitat_raster_path, ksq, target_path):
+    """Calculate habitat quality from degradation and habitat.
+
+    Parameters:
+        deg_sum_raster_path (string): path to the total degradation raster.
+        habitat_raster_path (string): path to the habitat raster.
+        ksq (float): the half saturation constant raised to
+            ``_SCALING_PARAM``.
+        target_path (string): path to the quality raster to create.
+
+    Returns:
+        None
+    """
+    def quality_op(degradation, habitat):
+        """Vectorized function that computes habitat quality given
+            a degradation and habitat value.
+
+            degradation - a float from the created degradation
+                raster above.
+            habitat - a float indicating habitat suitability from
+                from the habitat raster created above.
+
+            returns - a float representing the habitat quality
+                score for a pixel
+        """
+        degredataion_clamped = numpy.where(degradation < 0, 0, degradation)
+
+        return numpy.where(
+                (degradation == _OUT_NODATA) | (habitat == _OUT_NODATA),
+                _OUT_NODATA,
+                (habitat * (1.0 - ((degredataion_clamped**_SCALING_PARAM) /
+                 (degredataion_clamped**_SCALING_PARAM + ksq)))))
+
+    LOGGER.info('Starting raster calculation on quality_op')
+    pygeoprocessing.raster_calculator(
+        [(deg_sum_raster_path, 1), (habitat_raster_path, 1)], quality_op,
+        target_path, gdal.GDT_Float32, _OUT_NODATA)
+    LOGGER.info('Finished raster calculation on quality_op')
+
+
+def _compute_rarity(lulc_base_path, lulc_path_list, rarity_path_list):
+    """Compute the rarity of land covers relative to the baseline.
+
+    The rarity of a land cover code is 1 minus the ratio of its area in the
+    land cover to its area in the baseline, counting only the pixels of the
+    land cover where the baseline also has data, or 0 if the code isn't in
+    the baseline.  The baseline and every land cover are read together in
+    one pass to count the pixels of each code they contain, then the rarity
+    rasters are written in a second pass.
+
+    Parameters:
+        lulc_base_path (string): path to the aligned baseline land cover.
+        lulc_path_list (list): paths to the aligned current and/or future
+            land covers.
+        rarity_path_list (list): paths to the rarity rasters to create, one
+            per path in ``lulc_path_list``.
+
+    Returns:
+        None
+    """
+    # get the area of a base pixel to use for computing rarity where the
+    # pixel sizes are different between base and cur/fut rasters
+    base_raster_info = pygeoprocessing.get_raster_info(lulc_base_path)
+    base_pixel_size = base_raster_info['pixel_size']
+    base_area = float(abs(base_pixel_size[0]) * abs(base_pixel_size[1]))
+    base_nodata = base_raster_info['nodata'][0]
+
+    lulc_area_list = []
+    lulc_nodata_list = []
+    for lulc_path in lulc_path_list:
+        # get the area of a cur/fut pixel
+        lulc_raster_info = pygeoprocessing.get_raster_info(lulc_path)
+        lulc_pixel_size = lulc_raster_info['pixel_size']
+        lulc_area_list.append(
+            float(abs(lulc_pixel_size[0]) * abs(lulc_pixel_size[1])))
+        lulc_nodata_list.append(lulc_raster_info['nodata'][0])
+
+    base_raster = gdal.OpenEx(lulc_base_path, gdal.OF_RASTER)
+    base_band = base_raster.GetRasterBand(1)
+    lulc_raster_list = [
+        gdal.OpenEx(lulc_path, gdal.OF_RASTER) for lulc_path in lulc_path_list]
+    lulc_band_list = [
+        lulc_raster.GetRasterBand(1) for lulc_raster in lulc_raster_list]
+
+    def _read_valid_blocks(offset_dict):
+        """Read the blocks of every land cover and where they have data.
+
+        Returns:
+            a (base block, base valid mask, list of (block, valid mask) of
+            each land cover) tuple.  A land cover pixel is only valid where
+            the base is too.
+        """
+        base_array = base_band.ReadAsArray(**offset_dict)
+        base_valid_mask = base_array != base_nodata
+        lulc_block_list = []
+        for lulc_band, lulc_nodata in zip(lulc_band_list, lulc_nodata_list):
+            lulc_array = lulc_band.ReadAsArray(**offset_dict)
+            lulc_block_list.append((
+                lulc_array, base_valid_mask & (lulc_array != lulc_nodata)))
+        return base_array, base_valid_mask, lulc_block_list
+
+    LOGGER.info('Starting rarity computation on %s.', lulc_path_list)
+
+    def _add_code_counts(code_count_map, lulc_array):
+        """Add the number of pixels of each code in lulc_array."""
+        for lucode, count in zip(*numpy.unique(
+                lulc_array, return_counts=True)):
+            code_count_map[lucode] += count
+
+    # any code may be counted, including fill values added by alignment
+    # that aren't in the sensitivity table
+    base_count_map = collections.defaultdict(int)
+    lulc_count_map_list = [
+        collections.defaultdict(int) for _ in lulc_path_list]
+    offset_list = list(pygeoprocessing.iterblocks(
+        (lulc_base_path, 1), offset_only=True))
+    for offset_dict in offset_list:
+        base_array, base_valid_mask, lulc_block_list = _read_valid_blocks(
+            offset_dict)
+        _add_code_counts(base_count_map, base_array[base_valid_mask])
+        for lulc_count_map, (lulc_array, lulc_valid_mask) in zip(
+                lulc_count_map_list, lulc_block_list):
+            _add_code_counts(lulc_count_map, lulc_array[lulc_valid_mask])
+
+    # every valid code of the second pass was counted in the first, so a
+    # code's index in lucode_array can be found by a binary search
+    lucode_array = numpy.array(sorted(set(base_count_map).union(
+        *lulc_count_map_list)))
+    base_count_array = numpy.array(
+        [base_count_map[lucode] for lucode in lucode_array],
+        dtype=numpy.int64)
+    lulc_count_array_list = [
+        numpy.array(
+            [lulc_count_map[lucode] for lucode in lucode_array],
+            dtype=numpy.int64)
+        for lulc_count_map in lulc_count_map_list]
+
+    # the rarity index of each lulc code is 0.0 if an lulc code is found in
+    # the cur/fut landcover but not the baseline
+    base_mask = base_count_array > 0
+    rarity_index_list = []
+    for lulc_count_array, lulc_area in zip(
+            lulc_count_array_list, lulc_area_list):
+        rarity_index_array = numpy.zeros(lucode_array.size)
+        rarity_index_array[base_mask] = 1.0 - (
+            (lulc_count_array[base_mask] * lulc_area) /
+            (base_count_array[base_mask] * base_area))
+        rarity_index_list.append(rarity_index_array.astype(numpy.float32))
+
+    rarity_raster_list = []
+    for lulc_path, rarity_path in zip(lulc_path_list, rarity_path_list):
+        pygeoprocessing.new_raster_from_base(
+            lulc_path, rarity_path, gdal.GDT_Float32, [_RARITY_NODATA])
+        rarity_raster_list.append(
+            gdal.OpenEx(rarity_path, gdal.OF_RASTER | gdal.GA_Update))
+    rarity_band_list = [
+        rarity_raster.GetRasterBand(1)
+        for rarity_raster in rarity_raster_list]
+
+    for offset_dict in offset_list:
+        _, _, lulc_block_list = _read_valid_blocks(offset_dict)
+        for rarity_band, rarity_index_array, (lulc_array, lulc_valid_mask) in (
+                zip(rarity_band_list, rarity_index_list, lulc_block_list)):
+            rarity_array = numpy.full(
+                lulc_array.shape, _RARITY_NODATA, dtype=numpy.float32)
+            rarity_array[lulc_valid_mask] = rarity_index_array[
+                numpy.searchsorted(
+                    lucode_array, lulc_array[lulc_valid_mask])]
+            rarity_band.WriteArray(
+                rarity_array, xoff=offset_dict['xoff'],
+                yoff=offset_dict['yoff'])
+
+    for rarity_band in rarity_band_list:
+        rarity_band.FlushCache()
+    rarity_band_list = None
+    rarity_raster_list = None
+    lulc_band_list = None
+    lulc_raster_list = None
+    base_band = None
+    base_raster = None
+
+    LOGGER.info('Finished rarity computation on %s.', lulc_path_list)
 
 
 def resolve_ambiguous_raster_path(path, raise_error=True):
@@ -797,62 +984,6 @@ def resolve_ambiguous_raster_path(path, raise_error=True):
     return full_path
 
 
-def raster_pixel_count(raster_path):
-    """Count unique pixel values in raster.
-
-    Parameters:
-        raster_path (string): path to a raster
-
-    Returns:
-        dict of pixel values to frequency.
-    """
-    nodata = pygeoprocessing.get_raster_info(raster_path)['nodata'][0]
-    counts = collections.defaultdict(int)
-    for _, raster_block in pygeoprocessing.iterblocks((raster_path, 1)):
-        for value, count in zip(
-                *numpy.unique(raster_block, return_counts=True)):
-            if value == nodata:
-                continue
-            counts[value] += count
-    return counts
-
-
-def map_raster_to_dict_values(
-        key_raster_path, out_path, attr_dict, field, out_nodata, values_required):
-    """Creates a new raster from 'key_raster' where the pixel values from
-       'key_raster' are the keys to a dictionary 'attr_dict'. The values
-       corresponding to those keys is what is written to the new raster. If a
-       value from 'key_raster' does not appear as a key in 'attr_dict' then
-       raise an Exception if 'raise_error' is True, otherwise return a
-       'out_nodata'
-
-       key_raster_path - a GDAL raster path dataset whose pixel values relate to
-                     the keys in 'attr_dict'
-       out_path - a string for the output path of the created raster
-       attr_dict - a dictionary representing a table of values we are interested
-                   in making into a raster
-       field - a string of which field in the table or key in the dictionary
-               to use as the new raster pixel values
-       out_nodata - a floating point value that is the nodata value.
-       raise_error - a string that decides how to handle the case where the
-           value from 'key_raster' is not found in 'attr_dict'. If 'raise_error'
-           is 'values_required', raise Exception, if 'none', return 'out_nodata'
-
-       returns - a GDAL raster, or raises an Exception and fail if:
-           1) raise_error is True and
-           2) the value from 'key_raster' is not a key in 'attr_dict'
-    """
-
-    LOGGER.info('Starting map_raster_to_dict_values')
-    int_attr_dict = {}
-    for key in attr_dict:
-        int_attr_dict[int(key)] = float(attr_dict[key][field])
-
-    pygeoprocessing.reclassify_raster(
-        (key_raster_path, 1), int_attr_dict, out_path, gdal.GDT_Float32,
-        out_nodata, values_required)
-
-
 def make_linear_decay_kernel_path(max_distance, kernel_path):
     """Create a linear decay kernel as a raster.
 
@@ -0,0 +1,567 @@
+# cython: profile=False
+# cython: language_level=3
+"""LRU block-cached raster access shared by the compiled InVEST cores.
+
+The routing cores of SDR, NDR and Seasonal Water Yield and the Scenic
+Quality viewshed all use ``_ManagedRaster`` for random per-pixel access to a
+raster on disk.  By default each managed raster keeps a fixed number of
+blocks in memory.  A memory budget may instead be given in megabytes, either
+directly to the core functions as ``cache_mb`` or through the
+``NATCAP_INVEST_RASTER_CACHE_MB`` environment variable, in which case the
+budget is split evenly across the managed rasters the core opens.
+
+Cache hit, miss and eviction counts are tracked per managed raster and are
+accumulated module-wide as rasters are closed (see ``get_cache_stats``), so
+that a thrashing cache can be identified and resized.
+
+Intermediate rasters that are only ever read back by a core may optionally
+be written as uncompressed, band-sequential ENVI rasters (``.bin``) instead
+of compressed GeoTIFFs by setting the ``NATCAP_INVEST_RAW_SCRATCH``
+environment variable.  A ``_ManagedRaster`` opened on such a raster reads and
+writes its blocks through a ``numpy.memmap`` of the file rather than through
+GDAL, which avoids the compression and per-block GDAL overhead of random
+access.  Model outputs are always written as GeoTIFFs.
+"""
+import logging
+import os
+
+import numpy
+import pygeoprocessing
+import pygeoprocessing.geoprocessing_core
+cimport numpy
+from osgeo import gdal
+
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from cython.operator cimport dereference as deref
+from cython.operator cimport preincrement as inc
+from libcpp.list cimport list as clist
+from libcpp.set cimport set as cset
+
+LOGGER = logging.getLogger(__name__)
+
+# Environment variable that may hold the cache budget (in MB) for a call to
+# one of the compiled cores.
+CACHE_MB_ENV_VAR = 'NATCAP_INVEST_RASTER_CACHE_MB'
+
+# Number of raster blocks to hold in memory at once per Managed Raster when
+# no memory budget is given.
+MANAGED_RASTER_N_BLOCKS = 2**6
+
+# Environment variable that, when set to a true value, turns on uncompressed
+# memory-mapped scratch rasters for core intermediates.
+RAW_SCRATCH_ENV_VAR = 'NATCAP_INVEST_RAW_SCRATCH'
+
+# Extension and GDAL driver options used for raw scratch rasters.  SUFFIX=ADD
+# names the ENVI header ``<name>.bin.hdr`` so it can't collide with the
+# header of another raster sharing the same base name.
+RAW_SCRATCH_EXTENSION = '.bin'
+RAW_SCRATCH_DRIVER_CREATION_TUPLE = ('ENVI', ('INTERLEAVE=BSQ', 'SUFFIX=ADD'))
+
+# ENVI rasters are stored by row, so a _ManagedRaster caches square blocks of
+# this size from a raw scratch raster instead of GDAL's one-row blocks.
+RAW_SCRATCH_BLOCK_SIZE = 2**8
+
+# Cache counters accumulated over every _ManagedRaster closed in this process.
+_CACHE_STATS = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+}
+
+
+def get_raster_cache_mb(n_rasters, cache_mb=None):
+    """Split a cache budget across the managed rasters of a single call.
+
+    Parameters:
+        n_rasters (int): the number of managed rasters that will share the
+            budget.
+        cache_mb (number): the total cache budget in megabytes.  If ``None``,
+            the value of the ``NATCAP_INVEST_RASTER_CACHE_MB`` environment
+            variable is used, if it is defined.
+
+    Returns:
+        The per-raster budget in megabytes, or ``None`` if no budget was
+        given, in which case each managed raster falls back to its default
+        number of cached blocks.
+
+    Raises:
+        ValueError: if the budget is not a positive number.
+
+    """
+    if cache_mb is None:
+        cache_mb = os.environ.get(CACHE_MB_ENV_VAR, None)
+        if cache_mb is None:
+            return None
+    try:
+        cache_mb = float(cache_mb)
+    except ValueError:
+        raise ValueError(
+            'Raster cache budget must be a number of megabytes, got %r' %
+            cache_mb)
+    if cache_mb <= 0:
+        raise ValueError(
+            'Raster cache budget must be positive, got %s' % cache_mb)
+    return cache_mb / max(1, n_rasters)
+
+
+def use_raw_scratch():
+    """Determine whether core intermediates should be raw scratch rasters.
+
+    Returns:
+        True if the ``NATCAP_INVEST_RAW_SCRATCH`` environment variable is set
+        to anything other than an empty string, ``0`` or ``false``.
+
+    """
+    return os.environ.get(RAW_SCRATCH_ENV_VAR, '').strip().lower() not in (
+        '', '0', 'false')
+
+
+def get_scratch_path(raster_path):
+    """Get the path to use for an intermediate raster.
+
+    Parameters:
+        raster_path (string): the GeoTIFF path of the intermediate raster.
+
+    Returns:
+        ``raster_path`` with its extension replaced by ``.bin`` if raw scratch
+        rasters are enabled (see ``use_raw_scratch``), otherwise
+        ``raster_path`` unchanged.
+
+    """
+    if not use_raw_scratch():
+        return raster_path
+    return os.path.splitext(raster_path)[0] + RAW_SCRATCH_EXTENSION
+
+
+def get_driver_creation_tuple(raster_path):
+    """Get the GDAL driver and creation options for a raster path.
+
+    Parameters:
+        raster_path (string): path to a raster that is about to be created.
+
+    Returns:
+        ``RAW_SCRATCH_DRIVER_CREATION_TUPLE`` if ``raster_path`` is a raw
+        scratch path, otherwise pygeoprocessing's default GeoTIFF driver
+        creation tuple.
+
+    """
+    if raster_path.endswith(RAW_SCRATCH_EXTENSION):
+        return RAW_SCRATCH_DRIVER_CREATION_TUPLE
+    return (
+        pygeoprocessing.geoprocessing_core.DEFAULT_GTIFF_CREATION_TUPLE_OPTIONS)
+
+
+def get_sidecar_path_list(raster_path):
+    """List the files other than ``raster_path`` that make up the raster.
+
+    Parameters:
+        raster_path (string): path to a raster.
+
+    Returns:
+        A list containing the path of the ENVI header if ``raster_path`` is a
+        raw scratch path, otherwise an empty list.
+
+    """
+    if raster_path.endswith(RAW_SCRATCH_EXTENSION):
+        return [raster_path + '.hdr']
+    return []
+
+
+def remove_raster(raster_path):
+    """Delete a raster along with any header or auxiliary files.
+
+    Parameters:
+        raster_path (string): path to the raster to delete.
+
+    Returns:
+        None.
+
+    """
+    for path in [raster_path, raster_path + '.aux.xml'] + (
+            get_sidecar_path_list(raster_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _open_raw_array(raster_path, band_id, write_mode):
+    """Memory-map a band of a raw scratch raster.
+
+    Parameters:
+        raster_path (string): path to a raster.
+        band_id (int): the band to map, starting at 1.
+        write_mode (boolean): if true, the map is writable.
+
+    Returns:
+        A 2D ``numpy.memmap`` of the band, or ``None`` if ``raster_path`` is
+        not a band-sequential ENVI raster.
+
+    """
+    raster = gdal.OpenEx(raster_path, gdal.OF_RASTER)
+    if raster.GetDriver().ShortName != 'ENVI':
+        return None
+    header_path = None
+    for path in raster.GetFileList():
+        if path.endswith('.hdr'):
+            header_path = path
+            break
+    raster = None
+    if header_path is None:
+        return None
+
+    header = {}
+    with open(header_path, 'r') as header_file:
+        for line in header_file:
+            if '=' in line:
+                key, value = line.split('=', 1)
+                header[key.strip().lower()] = value.strip().lower()
+    if header.get('interleave', 'bsq') != 'bsq':
+        return None
+
+    raster_info = pygeoprocessing.get_raster_info(raster_path)
+    n_cols, n_rows = raster_info['raster_size']
+    dtype = numpy.dtype(raster_info['numpy_type']).newbyteorder(
+        '>' if header.get('byte order', '0') == '1' else '<')
+    offset = int(header.get('header offset', '0')) + (
+        (band_id - 1) * n_rows * n_cols * dtype.itemsize)
+    return numpy.memmap(
+        raster_path, dtype=dtype, mode='r+' if write_mode else 'r',
+        offset=offset, shape=(n_rows, n_cols))
+
+
+def get_cache_stats():
+    """Get the cache counters accumulated over all closed managed rasters.
+
+    Returns:
+        A dict with the integer keys ``'hits'``, ``'misses'`` and
+        ``'evictions'``.
+
+    """
+    return dict(_CACHE_STATS)
+
+
+def reset_cache_stats():
+    """Reset the accumulated cache counters to 0.
+
+    Returns:
+        None.
+
+    """
+    for key in _CACHE_STATS:
+        _CACHE_STATS[key] = 0
+
+
+cdef class _ManagedRaster:
+    def __cinit__(
+            self, raster_path, band_id, write_mode,
+            n_blocks=MANAGED_RASTER_N_BLOCKS, cache_mb=None):
+        """Create new instance of Managed Raster.
+
+        Parameters:
+            raster_path (char*): path to raster that has block sizes that are
+                powers of 2. If not, an exception is raised.  Band-sequential
+                ENVI rasters, such as raw scratch rasters, are accessed
+                through a ``numpy.memmap`` in square blocks of
+                ``RAW_SCRATCH_BLOCK_SIZE`` instead.
+            band_id (int): which band in `raster_path` to index. Uses GDAL
+                notation that starts at 1.
+            write_mode (boolean): if true, this raster is writable and dirty
+                memory blocks will be written back to the raster as blocks
+                are swapped out of the cache or when the object deconstructs.
+            n_blocks (int): the number of raster blocks to hold in memory at
+                once.  Ignored if ``cache_mb`` is provided.
+            cache_mb (number): if provided, the amount of memory in megabytes
+                that the block cache may use.  At least one block is always
+                cached.
+
+        Returns:
+            None.
+        """
+        raster_info = pygeoprocessing.get_raster_info(raster_path)
+        self.raster_x_size, self.raster_y_size = raster_info['raster_size']
+        self.block_xsize, self.block_ysize = raster_info['block_size']
+        self.raw_array = _open_raw_array(raster_path, band_id, write_mode)
+        if self.raw_array is not None:
+            self.block_xsize = RAW_SCRATCH_BLOCK_SIZE
+            self.block_ysize = RAW_SCRATCH_BLOCK_SIZE
+        self.block_xmod = self.block_xsize-1
+        self.block_ymod = self.block_ysize-1
+
+        if not (1 <= band_id <= raster_info['n_bands']):
+            err_msg = (
+                "Error: band ID (%s) is not a valid band number. "
+                "This exception is happening in Cython, so it will cause a "
+                "hard seg-fault, but it's otherwise meant to be a "
+                "ValueError." % (band_id))
+            print(err_msg)
+            raise ValueError(err_msg)
+        self.band_id = band_id
+
+        if (self.block_xsize & (self.block_xsize - 1) != 0) or (
+                self.block_ysize & (self.block_ysize - 1) != 0):
+            # If inputs are not a power of two, this will at least print
+            # an error message. Unfortunately with Cython, the exception will
+            # present itself as a hard seg-fault, but I'm leaving the
+            # ValueError in here at least for readability.
+            err_msg = (
+                "Error: Block size is not a power of two: "
+                "block_xsize: %d, %d, %s. This exception is happening"
+                "in Cython, so it will cause a hard seg-fault, but it's"
+                "otherwise meant to be a ValueError." % (
+                    self.block_xsize, self.block_ysize, raster_path))
+            print(err_msg)
+            raise ValueError(err_msg)
+
+        self.block_xbits = numpy.log2(self.block_xsize)
+        self.block_ybits = numpy.log2(self.block_ysize)
+        self.block_nx = (
+            self.raster_x_size + (self.block_xsize) - 1) // self.block_xsize
+        self.block_ny = (
+            self.raster_y_size + (self.block_ysize) - 1) // self.block_ysize
+
+        if cache_mb is not None:
+            n_blocks = int(
+                cache_mb * 2**20 //
+                (self.block_xsize * self.block_ysize * sizeof(double)))
+        self.n_blocks = max(1, n_blocks)
+
+        self.lru_cache = new LRUCache[int, double*](self.n_blocks)
+        self.raster_path = <bytes> raster_path
+        self.write_mode = write_mode
+        self.closed = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+
+    def __dealloc__(self):
+        """Deallocate _ManagedRaster.
+
+        This operation manually frees memory from the LRUCache and writes any
+        dirty memory blocks back to the raster if `self.write_mode` is True.
+        """
+        self.close()
+        del self.lru_cache
+
+    def cache_stats(self):
+        """Get the block cache counters of this managed raster.
+
+        Returns:
+            A dict with the keys ``'hits'``, ``'misses'`` and ``'evictions'``
+            (the number of pixel accesses served from memory, the number of
+            blocks read from disk and the number of blocks dropped from the
+            cache to make room for another) and ``'n_blocks'``, the capacity
+            of the cache in blocks.
+
+        """
+        return {
+            'hits': self.n_hits,
+            'misses': self.n_misses,
+            'evictions': self.n_evictions,
+            'n_blocks': self.n_blocks,
+        }
+
+    def close(self):
+        """Close the _ManagedRaster and free up resources.
+
+            This call writes any dirty blocks to disk, frees up the memory
+            allocated as part of the cache, and frees all GDAL references.
+
+            Any subsequent calls to any other functions in _ManagedRaster will
+            have undefined behavior.
+        """
+        if self.closed:
+            return
+        self.closed = 1
+        _CACHE_STATS['hits'] += self.n_hits
+        _CACHE_STATS['misses'] += self.n_misses
+        _CACHE_STATS['evictions'] += self.n_evictions
+        LOGGER.debug(
+            '%s cache: %d hits, %d misses, %d evictions (%d blocks)',
+            self.raster_path, self.n_hits, self.n_misses, self.n_evictions,
+            self.n_blocks)
+
+        cdef int xi_copy, yi_copy
+        cdef numpy.ndarray[double, ndim=2] block_array = numpy.empty(
+            (self.block_ysize, self.block_xsize))
+        cdef double *double_buffer
+        cdef int block_xi
+        cdef int block_yi
+        # initially the win size is the same as the block size unless
+        # we're at the edge of a raster
+        cdef int win_xsize
+        cdef int win_ysize
+
+        # we need the offsets to subtract from global indexes for cached array
+        cdef int xoff
+        cdef int yoff
+
+        cdef clist[BlockBufferPair].iterator it = self.lru_cache.begin()
+        cdef clist[BlockBufferPair].iterator end = self.lru_cache.end()
+        if not self.write_mode:
+            while it != end:
+                # write the changed value back if desired
+                PyMem_Free(deref(it).second)
+                inc(it)
+            self.raw_array = None
+            return
+
+        raster = None
+        raster_band = None
+        if self.raw_array is None:
+            raster = gdal.OpenEx(
+                self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
+            raster_band = raster.GetRasterBand(self.band_id)
+
+        # if we get here, we're in write_mode
+        cdef cset[int].iterator dirty_itr
+        while it != end:
+            double_buffer = deref(it).second
+            block_index = deref(it).first
+
+            # write to disk if block is dirty
+            dirty_itr = self.dirty_blocks.find(block_index)
+            if dirty_itr != self.dirty_blocks.end():
+                self.dirty_blocks.erase(dirty_itr)
+                block_xi = block_index % self.block_nx
+                block_yi = block_index // self.block_nx
+
+                # we need the offsets to subtract from global indexes for
+                # cached array
+                xoff = block_xi << self.block_xbits
+                yoff = block_yi << self.block_ybits
+
+                win_xsize = self.block_xsize
+                win_ysize = self.block_ysize
+
+                # clip window sizes if necessary
+                if xoff+win_xsize > self.raster_x_size:
+                    win_xsize = win_xsize - (
+                        xoff+win_xsize - self.raster_x_size)
+                if yoff+win_ysize > self.raster_y_size:
+                    win_ysize = win_ysize - (
+                        yoff+win_ysize - self.raster_y_size)
+
+                for xi_copy in range(win_xsize):
+                    for yi_copy in range(win_ysize):
+                        block_array[yi_copy, xi_copy] = (
+                            double_buffer[
+                                (yi_copy << self.block_xbits) + xi_copy])
+                if self.raw_array is not None:
+                    self.raw_array[
+                        yoff:yoff+win_ysize, xoff:xoff+win_xsize] = (
+                            block_array[0:win_ysize, 0:win_xsize])
+                else:
+                    raster_band.WriteArray(
+                        block_array[0:win_ysize, 0:win_xsize],
+                        xoff=xoff, yoff=yoff)
+            PyMem_Free(double_buffer)
+            inc(it)
+        if self.raw_array is not None:
+            self.raw_array.flush()
+            self.raw_array = None
+        else:
+            raster_band.FlushCache()
+        raster_band = None
+        raster = None
+
+    cdef void _load_block(self, int block_index) except *:
+        cdef int block_xi = block_index % self.block_nx
+        cdef int block_yi = block_index // self.block_nx
+
+        # we need the offsets to subtract from global indexes for cached array
+        cdef int xoff = block_xi << self.block_xbits
+        cdef int yoff = block_yi << self.block_ybits
+
+        cdef int xi_copy, yi_copy
+        cdef numpy.ndarray[double, ndim=2] block_array
+        cdef double *double_buffer
+        cdef clist[BlockBufferPair] removed_value_list
+
+        # determine the block aligned xoffset for read as array
+
+        # initially the win size is the same as the block size unless
+        # we're at the edge of a raster
+        cdef int win_xsize = self.block_xsize
+        cdef int win_ysize = self.block_ysize
+
+        # load a new block
+        if xoff+win_xsize > self.raster_x_size:
+            win_xsize = win_xsize - (xoff+win_xsize - self.raster_x_size)
+        if yoff+win_ysize > self.raster_y_size:
+            win_ysize = win_ysize - (yoff+win_ysize - self.raster_y_size)
+
+        if self.raw_array is not None:
+            block_array = self.raw_array[
+                yoff:yoff+win_ysize, xoff:xoff+win_xsize].astype(
+                numpy.float64)
+        else:
+            raster = gdal.OpenEx(self.raster_path, gdal.OF_RASTER)
+            raster_band = raster.GetRasterBand(self.band_id)
+            block_array = raster_band.ReadAsArray(
+                xoff=xoff, yoff=yoff, win_xsize=win_xsize,
+                win_ysize=win_ysize).astype(
+                numpy.float64)
+            raster_band = None
+            raster = None
+        double_buffer = <double*>PyMem_Malloc(
+            (sizeof(double) << self.block_xbits) * win_ysize)
+        for xi_copy in range(win_xsize):
+            for yi_copy in range(win_ysize):
+                double_buffer[(yi_copy<<self.block_xbits)+xi_copy] = (
+                    block_array[yi_copy, xi_copy])
+        self.lru_cache.put(
+            <int>block_index, <double*>double_buffer, removed_value_list)
+        self.n_evictions += removed_value_list.size()
+
+        if self.write_mode and self.raw_array is None:
+            raster = gdal.OpenEx(
+                self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
+            raster_band = raster.GetRasterBand(self.band_id)
+
+        block_array = numpy.empty(
+            (self.block_ysize, self.block_xsize), dtype=numpy.double)
+        while not removed_value_list.empty():
+            # write the changed value back if desired
+            double_buffer = removed_value_list.front().second
+
+            if self.write_mode:
+                block_index = removed_value_list.front().first
+
+                # write back the block if it's dirty
+                dirty_itr = self.dirty_blocks.find(block_index)
+                if dirty_itr != self.dirty_blocks.end():
+                    self.dirty_blocks.erase(dirty_itr)
+
+                    block_xi = block_index % self.block_nx
+                    block_yi = block_index // self.block_nx
+
+                    xoff = block_xi << self.block_xbits
+                    yoff = block_yi << self.block_ybits
+
+                    win_xsize = self.block_xsize
+                    win_ysize = self.block_ysize
+
+                    if xoff+win_xsize > self.raster_x_size:
+                        win_xsize = win_xsize - (
+                            xoff+win_xsize - self.raster_x_size)
+                    if yoff+win_ysize > self.raster_y_size:
+                        win_ysize = win_ysize - (
+                            yoff+win_ysize - self.raster_y_size)
+
+                    for xi_copy in range(win_xsize):
+                        for yi_copy in range(win_ysize):
+                            block_array[yi_copy, xi_copy] = double_buffer[
+                                (yi_copy << self.block_xbits) + xi_copy]
+                    if self.raw_array is not None:
+                        self.raw_array[
+                            yoff:yoff+win_ysize, xoff:xoff+win_xsize] = (
+                                block_array[0:win_ysize, 0:win_xsize])
+                    else:
+                        raster_band.WriteArray(
+                            block_array[0:win_ysize, 0:win_xsize],
+                            xoff=xoff, yoff=yoff)
+            PyMem_Free(double_buffer)
+            removed_value_list.pop_front()
+
+        if self.write_mode:
+            raster_band = None
+            raster = None
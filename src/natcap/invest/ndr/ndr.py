@@ -1,8 +1,11 @@
 """InVEST Nutrient Delivery Ratio (NDR) module."""
 import itertools
 import logging
+import math
 import os
 import pickle
+import shutil
+import tempfile
 
 import numpy
 import pygeoprocessing
@@ -10,6 +13,7 @@ import pygeoprocessing.routing
 from osgeo import gdal, ogr
 import taskgraph
 
+from .. import managed_raster
 from .. import utils, validation
 from . import ndr_core
 
@@ -79,6 +83,17 @@ ARGS_SPEC = {
                 "each watershed."),
             "name": "Watersheds"
         },
+        "partition_by_watershed": {
+            "type": "boolean",
+            "required": False,
+            "about": (
+                "If selected, effective retention is calculated separately "
+                "for each watershed, in parallel when n_workers is at least "
+                "1, and the results are mosaicked together.  Flow that "
+                "leaves a watershed is treated as draining at its boundary, "
+                "and where watersheds overlap the largest one is used."),
+            "name": "Partition effective retention by watershed"
+        },
         "biophysical_table_path": {
             "validation_options": {
                 "required_fields": ["lucode"],
@@ -307,6 +322,11 @@ def execute(args):
             processes should be used in parallel processing. -1 indicates
             single process mode, 0 is single process but non-blocking mode,
             and >= 1 is number of processes.
+        args['partition_by_watershed'] (boolean): (optional) if True, the
+            effective retention of each nutrient is calculated on each
+            watershed's clipped rasters in a separate task and the results
+            are mosaicked.  Flow leaving a watershed drains at its boundary
+            and where watersheds overlap, the largest one is used.
 
     Returns:
         None
@@ -388,6 +408,13 @@ def execute(args):
         [(_OUTPUT_BASE_FILES, output_dir),
          (_INTERMEDIATE_BASE_FILES, intermediate_output_dir),
          (_CACHE_BASE_FILES, cache_dir)], file_suffix)
+    # the retention efficiency and critical length maps are only read back
+    # by the effective retention core, so they may be uncompressed
+    # memory-mapped scratch rasters
+    for scratch_key in [
+            'eff_n_path', 'eff_p_path', 'crit_len_n_path', 'crit_len_p_path']:
+        f_reg[scratch_key] = managed_raster.get_scratch_path(
+            f_reg[scratch_key])
 
     # Build up a list of nutrients to process based on what's checked on
     nutrients_to_process = []
@@ -549,6 +576,20 @@ def execute(args):
         dependent_task_list=[d_dn_task, d_up_task],
         task_name='calc ic')
 
+    if args.get('partition_by_watershed', False):
+        # smallest watersheds first so the largest ones are mosaicked last
+        watersheds_vector = gdal.OpenEx(
+            args['watersheds_path'], gdal.OF_VECTOR)
+        watersheds_layer = watersheds_vector.GetLayer()
+        watershed_fid_list = [
+            ws_feature.GetFID() for ws_feature in sorted(
+                watersheds_layer,
+                key=lambda ws_feature: (
+                    ws_feature.GetGeometryRef().GetArea(),
+                    ws_feature.GetFID()))]
+        watersheds_layer = None
+        watersheds_vector = None
+
     for nutrient in nutrients_to_process:
         load_path = f_reg['load_%s_path' % nutrient]
         modified_load_path = f_reg['modified_load_%s_path' % nutrient]
@@ -601,7 +642,8 @@ def execute(args):
             args=(
                 f_reg['aligned_lulc_path'], f_reg['stream_path'],
                 lucode_to_parameters, 'eff_%s' % nutrient, eff_path),
-            target_path_list=[eff_path],
+            target_path_list=(
+                [eff_path] + managed_raster.get_sidecar_path_list(eff_path)),
             dependent_task_list=[align_raster_task, stream_extraction_task],
             task_name='ret eff %s' % nutrient)
 
@@ -611,21 +653,53 @@ def execute(args):
             args=(
                 f_reg['aligned_lulc_path'], f_reg['stream_path'],
                 lucode_to_parameters, 'crit_len_%s' % nutrient, crit_len_path),
-            target_path_list=[crit_len_path],
+            target_path_list=(
+                [crit_len_path] +
+                managed_raster.get_sidecar_path_list(crit_len_path)),
             dependent_task_list=[align_raster_task, stream_extraction_task],
             task_name='ret eff %s' % nutrient)
 
         effective_retention_path = (
             f_reg['effective_retention_%s_path' % nutrient])
-        ndr_eff_task = task_graph.add_task(
-            func=ndr_core.ndr_eff_calculation,
-            args=(
-                f_reg['flow_direction_path'], f_reg['stream_path'], eff_path,
-                crit_len_path, effective_retention_path),
-            target_path_list=[effective_retention_path],
-            dependent_task_list=[
-                stream_extraction_task, eff_task, crit_len_task],
-            task_name='eff ret %s' % nutrient)
+        if args.get('partition_by_watershed', False):
+            watershed_effective_retention_path_list = []
+            watershed_task_list = []
+            for ws_fid in watershed_fid_list:
+                watershed_effective_retention_path = os.path.join(
+                    cache_dir, 'effective_retention_%s_ws%d%s.tif' % (
+                        nutrient, ws_fid, file_suffix))
+                watershed_effective_retention_path_list.append(
+                    watershed_effective_retention_path)
+                # no target path list because a watershed that's outside
+                # of the rasters doesn't produce a raster
+                watershed_task_list.append(task_graph.add_task(
+                    func=_calculate_watershed_effective_retention,
+                    args=(
+                        args['watersheds_path'], ws_fid,
+                        f_reg['flow_direction_path'], f_reg['stream_path'],
+                        eff_path, crit_len_path,
+                        watershed_effective_retention_path, cache_dir),
+                    dependent_task_list=[
+                        stream_extraction_task, eff_task, crit_len_task],
+                    task_name='eff ret %s ws %d' % (nutrient, ws_fid)))
+            ndr_eff_task = task_graph.add_task(
+                func=_mosaic_rasters,
+                args=(
+                    watershed_effective_retention_path_list,
+                    f_reg['flow_direction_path'], effective_retention_path),
+                target_path_list=[effective_retention_path],
+                dependent_task_list=watershed_task_list,
+                task_name='mosaic eff ret %s' % nutrient)
+        else:
+            ndr_eff_task = task_graph.add_task(
+                func=ndr_core.ndr_eff_calculation,
+                args=(
+                    f_reg['flow_direction_path'], f_reg['stream_path'],
+                    eff_path, crit_len_path, effective_retention_path),
+                target_path_list=[effective_retention_path],
+                dependent_task_list=[
+                    stream_extraction_task, eff_task, crit_len_task],
+                task_name='eff ret %s' % nutrient)
 
         ndr_path = f_reg['ndr_%s_path' % nutrient]
         ndr_task = task_graph.add_task(
@@ -1088,7 +1162,9 @@ def _map_lulc_to_val_mask_stream(
             landcover to efficiency.
         target_eff_path (string): target raster that contains the mapping of
             landcover codes to retention efficiency values except where there
-            is a stream in which case the retention efficiency is 0.
+            is a stream in which case the retention efficiency is 0.  If
+            this path ends in ``.bin`` it is created as an uncompressed ENVI
+            raster.
 
     Returns:
         None.
@@ -1117,7 +1193,9 @@ def _map_lulc_to_val_mask_stream(
 
     pygeoprocessing.raster_calculator(
         ((lulc_raster_path, 1), (stream_path, 1)), _map_eff_op,
-        target_eff_path, gdal.GDT_Float32, _TARGET_NODATA)
+        target_eff_path, gdal.GDT_Float32, _TARGET_NODATA,
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(target_eff_path)))
 
 
 def s_bar_calculate(
@@ -1334,6 +1412,146 @@ def _aggregate_and_pickle_total(
         pickle.dump(result, target_pickle_file)
 
 
+def _calculate_watershed_effective_retention(
+        watersheds_path, ws_fid, mfd_flow_direction_path, stream_path,
+        retention_eff_lulc_path, crit_len_path,
+        target_effective_retention_path, working_dir):
+    """Calculate effective retention on the rasters clipped to a watershed.
+
+    Parameters:
+        watersheds_path (string): path to the watersheds vector.
+        ws_fid (int): the FID of the watershed in ``watersheds_path``.
+        mfd_flow_direction_path, stream_path, retention_eff_lulc_path,
+            crit_len_path (string): the rasters passed to
+            ``ndr_core.ndr_eff_calculation``.
+        target_effective_retention_path (string): path to the effective
+            retention raster to create, covering the bounding box of the
+            watershed.  Not created if the watershed doesn't overlap the
+            rasters.
+        working_dir (string): path to a directory for temporary files.
+
+    Returns:
+        None.
+
+    """
+    flow_dir_info = pygeoprocessing.get_raster_info(mfd_flow_direction_path)
+    n_cols, n_rows = flow_dir_info['raster_size']
+    geotransform = flow_dir_info['geotransform']
+
+    watersheds_vector = gdal.OpenEx(watersheds_path, gdal.OF_VECTOR)
+    watersheds_layer = watersheds_vector.GetLayer()
+    min_x, max_x, min_y, max_y = watersheds_layer.GetFeature(
+        ws_fid).GetGeometryRef().GetEnvelope()
+    watershed_bb = pygeoprocessing.transform_bounding_box(
+        [min_x, min_y, max_x, max_y],
+        watersheds_layer.GetSpatialRef().ExportToWkt(),
+        flow_dir_info['projection'])
+    watersheds_layer = None
+    watersheds_vector = None
+
+    # snap the bounding box outward to the flow direction pixel grid so the
+    # clipped rasters are pixel for pixel copies
+    col_min = max(0, int(math.floor(
+        (watershed_bb[0] - geotransform[0]) / geotransform[1])))
+    col_max = min(n_cols, int(math.ceil(
+        (watershed_bb[2] - geotransform[0]) / geotransform[1])))
+    row_min = max(0, int(math.floor(
+        (watershed_bb[3] - geotransform[3]) / geotransform[5])))
+    row_max = min(n_rows, int(math.ceil(
+        (watershed_bb[1] - geotransform[3]) / geotransform[5])))
+    if col_min >= col_max or row_min >= row_max:
+        LOGGER.warning(
+            'watershed %d does not overlap the flow direction raster, '
+            'skipping', ws_fid)
+        return
+    target_bb = [
+        geotransform[0] + col_min * geotransform[1],
+        geotransform[3] + row_max * geotransform[5],
+        geotransform[0] + col_max * geotransform[1],
+        geotransform[3] + row_min * geotransform[5]]
+
+    clip_dir = tempfile.mkdtemp(
+        dir=working_dir, prefix='eff_ret_ws%d_' % ws_fid)
+    clipped_path_list = []
+    for base_path in (
+            mfd_flow_direction_path, stream_path, retention_eff_lulc_path,
+            crit_len_path):
+        clipped_path = os.path.join(
+            clip_dir, os.path.splitext(os.path.basename(base_path))[0] +
+            '.tif')
+        kwargs = {'target_bb': target_bb, 'working_dir': clip_dir}
+        if base_path == mfd_flow_direction_path:
+            # flow out of the watershed drains at its boundary
+            kwargs['vector_mask_options'] = {
+                'mask_vector_path': watersheds_path,
+                'mask_vector_where_filter': 'FID=%d' % ws_fid,
+            }
+        pygeoprocessing.warp_raster(
+            base_path, flow_dir_info['pixel_size'], clipped_path, 'near',
+            **kwargs)
+        clipped_path_list.append(clipped_path)
+
+    ndr_core.ndr_eff_calculation(
+        *clipped_path_list, target_effective_retention_path)
+    shutil.rmtree(clip_dir, ignore_errors=True)
+
+
+def _mosaic_rasters(raster_path_list, base_raster_path, target_raster_path):
+    """Mosaic rasters that are aligned to a base raster's pixel grid.
+
+    Parameters:
+        raster_path_list (list): paths to single band rasters on the pixel
+            grid of ``base_raster_path`` that are each within its extent.
+            Paths that don't exist are skipped.  Valid pixels of later
+            rasters overwrite those of earlier ones.
+        base_raster_path (string): path to the raster that defines the
+            extent and grid of the target.
+        target_raster_path (string): path to the float32 mosaic to create.
+            Pixels not covered by a valid pixel are nodata.
+
+    Returns:
+        None.
+
+    """
+    target_nodata = -1.0
+    pygeoprocessing.new_raster_from_base(
+        base_raster_path, target_raster_path, gdal.GDT_Float32,
+        [target_nodata], fill_value_list=[target_nodata])
+    base_geotransform = pygeoprocessing.get_raster_info(
+        base_raster_path)['geotransform']
+
+    target_raster = gdal.OpenEx(
+        target_raster_path, gdal.OF_RASTER | gdal.GA_Update)
+    target_band = target_raster.GetRasterBand(1)
+    for raster_path in raster_path_list:
+        if not os.path.exists(raster_path):
+            continue
+        raster_info = pygeoprocessing.get_raster_info(raster_path)
+        raster_nodata = raster_info['nodata'][0]
+        xoff = int(round(
+            (raster_info['geotransform'][0] - base_geotransform[0]) /
+            base_geotransform[1]))
+        yoff = int(round(
+            (raster_info['geotransform'][3] - base_geotransform[3]) /
+            base_geotransform[5]))
+        for offset_dict, array in pygeoprocessing.iterblocks(
+                (raster_path, 1)):
+            valid_mask = array != raster_nodata
+            if not valid_mask.any():
+                continue
+            target_xoff = xoff + offset_dict['xoff']
+            target_yoff = yoff + offset_dict['yoff']
+            target_array = target_band.ReadAsArray(
+                xoff=target_xoff, yoff=target_yoff,
+                win_xsize=offset_dict['win_xsize'],
+                win_ysize=offset_dict['win_ysize'])
+            target_array[valid_mask] = array[valid_mask]
+            target_band.WriteArray(
+                target_array, xoff=target_xoff, yoff=target_yoff)
+    target_band = None
+    target_raster = None
+
+
 def create_vector_copy(base_vector_path, target_vector_path):
     """Create a copy of base vector."""
     if os.path.isfile(target_vector_path):
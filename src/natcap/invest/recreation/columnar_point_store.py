@@ -0,0 +1,298 @@
+"""Columnar, memory-mapped point store for the recreation quadtree."""
+
+import collections
+import os
+import time
+import logging
+
+import numpy
+
+from .. import utils
+
+
+LOGGER = logging.getLogger(
+    'natcap.invest.recmodel_server.columnar_point_store')
+
+
+class ColumnarPointStore(object):
+    """Append-only columnar store of the points in each quadtree node.
+
+    This object has the same append, read, and delete interface as
+    ``BufferedNumpyDiskMap`` but keeps every node's points in one set of
+    column files, one per field of ``_ARRAY_TUPLE_TYPE`` (date, user hash,
+    x and y coordinate).  Points are buffered in memory and appended to the
+    end of the column files when the buffer is full, and each node records
+    the ``(start, stop)`` row ranges that hold its points.  Column files are
+    read through ``numpy.memmap`` so that processes reading the same store
+    share its pages rather than each loading a copy.
+
+    ``flush`` packs the column files so that each node's points are one
+    contiguous range, after which ``read_columns`` returns views into the
+    memory maps without copying.
+
+    The store is pickled along with the quadtree that uses it; only the
+    file paths and node ranges are pickled, so it must be flushed first.
+    """
+
+    _ARRAY_TUPLE_TYPE = numpy.dtype('datetime64[D],a4,f4,f4')
+
+    def __init__(self, manager_filename, max_bytes_to_buffer):
+        """Create a point store.
+
+        Parameters:
+            manager_filename (string): base path of the store.  The column
+                files are created next to it as
+                ``<manager_filename>_<generation>_f<field>.bin``.
+            max_bytes_to_buffer (int): number of bytes to hold in memory
+                before appending to the column files.
+
+        Returns:
+            None
+        """
+        self.manager_filename = manager_filename
+        utils.make_directories([os.path.dirname(manager_filename)])
+        self.max_bytes_to_buffer = max_bytes_to_buffer
+        # column files are rewritten under a new generation when packed
+        self.generation = 0
+        self.n_rows = 0
+        # rows in the column files that belong to deleted nodes
+        self.n_dead_rows = 0
+        self.array_ranges = collections.defaultdict(list)
+        self.array_cache = collections.defaultdict(collections.deque)
+        self.current_bytes_in_system = 0
+        self._column_memmaps = None
+        for column_path in self._column_paths():
+            open(column_path, 'wb').close()
+
+    def __getstate__(self):
+        """Pickle the store's file paths and node ranges only."""
+        if self.current_bytes_in_system > 0:
+            raise ValueError(
+                'ColumnarPointStore must be flushed before it is pickled.')
+        state = self.__dict__.copy()
+        state['array_cache'] = None
+        state['_column_memmaps'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled store with an empty buffer."""
+        self.__dict__.update(state)
+        self.array_cache = collections.defaultdict(collections.deque)
+
+    def _column_paths(self, generation=None):
+        """List the paths of the column files of a generation."""
+        if generation is None:
+            generation = self.generation
+        return [
+            '%s_%d_f%d.bin' % (self.manager_filename, generation, field_index)
+            for field_index in range(len(self._ARRAY_TUPLE_TYPE))]
+
+    def _columns(self):
+        """Return read-only memory maps of the column files."""
+        if self._column_memmaps is None:
+            self._column_memmaps = []
+            for field_index, column_path in enumerate(self._column_paths()):
+                column_type = self._ARRAY_TUPLE_TYPE[field_index]
+                if self.n_rows == 0:
+                    # numpy can't map an empty file
+                    self._column_memmaps.append(
+                        numpy.empty(0, dtype=column_type))
+                else:
+                    self._column_memmaps.append(numpy.memmap(
+                        column_path, dtype=column_type, mode='r',
+                        shape=(self.n_rows,)))
+        return self._column_memmaps
+
+    def append(self, array_id, array_data):
+        """Append data to a node.
+
+        Parameters:
+            array_id (int): unique key to identify the array node
+            array_data (numpy.ndarray): structured array of
+                ``_ARRAY_TUPLE_TYPE`` to append to node.
+
+        Returns:
+            None
+        """
+        self.array_cache[array_id].append(array_data.copy())
+        self.current_bytes_in_system += (
+            array_data.size * self._ARRAY_TUPLE_TYPE.itemsize)
+        if self.current_bytes_in_system > self.max_bytes_to_buffer:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        """Append the buffered points to the end of the column files."""
+        start_time = time.time()
+        LOGGER.info(
+            'Appending %d bytes in %d arrays', self.current_bytes_in_system,
+            len(self.array_cache))
+        column_files = [
+            open(column_path, 'ab') for column_path in self._column_paths()]
+        try:
+            while len(self.array_cache) > 0:
+                array_id, array_deque = self.array_cache.popitem()
+                array_data = numpy.concatenate(array_deque)
+                array_deque = None
+                for field_index, column_file in enumerate(column_files):
+                    numpy.ascontiguousarray(
+                        array_data['f%d' % field_index]).tofile(column_file)
+                self.array_ranges[array_id].append(
+                    (self.n_rows, self.n_rows + array_data.size))
+                self.n_rows += array_data.size
+        finally:
+            for column_file in column_files:
+                column_file.close()
+        self._column_memmaps = None
+        self.current_bytes_in_system = 0
+        LOGGER.info('Completed append in %.2fs', time.time() - start_time)
+
+    def flush(self, pack=True):
+        """Write buffered points to disk and pack the column files.
+
+        Parameters:
+            pack (bool): if False, buffered points are only appended to the
+                column files.  Packing writes a new generation of column
+                files and removes the old one, which would invalidate other
+                pickles of the store.
+
+        Returns:
+            None
+        """
+        self._write_buffer()
+        if pack and (self.n_dead_rows > 0 or any(
+                len(range_list) > 1
+                for range_list in self.array_ranges.values())):
+            self._pack()
+
+    def _pack(self):
+        """Rewrite the column files so each node's points are contiguous."""
+        start_time = time.time()
+        LOGGER.info(
+            'Packing %d rows, %d of them deleted, in %d arrays', self.n_rows,
+            self.n_dead_rows, len(self.array_ranges))
+        base_columns = self._columns()
+        base_column_paths = self._column_paths()
+        target_column_paths = self._column_paths(self.generation + 1)
+        target_column_files = [
+            open(column_path, 'wb') for column_path in target_column_paths]
+        packed_array_ranges = collections.defaultdict(list)
+        n_packed_rows = 0
+        try:
+            for array_id in sorted(self.array_ranges):
+                start = n_packed_rows
+                for range_start, range_stop in self.array_ranges[array_id]:
+                    for base_column, column_file in zip(
+                            base_columns, target_column_files):
+                        numpy.ascontiguousarray(
+                            base_column[range_start:range_stop]).tofile(
+                                column_file)
+                    n_packed_rows += range_stop - range_start
+                packed_array_ranges[array_id].append((start, n_packed_rows))
+        finally:
+            for column_file in target_column_files:
+                column_file.close()
+        base_columns = None
+        self._column_memmaps = None
+
+        self.generation += 1
+        self.n_rows = n_packed_rows
+        self.n_dead_rows = 0
+        self.array_ranges = packed_array_ranges
+        for column_path in base_column_paths:
+            os.remove(column_path)
+        LOGGER.info('Completed pack in %.2fs', time.time() - start_time)
+
+    def reopen(self):
+        """Prepare a store loaded from a pickle to append more points.
+
+        Rows in the column files past those recorded when the store was
+        pickled, such as those appended by an interrupted build or by
+        another pickle of the store, are kept as deleted rows so that the
+        files stay valid for every pickle that shares them.
+
+        Returns:
+            None
+
+        Raises:
+            OSError if a column file is missing, or ValueError if the column
+            files are shorter than the pickled store.
+        """
+        column_paths = self._column_paths()
+        n_file_rows = max([
+            -(-os.path.getsize(column_path) //
+              self._ARRAY_TUPLE_TYPE[field_index].itemsize)
+            for field_index, column_path in enumerate(column_paths)])
+        if n_file_rows < self.n_rows:
+            raise ValueError(
+                '%s has %d rows but the store has %d' % (
+                    self.manager_filename, n_file_rows, self.n_rows))
+        # a column cut short by an interruption is padded to the same number
+        # of rows as the others
+        for field_index, column_path in enumerate(column_paths):
+            with open(column_path, 'r+b') as column_file:
+                column_file.truncate(
+                    n_file_rows *
+                    self._ARRAY_TUPLE_TYPE[field_index].itemsize)
+        self.n_dead_rows += n_file_rows - self.n_rows
+        self.n_rows = n_file_rows
+        self._column_memmaps = None
+
+    def read_columns(self, array_id):
+        """Read a node's points as a list of columns.
+
+        Parameters:
+            array_id (int): unique node id to read
+
+        Returns:
+            list of one numpy array per field of ``_ARRAY_TUPLE_TYPE``.  When
+            the node's points are one contiguous range on disk and none are
+            buffered, these are read-only views of the memory-mapped column
+            files.
+        """
+        range_list = self.array_ranges.get(array_id, [])
+        cached_deque = self.array_cache.get(array_id, [])
+        columns = self._columns()
+        if len(range_list) == 1 and len(cached_deque) == 0:
+            range_start, range_stop = range_list[0]
+            return [column[range_start:range_stop] for column in columns]
+
+        column_list = []
+        for field_index, column in enumerate(columns):
+            part_list = [
+                column[range_start:range_stop]
+                for range_start, range_stop in range_list]
+            part_list.extend(
+                cached_array['f%d' % field_index]
+                for cached_array in cached_deque)
+            if part_list:
+                column_list.append(numpy.concatenate(part_list))
+            else:
+                column_list.append(numpy.empty(
+                    0, dtype=self._ARRAY_TUPLE_TYPE[field_index]))
+        return column_list
+
+    def read(self, array_id):
+        """Read the entirety of a node.
+
+        Parameters:
+            array_id (int): unique node id to read
+
+        Returns:
+            contents of node as a structured numpy.ndarray of
+            ``_ARRAY_TUPLE_TYPE``.
+        """
+        column_list = self.read_columns(array_id)
+        array_data = numpy.empty(
+            column_list[0].size, dtype=self._ARRAY_TUPLE_TYPE)
+        for field_index, column in enumerate(column_list):
+            array_data['f%d' % field_index] = column
+        return array_data
+
+    def delete(self, array_id):
+        """Delete node `array_id` from the store and cache."""
+        for range_start, range_stop in self.array_ranges.pop(array_id, []):
+            self.n_dead_rows += range_stop - range_start
+        cached_deque = self.array_cache.pop(array_id, [])
+        self.current_bytes_in_system -= (
+            sum([x.size for x in cached_deque]) *
+            self._ARRAY_TUPLE_TYPE.itemsize)
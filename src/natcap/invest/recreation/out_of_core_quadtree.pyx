@@ -23,8 +23,9 @@ cimport numpy
 
 MAX_BYTES_TO_BUFFER = 2**27  # buffer a little over 128 megabytes
 import buffered_numpy_disk_map
+import columnar_point_store
 _ARRAY_TUPLE_TYPE = (
-    buffered_numpy_disk_map.BufferedNumpyDiskMap._ARRAY_TUPLE_TYPE)
+    columnar_point_store.ColumnarPointStore._ARRAY_TUPLE_TYPE)
 
 LOGGER = logging.getLogger(
     'natcap.invest.recmodel_server.out_of_core_quadtree')
@@ -49,8 +50,12 @@ class OutOfCoreQuadTree(object):
             quad_tree_storage_dir (string): path to a directory where the
                 quadtree files can be stored
             node_depth (int): depth of current node
-            node_data_manager (BufferedNumpyDiskMap): an object which is used
-                to store the node data across the entire quadtree
+            node_data_manager (ColumnarPointStore): an object which is used
+                to store the node data across the entire quadtree.  If not
+                provided, a ``ColumnarPointStore`` is created next to
+                ``pickle_filename``.  Trees pickled before the columnar store
+                was introduced still load with their
+                ``BufferedNumpyDiskMap``.
             pickle_filename (string): name of file on disk which to pickle the
                 tree to during a flush
 
@@ -67,8 +72,8 @@ class OutOfCoreQuadTree(object):
         self.quad_tree_storage_dir = quad_tree_storage_dir
         if node_data_manager is None:
             self.node_data_manager = (
-                buffered_numpy_disk_map.BufferedNumpyDiskMap(
-                    pickle_filename+'.db', MAX_BYTES_TO_BUFFER))
+                columnar_point_store.ColumnarPointStore(
+                    pickle_filename+'.points', MAX_BYTES_TO_BUFFER))
         else:
             self.node_data_manager = node_data_manager
 
@@ -78,12 +83,50 @@ class OutOfCoreQuadTree(object):
         self.blob_id = OutOfCoreQuadTree.next_available_blob_id
         OutOfCoreQuadTree.next_available_blob_id += 1
 
-    def flush(self):
-        """Flush any cached data to disk."""
-        self.node_data_manager.flush()
+    def flush(self, pack=True):
+        """Flush any cached data to disk.
+
+        Parameters:
+            pack (bool): if False, buffered points are appended to the
+                node data manager's files without packing them, so other
+                pickled trees that share those files stay valid.  Only
+                supported by ``ColumnarPointStore``.
+
+        Returns:
+            None
+        """
+        if pack:
+            self.node_data_manager.flush()
+        else:
+            self.node_data_manager.flush(pack=False)
         if self.pickle_filename is not None:
             pickle.dump(self, open(self.pickle_filename, 'wb'))
 
+    def set_quadrant_subtrees(self, subtree_list):
+        """Make this empty leaf the parent of four separately built subtrees.
+
+        Parameters:
+            subtree_list (list): four ``OutOfCoreQuadTree`` nodes one level
+                deeper than this node, covering the bounding boxes returned by
+                ``quadrant_bounding_boxes(self.bounding_box)`` in order.
+
+        Returns:
+            None
+        """
+        if not self.is_leaf or self.n_points_in_node > 0:
+            raise ValueError('Only an empty leaf can be given subtrees.')
+        # an empty leaf has nothing stored under its blob id to delete
+        self.blob_id = None
+        self.nodes = list(subtree_list)
+        self.is_leaf = False
+
+    def max_blob_id(self):
+        """Return the largest blob id of the leaves under this node."""
+        if self.is_leaf:
+            return self.blob_id
+        return max([
+            self.nodes[index].max_blob_id() for index in xrange(4)])
+
     def build_node_shapes(self, ogr_polygon_layer):
         """Add features to an ogr.Layer to visualize quadtree segmentation.
 
@@ -120,6 +163,24 @@ class OutOfCoreQuadTree(object):
         """
         return self.node_data_manager.read(self.blob_id)
 
+    def _get_point_columns_from_node(self):
+        """Return the points in the current node as columns.
+
+        Returns:
+            dict mapping each field name of ``_ARRAY_TUPLE_TYPE`` to an array
+            of that field of the node's points.  The columns of a
+            ``ColumnarPointStore`` are views of its memory maps where
+            possible rather than copies.
+        """
+        if hasattr(self.node_data_manager, 'read_columns'):
+            return dict(zip(
+                _ARRAY_TUPLE_TYPE.names,
+                self.node_data_manager.read_columns(self.blob_id)))
+        point_array = self._get_points_from_node()
+        return dict(
+            (field_name, point_array[field_name])
+            for field_name in _ARRAY_TUPLE_TYPE.names)
+
     def _drain_node(self):
         """Delete current node data from the quadtree and return as a list.
 
@@ -136,30 +197,7 @@ class OutOfCoreQuadTree(object):
     def _split_node(self):
         """Split node into quads and distribute current node's points."""
         point_list = self._drain_node()
-        mid_x_coord = (self.bounding_box[0] + self.bounding_box[2]) / 2.
-        mid_y_coord = (self.bounding_box[1] + self.bounding_box[3]) / 2.
-
-        # children node indexes are arranged like this:
-        # 01
-        # 23
-        bounding_quads = [
-            [self.bounding_box[0],  # xmin
-             mid_y_coord,  # ymin
-             mid_x_coord,  # xmax
-             self.bounding_box[3]],
-            [mid_x_coord,  # xmin
-             mid_y_coord,  # ymin
-             self.bounding_box[2],  # xmax
-             self.bounding_box[3]],
-            [self.bounding_box[0],  # xmin
-             self.bounding_box[1],  # ymin
-             mid_x_coord,  # xmax
-             mid_y_coord],  # ymax
-            [mid_x_coord,  # xmin
-             self.bounding_box[1],  # ymin
-             self.bounding_box[2],  # xmax
-             mid_y_coord],  # ymax
-        ]
+        bounding_quads = quadrant_bounding_boxes(self.bounding_box)
         self.nodes = []
         for bounding_box in bounding_quads:
             self.nodes.append(OutOfCoreQuadTree(
@@ -281,38 +319,77 @@ class OutOfCoreQuadTree(object):
                 against
 
         Returns:
-            deque of (data, x_coord, y_coord) of nodes that are contained
-                in `shapely_prepared_polygon`.
+            structured numpy.ndarray of ``_ARRAY_TUPLE_TYPE`` of the points
+                that are contained in `shapely_polygon`.
+        """
+        point_columns = self.get_intersecting_point_columns_in_polygon(
+            shapely_polygon)
+        point_array = numpy.empty(
+            point_columns['f0'].size, dtype=_ARRAY_TUPLE_TYPE)
+        for field_name, column in point_columns.items():
+            point_array[field_name] = column
+        return point_array
+
+    def get_intersecting_point_columns_in_polygon(self, shapely_polygon):
+        """Return the columns of the points contained in `shapely_polygon`.
+
+        The points of leaves that are wholly inside the polygon are not
+        copied out of a ``ColumnarPointStore``, so processes querying the
+        same quadtree share the pages of its memory-mapped columns.
+
+        Parameters:
+            shapely_polygon (shapely.geometry.Polygon): the polygon to find
+                the points in.
+
+        Returns:
+            dict mapping each field name of ``_ARRAY_TUPLE_TYPE`` to an array
+            of that field of the points contained in `shapely_polygon`.
         """
         bounding_polygon = shapely.geometry.box(*self.bounding_box)
 
         if self.is_leaf:
             if shapely_polygon.contains(bounding_polygon):
                 # trivial, all points are in the poly
-                return self._get_points_from_node()
+                return self._get_point_columns_from_node()
             elif shapely_polygon.intersects(bounding_polygon):
                 # tricky, some points might be in poly
-                result_deque = collections.deque()
+                point_columns = self._get_point_columns_from_node()
                 shapely_prepared_polygon = shapely.prepared.prep(
                     shapely_polygon)
-                polygon_box = shapely.geometry.box(
-                    *shapely_polygon.bounds)
-                for point in self._get_points_from_node():
-                    shapely_point = shapely.geometry.Point(point[2], point[3])
-                    if (polygon_box.contains(shapely_point) and
-                            shapely_prepared_polygon.contains(shapely_point)):
-                        result_deque.append(point)
-                return result_deque
+                # a point is only contained by the polygon's bounding box
+                # if it's strictly inside it, so test that first on the whole
+                # array and only test the remaining points against the polygon
+                poly_xmin, poly_ymin, poly_xmax, poly_ymax = (
+                    shapely_polygon.bounds)
+                x_coords = point_columns['f2'].astype(numpy.float64)
+                y_coords = point_columns['f3'].astype(numpy.float64)
+                contained_mask = (
+                    (x_coords > poly_xmin) & (x_coords < poly_xmax) &
+                    (y_coords > poly_ymin) & (y_coords < poly_ymax))
+                for point_index in numpy.nonzero(contained_mask)[0]:
+                    contained_mask[point_index] = (
+                        shapely_prepared_polygon.contains(
+                            shapely.geometry.Point(
+                                x_coords[point_index],
+                                y_coords[point_index])))
+                return dict(
+                    (field_name, column[contained_mask])
+                    for field_name, column in point_columns.items())
         elif shapely_polygon.intersects(bounding_polygon):
             # combine results of children
-            result_deque = collections.deque()
-            for node_index in xrange(4):
-                result_deque.extend(
-                    self.nodes[node_index].get_intersecting_points_in_polygon(
-                        shapely_polygon))
-            return result_deque
-
-        return collections.deque()  # empty
+            child_columns_list = [
+                self.nodes[node_index]
+                .get_intersecting_point_columns_in_polygon(shapely_polygon)
+                for node_index in xrange(4)]
+            return dict(
+                (field_name, numpy.concatenate([
+                    child_columns[field_name]
+                    for child_columns in child_columns_list]))
+                for field_name in _ARRAY_TUPLE_TYPE.names)
+
+        return dict(
+            (field_name, numpy.empty(0, dtype=_ARRAY_TUPLE_TYPE[field_name]))
+            for field_name in _ARRAY_TUPLE_TYPE.names)
 
     def get_intersecting_points_in_bounding_box(self, bounding_box):
         """Get list of data that is contained by bounding_box.
@@ -333,11 +410,15 @@ class OutOfCoreQuadTree(object):
 
         if self.is_leaf:
             # drain the node into a list, filter to current bounding box
-            point_list = numpy.array([
-                point for point in self._get_points_from_node() if _in_box(
-                    bounding_box, point[2], point[3])],
-                dtype=_ARRAY_TUPLE_TYPE)
-            return point_list
+            point_list = self._get_points_from_node()
+            # compare in double precision, as _in_box does
+            x_coords = point_list['f2'].astype(numpy.float64)
+            y_coords = point_list['f3'].astype(numpy.float64)
+            return point_list[
+                (x_coords >= bounding_box[0]) &
+                (y_coords >= bounding_box[1]) &
+                (x_coords < bounding_box[2]) &
+                (y_coords < bounding_box[3])]
         else:
             point_list = numpy.empty(0, dtype=_ARRAY_TUPLE_TYPE)
             for node_index in xrange(4):
@@ -347,6 +428,65 @@ class OutOfCoreQuadTree(object):
             return point_list
 
 
+def quadrant_bounding_boxes(bounding_box):
+    """Split a bounding box into quadrants.
+
+    Parameters:
+        bounding_box (list): of the form [xmin, ymin, xmax, ymax]
+
+    Returns:
+        list of the four quadrant bounding boxes, indexed like this:
+
+        01
+        23
+    """
+    mid_x_coord = (bounding_box[0] + bounding_box[2]) / 2.
+    mid_y_coord = (bounding_box[1] + bounding_box[3]) / 2.
+    return [
+        [bounding_box[0],  # xmin
+         mid_y_coord,  # ymin
+         mid_x_coord,  # xmax
+         bounding_box[3]],
+        [mid_x_coord,  # xmin
+         mid_y_coord,  # ymin
+         bounding_box[2],  # xmax
+         bounding_box[3]],
+        [bounding_box[0],  # xmin
+         bounding_box[1],  # ymin
+         mid_x_coord,  # xmax
+         mid_y_coord],  # ymax
+        [mid_x_coord,  # xmin
+         bounding_box[1],  # ymin
+         bounding_box[2],  # xmax
+         mid_y_coord],  # ymax
+    ]
+
+
+def partition_points_to_quadrants(point_array, bounding_box):
+    """Split points into the quadrants of a bounding box.
+
+    Points are assigned to quadrants the same way ``add_points`` passes
+    them to the children of a split node.
+
+    Parameters:
+        point_array (numpy.ndarray): structured array of
+            ``_ARRAY_TUPLE_TYPE`` points.
+        bounding_box (list): of the form [xmin, ymin, xmax, ymax]
+
+    Returns:
+        list of four structured arrays of the points in each of the
+        quadrants returned by ``quadrant_bounding_boxes(bounding_box)``.
+    """
+    # add_points splits on single precision midpoints
+    quad_bounding_box = quadrant_bounding_boxes(bounding_box)[0]
+    mid_x_coord = numpy.float32(quad_bounding_box[2])
+    mid_y_coord = numpy.float32(quad_bounding_box[1])
+    quad_index = (
+        numpy.where(point_array['f3'] >= mid_y_coord, 0, 2) +
+        (point_array['f2'] >= mid_x_coord))
+    return [point_array[quad_index == index] for index in xrange(4)]
+
+
 cdef _sort_list_to_quads(
         numpy.ndarray point_list, int left_bound, int right_bound,
         float mid_x_coord, float mid_y_coord, int *left_y_split_index,
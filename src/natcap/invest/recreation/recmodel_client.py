@@ -7,8 +7,6 @@ import logging
 import math
 import pickle
 import urllib.request
-import tempfile
-import shutil
 
 import rtree
 import Pyro4
@@ -178,8 +176,17 @@ _ESRI_SHAPEFILE_EXTENSIONS = ['.prj', '.shp', '.shx', '.dbf', '.sbn', '.sbx']
 # Have 5.0 seconds between timed progress outputs
 LOGGER_TIME_DELAY = 5.0
 
+# Size of the chunks that AOIs and results are transferred to and from the
+# server in, and the number of times in a row a transfer is resumed
+TRANSFER_CHUNK_SIZE = 2 ** 22
+TRANSFER_RETRIES = 5
+
 # For now, this is the field name we use to mark the photo user "days"
 RESPONSE_ID = 'PUD_YR_AVG'
+# PUD fields are 'PUD_<suffix>' for the annual and monthly averages
+PUD_FIELD_SUFFIXES = [
+    'YR_AVG', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG',
+    'SEP', 'OCT', 'NOV', 'DEC']
 SCENARIO_RESPONSE_ID = 'PUD_EST'
 
 _OUTPUT_BASE_FILES = {
@@ -193,7 +200,7 @@ _OUTPUT_BASE_FILES = {
 _INTERMEDIATE_BASE_FILES = {
     'local_aoi_path': 'aoi.shp',
     'compressed_aoi_path': 'aoi.zip',
-    'compressed_pud_path': 'pud.zip',
+    'pud_table_path': 'pud_table.npy',
     'response_polygons_lookup': 'response_polygons_lookup.pickle',
     'server_version': 'server_version.pickle',
     }
@@ -341,12 +348,12 @@ def execute(args):
         args=(file_registry['local_aoi_path'],
               file_registry['compressed_aoi_path'],
               args['start_year'], args['end_year'],
-              os.path.basename(file_registry['pud_results_path']),
-              os.path.basename(file_registry['monthly_table_path']),
-              file_registry['compressed_pud_path'],
-              output_dir, server_url, file_registry['server_version']),
+              file_registry['pud_results_path'],
+              file_registry['monthly_table_path'],
+              file_registry['pud_table_path'],
+              server_url, file_registry['server_version']),
         target_path_list=[file_registry['compressed_aoi_path'],
-                          file_registry['compressed_pud_path'],
+                          file_registry['pud_table_path'],
                           file_registry['pud_results_path'],
                           file_registry['monthly_table_path'],
                           file_registry['server_version']],
@@ -424,25 +431,24 @@ def _copy_aoi_no_grid(source_aoi_path, dest_aoi_path):
 
 def _retrieve_photo_user_days(
         local_aoi_path, compressed_aoi_path, start_year, end_year,
-        pud_results_filename, monthly_table_filename, compressed_pud_path,
-        output_dir, server_url, server_version_pickle):
+        pud_results_path, monthly_table_path, pud_table_path, server_url,
+        server_version_pickle):
     """Calculate photo-user-days (PUD) on the server and send back results.
 
     All of the client-server communication happens in this scope. The local AOI
-    is sent to the server for PUD calculations. PUD results are sent back when
-    complete.
+    is uploaded to the server in chunks for PUD calculations. A binary table
+    of the PUD of each polygon and the monthly table are downloaded in chunks
+    when complete, and the PUD are added to a copy of the local AOI.
 
     Parameters:
         local_aoi_path (string): path to polygon vector for PUD aggregation
         compressed_aoi_path (string): path to zip file storing compressed AOI
         start_year (int/string): lower limit of date-range for PUD queries
         end_year (int/string): upper limit of date-range for PUD queries
-        pud_results_filename (string): filename for a shapefile to hold results
-        monthly_table_filename (string): filename for monthly PUD results CSV
-        compressed_pud_path (string): path to zip file storing compressed PUD
-            results, including 'pud_results.shp' and 'monthly_table.csv'.
-        output_dir (string): path to output workspace where results are
-            unpacked.
+        pud_results_path (string): path to a shapefile to hold results
+        monthly_table_path (string): path to monthly PUD results CSV
+        pud_table_path (string): path to the binary table of the PUD of each
+            polygon sent back by the server.
         server_url (string): URL for connecting to the server
         server_version_pickle (string): path to a pickle that stores server
             version and workspace id info.
@@ -485,40 +491,179 @@ def _retrieve_photo_user_days(
                 LOGGER.info('archiving %s', filename)
                 aoizip.write(filename, os.path.basename(filename))
 
-    # convert shapefile to binary string for serialization
-    zip_file_binary = open(compressed_aoi_path, 'rb').read()
-
     # transfer zipped file to server
     start_time = time.time()
+    workspace_id = recmodel_server.start_upload()
+    upload_file(recmodel_server, compressed_aoi_path, workspace_id)
     LOGGER.info('Please wait for server to calculate PUD...')
-
-    result_zip_file_binary, workspace_id = (
-        recmodel_server.calc_photo_user_days_in_aoi(
-            zip_file_binary, date_range,
-            pud_results_filename))
+    recmodel_server.calc_photo_user_days_in_upload(workspace_id, date_range)
     LOGGER.info(
         'received result, took %f seconds, workspace_id: %s',
         time.time() - start_time, workspace_id)
 
-    # unpack result
-    open(compressed_pud_path, 'wb').write(
-        result_zip_file_binary)
-    temporary_output_dir = tempfile.mkdtemp(dir=output_dir)
-    zipfile.ZipFile(compressed_pud_path, 'r').extractall(
-        temporary_output_dir)
-
-    for filename in os.listdir(temporary_output_dir):
-        shutil.copy(os.path.join(temporary_output_dir, filename), output_dir)
-    shutil.rmtree(temporary_output_dir)
+    download_file(
+        recmodel_server, workspace_id, 'pud_table.npy', pud_table_path)
     # the monthly table is returned from the server without a results_suffix.
-    shutil.move(
-        os.path.join(output_dir, 'monthly_table.csv'),
-        os.path.join(output_dir, monthly_table_filename))
+    download_file(
+        recmodel_server, workspace_id, 'monthly_table.csv',
+        monthly_table_path)
+    pud_table = numpy.load(pud_table_path, allow_pickle=False)
+    write_pud_fields(
+        local_aoi_path, pud_table['fid'], pud_table['pud'], pud_results_path)
 
     LOGGER.info('connection release')
     recmodel_server._pyroRelease()
 
 
+def upload_file(
+        recmodel_server, file_path, workspace_id,
+        chunk_size=TRANSFER_CHUNK_SIZE):
+    """Upload a file to a server workspace in chunks.
+
+    If the connection is lost the upload is resumed from the number of bytes
+    the server received, up to ``TRANSFER_RETRIES`` times in a row.
+
+    Parameters:
+        recmodel_server (Pyro4.Proxy): proxy of the recreation server.
+        file_path (string): path to the zipped AOI to upload.
+        workspace_id (string): workspace returned by the server's
+            ``start_upload``.
+        chunk_size (int): number of bytes to send per call.
+
+    Returns:
+        None
+
+    """
+    file_size = os.path.getsize(file_path)
+    n_retries = 0
+    offset = 0
+    last_time = time.time()
+    with open(file_path, 'rb') as local_file:
+        while True:
+            try:
+                if offset is None:
+                    recmodel_server._pyroReconnect()
+                    offset = recmodel_server.get_upload_size(workspace_id)
+                if offset >= file_size:
+                    break
+                local_file.seek(offset)
+                offset = recmodel_server.upload_chunk(
+                    workspace_id, offset, local_file.read(chunk_size))
+            except Pyro4.errors.CommunicationError as error:
+                n_retries += 1
+                if n_retries > TRANSFER_RETRIES:
+                    raise
+                LOGGER.warning('upload interrupted (%s), resuming', error)
+                offset = None
+                continue
+            n_retries = 0
+            last_time = delay_op(
+                last_time, LOGGER_TIME_DELAY, lambda: LOGGER.info(
+                    'uploaded %d of %d bytes', offset, file_size))
+
+
+def download_file(
+        recmodel_server, workspace_id, filename, target_path,
+        chunk_size=TRANSFER_CHUNK_SIZE):
+    """Download a file from a server workspace in chunks.
+
+    If the connection is lost the download is resumed from the number of
+    bytes received, up to ``TRANSFER_RETRIES`` times in a row.
+
+    Parameters:
+        recmodel_server (Pyro4.Proxy): proxy of the recreation server.
+        workspace_id (string): unique workspace ID on the server.
+        filename (string): name of the file in the workspace.
+        target_path (string): path to write the file to.
+        chunk_size (int): number of bytes to request per call.
+
+    Returns:
+        None
+
+    """
+    n_retries = 0
+    file_size = None
+    offset = 0
+    last_time = time.time()
+    with open(target_path, 'wb') as target_file:
+        while True:
+            try:
+                if file_size is None:
+                    file_size = recmodel_server.get_result_size(
+                        workspace_id, filename)
+                if offset >= file_size:
+                    break
+                chunk = recmodel_server.download_chunk(
+                    workspace_id, filename, offset, chunk_size)
+            except Pyro4.errors.CommunicationError as error:
+                n_retries += 1
+                if n_retries > TRANSFER_RETRIES:
+                    raise
+                LOGGER.warning('download interrupted (%s), resuming', error)
+                recmodel_server._pyroReconnect()
+                continue
+            if not chunk:
+                raise ValueError(
+                    '%s ended after %d of %d bytes' % (
+                        filename, offset, file_size))
+            target_file.write(chunk)
+            offset += len(chunk)
+            n_retries = 0
+            last_time = delay_op(
+                last_time, LOGGER_TIME_DELAY, lambda: LOGGER.info(
+                    'downloaded %d of %d bytes of %s', offset, file_size,
+                    filename))
+
+
+def write_pud_fields(base_vector_path, fid_array, pud_array, target_path):
+    """Copy a vector and add the PUD of each feature as fields.
+
+    Parameters:
+        base_vector_path (string): path to an OGR compatible polygon vector.
+        fid_array (numpy.ndarray): FIDs of the features of
+            `base_vector_path` to set PUD for.
+        pud_array (numpy.ndarray): (n, 13) array of the annual and monthly
+            average PUD of each feature in `fid_array`, in the order of
+            ``PUD_FIELD_SUFFIXES``.
+        target_path (string): path to the ESRI shapefile copy of
+            `base_vector_path` to create, with a "PUD_YR_AVG", and a
+            "PUD_{MON}_AVG" field for {MON} in the calendar months.
+
+    Returns:
+        None
+
+    """
+    LOGGER.info('Creating a copy of the input shapefile')
+    base_vector = gdal.OpenEx(base_vector_path, gdal.OF_VECTOR)
+    driver = gdal.GetDriverByName('ESRI Shapefile')
+    if os.path.exists(target_path):
+        driver.Delete(target_path)
+    target_vector = driver.CreateCopy(target_path, base_vector)
+    target_layer = target_vector.GetLayer()
+    base_vector = None
+
+    for field_suffix in PUD_FIELD_SUFFIXES:
+        field_id = 'PUD_%s' % field_suffix
+        # delete the field if it already exists
+        field_index = target_layer.FindFieldIndex(str(field_id), 1)
+        if field_index >= 0:
+            target_layer.DeleteField(field_index)
+        field_defn = ogr.FieldDefn(field_id, ogr.OFTReal)
+        field_defn.SetWidth(24)
+        field_defn.SetPrecision(11)
+        target_layer.CreateField(field_defn)
+
+    for poly_id, pud_averages in zip(fid_array, pud_array):
+        poly_feat = target_layer.GetFeature(int(poly_id))
+        for field_suffix, pud in zip(PUD_FIELD_SUFFIXES, pud_averages):
+            poly_feat.SetField('PUD_%s' % field_suffix, float(pud))
+        target_layer.SetFeature(poly_feat)
+
+    target_layer = None
+    target_vector.FlushCache()
+    target_vector = None
+
+
 def _grid_vector(vector_path, grid_type, cell_size, out_grid_vector_path):
     """Convert vector to a regular grid.
 
@@ -1,6 +1,5 @@
 """InVEST Recreation Server."""
 
-import subprocess
 import os
 import multiprocessing
 import uuid
@@ -11,6 +10,8 @@ import pickle
 import time
 import threading
 import collections
+import itertools
+import json
 import logging
 import queue
 from io import StringIO
@@ -27,6 +28,7 @@ import shapely.prepared
 
 from ... import invest
 from natcap.invest.recreation import out_of_core_quadtree
+from natcap.invest.recreation import columnar_point_store
 from . import recmodel_client
 
 
@@ -37,6 +39,19 @@ GLOBAL_DEPTH = 10
 LOCAL_MAX_POINTS_PER_NODE = 50
 LOCAL_DEPTH = 8
 CSV_ROWS_PER_PARSE = 2 ** 10
+CHECKPOINT_BLOCKS = 2 ** 8  # Blocks of csv to add between build checkpoints
+RESULT_CACHE_BYTES = 2 ** 30  # Default size limit of cached PUD results
+MAX_TRANSFER_CHUNK_SIZE = 2 ** 26  # Largest chunk a client may download
+# the name of the uploaded AOI archive and the files in a workspace that can
+# be downloaded in chunks
+_UPLOAD_FILENAME = 'server_in.zip'
+_PUD_TABLE_FILENAME = 'pud_table.npy'
+_MONTHLY_TABLE_FILENAME = 'monthly_table.csv'
+_DOWNLOADABLE_FILENAMES = (
+    _UPLOAD_FILENAME, _PUD_TABLE_FILENAME, _MONTHLY_TABLE_FILENAME)
+# a polygon's FID and its annual and monthly average PUD, in the order of
+# ``recmodel_client.PUD_FIELD_SUFFIXES``
+PUD_TABLE_TYPE = numpy.dtype([('fid', '<i8'), ('pud', '<f8', (13,))])
 LOGGER_TIME_DELAY = 5.0
 
 Pyro4.config.SERIALIZER = 'marshal'  # lets us pass null bytes in strings
@@ -77,12 +92,14 @@ class RecModel(object):
     @_try_except_wrapper("RecModel construction exited while multiprocessing.")
     def __init__(
             self, raw_csv_filename, min_year, max_year, cache_workspace,
-            max_points_per_node=GLOBAL_MAX_POINTS_PER_NODE):
+            max_points_per_node=GLOBAL_MAX_POINTS_PER_NODE,
+            max_result_cache_bytes=RESULT_CACHE_BYTES):
         """Initialize RecModel object.
 
         Parameters:
-            raw_csv_filename (string): path to csv file that contains lines
-                with the following pattern:
+            raw_csv_filename (string or list): path to csv file, or list of
+                csv file paths oldest first, that contains lines with the
+                following pattern:
 
                 id,userid,date/time,lat,lng,err
 
@@ -93,8 +110,14 @@ class RecModel(object):
             max_year (int): maximum year allowed to be queried by user
             cache_workspace (string): path to a writable directory where the
                 object can write quadtree data to disk and search for
-                pre-computed quadtrees based on the hash of the file at
-                `raw_csv_filename`
+                pre-computed quadtrees based on the hash of the files at
+                `raw_csv_filename`.  A quadtree cached for the first files
+                of the list is updated with the points of the rest.
+            max_points_per_node (int): maximum number of points to allow
+                per node of the quadtree.
+            max_result_cache_bytes (int): the size in bytes that the cache of
+                PUD results of previously queried AOIs is limited to; the
+                least recently used results are deleted past this size.
 
         Returns:
             None
@@ -109,6 +132,9 @@ class RecModel(object):
             initial_bounding_box, raw_csv_filename, cache_workspace,
             max_points_per_node)
         self.cache_workspace = cache_workspace
+        self._result_cache = _PUDResultCache(
+            os.path.join(cache_workspace, 'pud_result_cache'),
+            max_result_cache_bytes)
         self.min_year = min_year
         self.max_year = max_year
 
@@ -151,6 +177,165 @@ class RecModel(object):
             workspace_path, str('server_in')+'.zip')
         return open(out_zip_file_path, 'rb').read()
 
+    def _workspace_file_path(self, workspace_id, filename):
+        """Return the path of a transferable file in a workspace.
+
+        Parameters:
+            workspace_id (string): unique workspace ID on server.
+            filename (string): one of ``_DOWNLOADABLE_FILENAMES``.
+
+        Returns:
+            path to `filename` in the workspace.
+
+        Raises:
+            ValueError if `workspace_id` is not a workspace ID or `filename`
+            is not a file that can be transferred.
+
+        """
+        try:
+            is_workspace_id = str(uuid.UUID(workspace_id)) == workspace_id
+        except (TypeError, ValueError):
+            is_workspace_id = False
+        if not is_workspace_id:
+            raise ValueError('Invalid workspace id: %s' % workspace_id)
+        if filename not in _DOWNLOADABLE_FILENAMES:
+            raise ValueError('%s can not be transferred' % filename)
+        return os.path.join(self.cache_workspace, workspace_id, filename)
+
+    def start_upload(self):
+        """Create a workspace to upload a zipped AOI to in chunks.
+
+        Returns:
+            workspace_id: a string that identifies the workspace in calls to
+                ``upload_chunk``, ``get_upload_size``, and
+                ``calc_photo_user_days_in_upload``.
+
+        """
+        workspace_id = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.cache_workspace, workspace_id))
+        open(self._workspace_file_path(
+            workspace_id, _UPLOAD_FILENAME), 'wb').close()
+        return workspace_id
+
+    @_try_except_wrapper("exception in upload_chunk")
+    def upload_chunk(self, workspace_id, offset, chunk_binary):
+        """Write a chunk of the zipped AOI of a workspace.
+
+        Chunks may be sent again, so an interrupted upload is resumed from
+        the size returned by ``get_upload_size``.
+
+        Parameters:
+            workspace_id (string): ID returned by ``start_upload``.
+            offset (int): byte offset of the chunk in the zip file, no more
+                than the number of bytes uploaded so far.
+            chunk_binary (string): bytes of the chunk.
+
+        Returns:
+            the number of bytes uploaded so far.
+
+        """
+        upload_path = self._workspace_file_path(
+            workspace_id, _UPLOAD_FILENAME)
+        upload_size = os.path.getsize(upload_path)
+        if offset > upload_size:
+            raise ValueError(
+                'Chunk at offset %d would leave a gap after the %d bytes '
+                'uploaded so far' % (offset, upload_size))
+        with open(upload_path, 'r+b') as upload_file:
+            upload_file.seek(offset)
+            upload_file.write(chunk_binary)
+        return max(upload_size, offset + len(chunk_binary))
+
+    def get_upload_size(self, workspace_id):
+        """Return the number of bytes of a workspace's zipped AOI uploaded."""
+        return os.path.getsize(
+            self._workspace_file_path(workspace_id, _UPLOAD_FILENAME))
+
+    @_try_except_wrapper("exception in calc_photo_user_days_in_upload")
+    def calc_photo_user_days_in_upload(self, workspace_id, date_range):
+        """Calculate the PUD of the polygons of an uploaded AOI.
+
+        The results are written to the workspace as a binary table of the
+        annual and monthly average PUD of each polygon, and a csv of the
+        PUD of each polygon in each month of the date range, both of which
+        are fetched with ``download_chunk``.
+
+        Parameters:
+            workspace_id (string): ID of a workspace whose zipped ESRI
+                shapefile has been uploaded with ``upload_chunk``.
+            date_range (string 2-tuple): a tuple that contains the inclusive
+                start and end date formatted as 'YYYY-MM-DD'
+
+        Returns:
+            dict mapping the filenames of the binary PUD table and the
+            monthly table to their sizes in bytes.  The table is a ``.npy``
+            file of ``PUD_TABLE_TYPE`` records, one per polygon, of its FID
+            and the "PUD_YR_AVG" and "PUD_{MON}_AVG" values.
+
+        """
+        workspace_path = os.path.join(self.cache_workspace, workspace_id)
+        aoi_path = _extract_aoi(
+            self._workspace_file_path(workspace_id, _UPLOAD_FILENAME),
+            workspace_path)
+
+        LOGGER.info('running calc user days on %s', workspace_path)
+        numpy_date_range = (
+            numpy.datetime64(date_range[0]),
+            numpy.datetime64(date_range[1]))
+        pud_results = self._get_pud_results(
+            aoi_path, workspace_path, numpy_date_range)
+
+        pud_table = numpy.empty(
+            pud_results['fid'].size, dtype=PUD_TABLE_TYPE)
+        pud_table['fid'] = pud_results['fid']
+        pud_table['pud'] = pud_results['pud']
+        numpy.save(
+            self._workspace_file_path(workspace_id, _PUD_TABLE_FILENAME),
+            pud_table)
+        _write_monthly_table(
+            pud_results, numpy_date_range, self._workspace_file_path(
+                workspace_id, _MONTHLY_TABLE_FILENAME))
+        return dict(
+            (filename, self.get_result_size(workspace_id, filename))
+            for filename in (_PUD_TABLE_FILENAME, _MONTHLY_TABLE_FILENAME))
+
+    def get_result_size(self, workspace_id, filename):
+        """Return the size in bytes of a file in a workspace.
+
+        Parameters:
+            workspace_id (string): unique workspace ID on server.
+            filename (string): 'server_in.zip', 'pud_table.npy', or
+                'monthly_table.csv'.
+
+        Returns:
+            size of the file in bytes.
+
+        """
+        return os.path.getsize(
+            self._workspace_file_path(workspace_id, filename))
+
+    @_try_except_wrapper("exception in download_chunk")
+    def download_chunk(self, workspace_id, filename, offset, n_bytes):
+        """Read a chunk of a file in a workspace.
+
+        Parameters:
+            workspace_id (string): unique workspace ID on server.
+            filename (string): 'server_in.zip', 'pud_table.npy', or
+                'monthly_table.csv'.
+            offset (int): byte offset of the chunk in the file.
+            n_bytes (int): the most bytes to read, no more than
+                ``MAX_TRANSFER_CHUNK_SIZE``.
+
+        Returns:
+            binary string of up to `n_bytes` of the file starting at
+            `offset`, which is empty past the end of the file.
+
+        """
+        with open(self._workspace_file_path(
+                workspace_id, filename), 'rb') as workspace_file:
+            workspace_file.seek(offset)
+            return workspace_file.read(min(n_bytes, MAX_TRANSFER_CHUNK_SIZE))
+
     @_try_except_wrapper("exception in calc_photo_user_days_in_aoi")
     def calc_photo_user_days_in_aoi(
             self, zip_file_binary, date_range, out_vector_filename):
@@ -176,18 +361,10 @@ class RecModel(object):
         workspace_path = os.path.join(self.cache_workspace, workspace_id)
         os.makedirs(workspace_path)
 
-        # decompress zip
-        out_zip_file_filename = os.path.join(
-            workspace_path, str('server_in')+'.zip')
-
-        LOGGER.info('decompress zip file AOI')
+        out_zip_file_filename = os.path.join(workspace_path, _UPLOAD_FILENAME)
         with open(out_zip_file_filename, 'wb') as zip_file_disk:
             zip_file_disk.write(zip_file_binary)
-        shapefile_archive = zipfile.ZipFile(out_zip_file_filename, 'r')
-        shapefile_archive.extractall(workspace_path)
-        shapefile_archive.close()
-        shapefile_archive = None
-        aoi_path = glob.glob(os.path.join(workspace_path, '*.shp'))[0]
+        aoi_path = _extract_aoi(out_zip_file_filename, workspace_path)
 
         LOGGER.info('running calc user days on %s', workspace_path)
         numpy_date_range = (
@@ -214,10 +391,25 @@ class RecModel(object):
             workspace_path)
         return open(aoi_pud_archive_path, 'rb').read(), workspace_id
 
+    def get_result_cache_stats(self):
+        """Return the hit, miss, and size statistics of the result cache.
+
+        Returns:
+            dict with the number of cache 'hits', 'misses', and
+            'evictions', and the number of cached results 'n_results' and
+            their total size in bytes 'n_bytes' and limit 'max_bytes'.
+
+        """
+        return self._result_cache.stats()
+
     def _calc_aggregated_points_in_aoi(
             self, aoi_path, workspace_path, date_range, out_vector_filename):
         """Aggregate the PUD in the AOI.
 
+        Results are cached by the AOI's geometry, the date range, and the
+        server version, so repeated queries on the same AOI only copy the
+        cached PUD values onto the new AOI.
+
         Parameters:
             aoi_path (string): a path to an OGR compatible vector.
             workspace_path(string): path to a directory where working files
@@ -228,12 +420,66 @@ class RecModel(object):
 
         Returns:
             a path to an ESRI shapefile copy of `aoi_path` updated with a
-            "PUD" field which contains the metric per polygon.
+            "PUD" field which contains the metric per polygon, and a path to
+            the monthly table csv.
 
         """
-        aoi_vector = gdal.OpenEx(aoi_path, gdal.OF_VECTOR)
-        # append a _pud to the aoi filename
+        pud_results = self._get_pud_results(
+            aoi_path, workspace_path, date_range)
+
         out_aoi_pud_path = os.path.join(workspace_path, out_vector_filename)
+        monthly_table_path = os.path.join(
+            workspace_path, _MONTHLY_TABLE_FILENAME)
+        recmodel_client.write_pud_fields(
+            aoi_path, pud_results['fid'], pud_results['pud'],
+            out_aoi_pud_path)
+        _write_monthly_table(pud_results, date_range, monthly_table_path)
+        LOGGER.info('returning out shapefile path')
+        return out_aoi_pud_path, monthly_table_path
+
+    def _get_pud_results(self, aoi_path, workspace_path, date_range):
+        """Return the cached or newly calculated PUD results of an AOI.
+
+        Parameters:
+            aoi_path (string): a path to an OGR compatible vector.
+            workspace_path(string): path to a directory where working files
+                can be created
+            date_range (datetime 2-tuple): a tuple that contains the inclusive
+                start and end date
+
+        Returns:
+            dict of numpy arrays as returned by ``_calc_pud_results``.
+
+        """
+        cache_key = _pud_result_cache_key(
+            aoi_path, date_range, self.get_version())
+        pud_results = self._result_cache.get(cache_key)
+        if pud_results is None:
+            pud_results = self._calc_pud_results(
+                aoi_path, workspace_path, date_range)
+            self._result_cache.put(cache_key, pud_results)
+        else:
+            LOGGER.info('found cached PUD results for %s', aoi_path)
+        return pud_results
+
+    def _calc_pud_results(self, aoi_path, workspace_path, date_range):
+        """Calculate the PUD of each polygon in the AOI.
+
+        Parameters:
+            aoi_path (string): a path to an OGR compatible vector.
+            workspace_path(string): path to a directory where working files
+                can be created
+            date_range (datetime 2-tuple): a tuple that contains the inclusive
+                start and end date
+
+        Returns:
+            dict of numpy arrays sorted by FID: 'fid' the polygon FIDs,
+            'pud' the (n, 13) annual and monthly average PUD, and
+            'monthly_counts' the (n, 12 * n_years) PUD of each month of each
+            year in the date range.
+
+        """
+        aoi_vector = gdal.OpenEx(aoi_path, gdal.OF_VECTOR)
 
         # start the workers now, because they have to load a quadtree and
         # it will take some time
@@ -355,55 +601,29 @@ class RecModel(object):
             polytest_process.start()
             polytest_process_list.append(polytest_process)
 
-        # Copy the input shapefile into the designated output folder
-        LOGGER.info('Creating a copy of the input shapefile')
-        driver = gdal.GetDriverByName('ESRI Shapefile')
-        pud_aoi_vector = driver.CreateCopy(out_aoi_pud_path, aoi_vector)
-        pud_aoi_layer = pud_aoi_vector.GetLayer()
-
-        aoi_layer = None
-        gdal.Dataset.__swig_destroy__(aoi_vector)
-        aoi_vector = None
-
-        pud_id_suffix_list = [
-            'YR_AVG', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG',
-            'SEP', 'OCT', 'NOV', 'DEC']
-        for field_suffix in pud_id_suffix_list:
-            field_id = 'PUD_%s' % field_suffix
-            # delete the field if it already exists
-            field_index = pud_aoi_layer.FindFieldIndex(str(field_id), 1)
-            if field_index >= 0:
-                pud_aoi_layer.DeleteField(field_index)
-            field_defn = ogr.FieldDefn(field_id, ogr.OFTReal)
-            field_defn.SetWidth(24)
-            field_defn.SetPrecision(11)
-            pud_aoi_layer.CreateField(field_defn)
-
         last_time = time.time()
         LOGGER.info('testing polygons against quadtree')
 
         # Load up the test queue with polygons
-        for poly_feat in pud_aoi_layer:
+        n_polygons = aoi_layer.GetFeatureCount()
+        for poly_feat in aoi_layer:
             poly_test_queue.put(poly_feat.GetFID())
+        aoi_layer = None
+        gdal.Dataset.__swig_destroy__(aoi_vector)
+        aoi_vector = None
 
         # Fill the queue with STOPs for each process
         for _ in range(n_polytest_processes):
             poly_test_queue.put('STOP')
 
+        table_headers = _monthly_table_headers(date_range)
+        fid_list = []
+        pud_list = []
+        monthly_count_list = []
+
         # Read the result until we've seen n_processes_alive
         n_processes_alive = n_polytest_processes
         n_poly_tested = 0
-
-        monthly_table_path = os.path.join(workspace_path, 'monthly_table.csv')
-        monthly_table = open(monthly_table_path, 'w')
-        date_range_year = [
-            date.tolist().timetuple().tm_year for date in date_range]
-        table_headers = [
-            '%s-%s' % (year, month) for year in range(
-                int(date_range_year[0]), int(date_range_year[1])+1)
-            for month in range(1, 13)]
-        monthly_table.write('poly_id,' + ','.join(table_headers) + '\n')
-
         while True:
             result_tuple = pud_poly_feature_queue.get()
             n_poly_tested += 1
@@ -415,99 +635,305 @@ class RecModel(object):
             last_time = recmodel_client.delay_op(
                 last_time, LOGGER_TIME_DELAY, lambda: LOGGER.info(
                     '%.2f%% of polygons tested', 100 * float(n_poly_tested) /
-                    pud_aoi_layer.GetFeatureCount()))
-            poly_id, pud_list, pud_monthly_set = result_tuple
-            poly_feat = pud_aoi_layer.GetFeature(poly_id)
-            for pud_index, pud_id in enumerate(pud_id_suffix_list):
-                poly_feat.SetField('PUD_%s' % pud_id, pud_list[pud_index])
-            pud_aoi_layer.SetFeature(poly_feat)
+                    n_polygons))
+            poly_id, pud_averages, pud_monthly_counts = result_tuple
+            fid_list.append(poly_id)
+            pud_list.append(pud_averages)
+            monthly_count_list.append([
+                pud_monthly_counts.get(header, 0)
+                for header in table_headers])
+
+        for polytest_process in polytest_process_list:
+            polytest_process.join()
+
+        fid_order = numpy.argsort(numpy.array(fid_list, dtype=numpy.int64))
+        return {
+            'fid': numpy.array(fid_list, dtype=numpy.int64)[fid_order],
+            'pud': numpy.array(
+                pud_list, dtype=numpy.float64).reshape((-1, 13))[fid_order],
+            'monthly_counts': numpy.array(
+                monthly_count_list, dtype=numpy.int64).reshape(
+                    (-1, len(table_headers)))[fid_order],
+        }
+
+
+class _PUDResultCache(object):
+    """Least recently used cache of PUD results on disk.
+
+    Each result is a dict of numpy arrays saved to ``<key>.npz`` in the
+    cache directory.  Results left in the directory by an earlier server
+    are adopted, oldest first, when the cache is created.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        """Create or reopen a result cache.
+
+        Parameters:
+            cache_dir (string): directory to store cached results in.
+            max_bytes (int): the least recently used results are deleted
+                when the cached results exceed this size.
+
+        Returns:
+            None
+
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key to size in bytes, least recently used first
+        self.result_sizes = collections.OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        for result_path in sorted(
+                glob.glob(os.path.join(cache_dir, '*.npz')),
+                key=os.path.getmtime):
+            self.result_sizes[os.path.basename(result_path)[:-4]] = (
+                os.path.getsize(result_path))
+        with self.lock:
+            self._evict()
+
+    def _result_path(self, key):
+        """Return the path of the cached result of `key`."""
+        return os.path.join(self.cache_dir, '%s.npz' % key)
+
+    def _evict(self):
+        """Delete least recently used results until under ``max_bytes``."""
+        while (self.result_sizes and
+               sum(self.result_sizes.values()) > self.max_bytes):
+            key, _ = self.result_sizes.popitem(last=False)
+            os.remove(self._result_path(key))
+            self.n_evictions += 1
+
+    def get(self, key):
+        """Return the cached result of `key`, or None if not cached."""
+        with self.lock:
+            if key not in self.result_sizes:
+                self.n_misses += 1
+                return None
+            self.n_hits += 1
+            self.result_sizes.move_to_end(key)
+            result_path = self._result_path(key)
+            # touch so that the order is kept if the cache is reopened
+            os.utime(result_path, None)
+            with numpy.load(result_path) as result_npz:
+                return dict(
+                    (array_id, result_npz[array_id])
+                    for array_id in result_npz.files)
+
+    def put(self, key, result):
+        """Cache the dict of numpy arrays `result` under `key`."""
+        result_path = self._result_path(key)
+        # save under a temporary name so a result is never partly written
+        temporary_path = '%s.%s.tmp' % (result_path, uuid.uuid4())
+        with open(temporary_path, 'wb') as result_file:
+            numpy.savez(result_file, **result)
+        with self.lock:
+            os.replace(temporary_path, result_path)
+            self.result_sizes[key] = os.path.getsize(result_path)
+            self.result_sizes.move_to_end(key)
+            self._evict()
+
+    def stats(self):
+        """Return a dict of the cache's hit, miss, and size statistics."""
+        with self.lock:
+            return {
+                'hits': self.n_hits,
+                'misses': self.n_misses,
+                'evictions': self.n_evictions,
+                'n_results': len(self.result_sizes),
+                'n_bytes': sum(self.result_sizes.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+
+def _pud_result_cache_key(aoi_path, date_range, version):
+    """Hash the inputs that determine the PUD results of an AOI.
+
+    Parameters:
+        aoi_path (string): a path to an OGR compatible vector.
+        date_range (datetime 2-tuple): a tuple that contains the inclusive
+            start and end date
+        version (string): the server version from ``RecModel.get_version``.
 
+    Returns:
+        a hex digest of the AOI's projection and the FID and geometry of
+        each of its features, `date_range`, and `version`.
+
+    """
+    hasher = hashlib.sha1()
+    aoi_vector = gdal.OpenEx(aoi_path, gdal.OF_VECTOR)
+    aoi_layer = aoi_vector.GetLayer()
+    aoi_ref = aoi_layer.GetSpatialRef()
+    if aoi_ref is not None:
+        hasher.update(aoi_ref.ExportToWkt().encode('utf-8'))
+    for poly_feat in aoi_layer:
+        hasher.update(('fid:%d' % poly_feat.GetFID()).encode('utf-8'))
+        poly_geom = poly_feat.GetGeometryRef()
+        if poly_geom is not None:
+            hasher.update(bytes(poly_geom.ExportToWkb()))
+    aoi_layer = None
+    gdal.Dataset.__swig_destroy__(aoi_vector)
+    aoi_vector = None
+    hasher.update(('%s:%s:%s' % (
+        date_range[0], date_range[1], version)).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def _monthly_table_headers(date_range):
+    """List the 'year-month' columns of the monthly table of a date range."""
+    date_range_year = [
+        date.tolist().timetuple().tm_year for date in date_range]
+    return [
+        '%s-%s' % (year, month) for year in range(
+            int(date_range_year[0]), int(date_range_year[1])+1)
+        for month in range(1, 13)]
+
+
+def _write_monthly_table(pud_results, date_range, monthly_table_path):
+    """Write the PUD of each polygon in each month to a csv.
+
+    Parameters:
+        pud_results (dict): PUD results of the polygons of an AOI as
+            returned by ``RecModel._calc_pud_results``.
+        date_range (datetime 2-tuple): a tuple that contains the inclusive
+            start and end date
+        monthly_table_path (string): path to the csv to create with the PUD
+            of each polygon in each month of the date range.
+
+    Returns:
+        None
+
+    """
+    table_headers = _monthly_table_headers(date_range)
+    with open(monthly_table_path, 'w') as monthly_table:
+        monthly_table.write('poly_id,' + ','.join(table_headers) + '\n')
+        for poly_id, monthly_counts in zip(
+                pud_results['fid'], pud_results['monthly_counts']):
             line = '%s,' % poly_id
-            line += (
-                ",".join(['%s' % len(pud_monthly_set[header])
-                          for header in table_headers]))
+            line += ','.join(['%s' % count for count in monthly_counts])
             line += '\n'  # final newline
             monthly_table.write(line)
 
-        LOGGER.info('done with polygon test, syncing to disk')
-        pud_aoi_layer = None
-        pud_aoi_vector.FlushCache()
-        gdal.Dataset.__swig_destroy__(pud_aoi_vector)
-        pud_aoi_vector = None
 
-        for polytest_process in polytest_process_list:
-            polytest_process.join()
+def _extract_aoi(zip_path, workspace_path):
+    """Extract a zipped ESRI shapefile.
 
-        LOGGER.info('returning out shapefile path')
-        return out_aoi_pud_path, monthly_table_path
+    Parameters:
+        zip_path (string): path to a zip file of an ESRI shapefile.
+        workspace_path (string): directory to extract the zip file to.
 
+    Returns:
+        path to the extracted shapefile.
+
+    """
+    LOGGER.info('decompress zip file AOI')
+    with zipfile.ZipFile(zip_path, 'r') as shapefile_archive:
+        shapefile_archive.extractall(workspace_path)
+    return glob.glob(os.path.join(workspace_path, '*.shp'))[0]
 
-def _parse_input_csv(
-        block_offset_size_queue, csv_filepath, numpy_array_queue):
-    """Parse CSV file lines to (datetime64[d], userhash, lat, lng) tuples.
+
+def _parse_and_partition_csv(
+        block_queue, bounding_box, quadrant_queue_list, parsed_queue):
+    """Parse CSV blocks and split their points into top-level quadrants.
 
     Parameters:
+        block_queue (multiprocessing.Queue): contains tuples of the form
+            (csv path, offset, chunk size) of the blocks to parse, followed
+            by 'STOP'.
+        bounding_box (list): bounding box of the quadtree's root of the form
+            [xmin, ymin, xmax, ymax].
+        quadrant_queue_list (list): a multiprocessing.Queue per quadrant of
+            `bounding_box` that the non-empty structured arrays of each
+            block's points in that quadrant are put on.
+        parsed_queue (multiprocessing.Queue): a list of the number of points
+            put on each quadrant queue is put here when a block is done.
+
+    Returns:
+        None
+    """
+    for csv_filepath, file_offset, chunk_size in iter(
+            block_queue.get, 'STOP'):
+        point_array = _parse_csv_block(csv_filepath, file_offset, chunk_size)
+        quadrant_array_list = (
+            out_of_core_quadtree.partition_points_to_quadrants(
+                point_array, bounding_box))
+        for quadrant_queue, quadrant_array in zip(
+                quadrant_queue_list, quadrant_array_list):
+            if quadrant_array.size > 0:
+                quadrant_queue.put(quadrant_array)
+        parsed_queue.put(
+            [quadrant_array.size for quadrant_array in quadrant_array_list])
+
+
+def _parse_csv_block(csv_filepath, file_offset, chunk_size):
+    """Parse a block of CSV file lines to a structured array of points.
 
-        block_offset_size_queue (multiprocessing.Queue): contains tuples of
-            the form (offset, chunk size) to direct where the file should be
-            read from
-        numpy_array_queue (multiprocessing.Queue): output queue will have
-            paths to files that can be opened with numpy.load and contain
-            structured arrays of (datetime, userid, lat, lng) parsed from the
-            raw CSV file
+    Parameters:
         csv_filepath (string): path to csv file to parse from
+        file_offset (int): offset of the first line of the block
+        chunk_size (int): length of the block
 
     Returns:
-        None
+        structured array of (datetime64[d], userhash, lng, lat) points.
     """
-    for file_offset, chunk_size in iter(block_offset_size_queue.get, 'STOP'):
-        csv_file = open(csv_filepath, 'r')
-        csv_file.seek(file_offset, 0)
-        chunk_string = csv_file.read(chunk_size)
-        csv_file.close()
-
-        # sample line:
-        # 8568090486,48344648@N00,2013-03-17 16:27:27,42.383841,-71.138378,16
-        # this pattern matches the above style of line and only parses valid
-        # dates to handle some cases where there are weird dates in the input
-        pattern = r"[^,]+,([^,]+),(19|20\d\d-(?:0[1-9]|1[012])-(?:0[1-9]|[12][0-9]|3[01])) [^,]+,([^,]+),([^,]+),[^\n]"  # pylint: disable=line-too-long
-        result = numpy.fromregex(
-            StringIO(chunk_string), pattern,
-            [('user', 'S40'), ('date', 'datetime64[D]'), ('lat', 'f4'),
-             ('lng', 'f4')])
-
-        def md5hash(user_string):
-            """md5hash userid."""
-            return hashlib.md5(user_string).digest()[-4:]
-
-        md5hash_v = numpy.vectorize(md5hash, otypes=['S4'])
-        hashes = md5hash_v(result['user'])
-
-        user_day_lng_lat = numpy.empty(
-            hashes.size, dtype='datetime64[D],a4,f4,f4')
-        user_day_lng_lat['f0'] = result['date']
-        user_day_lng_lat['f1'] = hashes
-        user_day_lng_lat['f2'] = result['lng']
-        user_day_lng_lat['f3'] = result['lat']
-        numpy_array_queue.put(user_day_lng_lat)
-    numpy_array_queue.put('STOP')
-
-
-def _file_len(file_path):
-    """Count lines in file, return -1 if not supported."""
-    # If wc isn't found, Popen raises an exception here:
-    try:
-        wc_process = subprocess.Popen(
-            ['wc', '-l', file_path], stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-    except OSError as e:
-        LOGGER.warn(repr(e))
-        return -1
-    result, err = wc_process.communicate()
-    if wc_process.returncode != 0:
-        LOGGER.warn(err)
-        return -1
-    return int(result.strip().split()[0])
+    csv_file = open(csv_filepath, 'r')
+    csv_file.seek(file_offset, 0)
+    chunk_string = csv_file.read(chunk_size)
+    csv_file.close()
+
+    # sample line:
+    # 8568090486,48344648@N00,2013-03-17 16:27:27,42.383841,-71.138378,16
+    # this pattern matches the above style of line and only parses valid
+    # dates to handle some cases where there are weird dates in the input
+    pattern = r"[^,]+,([^,]+),(19|20\d\d-(?:0[1-9]|1[012])-(?:0[1-9]|[12][0-9]|3[01])) [^,]+,([^,]+),([^,]+),[^\n]"  # pylint: disable=line-too-long
+    result = numpy.fromregex(
+        StringIO(chunk_string), pattern,
+        [('user', 'S40'), ('date', 'datetime64[D]'), ('lat', 'f4'),
+         ('lng', 'f4')])
+
+    def md5hash(user_string):
+        """md5hash userid."""
+        return hashlib.md5(user_string).digest()[-4:]
+
+    md5hash_v = numpy.vectorize(md5hash, otypes=['S4'])
+    hashes = md5hash_v(result['user'])
+
+    user_day_lng_lat = numpy.empty(
+        hashes.size, dtype='datetime64[D],a4,f4,f4')
+    user_day_lng_lat['f0'] = result['date']
+    user_day_lng_lat['f1'] = hashes
+    user_day_lng_lat['f2'] = result['lng']
+    user_day_lng_lat['f3'] = result['lat']
+    return user_day_lng_lat
+
+
+def _csv_blocks(csv_filepath, start_offset=None):
+    """Split a CSV file into blocks of whole lines.
+
+    Parameters:
+        csv_filepath (string): path to csv file
+        start_offset (int): offset to start the blocks at, or None to start
+            after the csv header.
+
+    Yields:
+        (offset, size) tuples of blocks of about ``BLOCKSIZE`` bytes.
+    """
+    with open(csv_filepath, 'rb') as csv_file:
+        file_size = os.fstat(csv_file.fileno()).st_size
+        if start_offset is None:
+            csv_file.readline()  # skip the csv header
+        else:
+            csv_file.seek(start_offset)
+        while csv_file.tell() < file_size:
+            start = csv_file.tell()
+            csv_file.seek(BLOCKSIZE, 1)
+            csv_file.readline()  # skip to end of line
+            end = min(csv_file.tell(), file_size)
+            csv_file.seek(end)
+            yield (start, end - start)
 
 
 def construct_userday_quadtree(
@@ -515,9 +941,20 @@ def construct_userday_quadtree(
         max_points_per_node):
     """Construct a spatial quadtree for fast querying of userday points.
 
+    The points in each of the four quadrants of the root are added to their
+    own subtree by a separate process while the CSV is parsed by others.
+    The subtrees are pickled every ``CHECKPOINT_BLOCKS`` blocks of the CSV,
+    so an interrupted build resumes from the last of these checkpoints.
+
     Parameters:
-        initial_bounding_box (list of int):
-        raw_photo_csv_table ():
+        initial_bounding_box (list of int): bounding box of the quadtree of
+            the form [xmin, ymin, xmax, ymax]
+        raw_photo_csv_table (string or list): path to a csv file of photo
+            points, or a list of paths where each csv after the first holds
+            the points added since the csv before it, such as a new month of
+            photos.  The quadtree of a list is built by adding the points of
+            the later csvs to the cached quadtree of the longest leading part
+            of the list, if there is one.
         cache_dir (string): path to a directory that can be used to cache
             the quadtree files on disk
         max_points_per_node(int): maximum number of points to allow per node
@@ -525,109 +962,391 @@ def construct_userday_quadtree(
             subdivide.
 
     Returns:
-        None
+        path to the pickled quadtree
     """
+    if isinstance(raw_photo_csv_table, str):
+        csv_path_list = [raw_photo_csv_table]
+    else:
+        csv_path_list = list(raw_photo_csv_table)
+
     LOGGER.info('hashing input file')
     start_time = time.time()
-    LOGGER.info(raw_photo_csv_table)
-    csv_hash = _hashfile(raw_photo_csv_table, fast_hash=True)
-
-    ooc_qt_picklefilename = os.path.join(cache_dir, csv_hash + '.pickle')
+    quadtree_id_list = []
+    for csv_path in csv_path_list:
+        LOGGER.info(csv_path)
+        quadtree_id = _hashfile(csv_path, fast_hash=True)
+        if quadtree_id_list:
+            # a quadtree with added points is named by the quadtree it adds
+            # to and the hash of the added points
+            quadtree_id = hashlib.sha1(('%s:%s' % (
+                quadtree_id_list[-1], quadtree_id)).encode(
+                    'utf-8')).hexdigest()[:16]
+        quadtree_id_list.append(quadtree_id)
+    pickle_path_list = [
+        os.path.join(cache_dir, quadtree_id + '.pickle')
+        for quadtree_id in quadtree_id_list]
+
+    ooc_qt_picklefilename = pickle_path_list[-1]
     if os.path.isfile(ooc_qt_picklefilename):
         return ooc_qt_picklefilename
-    else:
-        LOGGER.info(
-            '%s not found, constructing quadtree', ooc_qt_picklefilename)
-        LOGGER.info('counting lines in input file')
-        total_lines = _file_len(raw_photo_csv_table)
-        LOGGER.info('%d lines', total_lines)
-        ooc_qt = out_of_core_quadtree.OutOfCoreQuadTree(
-            initial_bounding_box, max_points_per_node, GLOBAL_DEPTH,
-            cache_dir, pickle_filename=ooc_qt_picklefilename)
-
-        n_parse_processes = multiprocessing.cpu_count() - 1
-        if n_parse_processes < 1:
-            n_parse_processes = 1
-
-        block_offset_size_queue = multiprocessing.Queue(n_parse_processes * 2)
-        numpy_array_queue = multiprocessing.Queue(n_parse_processes * 2)
-
-        LOGGER.info('starting parsing processes')
-        for _ in range(n_parse_processes):
-            parse_input_csv_process = multiprocessing.Process(
-                target=_parse_input_csv, args=(
-                    block_offset_size_queue, raw_photo_csv_table,
-                    numpy_array_queue))
-            parse_input_csv_process.deamon = True
-            parse_input_csv_process.start()
-
-        # rush through file and determine reasonable offsets and blocks
-        def _populate_offset_queue(block_offset_size_queue):
-            csv_file = open(raw_photo_csv_table, 'rb')
-            csv_file.readline()  # skip the csv header
-            while True:
-                start = csv_file.tell()
-                csv_file.seek(BLOCKSIZE, 1)
-                line = csv_file.readline()  # skip to end of line
-                bounds = (start, csv_file.tell() - start)
-                block_offset_size_queue.put(bounds)
-                if not line:
-                    break
-            csv_file.close()
-            for _ in range(n_parse_processes):
-                block_offset_size_queue.put('STOP')
 
-        LOGGER.info('starting offset queue population thread')
-        populate_thread = threading.Thread(
-            target=_populate_offset_queue, args=(block_offset_size_queue,))
-        populate_thread.start()
+    LOGGER.info(
+        '%s not found, constructing quadtree', ooc_qt_picklefilename)
+    base_qt = None
+    base_index = -1
+    for index in range(len(pickle_path_list) - 2, -1, -1):
+        if os.path.isfile(pickle_path_list[index]):
+            with open(pickle_path_list[index], 'rb') as base_qt_file:
+                base_qt = pickle.load(base_qt_file)
+            if _is_built_in_quadrants(base_qt):
+                LOGGER.info(
+                    'adding points to quadtree %s', pickle_path_list[index])
+                base_index = index
+            else:
+                base_qt = None
+            break
 
-        LOGGER.info("add points to the quadtree as they are ready")
-        last_time = time.time()
-        start_time = last_time
-        n_points = 0
+    ooc_qt = _build_userday_quadtree(
+        initial_bounding_box, csv_path_list[base_index+1:], cache_dir,
+        max_points_per_node, ooc_qt_picklefilename, base_qt)
 
-        while True:
-            point_array = numpy_array_queue.get()
-            if (isinstance(point_array, str) and
-                    point_array == 'STOP'):  # count 'n cpu' STOPs
-                n_parse_processes -= 1
-                if n_parse_processes == 0:
-                    break
-                continue
+    quad_tree_shapefile_name = os.path.join(
+        cache_dir, 'quad_tree_shape.shp')
+
+    lat_lng_ref = osr.SpatialReference()
+    lat_lng_ref.ImportFromEPSG(4326)  # EPSG 4326 is lat/lng
+    LOGGER.info("building quadtree shapefile overview")
+    build_quadtree_shape(quad_tree_shapefile_name, ooc_qt, lat_lng_ref)
+
+    LOGGER.info('took %f seconds', (time.time() - start_time))
+    return ooc_qt_picklefilename
+
+
+def _is_built_in_quadrants(quadtree):
+    """Return True if points can be added to a quadtree in quadrants.
+
+    Parameters:
+        quadtree (out_of_core_quadtree.OutOfCoreQuadTree): a quadtree
+
+    Returns:
+        True if each of the root's quadrants has its own
+        ``ColumnarPointStore``, as built by ``construct_userday_quadtree``.
+    """
+    if quadtree.is_leaf:
+        return False
+    store_list = [node.node_data_manager for node in quadtree.nodes]
+    return (
+        len(set(id(store) for store in store_list)) == 4 and
+        all(isinstance(store, columnar_point_store.ColumnarPointStore)
+            for store in store_list))
+
+
+def _build_userday_quadtree(
+        initial_bounding_box, csv_path_list, cache_dir, max_points_per_node,
+        target_pickle_path, base_qt):
+    """Build a quadtree in quadrants, resuming from a checkpoint if any.
+
+    The build's progress is recorded next to `target_pickle_path` in a json
+    file of the csv and file offset that the checkpoint was taken at and the
+    paths to the pickled subtrees.
 
-            n_points += len(point_array)
-            ooc_qt.add_points(point_array, 0, point_array.size)
-            current_time = time.time()
-            time_elapsed = current_time - last_time
-            if time_elapsed > 5.0:
+    Parameters:
+        initial_bounding_box (list of int): bounding box of the quadtree of
+            the form [xmin, ymin, xmax, ymax]
+        csv_path_list (list): paths to the csv files of points to add.
+        cache_dir (string): path to a directory that can be used to cache
+            the quadtree files on disk
+        max_points_per_node(int): maximum number of points to allow per node
+            of the quadree.
+        target_pickle_path (string): path to pickle the quadtree to.
+        base_qt (out_of_core_quadtree.OutOfCoreQuadTree): a quadtree for
+            which ``_is_built_in_quadrants`` is True to add the points to, or
+            None to build a new quadtree.  The point stores of `base_qt` are
+            appended to but not packed, so its pickle stays valid.
+
+    Returns:
+        the built out_of_core_quadtree.OutOfCoreQuadTree
+    """
+    target_base_path = os.path.splitext(target_pickle_path)[0]
+    build_state_path = _build_state_path(target_base_path)
+
+    build_state = None
+    if os.path.isfile(build_state_path):
+        with open(build_state_path, 'r') as build_state_file:
+            build_state = json.load(build_state_file)
+        try:
+            # make sure the checkpoint is loadable before starting from it
+            for subtree_path in build_state['subtree_paths']:
+                with open(subtree_path, 'rb') as subtree_file:
+                    pickle.load(subtree_file).node_data_manager.reopen()
+            LOGGER.info(
+                'resuming quadtree build at offset %s of %s',
+                build_state['offset'],
+                csv_path_list[min(
+                    build_state['csv_index'], len(csv_path_list) - 1)])
+        except (OSError, ValueError, EOFError,
+                pickle.UnpicklingError) as error:
+            LOGGER.warning(
+                "can't resume quadtree build (%s), starting over", error)
+            build_state = None
+
+    if build_state is None:
+        if base_qt is not None:
+            subtree_list = base_qt.nodes
+        else:
+            subtree_list = [
+                out_of_core_quadtree.OutOfCoreQuadTree(
+                    quad_bounding_box, max_points_per_node, GLOBAL_DEPTH,
+                    cache_dir, node_depth=1,
+                    node_data_manager=columnar_point_store.ColumnarPointStore(
+                        '%s_q%d.points' % (target_base_path, quad_index),
+                        out_of_core_quadtree.MAX_BYTES_TO_BUFFER))
+                for quad_index, quad_bounding_box in enumerate(
+                    out_of_core_quadtree.quadrant_bounding_boxes(
+                        initial_bounding_box))]
+        build_state = {
+            'csv_index': 0,
+            'offset': None,
+            'checkpoint_index': 0,
+            'pack': base_qt is None,
+            'subtree_paths': _subtree_checkpoint_paths(target_base_path, 0),
+        }
+        for subtree, subtree_path in zip(
+                subtree_list, build_state['subtree_paths']):
+            with open(subtree_path, 'wb') as subtree_file:
+                pickle.dump(subtree, subtree_file)
+        _write_build_state(build_state_path, build_state)
+        subtree_list = None
+
+    n_parse_processes = multiprocessing.cpu_count() - 1
+    if n_parse_processes < 1:
+        n_parse_processes = 1
+    quadrant_queue_list = [
+        multiprocessing.Queue(n_parse_processes * 2) for _ in range(4)]
+    checkpoint_queue = multiprocessing.Queue()
+    block_queue = multiprocessing.Queue()
+    parsed_queue = multiprocessing.Queue()
+
+    LOGGER.info('starting quadrant and parsing processes')
+    process_list = []
+    for subtree_path, quadrant_queue in zip(
+            build_state['subtree_paths'], quadrant_queue_list):
+        process_list.append(multiprocessing.Process(
+            target=_build_quadrant_subtree, args=(
+                subtree_path, quadrant_queue, checkpoint_queue)))
+    for _ in range(n_parse_processes):
+        process_list.append(multiprocessing.Process(
+            target=_parse_and_partition_csv, args=(
+                block_queue, initial_bounding_box, quadrant_queue_list,
+                parsed_queue)))
+    for process in process_list:
+        process.daemon = True
+        process.start()
+
+    try:
+        start_time = time.time()
+        n_quadrant_points = [0] * 4
+        for csv_index in range(build_state['csv_index'], len(csv_path_list)):
+            csv_path = csv_path_list[csv_index]
+            csv_size = os.path.getsize(csv_path)
+            start_offset = None
+            if csv_index == build_state['csv_index']:
+                start_offset = build_state['offset']
+            block_iterator = _csv_blocks(csv_path, start_offset)
+            while True:
+                block_list = list(
+                    itertools.islice(block_iterator, CHECKPOINT_BLOCKS))
+                if not block_list:
+                    break
+                for offset, size in block_list:
+                    block_queue.put((csv_path, offset, size))
+                for _ in block_list:
+                    n_quadrant_points = [
+                        n_points + n_block_points for n_points, n_block_points
+                        in zip(n_quadrant_points, _get_from_workers(
+                            parsed_queue, process_list))]
+
+                end_offset = block_list[-1][0] + block_list[-1][1]
+                build_state = _checkpoint_subtrees(
+                    target_base_path, build_state, csv_index, end_offset,
+                    False, n_quadrant_points, quadrant_queue_list,
+                    checkpoint_queue, process_list)
                 LOGGER.info(
-                    '%.2f%% complete, %d points skipped, %d nodes in qt in '
-                    'only %.2fs', n_points * 100.0 / total_lines,
-                    n_points - ooc_qt.n_points(), ooc_qt.n_nodes(),
-                    current_time-start_time)
-                last_time = time.time()
-
-        # save quadtree to disk
-        ooc_qt.flush()
-        LOGGER.info(
-            '100.00%% complete, %d points skipped, %d nodes in qt in '
-            'only %.2fs', n_points - ooc_qt.n_points(), ooc_qt.n_nodes(),
-            time.time()-start_time)
+                    '%.2f%% of %s added, %d points in %.2fs',
+                    end_offset * 100.0 / csv_size, csv_path,
+                    sum(n_quadrant_points), time.time() - start_time)
+
+        # the last checkpoint packs the point stores of a new quadtree
+        build_state = _checkpoint_subtrees(
+            target_base_path, build_state, len(csv_path_list), None,
+            build_state['pack'], n_quadrant_points, quadrant_queue_list,
+            checkpoint_queue, process_list)
+        for quadrant_queue in quadrant_queue_list:
+            quadrant_queue.put('STOP')
+        for _ in range(n_parse_processes):
+            block_queue.put('STOP')
+        for process in process_list:
+            process.join()
+    finally:
+        for process in process_list:
+            if process.is_alive():
+                process.terminate()
+
+    subtree_list = []
+    for subtree_path in build_state['subtree_paths']:
+        with open(subtree_path, 'rb') as subtree_file:
+            subtree_list.append(pickle.load(subtree_file))
+    ooc_qt = out_of_core_quadtree.OutOfCoreQuadTree(
+        initial_bounding_box, max_points_per_node, GLOBAL_DEPTH, cache_dir,
+        node_data_manager=subtree_list[0].node_data_manager,
+        pickle_filename=target_pickle_path)
+    ooc_qt.set_quadrant_subtrees(subtree_list)
+    # the quadtree pickle marks a finished build, so it's written whole
+    temporary_pickle_path = target_pickle_path + '.tmp'
+    with open(temporary_pickle_path, 'wb') as qt_file:
+        pickle.dump(ooc_qt, qt_file)
+    os.replace(temporary_pickle_path, target_pickle_path)
+
+    os.remove(build_state_path)
+    for subtree_path in build_state['subtree_paths']:
+        os.remove(subtree_path)
+    LOGGER.info(
+        '100.00%% complete, %d points added, %d nodes in qt in only %.2fs',
+        sum(n_quadrant_points), ooc_qt.n_nodes(), time.time() - start_time)
+    return ooc_qt
+
+
+def _build_state_path(target_base_path):
+    """Return the path of the state json of a quadtree build."""
+    return target_base_path + '_build_state.json'
+
+
+def _subtree_checkpoint_paths(target_base_path, checkpoint_index):
+    """List the paths of the pickled subtrees of a build checkpoint."""
+    return [
+        '%s_q%d_%d.pickle' % (target_base_path, quad_index, checkpoint_index)
+        for quad_index in range(4)]
+
+
+def _write_build_state(build_state_path, build_state):
+    """Replace a quadtree build's state json in one step."""
+    temporary_path = build_state_path + '.tmp'
+    with open(temporary_path, 'w') as build_state_file:
+        json.dump(build_state, build_state_file)
+    os.replace(temporary_path, build_state_path)
+
+
+def _checkpoint_subtrees(
+        target_base_path, build_state, csv_index, offset, pack,
+        n_quadrant_points, quadrant_queue_list, checkpoint_queue,
+        process_list):
+    """Pickle the subtrees of a quadtree build and record its progress.
 
-        quad_tree_shapefile_name = os.path.join(
-            cache_dir, 'quad_tree_shape.shp')
+    Parameters:
+        target_base_path (string): path to the quadtree pickle being built
+            without its extension.
+        build_state (dict): the build state of the last checkpoint.
+        csv_index (int): index of the csv being added.
+        offset (int): offset in the csv that all points before have been
+            added, or None for the start of the csv.
+        pack (bool): whether to pack the subtrees' point stores.
+        n_quadrant_points (list): the number of points sent to each
+            subtree's process in this build.
+        quadrant_queue_list (list): the queues of the subtree processes.
+        checkpoint_queue (multiprocessing.Queue): queue the subtree
+            processes report checkpoints on.
+        process_list (list): the build's worker processes.
 
-        lat_lng_ref = osr.SpatialReference()
-        lat_lng_ref.ImportFromEPSG(4326)  # EPSG 4326 is lat/lng
-        LOGGER.info("building quadtree shapefile overview")
-        build_quadtree_shape(quad_tree_shapefile_name, ooc_qt, lat_lng_ref)
+    Returns:
+        the new build state.
+    """
+    checkpoint_index = build_state['checkpoint_index'] + 1
+    subtree_path_list = _subtree_checkpoint_paths(
+        target_base_path, checkpoint_index)
+    for quadrant_queue, n_points, subtree_path in zip(
+            quadrant_queue_list, n_quadrant_points, subtree_path_list):
+        quadrant_queue.put((n_points, subtree_path, pack))
+    for _ in range(len(quadrant_queue_list)):
+        _get_from_workers(checkpoint_queue, process_list)
+
+    new_build_state = dict(build_state)
+    new_build_state.update({
+        'csv_index': csv_index,
+        'offset': offset,
+        'checkpoint_index': checkpoint_index,
+        'subtree_paths': subtree_path_list,
+    })
+    _write_build_state(
+        _build_state_path(target_base_path), new_build_state)
+    for subtree_path in build_state['subtree_paths']:
+        os.remove(subtree_path)
+    return new_build_state
+
+
+def _build_quadrant_subtree(subtree_path, point_queue, checkpoint_queue):
+    """Add points to one of the quadrant subtrees of a quadtree build.
 
-    populate_thread.join()
-    parse_input_csv_process.join()
+    Parameters:
+        subtree_path (string): path to the pickled subtree to add points to.
+        point_queue (multiprocessing.Queue): contains structured arrays of
+            points to add, checkpoint requests of the form
+            (n_points, pickle path, pack), and a final 'STOP'.  Once
+            `n_points` points have been added in all, the subtree is
+            flushed, its point store packed if `pack`, and it's pickled to
+            the path, which is then put on `checkpoint_queue`.
+        checkpoint_queue (multiprocessing.Queue): queue to report finished
+            checkpoints on.
 
-    LOGGER.info('took %f seconds', (time.time() - start_time))
-    return ooc_qt_picklefilename
+    Returns:
+        None
+    """
+    with open(subtree_path, 'rb') as subtree_file:
+        subtree = pickle.load(subtree_file)
+    subtree.node_data_manager.reopen()
+    # blob ids only need to be unique within the subtree's point store
+    out_of_core_quadtree.OutOfCoreQuadTree.next_available_blob_id = (
+        subtree.max_blob_id() + 1)
+
+    n_points = 0
+    checkpoint = None
+    while True:
+        message = point_queue.get()
+        if isinstance(message, str):
+            break
+        if isinstance(message, tuple):
+            checkpoint = message
+        else:
+            subtree.add_points(message, 0, message.size)
+            n_points += message.size
+        if checkpoint is not None and n_points >= checkpoint[0]:
+            _, checkpoint_path, pack = checkpoint
+            subtree.flush(pack=pack)
+            with open(checkpoint_path, 'wb') as checkpoint_file:
+                pickle.dump(subtree, checkpoint_file)
+            checkpoint_queue.put(checkpoint_path)
+            checkpoint = None
+
+
+def _get_from_workers(result_queue, process_list):
+    """Get an item from a queue, raising an error if a worker has died.
+
+    Parameters:
+        result_queue (multiprocessing.Queue): queue filled by the workers.
+        process_list (list): the worker processes, which only exit when
+            they're stopped.
+
+    Returns:
+        the next item on `result_queue`.
+    """
+    while True:
+        try:
+            return result_queue.get(timeout=LOGGER_TIME_DELAY)
+        except queue.Empty:
+            for process in process_list:
+                if not process.is_alive():
+                    raise RuntimeError(
+                        '%s exited unexpectedly with code %s' % (
+                            process.name, process.exitcode))
 
 
 def build_quadtree_shape(
@@ -660,6 +1379,57 @@ def build_quadtree_shape(
     quadtree.build_node_shapes(polygon_layer)
 
 
+def _count_user_days(point_array, date_range):
+    """Count the unique user days of points within a date range.
+
+    A user day is a unique (user hash, date) pair.
+
+    Parameters:
+        point_array (numpy.ndarray or dict): structured array of
+            ``out_of_core_quadtree._ARRAY_TUPLE_TYPE`` points, or a dict
+            mapping those field names to column arrays.
+        date_range (tuple): numpy.datetime64 tuple indicating inclusive start
+            and stop dates
+
+    Returns:
+        tuple of (n_user_days, monthly_counts) where ``n_user_days`` is the
+        number of user days in ``date_range`` and ``monthly_counts`` maps
+        month strings ``'1'``..``'12'`` to the user days in that month of any
+        year, and ``'<year>-<month>'`` strings to the user days in that
+        month of that year.  Months with no user days are not in the dict.
+    """
+    point_dates = point_array['f0']
+    in_range_mask = (
+        (point_dates >= date_range[0]) & (point_dates <= date_range[1]))
+    point_days = point_dates[in_range_mask].astype(numpy.int64)
+    if point_days.size == 0:
+        return 0, {}
+    # the 4 byte user hash is packed in the high half of a key and the day in
+    # the low half, so unique keys are unique user days
+    user_ids = numpy.ascontiguousarray(
+        point_array['f1'][in_range_mask]).view(numpy.uint32)
+    user_day_keys = (
+        (user_ids.astype(numpy.uint64) << numpy.uint64(32)) |
+        (point_days - point_days.min()).astype(numpy.uint64))
+    unique_keys = numpy.unique(user_day_keys)
+    unique_days = (
+        (unique_keys & numpy.uint64(0xFFFFFFFF)).astype(numpy.int64) +
+        point_days.min())
+
+    # months since 1970-01, so month of year is this mod 12
+    unique_months = unique_days.astype('datetime64[D]').astype(
+        'datetime64[M]').astype(numpy.int64)
+    monthly_counts = {}
+    year_month_ids, year_month_counts = numpy.unique(
+        unique_months, return_counts=True)
+    for year_month_id, count in zip(year_month_ids, year_month_counts):
+        year, month = 1970 + year_month_id // 12, year_month_id % 12 + 1
+        monthly_counts['%d-%d' % (year, month)] = int(count)
+        monthly_counts[str(month)] = (
+            monthly_counts.get(str(month), 0) + int(count))
+    return unique_keys.size, monthly_counts
+
+
 def _calc_poly_pud(
         local_qt_pickle_path, aoi_path, date_range, poly_test_queue,
         pud_poly_feature_queue):
@@ -675,7 +1445,7 @@ def _calc_poly_pud(
         poly_test_queue (multiprocessing.Queue): queue with incoming
             ogr.Features
         pud_poly_feature_queue (multiprocessing.Queue): queue to put outgoing
-            (fid, pud) tuple
+            (fid, pud averages, monthly counts) tuple
 
     Returns:
         None
@@ -699,22 +1469,13 @@ def _calc_poly_pud(
             LOGGER.warn('error parsing poly, skipping')
             continue
 
-        poly_points = local_qt.get_intersecting_points_in_polygon(
-            shapely_polygon)
-        pud_set = set()
-        pud_monthly_set = collections.defaultdict(set)
-
-        for point_datetime, user_hash, _, _ in poly_points:
-            if date_range[0] <= point_datetime <= date_range[1]:
-                timetuple = point_datetime.tolist().timetuple()
-
-                year = str(timetuple.tm_year)
-                month = str(timetuple.tm_mon)
-                day = str(timetuple.tm_mday)
-                pud_hash = str(user_hash) + '%s-%s-%s' % (year, month, day)
-                pud_set.add(pud_hash)
-                pud_monthly_set[month].add(pud_hash)
-                pud_monthly_set["%s-%s" % (year, month)].add(pud_hash)
+        # the columns are views of the quadtree's memory-mapped point store,
+        # so the worker processes share its pages rather than copying them
+        poly_point_columns = (
+            local_qt.get_intersecting_point_columns_in_polygon(
+                shapely_polygon))
+        n_user_days, pud_monthly_counts = _count_user_days(
+            poly_point_columns, date_range)
 
         # calculate the number of years and months between the max/min dates
         # index 0 is annual and 1-12 are the months
@@ -722,13 +1483,13 @@ def _calc_poly_pud(
         n_years = (
             date_range[1].tolist().timetuple().tm_year -
             date_range[0].tolist().timetuple().tm_year + 1)
-        pud_averages[0] = len(pud_set) / float(n_years)
+        pud_averages[0] = n_user_days / float(n_years)
         for month_id in range(1, 13):
-            monthly_pud_set = pud_monthly_set[str(month_id)]
             pud_averages[month_id] = (
-                len(monthly_pud_set) / float(n_years))
+                pud_monthly_counts.get(str(month_id), 0) / float(n_years))
 
-        pud_poly_feature_queue.put((poly_id, pud_averages, pud_monthly_set))
+        pud_poly_feature_queue.put(
+            (poly_id, pud_averages, pud_monthly_counts))
     pud_poly_feature_queue.put('STOP')
     aoi_layer = None
     gdal.Dataset.__swig_destroy__(aoi_vector)
@@ -754,14 +1515,18 @@ def execute(args):
         natcap.invest.recreation.recmodel_server.execute(args)"
 
     Parameters:
-        args['raw_csv_point_data_path'] (string): path to a csv file of the
-            format
+        args['raw_csv_point_data_path'] (string or list): path to a csv file
+            of the format, or a list of such paths oldest first
         args['hostname'] (string): hostname to host Pyro server.
         args['port'] (int/or string representation of int): port number to host
             Pyro entry point.
         args['max_year'] (int): maximum year allowed to be queries by user
         args['min_year'] (int): minimum valid year allowed to be queried by
             user
+        args['max_points_per_node'] (int): (optional) maximum number of
+            points to allow per node of the quadtree.
+        args['max_result_cache_bytes'] (int): (optional) size limit in
+            bytes of the cache of PUD results of previously queried AOIs.
 
     Returns:
         Never returns
@@ -770,11 +1535,15 @@ def execute(args):
     max_points_per_node = GLOBAL_MAX_POINTS_PER_NODE
     if 'max_points_per_node' in args:
         max_points_per_node = args['max_points_per_node']
+    max_result_cache_bytes = RESULT_CACHE_BYTES
+    if 'max_result_cache_bytes' in args:
+        max_result_cache_bytes = int(args['max_result_cache_bytes'])
 
     uri = daemon.register(
         RecModel(args['raw_csv_point_data_path'], args['min_year'],
                  args['max_year'], args['cache_workspace'],
-                 max_points_per_node=max_points_per_node),
+                 max_points_per_node=max_points_per_node,
+                 max_result_cache_bytes=max_result_cache_bytes),
         'natcap.invest.recreation')
     LOGGER.info("natcap.invest.recreation ready. Object uri = %s", uri)
     daemon.requestLoop()
@@ -7,6 +7,7 @@ import urllib
 import Pyro4
 
 from .. import utils
+from . import recmodel_client
 
 LOGGER = logging.getLogger('natcap.invest.recmodel_client')
 # This URL is a NatCap global constant
@@ -46,11 +47,7 @@ def execute(args):
     recmodel_server = Pyro4.Proxy(path)
 
     LOGGER.info("sending id request %s", args['workspace_id'])
-    workspace_aoi_binary = recmodel_server.fetch_workspace_aoi(
-        args['workspace_id'])
-
-    # unpack result
-    open(os.path.join(
-        output_dir, '%s.zip' % args['workspace_id']), 'wb').write(
-            workspace_aoi_binary)
+    recmodel_client.download_file(
+        recmodel_server, args['workspace_id'], 'server_in.zip',
+        os.path.join(output_dir, '%s.zip' % args['workspace_id']))
     LOGGER.info("fetched aoi")
@@ -4,16 +4,14 @@ import shutil
 import os
 import logging
 import tempfile
-import struct
-import heapq
 import time
 import collections
 
 import numpy
 from osgeo import osr
 from osgeo import gdal
-import scipy
 import pygeoprocessing
+import scipy.ndimage
 import taskgraph
 
 from . import validation
@@ -95,6 +93,17 @@ ARGS_SPEC = {
                 "if the base types are also convertible types."),
             "name": "Number of Steps in Conversion"
         },
+        "incremental_distance_update": {
+            "type": "boolean",
+            "required": False,
+            "about": (
+                "If selected, the distance transform is only recalculated "
+                "near the pixels converted on the previous step, and only "
+                "those distances are smoothed again, rather than over the "
+                "whole landscape on every step.  Steps that change too much "
+                "of the landscape are recalculated in full."),
+            "name": "Update distances incrementally"
+        },
         "aoi_path": {
             "type": "vector",
             "required": False,
@@ -128,15 +137,19 @@ ARGS_SPEC = {
 }
 
 
-# This sets the largest number of elements that will be packed at once and
-# addresses a memory leak issue that happens when many arguments are passed
-# to the function via the * operator
-_LARGEST_STRUCT_PACK = 1024
-
 # Max number of elements to read/cache at once.  Used throughout the code to
 # load arrays to and from disk
 _BLOCK_SIZE = 2**20
 
+# width and height of the tiles that distances from edge are updated in when
+# they're updated incrementally
+_DISTANCE_TILE_SIZE = 2**8
+
+# landcover classes of the incremental distance from edge update
+_NON_FOCAL_CLASS = 0
+_FOCAL_CLASS = 1
+_NODATA_CLASS = 2
+
 
 def execute(args):
     """Scenario Generator: Proximity-Based.
@@ -175,6 +188,10 @@ def execute(args):
         args['n_workers'] (int): (optional) The number of worker processes to
             use for processing this model.  If omitted, computation will take
             place in the current process.
+        args['incremental_distance_update'] (boolean): (optional) if True,
+            after the first step the distance from edge is only updated near
+            the pixels converted on the previous step instead of being
+            recalculated for the whole landscape.
 
     Returns:
         None.
@@ -249,7 +266,8 @@ def execute(args):
                   focal_landcover_codes, convertible_type_list, score_weight,
                   int(args['n_fragmentation_steps']), distance_from_edge_path,
                   output_landscape_raster_path, stats_path,
-                  args['workspace_dir']),
+                  args['workspace_dir'],
+                  bool(args.get('incremental_distance_update', False))),
             target_path_list=[
                 distance_from_edge_path, output_landscape_raster_path,
                 stats_path],
@@ -331,7 +349,7 @@ def _convert_landscape(
         base_lulc_path, replacement_lucode, area_to_convert,
         focal_landcover_codes, convertible_type_list, score_weight, n_steps,
         smooth_distance_from_edge_path, output_landscape_raster_path,
-        stats_path, workspace_dir):
+        stats_path, workspace_dir, incremental_update=False):
     """Expand replacement lucodes in relation to the focal lucodes.
 
     If the sign on `score_weight` is positive, expansion occurs marches
@@ -367,6 +385,11 @@ def _convert_landscape(
         workspace_dir (string): workspace directory that will be used to
             hold temporary files. On a successful run of this function,
             the temporary directory will be removed.
+        incremental_update (bool): if True, after the first step the
+            distance from edge is only recalculated in the tiles that the
+            pixels converted on the previous step could affect, and only the
+            tiles around changed distances are smoothed again.  A step falls
+            back to the full raster passes if the update would cost more.
 
     Returns:
         None.
@@ -385,6 +408,9 @@ def _convert_landscape(
             temp_dir, 'convertible_distances.tif'),
         'distance_from_edge': os.path.join(
             temp_dir, 'distance_from_edge.tif'),
+        'landcover_class': os.path.join(temp_dir, 'landcover_class.npy'),
+        'distance_from_edge_array': os.path.join(
+            temp_dir, 'distance_from_edge_array.npy'),
     }
     # a sigma of 1.0 gives nice visual results to smooth pixel level artifacts
     # since a pixel is the 1.0 unit
@@ -413,6 +439,23 @@ def _convert_landscape(
     invert_mask = None
     distance_nodata = None
 
+    if incremental_update:
+        # working copies of the landcover classes and the distance from edge
+        # that are updated near converted pixels on each step
+        n_cols, n_rows = lulc_raster_info['raster_size']
+        class_array = numpy.lib.format.open_memmap(
+            tmp_file_registry['landcover_class'], mode='w+',
+            dtype=numpy.uint8, shape=(n_rows, n_cols))
+        distance_array = numpy.lib.format.open_memmap(
+            tmp_file_registry['distance_from_edge_array'], mode='w+',
+            dtype=numpy.float32, shape=(n_rows, n_cols))
+        tile_max_array = None
+        converted_flat_indexes = None
+        changed_flat_indexes = None
+        replacement_class = _classify_landcover(
+            numpy.array([replacement_lucode]), focal_landcover_codes,
+            lulc_nodata)[0]
+
     for step_index in range(n_steps):
         LOGGER.info('step %d of %d', step_index+1, n_steps)
         pixels_left_to_convert -= pixels_to_convert
@@ -422,79 +465,124 @@ def _convert_landscape(
         if pixels_left_to_convert < 0:
             pixels_to_convert += pixels_left_to_convert
 
-        # create distance transforms for inside and outside the base lulc codes
-        LOGGER.info('create distance transform for current landcover')
-        for invert_mask, mask_id, distance_id in [
-                (False, 'non_base_mask', 'distance_from_non_base_mask_edge'),
-                (True, 'base_mask', 'distance_from_base_mask_edge')]:
-
-            def _mask_base_op(lulc_array):
+        distance_updated = False
+        if incremental_update and step_index > 0:
+            LOGGER.info('update distance transform near converted pixels')
+            dirty_tiles = _update_distance_from_edge(
+                class_array, distance_array, tile_max_array,
+                changed_flat_indexes)
+            if dirty_tiles is None:
+                LOGGER.info(
+                    'too many distances changed to update incrementally, '
+                    'recalculating the full distance transform')
+            else:
+                _update_convertible_distances(
+                    distance_array, dirty_tiles, converted_flat_indexes,
+                    tmp_file_registry['gaussian_kernel'],
+                    output_landscape_raster_path, convertible_type_list,
+                    convertible_type_nodata, smooth_distance_from_edge_path,
+                    tmp_file_registry['convertible_distances'])
+                distance_updated = True
+
+        if not distance_updated:
+            # create distance transforms for inside and outside the base lulc
+            # codes
+            LOGGER.info('create distance transform for current landcover')
+            for invert_mask, mask_id, distance_id in [
+                    (False, 'non_base_mask',
+                     'distance_from_non_base_mask_edge'),
+                    (True, 'base_mask', 'distance_from_base_mask_edge')]:
+
+                def _mask_base_op(lulc_array):
+                    """Create a mask of valid non-base pixels only."""
+                    base_mask = numpy.in1d(
+                        lulc_array.flatten(),
+                        focal_landcover_codes).reshape(lulc_array.shape)
+                    if invert_mask:
+                        base_mask = ~base_mask
+                    return numpy.where(
+                        lulc_array == lulc_nodata,
+                        mask_nodata, base_mask)
+                pygeoprocessing.raster_calculator(
+                    [(output_landscape_raster_path, 1)], _mask_base_op,
+                    tmp_file_registry[mask_id], gdal.GDT_Byte,
+                    mask_nodata)
+
+                # create distance transform for the current mask
+                pygeoprocessing.distance_transform_edt(
+                    (tmp_file_registry[mask_id], 1),
+                    tmp_file_registry[distance_id],
+                    working_dir=temp_dir)
+
+            # combine inner and outer distance transforms into one
+            distance_nodata = pygeoprocessing.get_raster_info(
+                tmp_file_registry['distance_from_base_mask_edge'])[
+                    'nodata'][0]
+
+            def _combine_masks(
+                    base_distance_array, non_base_distance_array):
                 """Create a mask of valid non-base pixels only."""
-                base_mask = numpy.in1d(
-                    lulc_array.flatten(), focal_landcover_codes).reshape(
-                        lulc_array.shape)
-                if invert_mask:
-                    base_mask = ~base_mask
+                result = non_base_distance_array
+                valid_base_mask = base_distance_array > 0.0
+                result[valid_base_mask] = base_distance_array[
+                    valid_base_mask]
+                return result
+            pygeoprocessing.raster_calculator(
+                [(tmp_file_registry['distance_from_base_mask_edge'], 1),
+                 (tmp_file_registry['distance_from_non_base_mask_edge'], 1)],
+                _combine_masks, tmp_file_registry['distance_from_edge'],
+                gdal.GDT_Float32, distance_nodata)
+
+            # smooth the distance transform to avoid scanline artifacts
+            pygeoprocessing.convolve_2d(
+                (tmp_file_registry['distance_from_edge'], 1),
+                (tmp_file_registry['gaussian_kernel'], 1),
+                smooth_distance_from_edge_path)
+
+            # turn inside and outside masks into a single mask
+            def _mask_to_convertible_codes(distance_from_base_edge, lulc):
+                """Mask out the distance transform to a set of lucodes."""
+                convertible_mask = numpy.in1d(
+                    lulc.flatten(), convertible_type_list).reshape(
+                        lulc.shape)
                 return numpy.where(
-                    lulc_array == lulc_nodata,
-                    mask_nodata, base_mask)
+                    convertible_mask, distance_from_base_edge,
+                    convertible_type_nodata)
             pygeoprocessing.raster_calculator(
-                [(output_landscape_raster_path, 1)], _mask_base_op,
-                tmp_file_registry[mask_id], gdal.GDT_Byte,
-                mask_nodata)
-
-            # create distance transform for the current mask
-            pygeoprocessing.distance_transform_edt(
-                (tmp_file_registry[mask_id], 1),
-                tmp_file_registry[distance_id],
-                working_dir=temp_dir)
-
-        # combine inner and outer distance transforms into one
-        distance_nodata = pygeoprocessing.get_raster_info(
-            tmp_file_registry['distance_from_base_mask_edge'])['nodata'][0]
-
-        def _combine_masks(base_distance_array, non_base_distance_array):
-            """Create a mask of valid non-base pixels only."""
-            result = non_base_distance_array
-            valid_base_mask = base_distance_array > 0.0
-            result[valid_base_mask] = base_distance_array[valid_base_mask]
-            return result
-        pygeoprocessing.raster_calculator(
-            [(tmp_file_registry['distance_from_base_mask_edge'], 1),
-             (tmp_file_registry['distance_from_non_base_mask_edge'], 1)],
-            _combine_masks, tmp_file_registry['distance_from_edge'],
-            gdal.GDT_Float32, distance_nodata)
-
-        # smooth the distance transform to avoid scanline artifacts
-        pygeoprocessing.convolve_2d(
-            (tmp_file_registry['distance_from_edge'], 1),
-            (tmp_file_registry['gaussian_kernel'], 1),
-            smooth_distance_from_edge_path)
-
-        # turn inside and outside masks into a single mask
-        def _mask_to_convertible_codes(distance_from_base_edge, lulc):
-            """Mask out the distance transform to a set of lucodes."""
-            convertible_mask = numpy.in1d(
-                lulc.flatten(), convertible_type_list).reshape(lulc.shape)
-            return numpy.where(
-                convertible_mask, distance_from_base_edge,
-                convertible_type_nodata)
-        pygeoprocessing.raster_calculator(
-            [(smooth_distance_from_edge_path, 1),
-             (output_landscape_raster_path, 1)],
-            _mask_to_convertible_codes,
-            tmp_file_registry['convertible_distances'], gdal.GDT_Float32,
-            convertible_type_nodata)
+                [(smooth_distance_from_edge_path, 1),
+                 (output_landscape_raster_path, 1)],
+                _mask_to_convertible_codes,
+                tmp_file_registry['convertible_distances'],
+                gdal.GDT_Float32, convertible_type_nodata)
+
+            if incremental_update:
+                tile_max_array = _read_distance_from_edge(
+                    tmp_file_registry['distance_from_edge'],
+                    output_landscape_raster_path, focal_landcover_codes,
+                    lulc_nodata, class_array, distance_array)
 
         LOGGER.info(
             'convert %d pixels to lucode %d', pixels_to_convert,
             replacement_lucode)
-        _convert_by_score(
+        converted_flat_indexes = _convert_by_score(
             tmp_file_registry['convertible_distances'], pixels_to_convert,
             output_landscape_raster_path, replacement_lucode, stats_cache,
-            score_weight)
+            score_weight, working_dir=temp_dir)
+
+        if incremental_update:
+            # only pixels that changed between focal and non-focal move the
+            # edge
+            flat_class_array = class_array.reshape(-1)
+            changed_flat_indexes = converted_flat_indexes[
+                flat_class_array[converted_flat_indexes] != replacement_class]
+            flat_class_array[converted_flat_indexes] = replacement_class
+            flat_class_array = None
 
     _log_stats(stats_cache, pixel_area_ha, stats_path)
+    if incremental_update:
+        # memory maps must be closed before their files can be removed
+        class_array = None
+        distance_array = None
     try:
         shutil.rmtree(temp_dir)
     except OSError:
@@ -526,151 +614,152 @@ def _log_stats(stats_cache, pixel_area, stats_path):
                     stats_cache[lucode]))
 
 
-def _sort_to_disk(dataset_path, score_weight=1.0):
+def _sort_to_disk(dataset_path, score_weight=1.0, working_dir=None):
     """Return an iterable of non-nodata pixels in sorted order.
 
+    Each memory block of the dataset is sorted and written to disk as a run
+    of scores and a parallel run of flat indexes.  The runs are memory
+    mapped and merged a batch at a time.
+
     Parameters:
         dataset_path (string): a path to a floating point GDAL dataset
         score_weight (float): a number to multiply all values by, which can be
             used to reverse the order of the iteration if negative.
+        working_dir (string): path to a directory to write the sorted runs
+            in.  If None, the system's temporary directory is used.
 
     Returns:
-        an iterable that produces (value * score_weight, flat_index) in
-        decreasing sorted order by value * score_weight
+        an iterable that produces (score_array, flat_index_array) tuples of
+        value * score_weight and the flat index of each pixel, in increasing
+        order of value * score_weight and then of flat index.  The tuples
+        are batches of up to about ``_BLOCK_SIZE`` pixels.
 
     """
-    def _read_score_index_from_disk(
-            score_file_path, index_file_path):
-        """Create generator of float/int value from the given filenames.
-
-        Reads a buffer of `buffer_size` big before to avoid keeping the
-        file open between generations.
-
-        score_file_path (string): a path to a file that has 32 bit floats
-            packed consecutively
-        index_file_path (string): a path to a file that has 32 bit ints
-            packed consecutively
-
-        Yields:
-            next (score, index) tuple in the given score and index files.
-
-        """
-        try:
-            score_buffer = ''
-            index_buffer = ''
-            file_offset = 0
-            buffer_offset = 0  # initialize to 0 to trigger the first load
-
-            # ensure buffer size that is not a perfect multiple of 4
-            read_buffer_size = int(math.sqrt(_BLOCK_SIZE))
-            read_buffer_size = read_buffer_size - read_buffer_size % 4
-
-            while True:
-                if buffer_offset == len(score_buffer):
-                    score_file = open(score_file_path, 'rb')
-                    index_file = open(index_file_path, 'rb')
-                    score_file.seek(file_offset)
-                    index_file.seek(file_offset)
-
-                    score_buffer = score_file.read(read_buffer_size)
-                    index_buffer = index_file.read(read_buffer_size)
-                    score_file.close()
-                    index_file.close()
-
-                    file_offset += read_buffer_size
-                    buffer_offset = 0
-                packed_score = score_buffer[buffer_offset:buffer_offset+4]
-                packed_index = index_buffer[buffer_offset:buffer_offset+4]
-                buffer_offset += 4
-                if not packed_score:
-                    break
-                yield (struct.unpack('f', packed_score)[0],
-                       struct.unpack('i', packed_index)[0])
-        finally:
-            # deletes the files when generator goes out of scope or ends
-            os.remove(score_file_path)
-            os.remove(index_file_path)
-
-    def _sort_cache_to_iterator(
-            index_cache, score_cache):
-        """Flushe the current cache to a heap and return it.
-
-        Parameters:
-            index_cache (1d numpy.array): contains flat indexes to the
-                score pixels `score_cache`
-            score_cache (1d numpy.array): contains score pixels
-
-        Returns:
-            Iterable to visit scores/indexes in increasing score order.
-
-        """
-        # sort the whole bunch to disk
-        score_file = tempfile.NamedTemporaryFile(delete=False)
-        index_file = tempfile.NamedTemporaryFile(delete=False)
-
-        sort_index = score_cache.argsort()
-        score_cache = score_cache[sort_index]
-        index_cache = index_cache[sort_index]
-        for index in range(0, score_cache.size, _LARGEST_STRUCT_PACK):
-            score_block = score_cache[index:index+_LARGEST_STRUCT_PACK]
-            index_block = index_cache[index:index+_LARGEST_STRUCT_PACK]
-            score_file.write(
-                struct.pack('%sf' % score_block.size, *score_block))
-            index_file.write(
-                struct.pack('%si' % index_block.size, *index_block))
-
-        score_file_path = score_file.name
-        index_file_path = index_file.name
-        score_file.close()
-        index_file.close()
-
-        return _read_score_index_from_disk(score_file_path, index_file_path)
-
     dataset_info = pygeoprocessing.get_raster_info(dataset_path)
     nodata = dataset_info['nodata'][0]
-    nodata *= score_weight  # scale the nodata so they can be filtered out
-
-    # This will be a list of file iterators we'll pass to heap.merge
-    iters = []
-
     n_cols = dataset_info['raster_size'][0]
 
+    run_dir = tempfile.mkdtemp(prefix='sort_runs', dir=working_dir)
+    # (score path, index path, length) of each sorted run
+    run_list = []
     for scores_data, scores_block in pygeoprocessing.iterblocks(
             (dataset_path, 1), largest_block=_BLOCK_SIZE):
+        valid_mask = scores_block != nodata
+        if not valid_mask.any():
+            continue
         # flatten and scale the results
-        scores_block = scores_block.flatten() * score_weight
+        row_index, col_index = numpy.nonzero(valid_mask)
+        flat_indexes = (
+            (row_index + scores_data['yoff']).astype(numpy.int64) * n_cols +
+            col_index + scores_data['xoff'])
+        scores = scores_block[valid_mask] * numpy.float32(score_weight)
 
-        col_coords, row_coords = numpy.meshgrid(
-            range(scores_data['xoff'], scores_data['xoff'] +
-                   scores_data['win_xsize']),
-            range(scores_data['yoff'], scores_data['yoff'] +
-                   scores_data['win_ysize']))
+        # flat indexes are already increasing, so a stable sort breaks ties
+        # in score by flat index
+        sort_index = numpy.argsort(scores, kind='mergesort')
+        score_path = os.path.join(run_dir, '%d_scores.bin' % len(run_list))
+        index_path = os.path.join(run_dir, '%d_indexes.bin' % len(run_list))
+        scores[sort_index].tofile(score_path)
+        flat_indexes[sort_index].tofile(index_path)
+        run_list.append((score_path, index_path, sort_index.size))
 
-        flat_indexes = (col_coords + row_coords * n_cols).flatten()
+    return _merge_sorted_runs(run_list, run_dir)
 
-        sort_index = scores_block.argsort()
-        sorted_scores = scores_block[sort_index]
-        sorted_indexes = flat_indexes[sort_index]
 
-        # search for nodata values are so we can splice them out
-        left_index = numpy.searchsorted(sorted_scores, nodata, side='left')
-        right_index = numpy.searchsorted(
-            sorted_scores, nodata, side='right')
+def _merge_sorted_runs(run_list, run_dir):
+    """Merge sorted runs of scores and flat indexes a batch at a time.
 
-        # remove nodata values
-        score_cache = numpy.concatenate(
-            (sorted_scores[0:left_index], sorted_scores[right_index::]))
-        index_cache = numpy.concatenate(
-            (sorted_indexes[0:left_index], sorted_indexes[right_index::]))
+    The smallest of the pixels that end the next window of each run is the
+    limit of a batch: no pixel after a window can sort before it, so the
+    pixels of every run up to the limit are found by binary search, read,
+    and sorted together.
 
-        iters.append(_sort_cache_to_iterator(index_cache, score_cache))
+    Parameters:
+        run_list (list): a (score path, index path, length) tuple for each
+            run, where the score file holds float32 scores in increasing
+            order and the index file holds the parallel int64 flat indexes,
+            increasing where scores are equal.
+        run_dir (string): directory holding the runs, removed when the
+            merge is done or the generator is closed.
 
-    return heapq.merge(*iters)
+    Yields:
+        (score_array, flat_index_array) tuples in increasing order of score
+        and then of flat index.
+
+    """
+    try:
+        score_run_list = [
+            numpy.memmap(score_path, dtype=numpy.float32, mode='r',
+                         shape=(run_length,))
+            for score_path, _, run_length in run_list]
+        index_run_list = [
+            numpy.memmap(index_path, dtype=numpy.int64, mode='r',
+                         shape=(run_length,))
+            for _, index_path, run_length in run_list]
+        run_offsets = [0] * len(run_list)
+        window_size = max(_BLOCK_SIZE // max(len(run_list), 1), 2**10)
+
+        while True:
+            active_runs = [
+                run_id for run_id, (_, _, run_length) in enumerate(run_list)
+                if run_offsets[run_id] < run_length]
+            if not active_runs:
+                break
+            window_ends = dict(
+                (run_id, min(
+                    run_offsets[run_id] + window_size, run_list[run_id][2]))
+                for run_id in active_runs)
+            window_last_pixels = [
+                (score_run_list[run_id][window_ends[run_id]-1],
+                 index_run_list[run_id][window_ends[run_id]-1])
+                for run_id in active_runs
+                if window_ends[run_id] < run_list[run_id][2]]
+            # when every window reaches the end of its run, all are merged
+            limit_pixel = None
+            if window_last_pixels:
+                limit_pixel = min(window_last_pixels)
+
+            batch_scores = []
+            batch_indexes = []
+            for run_id in active_runs:
+                run_offset = run_offsets[run_id]
+                batch_end = window_ends[run_id]
+                if limit_pixel is not None:
+                    limit_score, limit_index = limit_pixel
+                    window_scores = score_run_list[run_id][
+                        run_offset:batch_end]
+                    tie_start = numpy.searchsorted(
+                        window_scores, limit_score, side='left')
+                    tie_end = numpy.searchsorted(
+                        window_scores, limit_score, side='right')
+                    batch_end = run_offset + tie_start + numpy.searchsorted(
+                        index_run_list[run_id][
+                            run_offset+tie_start:run_offset+tie_end],
+                        limit_index, side='right')
+                batch_scores.append(
+                    score_run_list[run_id][run_offset:batch_end])
+                batch_indexes.append(
+                    index_run_list[run_id][run_offset:batch_end])
+                run_offsets[run_id] = int(batch_end)
+
+            batch_scores = numpy.concatenate(batch_scores)
+            batch_indexes = numpy.concatenate(batch_indexes)
+            merge_order = numpy.lexsort((batch_indexes, batch_scores))
+            yield batch_scores[merge_order], batch_indexes[merge_order]
+    finally:
+        # memory maps must be closed before their files can be removed
+        score_run_list = None
+        index_run_list = None
+        try:
+            shutil.rmtree(run_dir)
+        except OSError:
+            LOGGER.warn(
+                "Could not delete temporary sort directory '%s'", run_dir)
 
 
 def _convert_by_score(
         score_path, max_pixels_to_convert, out_raster_path, convert_value,
-        stats_cache, score_weight):
+        stats_cache, score_weight, working_dir=None):
     """Convert up to max pixels in ranked order of score.
 
     Parameters:
@@ -688,131 +777,469 @@ def _convert_by_score(
         convert_value (int/float): type is dependant on out_raster_path. Any
             pixels converted in `out_raster_path` are set to the value of this
             variable.
-        reverse_sort (boolean): If true, pixels are visited in descreasing
-            order of `score_path`, otherwise increasing.
         stats_cache (collections.defaultdict(int)): contains the number of
             pixels converted indexed by original pixel id.
+        score_weight (float): a number to multiply all scores by, which
+            reverses the order of conversion if negative.
+        working_dir (string): path to a directory for temporary sort files.
+            If None, the system's temporary directory is used.
 
     Returns:
-        None.
+        an int64 array of the flat indexes of the converted pixels.
 
     """
-    def _flush_cache_to_band(
-            data_array, row_array, col_array, valid_index, dirty_blocks,
-            out_band, stats_counter):
-        """Flush block cache to the output band.
+    def _flush_cache_to_band(flat_index_array):
+        """Convert the pixels at the given flat indexes in `out_band`.
 
         Provided as an internal function because the exact operation needs
         to be invoked inside the processing loop and again at the end to
         finalize the scan.
 
         Parameters:
-            data_array (numpy array): 1D array of valid data in buffer
-            row_array (numpy array): 1D array to indicate row indexes for
-                `data_array`
-            col_array (numpy array): 1D array to indicate col indexes for
-                `data_array`
-            valid_index (int): value indicates the non-inclusive left valid
-                entry in the parallel input arrays
-            dirty_blocks (set): contains tuples indicating the block row and
-                column indexes that will need to be set in `out_band`.  Allows
-                us to skip the examination of the entire sparse matrix.
-            out_band (gdal.Band): output band to write to
-            stats_counter (collections.defaultdict(int)): is updated so that
-                the key corresponds to ids in out_band that get set by the
-                sparse matrix, and the number of pixels converted is added
-                to the value of that entry.
+            flat_index_array (numpy array): 1D array of flat indexes of the
+                pixels to convert.  Only the blocks of `out_band` that hold
+                one of these pixels are read and written.
 
         Returns:
             None
 
         """
-        # construct sparse matrix so it can be indexed later
-        sparse_matrix = scipy.sparse.csc_matrix(
-            (data_array[:valid_index],
-             (row_array[:valid_index], col_array[:valid_index])),
-            shape=(n_rows, n_cols))
+        row_index = flat_index_array // n_cols
+        col_index = flat_index_array % n_cols
+        block_index = (
+            (row_index // out_block_row_size) * n_block_cols +
+            col_index // out_block_col_size)
+        block_order = numpy.argsort(block_index, kind='mergesort')
+        dirty_blocks, block_starts = numpy.unique(
+            block_index[block_order], return_index=True)
+        block_ends = numpy.append(block_starts[1:], block_order.size)
 
         # classic memory block iteration
-        for block_row_index, block_col_index in dirty_blocks:
-            row_index = block_row_index * out_block_row_size
-            col_index = block_col_index * out_block_col_size
-            row_index_end = row_index + out_block_row_size
-            col_index_end = col_index + out_block_col_size
-            row_win = out_block_row_size
-            col_win = out_block_col_size
-            if row_index_end > n_rows:
-                row_index_end = n_rows
-                row_win = n_rows - row_index
-            if col_index_end > n_cols:
-                col_index_end = n_cols
-                col_win = n_cols - col_index
-
-            # slice out values, some must be non-zero because of set
-            mask_array = sparse_matrix[
-                row_index:row_index_end, col_index:col_index_end].toarray()
+        for dirty_block, block_start, block_end in zip(
+                dirty_blocks, block_starts, block_ends):
+            block_row_offset = (
+                (dirty_block // n_block_cols) * out_block_row_size)
+            block_col_offset = (
+                (dirty_block % n_block_cols) * out_block_col_size)
+            row_win = min(out_block_row_size, n_rows - block_row_offset)
+            col_win = min(out_block_col_size, n_cols - block_col_offset)
+            pixel_order = block_order[block_start:block_end]
+            block_pixels = (
+                row_index[pixel_order] - block_row_offset,
+                col_index[pixel_order] - block_col_offset)
 
             # read old array so we can write over the top
             out_array = out_band.ReadAsArray(
-                xoff=col_index, yoff=row_index,
-                win_xsize=col_win, win_ysize=row_win)
+                xoff=int(block_col_offset), yoff=int(block_row_offset),
+                win_xsize=int(col_win), win_ysize=int(row_win))
 
             # keep track of the stats of what ids changed
-            for unique_id in numpy.unique(out_array[mask_array]):
-                stats_counter[unique_id] += numpy.count_nonzero(
-                    out_array[mask_array] == unique_id)
+            unique_ids, id_counts = numpy.unique(
+                out_array[block_pixels], return_counts=True)
+            for unique_id, id_count in zip(unique_ids, id_counts):
+                stats_cache[unique_id] += id_count
 
-            out_array[mask_array] = convert_value
-            out_band.WriteArray(out_array, xoff=col_index, yoff=row_index)
+            out_array[block_pixels] = convert_value
+            out_band.WriteArray(
+                out_array, xoff=int(block_col_offset),
+                yoff=int(block_row_offset))
 
     out_ds = gdal.OpenEx(out_raster_path, gdal.OF_RASTER | gdal.GA_Update)
     out_band = out_ds.GetRasterBand(1)
     out_block_col_size, out_block_row_size = out_band.GetBlockSize()
     n_rows = out_band.YSize
     n_cols = out_band.XSize
+    n_block_cols = (n_cols + out_block_col_size - 1) // out_block_col_size
+    # pixels are converted until at least `max_pixels_to_convert` are
+    n_pixels_to_convert = max(int(math.ceil(max_pixels_to_convert)), 0)
     pixels_converted = 0
 
-    row_array = numpy.empty((_BLOCK_SIZE,), dtype=numpy.uint32)
-    col_array = numpy.empty((_BLOCK_SIZE,), dtype=numpy.uint32)
-    data_array = numpy.empty((_BLOCK_SIZE,), dtype=numpy.bool)
-    next_index = 0
-    dirty_blocks = set()
-
+    flat_index_cache = []
+    n_cached = 0
+    converted_index_list = []
     last_time = time.time()
-    for _, flatindex in _sort_to_disk(score_path, score_weight=score_weight):
-        if pixels_converted >= max_pixels_to_convert:
-            break
-        col_index = flatindex % n_cols
-        row_index = flatindex // n_cols
-        row_array[next_index] = row_index
-        col_array[next_index] = col_index
-        # data_array will only ever recieve True elements, necessary for the
-        # sparse matrix to function since it requires a data array as long
-        # as the row and column arrays
-        data_array[next_index] = True
-        next_index += 1
-        dirty_blocks.add(
-            (row_index // out_block_row_size, col_index // out_block_col_size))
-        pixels_converted += 1
-
-        if time.time() - last_time > 5.0:
-            LOGGER.info(
-                "converted %d of %d pixels", pixels_converted,
-                max_pixels_to_convert)
-            last_time = time.time()
-
-        if next_index == _BLOCK_SIZE:
-            # next_index points beyond the end of the cache, flush and reset
-            _flush_cache_to_band(
-                data_array, row_array, col_array, next_index, dirty_blocks,
-                out_band, stats_cache)
-            dirty_blocks = set()
-            next_index = 0
+    sorted_pixel_iterator = _sort_to_disk(
+        score_path, score_weight=score_weight, working_dir=working_dir)
+    try:
+        for _, flat_index_array in sorted_pixel_iterator:
+            if pixels_converted >= n_pixels_to_convert:
+                break
+            flat_index_array = flat_index_array[
+                :n_pixels_to_convert - pixels_converted]
+            flat_index_cache.append(flat_index_array)
+            n_cached += flat_index_array.size
+            pixels_converted += flat_index_array.size
+
+            if time.time() - last_time > 5.0:
+                LOGGER.info(
+                    "converted %d of %d pixels", pixels_converted,
+                    max_pixels_to_convert)
+                last_time = time.time()
+
+            if n_cached >= _BLOCK_SIZE:
+                converted_index_list.append(
+                    numpy.concatenate(flat_index_cache))
+                _flush_cache_to_band(converted_index_list[-1])
+                flat_index_cache = []
+                n_cached = 0
+    finally:
+        # removes the sorted runs even if we stop before the end
+        sorted_pixel_iterator.close()
 
     # flush any remaining cache
-    _flush_cache_to_band(
-        data_array, row_array, col_array, next_index, dirty_blocks, out_band,
-        stats_cache)
+    if flat_index_cache:
+        converted_index_list.append(numpy.concatenate(flat_index_cache))
+        _flush_cache_to_band(converted_index_list[-1])
+    out_band = None
+    out_ds = None
+    return numpy.concatenate(
+        converted_index_list + [numpy.empty(0, dtype=numpy.int64)])
+
+
+def _classify_landcover(lulc_array, focal_landcover_codes, lulc_nodata):
+    """Classify landcover as focal, non-focal or nodata.
+
+    Parameters:
+        lulc_array (numpy.ndarray): landcover codes.
+        focal_landcover_codes (list of int): codes of the focal landcover.
+        lulc_nodata (int): nodata value of the landcover, or None.
+
+    Returns:
+        a uint8 array the shape of `lulc_array` of ``_FOCAL_CLASS``,
+        ``_NON_FOCAL_CLASS`` or ``_NODATA_CLASS``.
+
+    """
+    class_array = numpy.where(
+        numpy.in1d(lulc_array.flatten(), focal_landcover_codes).reshape(
+            lulc_array.shape), _FOCAL_CLASS, _NON_FOCAL_CLASS).astype(
+                numpy.uint8)
+    if lulc_nodata is not None:
+        class_array[lulc_array == lulc_nodata] = _NODATA_CLASS
+    return class_array
+
+
+def _distance_to_other_class(class_array):
+    """Calculate the distance from edge of a landcover class array.
+
+    This is the same distance as the combined distance transforms of
+    ``_convert_landscape``: non-focal pixels are the distance to the nearest
+    focal pixel, and all other pixels the distance to the nearest non-focal
+    pixel.
+
+    Parameters:
+        class_array (numpy.ndarray): 2D array of landcover classes as
+            returned by ``_classify_landcover``.
+
+    Returns:
+        a float64 array of pixel distances, ``inf`` where there is no pixel
+        of the other class in `class_array`.
+
+    """
+    distance_array = numpy.full(class_array.shape, numpy.inf)
+    non_focal_mask = class_array == _NON_FOCAL_CLASS
+    focal_mask = class_array == _FOCAL_CLASS
+    if focal_mask.any() and non_focal_mask.any():
+        distance_array[non_focal_mask] = scipy.ndimage.distance_transform_edt(
+            ~focal_mask)[non_focal_mask]
+    if non_focal_mask.any() and not non_focal_mask.all():
+        distance_array[~non_focal_mask] = (
+            scipy.ndimage.distance_transform_edt(
+                ~non_focal_mask)[~non_focal_mask])
+    return distance_array
+
+
+def _calculate_tile_max(distance_array):
+    """Find the largest distance in each tile of a distance array.
+
+    Parameters:
+        distance_array (numpy.ndarray): 2D array of distances from edge.
+
+    Returns:
+        a 2D array with the largest distance in each ``_DISTANCE_TILE_SIZE``
+        square tile of `distance_array`.
+
+    """
+    n_rows, n_cols = distance_array.shape
+    tile_max_array = numpy.empty((
+        -(-n_rows // _DISTANCE_TILE_SIZE), -(-n_cols // _DISTANCE_TILE_SIZE)))
+    for tile_row in range(tile_max_array.shape[0]):
+        for tile_col in range(tile_max_array.shape[1]):
+            tile_max_array[tile_row, tile_col] = distance_array[
+                tile_row*_DISTANCE_TILE_SIZE:(tile_row+1)*_DISTANCE_TILE_SIZE,
+                tile_col*_DISTANCE_TILE_SIZE:
+                (tile_col+1)*_DISTANCE_TILE_SIZE].max()
+    return tile_max_array
+
+
+def _read_distance_from_edge(
+        distance_from_edge_path, lulc_raster_path, focal_landcover_codes,
+        lulc_nodata, class_array, distance_array):
+    """Copy a distance from edge raster into the incremental working arrays.
+
+    Parameters:
+        distance_from_edge_path (string): path to the combined distance
+            transform raster.
+        lulc_raster_path (string): path to the landcover the distances were
+            calculated from.
+        focal_landcover_codes (list of int): codes of the focal landcover.
+        lulc_nodata (int): nodata value of the landcover, or None.
+        class_array (numpy.ndarray): uint8 array the size of the rasters that
+            is set to the landcover classes.
+        distance_array (numpy.ndarray): float32 array the size of the rasters
+            that is set to the distances.
+
+    Returns:
+        the tile maximum array of `distance_array` as returned by
+        ``_calculate_tile_max``.
+
+    """
+    for offset_dict, distance_block in pygeoprocessing.iterblocks(
+            (distance_from_edge_path, 1)):
+        distance_array[
+            offset_dict['yoff']:
+            offset_dict['yoff']+offset_dict['win_ysize'],
+            offset_dict['xoff']:
+            offset_dict['xoff']+offset_dict['win_xsize']] = distance_block
+    for offset_dict, lulc_block in pygeoprocessing.iterblocks(
+            (lulc_raster_path, 1)):
+        class_array[
+            offset_dict['yoff']:
+            offset_dict['yoff']+offset_dict['win_ysize'],
+            offset_dict['xoff']:
+            offset_dict['xoff']+offset_dict['win_xsize']] = (
+                _classify_landcover(
+                    lulc_block, focal_landcover_codes, lulc_nodata))
+    return _calculate_tile_max(distance_array)
+
+
+def _update_distance_from_edge(
+        class_array, distance_array, tile_max_array, changed_flat_indexes):
+    """Update the distance from edge near pixels that changed class.
+
+    A pixel's distance can only change if a changed pixel is no farther
+    than its old distance, so only tiles whose largest distance reaches
+    the nearest tile with a changed pixel are updated.  Each connected group
+    of these tiles is recalculated in a window around it that is grown
+    until none of the group's distances are farther than the edge of the
+    window, which makes them exact.
+
+    Parameters:
+        class_array (numpy.ndarray): 2D array of the current landcover
+            classes as returned by ``_classify_landcover``.
+        distance_array (numpy.ndarray): 2D float32 array of the distances
+            from edge of the landcover before the pixels at
+            `changed_flat_indexes` changed class.  Updated in place.
+        tile_max_array (numpy.ndarray): tile maximums of `distance_array` as
+            returned by ``_calculate_tile_max``.  Updated in place.
+        changed_flat_indexes (numpy.ndarray): flat indexes of the pixels
+            that changed between the focal and non-focal classes.
+
+    Returns:
+        a boolean array the shape of `tile_max_array` that's True for the
+        tiles whose distances changed, or None if updating would process
+        more pixels than the whole raster, in which case `distance_array`
+        and `tile_max_array` are left partly updated.
+
+    """
+    n_rows, n_cols = class_array.shape
+    tile_size = _DISTANCE_TILE_SIZE
+    dirty_tiles = numpy.zeros(tile_max_array.shape, dtype=numpy.bool_)
+    if changed_flat_indexes.size == 0:
+        return dirty_tiles
+
+    changed_tiles = numpy.zeros(tile_max_array.shape, dtype=numpy.bool_)
+    changed_tiles[
+        changed_flat_indexes // n_cols // tile_size,
+        changed_flat_indexes % n_cols // tile_size] = True
+    # a lower bound of the distance from any pixel of a tile to any pixel of
+    # the nearest changed tile
+    tile_distance_array = numpy.maximum(
+        scipy.ndimage.distance_transform_edt(~changed_tiles) - numpy.sqrt(2),
+        0) * tile_size
+    group_array, _ = scipy.ndimage.label(
+        tile_distance_array <= tile_max_array, structure=numpy.ones((3, 3)))
+
+    n_pixels_left = n_rows * n_cols
+    for group_id, (tile_row_slice, tile_col_slice) in enumerate(
+            scipy.ndimage.find_objects(group_array), start=1):
+        group_tile_mask = (
+            group_array[tile_row_slice, tile_col_slice] == group_id)
+        row_start = tile_row_slice.start * tile_size
+        row_end = min(tile_row_slice.stop * tile_size, n_rows)
+        col_start = tile_col_slice.start * tile_size
+        col_end = min(tile_col_slice.stop * tile_size, n_cols)
+        group_pixel_mask = numpy.repeat(numpy.repeat(
+            group_tile_mask, tile_size, axis=0), tile_size, axis=1)[
+                :row_end-row_start, :col_end-col_start]
+        row_index = numpy.arange(row_start, row_end).reshape(-1, 1)
+        col_index = numpy.arange(col_start, col_end).reshape(1, -1)
+        # old distances are usually close to the new ones
+        halo = int(min(
+            tile_max_array[tile_row_slice, tile_col_slice][
+                group_tile_mask].max(), n_rows + n_cols)) + 1
+        while True:
+            window_row_start = max(0, row_start - halo)
+            window_row_end = min(n_rows, row_end + halo)
+            window_col_start = max(0, col_start - halo)
+            window_col_end = min(n_cols, col_end + halo)
+            n_pixels_left -= (
+                (window_row_end - window_row_start) *
+                (window_col_end - window_col_start))
+            if n_pixels_left < 0:
+                return None
+
+            group_distance = _distance_to_other_class(class_array[
+                window_row_start:window_row_end,
+                window_col_start:window_col_end])[
+                    row_start-window_row_start:row_end-window_row_start,
+                    col_start-window_col_start:col_end-window_col_start]
+
+            # distance from each pixel to the nearest pixel outside of the
+            # window, other than outside of the raster
+            window_margin = numpy.full(group_distance.shape, numpy.inf)
+            if window_row_start > 0:
+                window_margin = numpy.minimum(
+                    window_margin, row_index - window_row_start + 1)
+            if window_row_end < n_rows:
+                window_margin = numpy.minimum(
+                    window_margin, window_row_end - row_index)
+            if window_col_start > 0:
+                window_margin = numpy.minimum(
+                    window_margin, col_index - window_col_start + 1)
+            if window_col_end < n_cols:
+                window_margin = numpy.minimum(
+                    window_margin, window_col_end - col_index)
+            exact_mask = (
+                (group_distance <= window_margin) &
+                numpy.isfinite(group_distance))
+            if exact_mask[group_pixel_mask].all():
+                break
+            if numpy.isinf(window_margin).all():
+                # the window is the whole raster and a class is missing
+                return None
+            halo *= 2
+
+        group_distance = group_distance.astype(numpy.float32)
+        for tile_row, tile_col in zip(*numpy.nonzero(group_tile_mask)):
+            local_slice = (
+                slice(tile_row*tile_size, (tile_row+1)*tile_size),
+                slice(tile_col*tile_size, (tile_col+1)*tile_size))
+            tile_distance = group_distance[local_slice]
+            tile_slice = (
+                slice(row_start + local_slice[0].start,
+                      row_start + local_slice[0].start +
+                      tile_distance.shape[0]),
+                slice(col_start + local_slice[1].start,
+                      col_start + local_slice[1].start +
+                      tile_distance.shape[1]))
+            tile_index = (
+                tile_row_slice.start + tile_row,
+                tile_col_slice.start + tile_col)
+            if not numpy.array_equal(
+                    tile_distance, distance_array[tile_slice]):
+                distance_array[tile_slice] = tile_distance
+                dirty_tiles[tile_index] = True
+            tile_max_array[tile_index] = tile_distance.max()
+    return dirty_tiles
+
+
+def _update_convertible_distances(
+        distance_array, dirty_tiles, converted_flat_indexes, kernel_path,
+        lulc_raster_path, convertible_type_list, convertible_type_nodata,
+        smooth_distance_from_edge_path, convertible_distances_path):
+    """Update the smoothed and convertible distances in changed tiles.
+
+    Tiles are smoothed again if they're within the kernel's radius of a
+    tile whose distances changed, and their convertible distances are
+    rewritten along with those of tiles with converted pixels.
+
+    Parameters:
+        distance_array (numpy.ndarray): 2D array of distances from edge.
+        dirty_tiles (numpy.ndarray): boolean array of the tiles whose
+            distances changed, as returned by ``_update_distance_from_edge``.
+        converted_flat_indexes (numpy.ndarray): flat indexes of the pixels
+            converted on the last step.
+        kernel_path (string): path to the smoothing kernel raster.
+        lulc_raster_path (string): path to the current landcover raster.
+        convertible_type_list (list of int): landcover codes that are
+            allowable to be converted.
+        convertible_type_nodata (float): the nodata value of
+            `convertible_distances_path`.
+        smooth_distance_from_edge_path (string): path to the smoothed
+            distance raster to update.
+        convertible_distances_path (string): path to the convertible
+            distance raster to update.
+
+    Returns:
+        None.
+
+    """
+    n_rows, n_cols = distance_array.shape
+    tile_size = _DISTANCE_TILE_SIZE
+    kernel_raster = gdal.OpenEx(kernel_path, gdal.OF_RASTER)
+    kernel_array = kernel_raster.GetRasterBand(1).ReadAsArray().astype(
+        numpy.float64)
+    kernel_raster = None
+    kernel_radius = kernel_array.shape[0] // 2
+
+    smooth_tiles = scipy.ndimage.binary_dilation(
+        dirty_tiles, structure=numpy.ones((3, 3)),
+        iterations=-(-kernel_radius // tile_size))
+    convertible_tiles = smooth_tiles.copy()
+    convertible_tiles[
+        converted_flat_indexes // n_cols // tile_size,
+        converted_flat_indexes % n_cols // tile_size] = True
+
+    smooth_raster = gdal.OpenEx(
+        smooth_distance_from_edge_path, gdal.OF_RASTER | gdal.GA_Update)
+    smooth_band = smooth_raster.GetRasterBand(1)
+    convertible_raster = gdal.OpenEx(
+        convertible_distances_path, gdal.OF_RASTER | gdal.GA_Update)
+    convertible_band = convertible_raster.GetRasterBand(1)
+    lulc_raster = gdal.OpenEx(lulc_raster_path, gdal.OF_RASTER)
+    lulc_band = lulc_raster.GetRasterBand(1)
+    for tile_row, tile_col in zip(*numpy.nonzero(convertible_tiles)):
+        row_start = tile_row * tile_size
+        row_end = min(row_start + tile_size, n_rows)
+        col_start = tile_col * tile_size
+        col_end = min(col_start + tile_size, n_cols)
+        tile_offset = {
+            'xoff': int(col_start), 'yoff': int(row_start),
+            'win_xsize': int(col_end - col_start),
+            'win_ysize': int(row_end - row_start)}
+
+        if smooth_tiles[tile_row, tile_col]:
+            # the convolution treats pixels outside of the raster as 0
+            window_row_start = max(0, row_start - kernel_radius)
+            window_col_start = max(0, col_start - kernel_radius)
+            smooth_array = scipy.ndimage.correlate(
+                distance_array[
+                    window_row_start:min(n_rows, row_end + kernel_radius),
+                    window_col_start:min(n_cols, col_end + kernel_radius)
+                ].astype(numpy.float64), kernel_array, mode='constant',
+                cval=0.0)[
+                    row_start-window_row_start:row_end-window_row_start,
+                    col_start-window_col_start:col_end-window_col_start]
+            smooth_band.WriteArray(
+                smooth_array, xoff=tile_offset['xoff'],
+                yoff=tile_offset['yoff'])
+        else:
+            smooth_array = smooth_band.ReadAsArray(**tile_offset)
+
+        lulc_array = lulc_band.ReadAsArray(**tile_offset)
+        convertible_mask = numpy.in1d(
+            lulc_array.flatten(), convertible_type_list).reshape(
+                lulc_array.shape)
+        convertible_band.WriteArray(
+            numpy.where(
+                convertible_mask, smooth_array, convertible_type_nodata),
+            xoff=tile_offset['xoff'], yoff=tile_offset['yoff'])
+    smooth_band = None
+    smooth_raster = None
+    convertible_band = None
+    convertible_raster = None
+    lulc_band = None
+    lulc_raster = None
 
 
 def _make_gaussian_kernel_path(sigma, kernel_path):
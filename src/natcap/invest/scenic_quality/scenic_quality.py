@@ -1,6 +1,7 @@
 """InVEST Scenic Quality Model."""
 import os
 import math
+import functools
 import logging
 import tempfile
 import shutil
@@ -10,11 +11,11 @@ import struct
 
 import numpy
 from osgeo import gdal
-from osgeo import osr
 import taskgraph
 import pygeoprocessing
 
-from natcap.invest.scenic_quality.viewshed import viewshed
+from natcap.invest.scenic_quality.viewshed import viewshed_batch
+from natcap.invest.scenic_quality.viewshed import VISIBILITY_SUM_NODATA
 from .. import utils
 from .. import validation
 
@@ -39,8 +40,9 @@ _INTERMEDIATE_BASE_FILES = {
     'structures_clipped': 'structures_clipped.shp',
     'structures_reprojected': 'structures_reprojected.shp',
     'visibility_pattern': 'visibility_{id}.tif',
-    'auxiliary_pattern': 'auxiliary_{id}.tif',  # Retained for debugging.
     'value_pattern': 'value_{id}.tif',
+    'partial_visibility_sum_pattern': 'partial_visibility_sum_{id}.tif',
+    'partial_value_sum_pattern': 'partial_value_sum_{id}.tif',
 }
 
 
@@ -160,6 +162,16 @@ ARGS_SPEC = {
                 "The valuation function 'f' cannot be negative at the "
                 "radius 'r' (f(r)>=0)."),
         },
+        "save_per_viewpoint_rasters": {
+            "name": "Save per-viewpoint rasters",
+            "type": "boolean",
+            "required": False,
+            "about": (
+                "If selected, the visibility raster of each viewpoint, and "
+                "its value raster if valuation is enabled, are saved to the "
+                "intermediate folder.  Otherwise only the sums over all "
+                "viewpoints are written."),
+        },
     }
 }
 
@@ -198,7 +210,12 @@ def execute(args):
             to 0.  Required if ``args['do_valuation']`` is ``True``.
         args['n_workers'] (int): (optional) The number of worker processes to
             use for processing this model.  If omitted, computation will take
-            place in the current process.
+            place in the current process.  Viewpoints are split into this
+            many batches that each share one DEM block cache.
+        args['save_per_viewpoint_rasters'] (bool): (optional) if ``True``,
+            the visibility raster (``visibility_<id>.tif``) and, when
+            valuing, the value raster (``value_<id>.tif``) of each viewpoint
+            are written to the intermediate folder.  Default: ``False``.
 
     Returns:
         ``None``
@@ -365,65 +382,84 @@ def execute(args):
     # helps avoid unnecesary recomputation in taskgraph for when an ESRI
     # Shapefile, for example, returns a different order of points because
     # someone decided to repack it.
-    viewshed_files = []
+    viewpoint_tuples = sorted(viewpoint_tuples, key=lambda x: x[0])
+    save_per_viewpoint_rasters = bool(
+        args.get('save_per_viewpoint_rasters', False))
+    if do_valuation:
+        valuation_args = (
+            valuation_method, valuation_coefficients, max_valuation_radius)
+    else:
+        valuation_args = None
+
+    # Each batch of viewpoints is computed in one task that shares a DEM
+    # block cache and sums its viewsheds as it goes, so there's one batch
+    # per worker.  With a single batch, its sums are the model outputs.
+    n_batches = max(1, min(n_workers, len(viewpoint_tuples)))
     viewshed_tasks = []
-    valuation_tasks = []
-    valuation_filepaths = []
-    weights = []
-    feature_index = 0
-    for viewpoint, max_radius, weight, viewpoint_height in sorted(
-            viewpoint_tuples, key=lambda x: x[0]):
-        weights.append(weight)
-        visibility_filepath = file_registry['visibility_pattern'].format(
-            id=feature_index)
-        viewshed_files.append(visibility_filepath)
-        viewshed_task = graph.add_task(
-            viewshed,
-            args=((file_registry['clipped_dem'], 1),  # DEM
-                  viewpoint,
-                  visibility_filepath),
-            kwargs={'curved_earth': True,  # SQ model always assumes this.
-                    'refraction_coeff': float(args['refraction']),
-                    'max_distance': max_radius,
-                    'viewpoint_height': viewpoint_height,
-                    'aux_filepath': None},  # Remove aux filepath after run
-            target_path_list=[visibility_filepath],
+    visibility_sum_paths = []
+    valuation_sum_paths = []
+    for batch_index in range(n_batches):
+        batch_start = batch_index * len(viewpoint_tuples) // n_batches
+        batch_end = (batch_index + 1) * len(viewpoint_tuples) // n_batches
+        if n_batches == 1:
+            visibility_sum_path = file_registry['n_visible_structures']
+            valuation_sum_path = file_registry['viewshed_value']
+        else:
+            visibility_sum_path = file_registry[
+                'partial_visibility_sum_pattern'].format(id=batch_index)
+            valuation_sum_path = file_registry[
+                'partial_value_sum_pattern'].format(id=batch_index)
+        target_path_list = [visibility_sum_path]
+        visibility_sum_paths.append(visibility_sum_path)
+        if do_valuation:
+            target_path_list.append(valuation_sum_path)
+            valuation_sum_paths.append(valuation_sum_path)
+        else:
+            valuation_sum_path = None
+
+        visibility_path_list = None
+        valuation_path_list = None
+        if save_per_viewpoint_rasters:
+            visibility_path_list = [
+                file_registry['visibility_pattern'].format(id=feature_index)
+                for feature_index in range(batch_start, batch_end)]
+            target_path_list.extend(visibility_path_list)
+            if do_valuation:
+                valuation_path_list = [
+                    file_registry['value_pattern'].format(id=feature_index)
+                    for feature_index in range(batch_start, batch_end)]
+                target_path_list.extend(valuation_path_list)
+
+        viewshed_tasks.append(graph.add_task(
+            _calculate_viewsheds,
+            args=(file_registry['clipped_dem'],
+                  viewpoint_tuples[batch_start:batch_end],
+                  float(args['refraction']),
+                  valuation_args,
+                  visibility_sum_path,
+                  valuation_sum_path,
+                  visibility_path_list,
+                  valuation_path_list,
+                  intermediate_dir),
+            target_path_list=target_path_list,
             dependent_task_list=[clipped_dem_task,
                                  clipped_viewpoints_task],
-            task_name='calculate_visibility_%s' % feature_index)
-        viewshed_tasks.append(viewshed_task)
+            task_name='calculate_viewsheds_%s' % batch_index))
 
-        if do_valuation:
-            # calculate valuation
-            viewshed_valuation_path = file_registry['value_pattern'].format(
-                id=feature_index)
-            valuation_task = graph.add_task(
-                _calculate_valuation,
-                args=(visibility_filepath,
-                      viewpoint,
-                      weight,  # user defined, from WEIGHT field in vector
-                      valuation_method,
-                      valuation_coefficients,  # a, b from args, a dict.
-                      max_valuation_radius,
-                      viewshed_valuation_path),
-                target_path_list=[viewshed_valuation_path],
-                dependent_task_list=[viewshed_task],
-                task_name='calculate_valuation_for_viewshed_%s' % feature_index)
-            valuation_tasks.append(valuation_task)
-            valuation_filepaths.append(viewshed_valuation_path)
-
-        feature_index += 1
-
-    # The weighted visible structures raster is a leaf node
-    weighted_visible_structures_task = graph.add_task(
-        _count_and_weight_visible_structures,
-        args=(viewshed_files,
-              weights,
-              file_registry['clipped_dem'],
-              file_registry['n_visible_structures']),
-        target_path_list=[file_registry['n_visible_structures']],
-        dependent_task_list=sorted(viewshed_tasks),
-        task_name='sum_visibility_for_all_structures')
+    if n_batches == 1:
+        weighted_visible_structures_task = viewshed_tasks[0]
+    else:
+        # The weighted visible structures raster is a leaf node
+        weighted_visible_structures_task = graph.add_task(
+            _sum_rasters,
+            args=(file_registry['clipped_dem'],
+                  visibility_sum_paths,
+                  file_registry['n_visible_structures'],
+                  gdal.GDT_Float32,
+                  VISIBILITY_SUM_NODATA),
+            target_path_list=[file_registry['n_visible_structures']],
+            dependent_task_list=viewshed_tasks,
+            task_name='sum_visibility_for_all_structures')
 
     # If we're not doing valuation, we can still compute visual quality,
     # we'll just use the weighted visible structures raster instead of the
@@ -433,14 +469,19 @@ def execute(args):
         parent_visual_quality_raster_path = (
             file_registry['n_visible_structures'])
     else:
-        parent_visual_quality_task = graph.add_task(
-            _sum_valuation_rasters,
-            args=(file_registry['clipped_dem'],
-                  valuation_filepaths,
-                  file_registry['viewshed_value']),
-            target_path_list=[file_registry['viewshed_value']],
-            dependent_task_list=sorted(valuation_tasks),
-            task_name='add_up_valuation_rasters')
+        if n_batches == 1:
+            parent_visual_quality_task = viewshed_tasks[0]
+        else:
+            parent_visual_quality_task = graph.add_task(
+                _sum_rasters,
+                args=(file_registry['clipped_dem'],
+                      valuation_sum_paths,
+                      file_registry['viewshed_value'],
+                      gdal.GDT_Float64,
+                      _VALUATION_NODATA),
+                target_path_list=[file_registry['viewshed_value']],
+                dependent_task_list=viewshed_tasks,
+                task_name='add_up_valuation_rasters')
         parent_visual_quality_raster_path = file_registry['viewshed_value']
 
     # visual quality is one of the leaf nodes on the task graph.
@@ -511,17 +552,77 @@ def _clip_vector(shape_to_clip_path, binding_shape_path, output_path):
     binding_shape = None
 
 
-def _sum_valuation_rasters(dem_path, valuation_filepaths, target_path):
-    """Sum up all valuation rasters.
+def _calculate_viewsheds(
+        dem_path, viewpoint_tuples, refraction_coeff, valuation_args,
+        visibility_sum_path, valuation_sum_path, visibility_path_list,
+        valuation_path_list, working_dir):
+    """Calculate and sum the viewsheds of a batch of viewpoints.
+
+    Parameters:
+        dem_path (string): The path to the clipped DEM.
+        viewpoint_tuples (list): A list of ``(viewpoint, max_radius, weight,
+            viewpoint_height)`` tuples.
+        refraction_coeff (float): The refraction coefficient.
+        valuation_args (tuple): The ``(valuation_method,
+            valuation_coefficients, max_valuation_radius)`` to value the
+            viewsheds with, as for ``_calculate_valuation``, or ``None`` to
+            skip valuation.
+        visibility_sum_path (string): The path to where the weighted sum of
+            visible structures will be written.
+        valuation_sum_path (string): The path to where the sum of the
+            valuation rasters will be written.  Ignored if
+            ``valuation_args`` is ``None``.
+        visibility_path_list (list): If not ``None``, a path per viewpoint to
+            write its visibility raster to.
+        valuation_path_list (list): If not ``None``, a path per viewpoint to
+            write its valuation raster to.
+        working_dir (string): The directory for temporary files.
+
+    Returns:
+        ``None``
+
+    """
+    valuation_op = None
+    max_valuation_radius = None
+    if valuation_args is not None:
+        valuation_method, valuation_coefficients, max_valuation_radius = (
+            valuation_args)
+        LOGGER.info('Calculating valuation with %s method. Coefficients: %s',
+                    valuation_method,
+                    ' '.join(['%s=%g' % (k, v) for (k, v) in
+                              sorted(valuation_coefficients.items())]))
+        valuation_op = functools.partial(
+            _calculate_valuation, valuation_method=valuation_method,
+            valuation_coefficients=valuation_coefficients,
+            max_valuation_radius=max_valuation_radius)
+
+    viewshed_batch(
+        (dem_path, 1), viewpoint_tuples, visibility_sum_path,
+        curved_earth=True,  # SQ model always assumes this.
+        refraction_coeff=refraction_coeff,
+        valuation_op=valuation_op,
+        target_valuation_sum_path=valuation_sum_path,
+        valuation_nodata=_VALUATION_NODATA,
+        visibility_path_list=visibility_path_list,
+        valuation_path_list=valuation_path_list,
+        max_valuation_distance=max_valuation_radius,
+        working_dir=working_dir)
+
+
+def _sum_rasters(dem_path, raster_path_list, target_path, target_datatype,
+                 target_nodata):
+    """Sum up rasters over the valid pixels of the DEM.
 
     Parameters:
         dem_path (string): A path to the DEM.  Must perfectly overlap all of
-            the rasters in ``valuation_filepaths``.
-        valuation_filepaths (list of strings): A list of paths to individual
-            valuation rasters.  All rasters in this list must overlap
-            perfectly.
+            the rasters in ``raster_path_list``.
+        raster_path_list (list of strings): A list of paths to the rasters to
+            sum.  All rasters in this list must overlap perfectly and have
+            the nodata value ``target_nodata``.
         target_path (string): The path on disk where the output raster will be
             written.  If a file exists at this path, it will be overwritten.
+        target_datatype (int): The GDAL datatype of the output raster.
+        target_nodata (number): The nodata value of the output raster.
 
     Returns:
         ``None``
@@ -529,36 +630,32 @@ def _sum_valuation_rasters(dem_path, valuation_filepaths, target_path):
     """
     dem_nodata = pygeoprocessing.get_raster_info(dem_path)['nodata'][0]
 
-    def _sum_rasters(dem, *valuation_rasters):
+    def _sum_op(dem, *arrays):
         valid_dem_pixels = (dem != dem_nodata)
         raster_sum = numpy.empty(dem.shape, dtype=numpy.float64)
-        raster_sum[:] = _VALUATION_NODATA
+        raster_sum[:] = target_nodata
         raster_sum[valid_dem_pixels] = 0
 
-        for valuation_matrix in valuation_rasters:
-            valid_pixels = ((valuation_matrix != _VALUATION_NODATA) &
-                            valid_dem_pixels)
-            raster_sum[valid_pixels] += valuation_matrix[valid_pixels]
+        for array in arrays:
+            valid_pixels = ((array != target_nodata) & valid_dem_pixels)
+            raster_sum[valid_pixels] += array[valid_pixels]
         return raster_sum
 
     pygeoprocessing.raster_calculator(
-        [(dem_path, 1)] + [(path, 1) for path in valuation_filepaths],
-        _sum_rasters, target_path, gdal.GDT_Float64, _VALUATION_NODATA,
+        [(dem_path, 1)] + [(path, 1) for path in raster_path_list],
+        _sum_op, target_path, target_datatype, target_nodata,
         raster_driver_creation_tuple=FLOAT_GTIFF_CREATION_OPTIONS)
 
 
-def _calculate_valuation(visibility_path, viewpoint, weight,
-                         valuation_method, valuation_coefficients,
-                         max_valuation_radius,
-                         valuation_raster_path):
+def _calculate_valuation(distance, visibility, weight, valuation_method,
+                         valuation_coefficients, max_valuation_radius):
     """Calculate valuation with one of the defined methods.
 
     Parameters:
-        visibility_path (string): The path to a visibility raster for a single
-            point.  The visibility raster has pixel values of 0, 1, or nodata.
-            This raster must be projected in meters.
-        viewpoint (tuple): The viewpoint in projected coordinates (x, y) of the
-            visibility raster.
+        distance (numpy.ndarray): The distance in meters of each pixel from
+            the viewpoint.
+        visibility (numpy.ndarray): The visibility of each pixel, 0, 1 or
+            nodata.
         weight (number): The numeric weight of the visibility.
         valuation_method (string): The valuation method to use, one of
             ('linear', 'logarithmic', 'exponential').
@@ -567,121 +664,39 @@ def _calculate_valuation(visibility_path, viewpoint, weight,
             required.
         max_valuation_radius (number): Past this distance (in meters),
             valuation values will be set to 0.
-        valuation_raster_path (string): The path to where the valuation raster
-            will be saved.
 
     Returns:
-        ``None``
+        A float64 array of the value of each pixel, with
+        ``_VALUATION_NODATA`` where visibility is nodata.
 
     """
     valuation_method = valuation_method.lower()
-    LOGGER.info('Calculating valuation with %s method. Coefficients: %s',
-                valuation_method,
-                ' '.join(['%s=%g' % (k, v) for (k, v) in
-                          sorted(valuation_coefficients.items())]))
 
     # All valuation functions use coefficients a, b
     a = valuation_coefficients['a']
     b = valuation_coefficients['b']
 
-    if valuation_method == 'linear':
-
-        def _valuation(distance, visibility):
-            valid_pixels = (visibility == 1)
-            valuation = numpy.empty(distance.shape, dtype=numpy.float64)
-            valuation[:] = _VALUATION_NODATA
-            valuation[(visibility == 0) | valid_pixels] = 0
-
-            x = distance[valid_pixels]
-            valuation[valid_pixels] = (
-                (a+b*x)*(weight*visibility[valid_pixels]))
-            return valuation
+    valuation = numpy.empty(distance.shape, dtype=numpy.float64)
+    valuation[:] = _VALUATION_NODATA
+    valid_pixels = (visibility != _BYTE_NODATA)
+    valuation[valid_pixels] = 0
 
+    visible_pixels = (
+        (visibility == 1) & (distance <= max_valuation_radius))
+    x = distance[visible_pixels]
+    if valuation_method == 'linear':
+        valuation[visible_pixels] = (
+            (a+b*x)*(weight*visibility[visible_pixels]))
     elif valuation_method == 'logarithmic':
-
-        def _valuation(distance, visibility):
-            valid_pixels = (visibility == 1)
-            valuation = numpy.empty(distance.shape, dtype=numpy.float64)
-            valuation[:] = _VALUATION_NODATA
-            valuation[(visibility == 0) | valid_pixels] = 0
-
-            # Per Rob, this is the natural log.
-            # Also per Rob (and Rich), we'll use log(x+1) because log of values
-            # where 0 < x < 1 yields strange results indeed.
-            valuation[valid_pixels] = (
-                (a+b*numpy.log(distance[valid_pixels] + 1))*(
-                    weight*visibility[valid_pixels]))
-            return valuation
-
+        # Per Rob, this is the natural log.
+        # Also per Rob (and Rich), we'll use log(x+1) because log of values
+        # where 0 < x < 1 yields strange results indeed.
+        valuation[visible_pixels] = (
+            (a+b*numpy.log(x + 1))*(weight*visibility[visible_pixels]))
     elif valuation_method == 'exponential':
-
-        def _valuation(distance, visibility):
-            valid_pixels = (visibility == 1)
-            valuation = numpy.empty(distance.shape, dtype=numpy.float64)
-            valuation[:] = _VALUATION_NODATA
-            valuation[(visibility == 0) | valid_pixels] = 0
-
-            valuation[valid_pixels] = (
-                (a*numpy.exp(-b*distance[valid_pixels])) * (
-                    weight*visibility[valid_pixels]))
-            return valuation
-
-    pygeoprocessing.new_raster_from_base(
-        visibility_path, valuation_raster_path, gdal.GDT_Float64,
-        [_VALUATION_NODATA])
-
-    vis_raster_info = pygeoprocessing.get_raster_info(visibility_path)
-    vis_gt = vis_raster_info['geotransform']
-    iy_viewpoint = int((viewpoint[1] - vis_gt[3]) / vis_gt[5])
-    ix_viewpoint = int((viewpoint[0] - vis_gt[0]) / vis_gt[1])
-
-    # convert the distance transform to meters
-    spatial_reference = osr.SpatialReference()
-    spatial_reference.ImportFromWkt(vis_raster_info['projection'])
-    linear_units = spatial_reference.GetLinearUnits()
-    pixel_size_in_m = utils.mean_pixel_size_and_area(
-        vis_raster_info['pixel_size'])[0] * linear_units
-
-    valuation_raster = gdal.OpenEx(valuation_raster_path,
-                                   gdal.OF_RASTER | gdal.GA_Update)
-    valuation_band = valuation_raster.GetRasterBand(1)
-    vis_nodata = vis_raster_info['nodata'][0]
-
-    for block_info, vis_block in pygeoprocessing.iterblocks(
-            (visibility_path, 1)):
-        visibility_value = numpy.empty(vis_block.shape, dtype=numpy.float64)
-        visibility_value[:] = _VALUATION_NODATA
-
-        x_coord = numpy.linspace(
-            block_info['xoff'],
-            block_info['xoff'] + block_info['win_xsize'] - 1,
-            block_info['win_xsize'])
-        y_coord = numpy.linspace(
-            block_info['yoff'],
-            block_info['yoff'] + block_info['win_ysize'] - 1,
-            block_info['win_ysize'])
-        ix_matrix, iy_matrix = numpy.meshgrid(x_coord, y_coord)
-        dist_in_m = numpy.hypot(numpy.absolute(ix_matrix - ix_viewpoint),
-                                numpy.absolute(iy_matrix - iy_viewpoint),
-                                dtype=numpy.float64) * pixel_size_in_m
-
-        valid_distances = (dist_in_m <= max_valuation_radius)
-        nodata = (vis_block == vis_nodata)
-        valid_indexes = (valid_distances & (~nodata))
-
-        visibility_value[valid_indexes] = _valuation(dist_in_m[valid_indexes],
-                                                     vis_block[valid_indexes])
-        visibility_value[~valid_distances & ~nodata] = 0
-
-        valuation_band.WriteArray(visibility_value,
-                                  xoff=block_info['xoff'],
-                                  yoff=block_info['yoff'])
-
-    # the 0 means approximate stats are not okay
-    valuation_band.ComputeStatistics(0)
-    valuation_band = None
-    valuation_raster.FlushCache()
-    valuation_raster = None
+        valuation[visible_pixels] = (
+            (a*numpy.exp(-b*x))*(weight*visibility[visible_pixels]))
+    return valuation
 
 
 def _viewpoint_within_raster(viewpoint, dem_path):
@@ -810,70 +825,6 @@ def _clip_and_mask_dem(dem_path, aoi_path, target_path, working_dir):
     shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def _count_and_weight_visible_structures(visibility_raster_path_list, weights,
-                                         clipped_dem_path, target_path):
-    """Count (and weight) the number of visible structures for each pixel.
-
-    Parameters:
-        visibility_raster_path_list (list of strings): A list of strings to
-            perfectly overlapping visibility rasters.
-        weights (list of numbers): A list of numeric weights to apply to each
-            visibility raster.  There must be the same number of weights in
-            this list as there are elements in visibility_rasters.
-        clipped_dem_path (string): String path to the DEM.
-        target_path (string): The path to where the output raster is stored.
-
-    Returns:
-        ``None``
-
-    """
-    LOGGER.info('Summing and weighting %d visibility rasters',
-                len(visibility_raster_path_list))
-    target_nodata = -1
-    dem_raster_info = pygeoprocessing.get_raster_info(clipped_dem_path)
-    dem_nodata = dem_raster_info['nodata'][0]
-
-    def _sum_and_weight(*args):
-        """Sum and weight the input matrices, masking the output to the DEM.
-
-        Parameters:
-            args (list): A list of 2n+1 items, where n is the number of
-                visibility rasters to sum and weight.  Item 0 in this list must
-                be the DEM array.  Items 1 through n of this list must be the
-                visibility arrays.  Items n+1 through 2n of this list must be
-                the weights that correspond with the visibility arrays, in
-                corresponding order.
-
-        Returns:
-            A 2D numpy array for the weighted sum of the visibility rasters.
-
-        """
-        dem = args[0]
-        n_visibility_arrays = (len(args) - 1) // 2
-        visibility_rasters = args[1: n_visibility_arrays + 1]
-        weights = args[n_visibility_arrays + 1:]
-
-        valid_mask = (dem != dem_nodata)
-
-        visibility_sum = numpy.empty(dem.shape, dtype=numpy.float32)
-        visibility_sum[:] = target_nodata
-        visibility_sum[valid_mask] = 0
-
-        # Weight and sum the outputs.
-        for visibility_matrix, weight in zip(visibility_rasters, weights):
-            visible_mask = (valid_mask & (visibility_matrix == 1))
-            visibility_sum[visible_mask] += (visibility_matrix[visible_mask] *
-                                             weight)
-        return visibility_sum
-
-    pygeoprocessing.raster_calculator(
-        ([(clipped_dem_path, 1)] +
-         [(vis_path, 1) for vis_path in visibility_raster_path_list] +
-         [(weight, 'raw') for weight in weights]),
-        _sum_and_weight, target_path, gdal.GDT_Float32, target_nodata,
-        raster_driver_creation_tuple=FLOAT_GTIFF_CREATION_OPTIONS)
-
-
 def _calculate_visual_quality(source_raster_path, working_dir, target_path):
     """Calculate visual quality based on a raster.
 
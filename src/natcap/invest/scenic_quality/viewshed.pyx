@@ -32,12 +32,9 @@ from osgeo import gdal
 from osgeo import osr
 import shapely.geometry
 from .. import utils
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
-from cython.operator cimport dereference as deref
-from cython.operator cimport preincrement as inc
+from .. import managed_raster
 from libc.time cimport time_t
 from libc.time cimport time as ctime
-from libcpp.list cimport list as clist
 from libcpp.set cimport set as cset
 from libcpp.deque cimport deque
 from libcpp.pair cimport pair
@@ -45,6 +42,7 @@ from libcpp.queue cimport queue
 from libc cimport math
 cimport numpy
 cimport cython
+from natcap.invest.managed_raster cimport _ManagedRaster
 
 
 LOGGER = logging.getLogger(__name__)
@@ -161,20 +159,6 @@ cdef inline long lmin(long a, long b):
     return b
 
 
-# this is a least recently used cache written in C++ in an external file,
-# exposing here so _ManagedRaster can use it.
-# Copied from src/pygeoprocessing/routing/routing.pyx,
-# revision 891288683889237cfd3a3d0a1f09483c23489fca.
-cdef extern from "LRUCache.h":
-    cdef cppclass LRUCache[KEY_T, VAL_T]:
-        LRUCache(int)
-        void put(KEY_T&, VAL_T&, clist[pair[KEY_T,VAL_T]]&)
-        clist[pair[KEY_T,VAL_T]].iterator begin()
-        clist[pair[KEY_T,VAL_T]].iterator end()
-        bint exist(KEY_T &)
-        VAL_T get(KEY_T &)
-
-
 # exposing stl::priority_queue so we can have all 3 template arguments so
 # we can pass a different Compare functor
 cdef extern from "<queue>" namespace "std":
@@ -233,371 +217,30 @@ cdef int MANAGED_RASTER_N_BLOCKS = 2**6
 # The nodata value for visibility rasters
 cdef int VISIBILITY_NODATA = 255
 
-# this ctype is used to store the block ID and the block buffer as one object
-# inside Managed Raster
-ctypedef pair[int, double*] BlockBufferPair
-
-# a class to allow fast random per-pixel access to a raster for both setting
-# and reading pixels.  Copied from src/pygeoprocessing/routing/routing.pyx,
-# revision 891288683889237cfd3a3d0a1f09483c23489fca.
-cdef class _ManagedRaster:
-    cdef LRUCache[int, double*]* lru_cache
-    cdef cset[int] dirty_blocks
-    cdef int block_xsize
-    cdef int block_ysize
-    cdef int block_xmod
-    cdef int block_ymod
-    cdef int block_xbits
-    cdef int block_ybits
-    cdef long raster_x_size
-    cdef long raster_y_size
-    cdef int block_nx
-    cdef int block_ny
-    cdef int write_mode
-    cdef bytes raster_path
-    cdef int band_id
-    cdef int closed
-
-    def __cinit__(self, raster_path, band_id, write_mode):
-        """Create new instance of Managed Raster.
-
-        Parameters:
-            raster_path (char*): path to raster that has block sizes that are
-                powers of 2. If not, an exception is raised.
-            band_id (int): which band in `raster_path` to index. Uses GDAL
-                notation that starts at 1.
-            write_mode (boolean): if true, this raster is writable and dirty
-                memory blocks will be written back to the raster as blocks
-                are swapped out of the cache or when the object deconstructs.
-
-        Returns:
-            None.
-        """
-        raster_info = pygeoprocessing.get_raster_info(raster_path)
-        self.raster_x_size, self.raster_y_size = raster_info['raster_size']
-        self.block_xsize, self.block_ysize = raster_info['block_size']
-        self.block_xmod = self.block_xsize-1
-        self.block_ymod = self.block_ysize-1
-
-        if not (1 <= band_id <= raster_info['n_bands']):
-            err_msg = (
-                "Error: band ID (%s) is not a valid band number. "
-                "This exception is happening in Cython, so it will cause a "
-                "hard seg-fault, but it's otherwise meant to be a "
-                "ValueError." % (band_id))
-            print(err_msg)
-            raise ValueError(err_msg)
-        self.band_id = band_id
-
-        if (self.block_xsize & (self.block_xsize - 1) != 0) or (
-                self.block_ysize & (self.block_ysize - 1) != 0):
-            # If inputs are not a power of two, this will at least print
-            # an error message. Unfortunately with Cython, the exception will
-            # present itself as a hard seg-fault, but I'm leaving the
-            # ValueError in here at least for readability.
-            err_msg = (
-                "Error: Block size is not a power of two: "
-                "block_xsize: %d, %d, %s. This exception is happening"
-                "in Cython, so it will cause a hard seg-fault, but it's"
-                "otherwise meant to be a ValueError." % (
-                    self.block_xsize, self.block_ysize, raster_path))
-            print(err_msg)
-            raise ValueError(err_msg)
-
-        self.block_xbits = numpy.log2(self.block_xsize)
-        self.block_ybits = numpy.log2(self.block_ysize)
-        self.block_nx = (
-            self.raster_x_size + (self.block_xsize) - 1) / self.block_xsize
-        self.block_ny = (
-            self.raster_y_size + (self.block_ysize) - 1) / self.block_ysize
-
-        self.lru_cache = new LRUCache[int, double*](MANAGED_RASTER_N_BLOCKS)
-        self.raster_path = <bytes> raster_path
-        self.write_mode = write_mode
-        self.closed = 0
-
-    def __dealloc__(self):
-        """Deallocate _ManagedRaster.
-
-        This operation manually frees memory from the LRUCache and writes any
-        dirty memory blocks back to the raster if `self.write_mode` is True.
-        """
-        self.close()
-
-    def close(self):
-        """Close the _ManagedRaster and free up resources.
-
-            This call writes any dirty blocks to disk, frees up the memory
-            allocated as part of the cache, and frees all GDAL references.
-
-            Any subsequent calls to any other functions in _ManagedRaster will
-            have undefined behavior.
-        """
-        if self.closed:
-            return
-        self.closed = 1
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize))
-        cdef double *double_buffer
-        cdef int block_xi
-        cdef int block_yi
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize
-        cdef int win_ysize
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff
-        cdef int yoff
-
-        cdef clist[BlockBufferPair].iterator it = self.lru_cache.begin()
-        cdef clist[BlockBufferPair].iterator end = self.lru_cache.end()
-        if not self.write_mode:
-            while it != end:
-                # write the changed value back if desired
-                PyMem_Free(deref(it).second)
-                inc(it)
-            return
-
-        raster = gdal.OpenEx(
-            self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-
-        # if we get here, we're in write_mode
-        cdef cset[int].iterator dirty_itr
-        while it != end:
-            double_buffer = deref(it).second
-            block_index = deref(it).first
-
-            # write to disk if block is dirty
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr != self.dirty_blocks.end():
-                self.dirty_blocks.erase(dirty_itr)
-                block_xi = block_index % self.block_nx
-                block_yi = block_index / self.block_nx
-
-                # we need the offsets to subtract from global indexes for
-                # cached array
-                xoff = block_xi << self.block_xbits
-                yoff = block_yi << self.block_ybits
-
-                win_xsize = self.block_xsize
-                win_ysize = self.block_ysize
-
-                # clip window sizes if necessary
-                if xoff+win_xsize > self.raster_x_size:
-                    win_xsize = win_xsize - (
-                        xoff+win_xsize - self.raster_x_size)
-                if yoff+win_ysize > self.raster_y_size:
-                    win_ysize = win_ysize - (
-                        yoff+win_ysize - self.raster_y_size)
-
-                for xi_copy in xrange(win_xsize):
-                    for yi_copy in xrange(win_ysize):
-                        block_array[yi_copy, xi_copy] = (
-                            double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy])
-                raster_band.WriteArray(
-                    block_array[0:win_ysize, 0:win_xsize],
-                    xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            inc(it)
-        raster_band.FlushCache()
-        raster_band = None
-        raster = None
-
-    cdef inline void set(self, long xi, long yi, double value):
-        """Set the pixel at `xi,yi` to `value`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))] = value
-        if self.write_mode:
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr == self.dirty_blocks.end():
-                self.dirty_blocks.insert(block_index)
-
-    cdef inline double get(self, long xi, long yi):
-        """Return the value of the pixel at `xi,yi`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        return self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))]
-
-    cdef void _load_block(self, int block_index) except *:
-        cdef int block_xi = block_index % self.block_nx
-        cdef int block_yi = block_index / self.block_nx
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff = block_xi << self.block_xbits
-        cdef int yoff = block_yi << self.block_ybits
-
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array
-        cdef double *double_buffer
-        cdef clist[BlockBufferPair] removed_value_list
-
-        # determine the block aligned xoffset for read as array
-
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize = self.block_xsize
-        cdef int win_ysize = self.block_ysize
-
-        # load a new block
-        if xoff+win_xsize > self.raster_x_size:
-            win_xsize = win_xsize - (xoff+win_xsize - self.raster_x_size)
-        if yoff+win_ysize > self.raster_y_size:
-            win_ysize = win_ysize - (yoff+win_ysize - self.raster_y_size)
-
-        raster = gdal.OpenEx(self.raster_path, gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-        block_array = raster_band.ReadAsArray(
-            xoff=xoff, yoff=yoff, win_xsize=win_xsize,
-            win_ysize=win_ysize).astype(
-            numpy.float64)
-        raster_band = None
-        raster = None
-        double_buffer = <double*>PyMem_Malloc(
-            (sizeof(double) << self.block_xbits) * win_ysize)
-        for xi_copy in xrange(win_xsize):
-            for yi_copy in xrange(win_ysize):
-                double_buffer[(yi_copy<<self.block_xbits)+xi_copy] = (
-                    block_array[yi_copy, xi_copy])
-        self.lru_cache.put(
-            <int>block_index, <double*>double_buffer, removed_value_list)
-
-        if self.write_mode:
-            raster = gdal.OpenEx(
-                self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-            raster_band = raster.GetRasterBand(self.band_id)
-
-        block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize), dtype=numpy.double)
-        while not removed_value_list.empty():
-            # write the changed value back if desired
-            double_buffer = removed_value_list.front().second
-
-            if self.write_mode:
-                block_index = removed_value_list.front().first
-
-                # write back the block if it's dirty
-                dirty_itr = self.dirty_blocks.find(block_index)
-                if dirty_itr != self.dirty_blocks.end():
-                    self.dirty_blocks.erase(dirty_itr)
-
-                    block_xi = block_index % self.block_nx
-                    block_yi = block_index / self.block_nx
-
-                    xoff = block_xi << self.block_xbits
-                    yoff = block_yi << self.block_ybits
-
-                    win_xsize = self.block_xsize
-                    win_ysize = self.block_ysize
-
-                    if xoff+win_xsize > self.raster_x_size:
-                        win_xsize = win_xsize - (
-                            xoff+win_xsize - self.raster_x_size)
-                    if yoff+win_ysize > self.raster_y_size:
-                        win_ysize = win_ysize - (
-                            yoff+win_ysize - self.raster_y_size)
-
-                    for xi_copy in xrange(win_xsize):
-                        for yi_copy in xrange(win_ysize):
-                            block_array[yi_copy, xi_copy] = double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy]
-                    raster_band.WriteArray(
-                        block_array[0:win_ysize, 0:win_xsize],
-                        xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            removed_value_list.pop_front()
-
-        if self.write_mode:
-            raster_band = None
-            raster = None
+# The nodata value for the visibility sum rasters of viewshed_batch
+VISIBILITY_SUM_NODATA = -1
 
+# Rows of a viewshed's window that are added to the running sums at once
+cdef long FOLD_STRIP_ROWS = 2**8
 
-@cython.binding(True)
-@cython.boundscheck(False)
-@cython.cdivision(True)
-@cython.wraparound(False)
-def viewshed(dem_raster_path_band,
-             viewpoint,
-             visibility_filepath,
-             viewpoint_height=0.0,
-             curved_earth=True,
-             refraction_coeff=0.13,
-             max_distance=None,
-             aux_filepath=None):
-    """Compute the Wang et al. reference-plane based viewshed.
+
+def _viewpoint_index(viewpoint, dem_raster_path_band, dem_raster_info):
+    """Find the DEM pixel of a viewpoint.
 
     Parameters:
-        dem_raster_path_band (tuple): A tuple of (path, band_index) where
-            ``path`` is a path to a GDAL-compatible raster on disk and
-            ``band_index`` is the 1-based band index.  This DEM must be tiled
-            with block sizes as a power of 2.  If the viewshed is being
-            adjusted for curvature of the earth and/or refraction, the
-            elevation units of the DEM must be in meters.  The DEM need not be
-            projected in meters.
-        viewpoint (tuple):  A tuple of 2 numbers in the order
-            ``(east offset, north offset)``.  These units must be of the same
-            units as the coordinate system of the DEM.  This index represents
-            the viewpoint location.  The closest pixel to this viewpoint index
-            will be used as the viewpoint.
-        visibility_filepath (string): A filepath on disk to where the
-            visibility raster will be written. If a raster exists in this
-            location, it will be overwritten.
-        viewpoint_height=0.0 (float):  The height (in the units of the DEM
-            height) of the observer at the viewpoint.
-        curved_earth=True (bool): Whether to adjust viewshed calculations for
-            the curvature of the earth.  If False, the earth will be treated as
-            though it is flat.
-        refraction_coeff=0.13 (float):  The coefficient of atmospheric
-            refraction that may be adjusted to accommodate varying atmospheric
-            conditions.  Default is ``0.13``.  Set to ``0`` to ignore
-            refraction calculations.
-        max_distance=None (float):  If provided, visibility will not be
-            calculated for DEM pixels that are more than this distance (in meters)
-            from the viewpoint.
-        aux_filepath=None (string): A path to a location on disk
-            where the raster containing the auxiliary matrix will be written.
-            The auxiliary matrix defines the height that a DEM must exceed in
-            order to be visible from the viewpoint.  This matrix is very useful
-            for debugging.  If a raster already exists at this location, it
-            will be overwritten.  If this path is not provided by the user, the
-            viewshed will create this file as a temporary file wherever the
-            system keeps its temp files and remove it when the viewshed
-            finishes.  See python's ``tempfile`` documentation for where this
-            might be on your system.
+        viewpoint (tuple): the ``(east offset, north offset)`` of the
+            viewpoint in the DEM's coordinate system.
+        dem_raster_path_band (tuple): the (path, band_index) of the DEM.
+        dem_raster_info (dict): ``pygeoprocessing.get_raster_info`` of the
+            DEM.
 
     Raises:
-        ValueError: When either the viewpoint does not overlap with the DEM or
-            the DEM is not tiled appropriately.
-
-        LookupError: When the ``viewpoint`` coordinate pair is over nodata.
-
-        AssertionError: When pixel dimensions are not square.
+        ValueError: When the viewpoint does not overlap with the DEM.
+        LookupError: When the viewpoint is over nodata.
 
     Returns:
-        ``None``
+        A tuple of the (column, row) index of the viewpoint.
     """
-    start_time = time.time()
-
-    # Check the bounding box to make sure that the viewpoint overlaps the DEM.
-    dem_raster_info = pygeoprocessing.get_raster_info(dem_raster_path_band[0])
     dem_gt = dem_raster_info['geotransform']
     bbox_minx, bbox_miny, bbox_maxx, bbox_maxy = dem_raster_info['bounding_box']
     if (not bbox_minx <= viewpoint[0] <= bbox_maxx or
@@ -605,8 +248,8 @@ def viewshed(dem_raster_path_band,
         raise ValueError(('Viewpoint (%s, %s) does not overlap with DEM with '
                           'bounding box %s') % (viewpoint[0], viewpoint[1],
                                                 dem_raster_info['bounding_box']))
-    cdef long iy_viewpoint = int((viewpoint[1] - dem_gt[3]) / dem_gt[5])
-    cdef long ix_viewpoint = int((viewpoint[0] - dem_gt[0]) / dem_gt[1])
+    iy_viewpoint = int((viewpoint[1] - dem_gt[3]) / dem_gt[5])
+    ix_viewpoint = int((viewpoint[0] - dem_gt[0]) / dem_gt[1])
 
     # Get the elevation of the pixel under the viewpoint and check to see if
     # it's nodata.
@@ -620,12 +263,30 @@ def viewshed(dem_raster_path_band,
     nodata_value = dem_raster_info['nodata'][band_to_array_index]
     if viewpoint_elevation == nodata_value:
         raise LookupError('Viewpoint is over nodata')
+    return ix_viewpoint, iy_viewpoint
+
+
+def _dem_nodata(dem_raster_path_band, dem_raster_info):
+    """Get the DEM nodata value, or an improbable value if it's undefined."""
+    band_to_array_index = dem_raster_path_band[1] - 1
+    nodata_value = dem_raster_info['nodata'][band_to_array_index]
 
     # Need to handle the case where the nodata value is not defined.
     if nodata_value is None:
         nodata_value = IMPROBABLE_NODATA
-    cdef double nodata = nodata_value
+    return nodata_value
+
+
+def _check_dem_pixels_and_blocks(dem_raster_info):
+    """Verify that the DEM has square pixels and square power of 2 blocks.
 
+    Raises:
+        AssertionError: When pixel dimensions are not square.
+        ValueError: When the DEM is not tiled appropriately.
+
+    Returns:
+        ``None``
+    """
     # Verify that pixels are very close to square.  The Wang et al algorithm
     # doesn't require that this be the case, but the math is simplified if it
     # is.
@@ -647,47 +308,33 @@ def viewshed(dem_raster_path_band,
             'power of 2.  Current block size is (%s, %s)' %
             (block_xsize, block_ysize))
 
-    # Create the auxiliary raster for storing the calculated minimum height
-    # for visibility at a given point.
-    temp_dir = None
-    if aux_filepath is None:
-        temp_dir = tempfile.mkdtemp(
-            prefix='viewshed_%s' % time.strftime(
-                '%Y-%m-%d_%H_%M_%S', time.gmtime()))
-        aux_filepath = os.path.join(temp_dir, 'auxiliary.tif')
 
-    LOGGER.info("Creating auxiliary raster %s", aux_filepath)
-    pygeoprocessing.new_raster_from_base(
-        dem_raster_path_band[0], aux_filepath, gdal.GDT_Float64, [AUX_NOT_VISITED],
-        fill_value_list=[AUX_NOT_VISITED],
-        raster_driver_creation_tuple=FLOAT_GTIFF_CREATION_OPTIONS)
-
-    # Create the visibility raster for indicating whether a pixel is visible
-    # based on the calculated minimum height.
-    LOGGER.info('Creating visibility raster %s', visibility_filepath)
-    pygeoprocessing.new_raster_from_base(
-        dem_raster_path_band[0], visibility_filepath, gdal.GDT_Byte,
-        [VISIBILITY_NODATA], fill_value_list=[VISIBILITY_NODATA],
-        raster_driver_creation_tuple=BYTE_GTIFF_CREATION_OPTIONS)
-
-    # LRU-cached rasters for easier access to individual pixels.
-    cdef _ManagedRaster dem_managed_raster = (
-            _ManagedRaster(dem_raster_path_band[0], dem_raster_path_band[1], 0))
-    cdef _ManagedRaster aux_managed_raster = (
-            _ManagedRaster(aux_filepath, 1, 1))
-    cdef _ManagedRaster visibility_managed_raster = (
-            _ManagedRaster(visibility_filepath, 1, 1))
-
-    # get the pixel size in terms of meters.
+def _pixel_size_in_meters(dem_raster_info):
+    """Get the mean pixel size of the DEM in meters."""
     dem_srs = osr.SpatialReference()
     dem_srs.ImportFromWkt(dem_raster_info['projection'])
     linear_units = dem_srs.GetLinearUnits()
-    cdef double pixel_size = utils.mean_pixel_size_and_area(
+    return utils.mean_pixel_size_and_area(
         dem_raster_info['pixel_size'])[0]*linear_units
-    cdef long raster_x_size = dem_raster_info['raster_size'][0]
-    cdef long raster_y_size = dem_raster_info['raster_size'][1]
-    cdef double max_visible_radius
-    cdef long pixels_in_raster
+
+
+def _max_visible_radius(viewpoint, max_distance, dem_raster_info, pixel_size):
+    """Get the visible radius and approximate pixel count of a viewshed.
+
+    Parameters:
+        viewpoint (tuple): the ``(east offset, north offset)`` of the
+            viewpoint.
+        max_distance (float): the maximum visible distance in meters, or
+            ``None`` for no limit.
+        dem_raster_info (dict): ``pygeoprocessing.get_raster_info`` of the
+            DEM.
+        pixel_size (float): the DEM pixel size in meters.
+
+    Returns:
+        A tuple of the maximum visible radius in meters and the approximate
+        number of DEM pixels within it, used for logging progress.
+    """
+    raster_x_size, raster_y_size = dem_raster_info['raster_size']
     if max_distance is not None:
         # This is an estimate of the number of pixels in the raster when
         # viewshed is given a max_distance radius.  The estimate is based on
@@ -707,15 +354,42 @@ def viewshed(dem_raster_path_band,
         # between two adjoining edges of the bounding box.
         max_visible_radius = math.hypot(raster_x_size, raster_y_size)*pixel_size
         pixels_in_raster = raster_x_size * raster_y_size
+    return max_visible_radius, pixels_in_raster
 
+
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+cdef int _compute_viewshed(
+        _ManagedRaster dem_managed_raster,
+        _ManagedRaster aux_managed_raster,
+        _ManagedRaster visibility_managed_raster,
+        long ix_viewpoint, long iy_viewpoint, double viewpoint_height,
+        int curved_earth, double refraction_coeff,
+        double max_visible_radius, long pixels_in_raster, double nodata,
+        double pixel_size, long raster_x_size, long raster_y_size,
+        int block_x_size, int block_y_size, long window_xoff,
+        long window_yoff) except -1:
+    """Sweep the viewshed of one viewpoint into the managed rasters.
+
+    This is the Wang et al. algorithm shared by ``viewshed`` and
+    ``viewshed_batch``.  Only pixels within ``max_visible_radius`` (plus the
+    viewpoint's immediate neighbors) of the viewpoint are touched, and every
+    pixel touched is set in both ``aux_managed_raster`` and
+    ``visibility_managed_raster``.  These two rasters may cover just a
+    window of the DEM that holds every pixel touched, where DEM pixel
+    ``(x, y)`` is at ``(x - window_xoff, y - window_yoff)``.
+
+    Returns:
+        0 on success.
+    """
     cdef long m, n, xi, yi
+    cdef long m_window, n_window
     cdef int correct_for_curvature = curved_earth
     cdef int correct_for_refraction = math.fabs(math.ceil(refraction_coeff) - 1.0) < 0.5e-7
     cdef double target_height_adjustment = 0  # initializing for compiler
     cdef double adjustment = 0.0
     cdef float refract_coeff = refraction_coeff  # from the user
-    cdef int block_x_size = dem_raster_info['block_size'][0]
-    cdef int block_y_size = dem_raster_info['block_size'][1]
     cdef int block_bits = numpy.log2(block_x_size)  # for bit-shifting
     cdef long ix_viewpoint_block = ix_viewpoint >> block_x_size
     cdef long iy_viewpoint_block = iy_viewpoint >> block_y_size
@@ -727,9 +401,6 @@ def viewshed(dem_raster_path_band,
     # blocks immediately adjacent to the viewpoint's block.
     cdef int ring_id
 
-    LOGGER.info("Starting viewshed for viewpoint %s on DEM %s",
-                viewpoint, dem_raster_path_band[0])
-
     # As defined by Wang et al, the viewpoint and the immediate neighbors are
     # all assumed to be visible.
     for yi in xrange(iy_viewpoint-1, iy_viewpoint+2):
@@ -743,8 +414,8 @@ def viewshed(dem_raster_path_band,
                 continue
 
             aux_managed_raster.set(
-                xi, yi, dem_managed_raster.get(xi, yi))
-            visibility_managed_raster.set(xi, yi, 1)
+                xi-window_xoff, yi-window_yoff, dem_managed_raster.get(xi, yi))
+            visibility_managed_raster.set(xi-window_xoff, yi-window_yoff, 1)
             pixels_touched += 1
 
     # Save the viewpoint index for later.  These are the variable names used in
@@ -788,8 +459,8 @@ def viewshed(dem_raster_path_band,
 
             ix_prev_target = ix_viewpoint+ix_cardinal_target*(multiplier-1)
             iy_prev_target = iy_viewpoint+iy_cardinal_target*(multiplier-1)
-            previous_height = aux_managed_raster.get(ix_prev_target,
-                                                     iy_prev_target)
+            previous_height = aux_managed_raster.get(
+                ix_prev_target-window_xoff, iy_prev_target-window_yoff)
 
             if lmax(ix_cardinal_target, iy_cardinal_target) == 0:
                 slope_distance = labs(
@@ -834,11 +505,16 @@ def viewshed(dem_raster_path_band,
             if (adjusted_dem_height >= z and
                     target_distance < max_visible_radius and
                     target_dem_height != nodata):
-                visibility_managed_raster.set(ix_target, iy_target, 1)
-                aux_managed_raster.set(ix_target, iy_target, adjusted_dem_height)
+                visibility_managed_raster.set(
+                    ix_target-window_xoff, iy_target-window_yoff, 1)
+                aux_managed_raster.set(
+                    ix_target-window_xoff, iy_target-window_yoff,
+                    adjusted_dem_height)
             else:
-                visibility_managed_raster.set(ix_target, iy_target, 0)
-                aux_managed_raster.set(ix_target, iy_target, z)
+                visibility_managed_raster.set(
+                    ix_target-window_xoff, iy_target-window_yoff, 0)
+                aux_managed_raster.set(
+                    ix_target-window_xoff, iy_target-window_yoff, z)
 
             multiplier += 1
             pixels_touched += 1
@@ -901,12 +577,14 @@ def viewshed(dem_raster_path_band,
         # We have a target, determine visibility
         m = target_pixel.iy  # y index (row)
         n = target_pixel.ix   # x index (col)
+        m_window = m - window_yoff
+        n_window = n - window_xoff
         r_n1 = aux_managed_raster.get(
-            n + SECTOR_TO_NEIGHBOR_1_INDEX[2*target_pixel.sector+1],
-            m + SECTOR_TO_NEIGHBOR_1_INDEX[2*target_pixel.sector])
+            n_window + SECTOR_TO_NEIGHBOR_1_INDEX[2*target_pixel.sector+1],
+            m_window + SECTOR_TO_NEIGHBOR_1_INDEX[2*target_pixel.sector])
         r_n2 = aux_managed_raster.get(
-            n + SECTOR_TO_NEIGHBOR_2_INDEX[2*target_pixel.sector+1],
-            m + SECTOR_TO_NEIGHBOR_2_INDEX[2*target_pixel.sector])
+            n_window + SECTOR_TO_NEIGHBOR_2_INDEX[2*target_pixel.sector+1],
+            m_window + SECTOR_TO_NEIGHBOR_2_INDEX[2*target_pixel.sector])
 
         # These equations are taken directly from the Wang et al. paper.
         # Sector 3 is the sector that is explicitly referenced in the paper.
@@ -964,19 +642,20 @@ def viewshed(dem_raster_path_band,
         if (adjusted_dem_height >= z and
                 target_pixel.distance_to_viewpoint < max_visible_radius and
                 target_dem_height != nodata):
-            visibility_managed_raster.set(n, m, 1)
-            aux_managed_raster.set(n, m, adjusted_dem_height)
+            visibility_managed_raster.set(n_window, m_window, 1)
+            aux_managed_raster.set(n_window, m_window, adjusted_dem_height)
         else:
             # If it's close enough to nodata to be interpreted as nodata,
             # consider it to be nodata.  Nodata implies that visibility is
             # undefined ... which it is, since there's no defined DEM value for
             # this pixel.
             if math.fabs(target_dem_height - nodata) <= 1.0e-7:
-                visibility_managed_raster.set(n, m, VISIBILITY_NODATA)
+                visibility_managed_raster.set(
+                    n_window, m_window, VISIBILITY_NODATA)
             else:
                 # If we're not over nodata, then the pixel isn't visible.
-                visibility_managed_raster.set(n, m, 0)
-            aux_managed_raster.set(n, m, z)
+                visibility_managed_raster.set(n_window, m_window, 0)
+            aux_managed_raster.set(n_window, m_window, z)
         pixels_touched += 1
 
         # Having determined the visibility for the target_pixel, we now need to
@@ -1014,6 +693,140 @@ def viewshed(dem_raster_path_band,
                 TargetPixel(ix_next_target, iy_next_target,
                             ring_id, target_pixel.sector, target_distance))
             process_queue_set.insert(next_target_index)
+    return 0
+
+
+@cython.binding(True)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+def viewshed(dem_raster_path_band,
+             viewpoint,
+             visibility_filepath,
+             viewpoint_height=0.0,
+             curved_earth=True,
+             refraction_coeff=0.13,
+             max_distance=None,
+             aux_filepath=None,
+             cache_mb=None):
+    """Compute the Wang et al. reference-plane based viewshed.
+
+    Parameters:
+        dem_raster_path_band (tuple): A tuple of (path, band_index) where
+            ``path`` is a path to a GDAL-compatible raster on disk and
+            ``band_index`` is the 1-based band index.  This DEM must be tiled
+            with block sizes as a power of 2.  If the viewshed is being
+            adjusted for curvature of the earth and/or refraction, the
+            elevation units of the DEM must be in meters.  The DEM need not be
+            projected in meters.
+        viewpoint (tuple):  A tuple of 2 numbers in the order
+            ``(east offset, north offset)``.  These units must be of the same
+            units as the coordinate system of the DEM.  This index represents
+            the viewpoint location.  The closest pixel to this viewpoint index
+            will be used as the viewpoint.
+        visibility_filepath (string): A filepath on disk to where the
+            visibility raster will be written. If a raster exists in this
+            location, it will be overwritten.
+        viewpoint_height=0.0 (float):  The height (in the units of the DEM
+            height) of the observer at the viewpoint.
+        curved_earth=True (bool): Whether to adjust viewshed calculations for
+            the curvature of the earth.  If False, the earth will be treated as
+            though it is flat.
+        refraction_coeff=0.13 (float):  The coefficient of atmospheric
+            refraction that may be adjusted to accommodate varying atmospheric
+            conditions.  Default is ``0.13``.  Set to ``0`` to ignore
+            refraction calculations.
+        max_distance=None (float):  If provided, visibility will not be
+            calculated for DEM pixels that are more than this distance (in meters)
+            from the viewpoint.
+        aux_filepath=None (string): A path to a location on disk
+            where the raster containing the auxiliary matrix will be written.
+            The auxiliary matrix defines the height that a DEM must exceed in
+            order to be visible from the viewpoint.  This matrix is very useful
+            for debugging.  If a raster already exists at this location, it
+            will be overwritten.  If this path is not provided by the user, the
+            viewshed will create this file as a temporary file wherever the
+            system keeps its temp files and remove it when the viewshed
+            finishes.  See python's ``tempfile`` documentation for where this
+            might be on your system.
+        cache_mb=None (number): A memory budget in megabytes for the raster
+            block caches used by the viewshed.  If not provided, the
+            ``NATCAP_INVEST_RASTER_CACHE_MB`` environment variable is used if
+            defined, otherwise a fixed number of blocks is cached per raster.
+
+    Raises:
+        ValueError: When either the viewpoint does not overlap with the DEM or
+            the DEM is not tiled appropriately.
+
+        LookupError: When the ``viewpoint`` coordinate pair is over nodata.
+
+        AssertionError: When pixel dimensions are not square.
+
+    Returns:
+        ``None``
+    """
+    start_time = time.time()
+
+    # Check the bounding box to make sure that the viewpoint overlaps the DEM.
+    dem_raster_info = pygeoprocessing.get_raster_info(dem_raster_path_band[0])
+    cdef long ix_viewpoint, iy_viewpoint
+    ix_viewpoint, iy_viewpoint = _viewpoint_index(
+        viewpoint, dem_raster_path_band, dem_raster_info)
+    cdef double nodata = _dem_nodata(dem_raster_path_band, dem_raster_info)
+    _check_dem_pixels_and_blocks(dem_raster_info)
+
+    # Create the auxiliary raster for storing the calculated minimum height
+    # for visibility at a given point.
+    temp_dir = None
+    if aux_filepath is None:
+        temp_dir = tempfile.mkdtemp(
+            prefix='viewshed_%s' % time.strftime(
+                '%Y-%m-%d_%H_%M_%S', time.gmtime()))
+        aux_filepath = os.path.join(temp_dir, 'auxiliary.tif')
+
+    LOGGER.info("Creating auxiliary raster %s", aux_filepath)
+    pygeoprocessing.new_raster_from_base(
+        dem_raster_path_band[0], aux_filepath, gdal.GDT_Float64, [AUX_NOT_VISITED],
+        fill_value_list=[AUX_NOT_VISITED],
+        raster_driver_creation_tuple=FLOAT_GTIFF_CREATION_OPTIONS)
+
+    # Create the visibility raster for indicating whether a pixel is visible
+    # based on the calculated minimum height.
+    LOGGER.info('Creating visibility raster %s', visibility_filepath)
+    pygeoprocessing.new_raster_from_base(
+        dem_raster_path_band[0], visibility_filepath, gdal.GDT_Byte,
+        [VISIBILITY_NODATA], fill_value_list=[VISIBILITY_NODATA],
+        raster_driver_creation_tuple=BYTE_GTIFF_CREATION_OPTIONS)
+
+    # LRU-cached rasters for easier access to individual pixels.
+    raster_cache_mb = managed_raster.get_raster_cache_mb(3, cache_mb)
+    cdef _ManagedRaster dem_managed_raster = (
+            _ManagedRaster(dem_raster_path_band[0], dem_raster_path_band[1], 0,
+                           MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
+    cdef _ManagedRaster aux_managed_raster = (
+            _ManagedRaster(aux_filepath, 1, 1, MANAGED_RASTER_N_BLOCKS,
+                           raster_cache_mb))
+    cdef _ManagedRaster visibility_managed_raster = (
+            _ManagedRaster(visibility_filepath, 1, 1, MANAGED_RASTER_N_BLOCKS,
+                           raster_cache_mb))
+
+    cdef double pixel_size = _pixel_size_in_meters(dem_raster_info)
+    cdef long raster_x_size = dem_raster_info['raster_size'][0]
+    cdef long raster_y_size = dem_raster_info['raster_size'][1]
+    cdef double max_visible_radius
+    cdef long pixels_in_raster
+    max_visible_radius, pixels_in_raster = _max_visible_radius(
+        viewpoint, max_distance, dem_raster_info, pixel_size)
+
+    LOGGER.info("Starting viewshed for viewpoint %s on DEM %s",
+                viewpoint, dem_raster_path_band[0])
+    _compute_viewshed(
+        dem_managed_raster, aux_managed_raster, visibility_managed_raster,
+        ix_viewpoint, iy_viewpoint, viewpoint_height, curved_earth,
+        refraction_coeff, max_visible_radius, pixels_in_raster, nodata,
+        pixel_size, raster_x_size, raster_y_size,
+        dem_raster_info['block_size'][0], dem_raster_info['block_size'][1],
+        0, 0)
     LOGGER.info('%6.2f%% complete after %.2fs', 100.0, time.time()-start_time)
 
     dem_managed_raster.close()
@@ -1025,3 +838,414 @@ def viewshed(dem_raster_path_band,
             shutil.rmtree(temp_dir)
         except OSError:
             LOGGER.exception('Could not remove temporary folder %s', temp_dir)
+
+
+@cython.binding(True)
+def viewshed_batch(dem_raster_path_band,
+                   viewpoint_list,
+                   target_visibility_sum_path,
+                   curved_earth=True,
+                   refraction_coeff=0.13,
+                   valuation_op=None,
+                   target_valuation_sum_path=None,
+                   valuation_nodata=None,
+                   visibility_path_list=None,
+                   valuation_path_list=None,
+                   max_valuation_distance=None,
+                   working_dir=None,
+                   cache_mb=None):
+    """Compute and sum the viewsheds of many viewpoints on one DEM.
+
+    The viewpoints share one DEM block cache and one pair of scratch
+    auxiliary and visibility rasters.  Each viewshed is computed on the
+    window of the DEM within its ``max_distance`` of the viewpoint, so the
+    scratch rasters only need to be as large as the largest window.  After
+    each viewshed, its window is added to the running sums by offset and
+    the scratch rasters are reset, so no per-viewpoint rasters are needed
+    unless asked for.
+
+    Parameters:
+        dem_raster_path_band (tuple): A tuple of (path, band_index) of the
+            DEM, with the same requirements as for ``viewshed``.
+        viewpoint_list (list): A list of ``(viewpoint, max_distance, weight,
+            viewpoint_height)`` tuples, where ``viewpoint``,
+            ``max_distance`` and ``viewpoint_height`` are as for
+            ``viewshed`` and ``weight`` is the number added to the
+            visibility sum of each pixel visible from the viewpoint.
+        target_visibility_sum_path (string): The path to a float32 raster
+            created by this call with the weighted count of viewpoints each
+            pixel is visible from, and ``VISIBILITY_SUM_NODATA`` where the
+            DEM is nodata.
+        curved_earth=True (bool): as for ``viewshed``.
+        refraction_coeff=0.13 (float): as for ``viewshed``.
+        valuation_op=None (callable): If provided, called as
+            ``valuation_op(distance, visibility, weight)`` for windows of each
+            viewshed, where ``distance`` is a float64 array of the distance
+            in meters of each pixel from the viewpoint and ``visibility`` is
+            the matching uint8 visibility array.  It must return a float64
+            array of the value of each pixel, ``valuation_nodata`` where the
+            value is undefined.
+        target_valuation_sum_path=None (string): The path to a float64
+            raster created by this call with the sum of the values returned
+            by ``valuation_op``.  Required if ``valuation_op`` is provided.
+        valuation_nodata=None (float): The nodata value of ``valuation_op``
+            results and of the valuation rasters.  Required if
+            ``valuation_op`` is provided.
+        visibility_path_list=None (list): If provided, one path per
+            viewpoint to write its visibility raster to, as ``viewshed``
+            would.
+        valuation_path_list=None (list): If provided, one path per viewpoint
+            to write its valuation raster to.
+        max_valuation_distance=None (float): If provided, ``valuation_op``
+            must return 0 for every pixel more than this distance in meters
+            from the viewpoint, and is only called on the part of each
+            viewshed within this distance unless ``valuation_path_list`` is
+            provided.
+        working_dir=None (string): The directory to create the scratch
+            rasters in.  If not provided, the system temp directory is used.
+        cache_mb=None (number): A memory budget in megabytes for the raster
+            block caches shared by all of the viewsheds.
+
+    Raises:
+        ValueError: When a viewpoint does not overlap with the DEM or the DEM
+            is not tiled appropriately.
+
+        LookupError: When a viewpoint is over nodata.
+
+        AssertionError: When pixel dimensions are not square.
+
+    Returns:
+        ``None``
+    """
+    start_time = time.time()
+    dem_raster_info = pygeoprocessing.get_raster_info(dem_raster_path_band[0])
+    cdef double nodata = _dem_nodata(dem_raster_path_band, dem_raster_info)
+    _check_dem_pixels_and_blocks(dem_raster_info)
+    # check every viewpoint before doing any work
+    viewpoint_index_list = [
+        _viewpoint_index(viewpoint, dem_raster_path_band, dem_raster_info)
+        for viewpoint, _, _, _ in viewpoint_list]
+    dem_nodata = dem_raster_info['nodata'][dem_raster_path_band[1] - 1]
+
+    cdef double pixel_size = _pixel_size_in_meters(dem_raster_info)
+    cdef long raster_x_size = dem_raster_info['raster_size'][0]
+    cdef long raster_y_size = dem_raster_info['raster_size'][1]
+    cdef double max_visible_radius
+    cdef long pixels_in_raster
+    cdef long ix_viewpoint, iy_viewpoint
+    cdef long xoff, yoff
+
+    # every pixel a viewshed touches is in its window
+    window_list = [
+        _viewshed_window(
+            ix_viewpoint, iy_viewpoint, max_distance, pixel_size,
+            raster_x_size, raster_y_size)
+        for (_, max_distance, _, _), (ix_viewpoint, iy_viewpoint) in zip(
+            viewpoint_list, viewpoint_index_list)]
+
+    temp_dir = tempfile.mkdtemp(
+        prefix='viewshed_batch_%s' % time.strftime(
+            '%Y-%m-%d_%H_%M_%S', time.gmtime()), dir=working_dir)
+    aux_filepath = os.path.join(temp_dir, 'auxiliary.tif')
+    scratch_visibility_filepath = os.path.join(temp_dir, 'visibility.tif')
+    scratch_x_size = max(window[2] for window in window_list)
+    scratch_y_size = max(window[3] for window in window_list)
+    _create_scratch_raster(
+        aux_filepath, scratch_x_size, scratch_y_size, gdal.GDT_Float64,
+        AUX_NOT_VISITED, FLOAT_GTIFF_CREATION_OPTIONS)
+    _create_scratch_raster(
+        scratch_visibility_filepath, scratch_x_size, scratch_y_size,
+        gdal.GDT_Byte, VISIBILITY_NODATA, BYTE_GTIFF_CREATION_OPTIONS)
+
+    sum_path_list = [
+        (target_visibility_sum_path, gdal.GDT_Float32,
+         VISIBILITY_SUM_NODATA)]
+    if valuation_op is not None:
+        sum_path_list.append(
+            (target_valuation_sum_path, gdal.GDT_Float64, valuation_nodata))
+    for sum_path, sum_datatype, sum_nodata in sum_path_list:
+        _create_sum_raster(
+            dem_raster_path_band, dem_nodata, sum_path, sum_datatype,
+            sum_nodata)
+
+    raster_cache_mb = managed_raster.get_raster_cache_mb(3, cache_mb)
+    cdef _ManagedRaster dem_managed_raster = (
+            _ManagedRaster(dem_raster_path_band[0], dem_raster_path_band[1], 0,
+                           MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
+    cdef _ManagedRaster aux_managed_raster = (
+            _ManagedRaster(aux_filepath, 1, 1, MANAGED_RASTER_N_BLOCKS,
+                           raster_cache_mb))
+    cdef _ManagedRaster visibility_managed_raster = (
+            _ManagedRaster(scratch_visibility_filepath, 1, 1,
+                           MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
+    sum_raster_list = [
+        gdal.OpenEx(sum_path, gdal.OF_RASTER | gdal.GA_Update)
+        for sum_path, _, _ in sum_path_list]
+    sum_band_list = [
+        sum_raster.GetRasterBand(1) for sum_raster in sum_raster_list]
+
+    try:
+        for viewpoint_id, (
+                (viewpoint, max_distance, weight, viewpoint_height),
+                (ix_viewpoint, iy_viewpoint),
+                (xoff, yoff, win_xsize, win_ysize)) in enumerate(
+                    zip(viewpoint_list, viewpoint_index_list, window_list)):
+            max_visible_radius, pixels_in_raster = _max_visible_radius(
+                viewpoint, max_distance, dem_raster_info, pixel_size)
+            LOGGER.info(
+                "Starting viewshed %d of %d for viewpoint %s on DEM %s",
+                viewpoint_id+1, len(viewpoint_list), viewpoint,
+                dem_raster_path_band[0])
+            _compute_viewshed(
+                dem_managed_raster, aux_managed_raster,
+                visibility_managed_raster, ix_viewpoint, iy_viewpoint,
+                viewpoint_height, curved_earth, refraction_coeff,
+                max_visible_radius, pixels_in_raster, nodata, pixel_size,
+                raster_x_size, raster_y_size,
+                dem_raster_info['block_size'][0],
+                dem_raster_info['block_size'][1], xoff, yoff)
+
+            viewpoint_band_list = [None, None]
+            viewpoint_raster_list = [None, None]
+            if visibility_path_list is not None:
+                pygeoprocessing.new_raster_from_base(
+                    dem_raster_path_band[0],
+                    visibility_path_list[viewpoint_id], gdal.GDT_Byte,
+                    [VISIBILITY_NODATA], fill_value_list=[VISIBILITY_NODATA],
+                    raster_driver_creation_tuple=BYTE_GTIFF_CREATION_OPTIONS)
+                viewpoint_raster_list[0] = gdal.OpenEx(
+                    visibility_path_list[viewpoint_id],
+                    gdal.OF_RASTER | gdal.GA_Update)
+                viewpoint_band_list[0] = (
+                    viewpoint_raster_list[0].GetRasterBand(1))
+            if valuation_op is not None and valuation_path_list is not None:
+                pygeoprocessing.new_raster_from_base(
+                    dem_raster_path_band[0],
+                    valuation_path_list[viewpoint_id], gdal.GDT_Float64,
+                    [valuation_nodata], fill_value_list=[valuation_nodata])
+                viewpoint_raster_list[1] = gdal.OpenEx(
+                    valuation_path_list[viewpoint_id],
+                    gdal.OF_RASTER | gdal.GA_Update)
+                viewpoint_band_list[1] = (
+                    viewpoint_raster_list[1].GetRasterBand(1))
+
+            # pixels beyond the valuation distance are worth 0 so they're
+            # skipped unless the valuation raster is saved
+            valuation_window = (xoff, yoff, win_xsize, win_ysize)
+            if (max_valuation_distance is not None and
+                    viewpoint_band_list[1] is None):
+                valuation_window = _intersect_windows(
+                    valuation_window, _viewshed_window(
+                        ix_viewpoint, iy_viewpoint, max_valuation_distance,
+                        pixel_size, raster_x_size, raster_y_size))
+
+            for strip_yoff in range(yoff, yoff+win_ysize, FOLD_STRIP_ROWS):
+                strip_ysize = min(FOLD_STRIP_ROWS, yoff+win_ysize-strip_yoff)
+                strip_window = (xoff, strip_yoff, win_xsize, strip_ysize)
+                visibility_array = _read_managed_window(
+                    visibility_managed_raster, 0, strip_yoff-yoff, win_xsize,
+                    strip_ysize).astype(numpy.uint8)
+                dem_array = _read_managed_window(
+                    dem_managed_raster, xoff, strip_yoff, win_xsize,
+                    strip_ysize).astype(dem_raster_info['numpy_type'])
+                if dem_nodata is not None:
+                    valid_dem_mask = (dem_array != dem_nodata)
+                else:
+                    valid_dem_mask = numpy.ones(dem_array.shape, dtype=bool)
+
+                visibility_sum = sum_band_list[0].ReadAsArray(
+                    xoff, strip_yoff, win_xsize, strip_ysize)
+                visible_mask = valid_dem_mask & (visibility_array == 1)
+                visibility_sum[visible_mask] += (
+                    visibility_array[visible_mask] * weight)
+                sum_band_list[0].WriteArray(
+                    visibility_sum, xoff=xoff, yoff=strip_yoff)
+                if viewpoint_band_list[0] is not None:
+                    viewpoint_band_list[0].WriteArray(
+                        visibility_array, xoff=xoff, yoff=strip_yoff)
+
+                strip_valuation_window = _intersect_windows(
+                    strip_window, valuation_window)
+                if (valuation_op is not None and
+                        strip_valuation_window is not None):
+                    val_xoff, val_yoff, val_xsize, val_ysize = (
+                        strip_valuation_window)
+                    strip_slice = (
+                        slice(val_yoff-strip_yoff,
+                              val_yoff-strip_yoff+val_ysize),
+                        slice(val_xoff-xoff, val_xoff-xoff+val_xsize))
+                    ix_matrix, iy_matrix = numpy.meshgrid(
+                        numpy.arange(
+                            val_xoff, val_xoff+val_xsize,
+                            dtype=numpy.float64),
+                        numpy.arange(
+                            val_yoff, val_yoff+val_ysize,
+                            dtype=numpy.float64))
+                    distance_array = numpy.hypot(
+                        numpy.absolute(ix_matrix - ix_viewpoint),
+                        numpy.absolute(iy_matrix - iy_viewpoint),
+                        dtype=numpy.float64) * pixel_size
+                    valuation_array = valuation_op(
+                        distance_array, visibility_array[strip_slice],
+                        weight)
+                    valuation_sum = sum_band_list[1].ReadAsArray(
+                        val_xoff, val_yoff, val_xsize, val_ysize)
+                    valid_mask = (
+                        (valuation_array != valuation_nodata) &
+                        valid_dem_mask[strip_slice])
+                    valuation_sum[valid_mask] += valuation_array[valid_mask]
+                    sum_band_list[1].WriteArray(
+                        valuation_sum, xoff=val_xoff, yoff=val_yoff)
+                    if viewpoint_band_list[1] is not None:
+                        viewpoint_band_list[1].WriteArray(
+                            valuation_array, xoff=val_xoff, yoff=val_yoff)
+
+                # reset the scratch rasters for the next viewpoint
+                _fill_managed_window(
+                    visibility_managed_raster, 0, strip_yoff-yoff, win_xsize,
+                    strip_ysize, VISIBILITY_NODATA)
+                _fill_managed_window(
+                    aux_managed_raster, 0, strip_yoff-yoff, win_xsize,
+                    strip_ysize, AUX_NOT_VISITED)
+            viewpoint_band_list = None
+            viewpoint_raster_list = None
+    finally:
+        sum_band_list = None
+        for sum_raster in sum_raster_list:
+            sum_raster.FlushCache()
+        sum_raster_list = None
+        dem_managed_raster.close()
+        aux_managed_raster.close()
+        visibility_managed_raster.close()
+        try:
+            shutil.rmtree(temp_dir)
+        except OSError:
+            LOGGER.exception('Could not remove temporary folder %s', temp_dir)
+    LOGGER.info('%d viewsheds complete after %.2fs', len(viewpoint_list),
+                time.time()-start_time)
+
+
+def _create_sum_raster(dem_raster_path_band, dem_nodata, target_path,
+                       datatype, target_nodata):
+    """Create a raster of 0 where the DEM is valid and nodata elsewhere.
+
+    Parameters:
+        dem_raster_path_band (tuple): the (path, band_index) of the DEM.
+        dem_nodata (float): the DEM nodata value, may be ``None``.
+        target_path (string): path to the raster to create.
+        datatype (int): the GDAL type of the target raster.
+        target_nodata (float): the nodata value of the target raster.
+
+    Returns:
+        ``None``
+    """
+    pygeoprocessing.new_raster_from_base(
+        dem_raster_path_band[0], target_path, datatype, [target_nodata],
+        raster_driver_creation_tuple=FLOAT_GTIFF_CREATION_OPTIONS)
+    target_raster = gdal.OpenEx(target_path, gdal.OF_RASTER | gdal.GA_Update)
+    target_band = target_raster.GetRasterBand(1)
+    for block_info, dem_block in pygeoprocessing.iterblocks(
+            dem_raster_path_band):
+        sum_block = numpy.full(dem_block.shape, target_nodata,
+                               dtype=numpy.float64)
+        if dem_nodata is not None:
+            sum_block[dem_block != dem_nodata] = 0
+        else:
+            sum_block[:] = 0
+        target_band.WriteArray(
+            sum_block, xoff=block_info['xoff'], yoff=block_info['yoff'])
+    target_band = None
+    target_raster = None
+
+
+def _create_scratch_raster(target_path, n_cols, n_rows, datatype, nodata,
+                           raster_driver_creation_tuple):
+    """Create a raster with no georeferencing, filled with nodata.
+
+    Parameters:
+        target_path (string): path to the raster to create.
+        n_cols, n_rows (int): the size of the raster.
+        datatype (int): the GDAL type of the raster.
+        nodata (float): the nodata and fill value of the raster.
+        raster_driver_creation_tuple (tuple): the driver name and creation
+            options of the raster.
+
+    Returns:
+        ``None``
+    """
+    driver = gdal.GetDriverByName(raster_driver_creation_tuple[0])
+    target_raster = driver.Create(
+        target_path, n_cols, n_rows, 1, datatype,
+        options=raster_driver_creation_tuple[1])
+    target_band = target_raster.GetRasterBand(1)
+    target_band.SetNoDataValue(nodata)
+    target_band.Fill(nodata)
+    target_band = None
+    target_raster = None
+
+
+def _intersect_windows(window_a, window_b):
+    """Get the overlap of two (xoff, yoff, win_xsize, win_ysize) windows.
+
+    Returns:
+        The (xoff, yoff, win_xsize, win_ysize) of the overlap, or ``None``
+        if the windows don't overlap.
+    """
+    x_min = max(window_a[0], window_b[0])
+    y_min = max(window_a[1], window_b[1])
+    x_max = min(window_a[0]+window_a[2], window_b[0]+window_b[2])
+    y_max = min(window_a[1]+window_a[3], window_b[1]+window_b[3])
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    return (x_min, y_min, x_max-x_min, y_max-y_min)
+
+
+def _viewshed_window(ix_viewpoint, iy_viewpoint, max_distance, pixel_size,
+                     raster_x_size, raster_y_size):
+    """Get the window of the DEM that a viewshed may touch.
+
+    Parameters:
+        ix_viewpoint, iy_viewpoint (int): the viewpoint's column and row.
+        max_distance (float): the maximum visible distance in meters, or
+            ``None`` for no limit.
+        pixel_size (float): the DEM pixel size in meters.
+        raster_x_size, raster_y_size (int): the size of the DEM.
+
+    Returns:
+        A tuple of the (xoff, yoff, win_xsize, win_ysize) of the window.
+    """
+    if max_distance is None:
+        return (0, 0, raster_x_size, raster_y_size)
+    # the viewpoint's sector seeds are up to 2 pixels away regardless of the
+    # distance
+    pixel_radius = int(math.ceil(max_distance / pixel_size)) + 2
+    xoff = max(0, ix_viewpoint - pixel_radius)
+    yoff = max(0, iy_viewpoint - pixel_radius)
+    x_max = min(raster_x_size, ix_viewpoint + pixel_radius + 1)
+    y_max = min(raster_y_size, iy_viewpoint + pixel_radius + 1)
+    return (xoff, yoff, x_max - xoff, y_max - yoff)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef numpy.ndarray _read_managed_window(
+        _ManagedRaster raster, long xoff, long yoff, long win_xsize,
+        long win_ysize):
+    """Read a window of a managed raster into a float64 array."""
+    cdef numpy.ndarray[numpy.float64_t, ndim=2] window = numpy.empty(
+        (win_ysize, win_xsize), dtype=numpy.float64)
+    cdef long xi, yi
+    for yi in range(win_ysize):
+        for xi in range(win_xsize):
+            window[yi, xi] = raster.get(xoff+xi, yoff+yi)
+    return window
+
+
+cdef void _fill_managed_window(
+        _ManagedRaster raster, long xoff, long yoff, long win_xsize,
+        long win_ysize, double value):
+    """Set every pixel in a window of a managed raster to ``value``."""
+    cdef long xi, yi
+    for yi in range(yoff, yoff+win_ysize):
+        for xi in range(xoff, xoff+win_xsize):
+            raster.set(xi, yi, value)
@@ -18,6 +18,7 @@ import numpy
 import pygeoprocessing
 import pygeoprocessing.routing
 import taskgraph
+from .. import managed_raster
 from .. import utils
 from .. import validation
 from . import sdr_core
@@ -300,6 +301,11 @@ def execute(args):
         [(_OUTPUT_BASE_FILES, output_dir),
          (_INTERMEDIATE_BASE_FILES, intermediate_output_dir),
          (_TMP_BASE_FILES, churn_dir)], file_suffix)
+    # these intermediates are only read back by the sediment deposition
+    # core, so they may be uncompressed memory-mapped scratch rasters
+    for scratch_key in ('e_prime_path', 'f_path'):
+        f_reg[scratch_key] = managed_raster.get_scratch_path(
+            f_reg[scratch_key])
 
     try:
         n_workers = int(args['n_workers'])
@@ -609,7 +615,8 @@ def execute(args):
             f_reg['usle_path'], f_reg['sdr_path'], f_reg['e_prime_path']),
         hash_algorithm='md5',
         copy_duplicate_artifact=True,
-        target_path_list=[f_reg['e_prime_path']],
+        target_path_list=[f_reg['e_prime_path']] + (
+            managed_raster.get_sidecar_path_list(f_reg['e_prime_path'])),
         dependent_task_list=[usle_task, sdr_task],
         task_name='calculate export prime')
 
@@ -619,6 +626,7 @@ def execute(args):
             f_reg['flow_direction_path'], f_reg['e_prime_path'],
             f_reg['f_path'], f_reg['sdr_path'],
             f_reg['sed_deposition_path']),
+        kwargs={'n_workers': n_workers},
         dependent_task_list=[e_prime_task, sdr_task, flow_dir_task],
         hash_algorithm='md5',
         copy_duplicate_artifact=True,
@@ -1266,7 +1274,9 @@ def _calculate_e_prime(usle_path, sdr_path, target_e_prime):
 
     pygeoprocessing.raster_calculator(
         [(usle_path, 1), (sdr_path, 1)], e_prime_op, target_e_prime,
-        gdal.GDT_Float32, _TARGET_NODATA)
+        gdal.GDT_Float32, _TARGET_NODATA,
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(target_e_prime)))
 
 
 def _calculate_sed_retention_index(
@@ -1,7 +1,10 @@
 # cython: profile=False
 # cython: language_level=3
+import functools
 import logging
 import os
+import shutil
+import tempfile
 
 import numpy
 import pygeoprocessing
@@ -9,15 +12,13 @@ cimport numpy
 cimport cython
 from osgeo import gdal
 
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
-from cython.operator cimport dereference as deref
-from cython.operator cimport preincrement as inc
-from libcpp.pair cimport pair
-from libcpp.set cimport set as cset
-from libcpp.list cimport list as clist
 from libcpp.stack cimport stack
 cimport libc.math as cmath
 
+from natcap.invest.managed_raster cimport _ManagedRaster
+from .. import managed_raster
+from .. import tile_routing
+
 cdef extern from "time.h" nogil:
     ctypedef int time_t
     time_t time(time_t*)
@@ -40,322 +41,52 @@ cdef int MANAGED_RASTER_N_BLOCKS = 2**6
 #           5 6 7
 cdef int *ROW_OFFSETS = [0, -1, -1, -1,  0,  1, 1, 1]
 cdef int *COL_OFFSETS = [1,  1,  0, -1, -1, -1, 0, 1]
+# the direction a neighbor at the same index above has to flow to flow in
+cdef int *INFLOW_OFFSETS = [4, 5, 6, 7, 0, 1, 2, 3]
+
+cdef float SEDIMENT_DEPOSITION_NODATA = -1.0
+# Width and height in pixels of a tile when sediment deposition is routed in
+# parallel.
+PARALLEL_TILE_SIZE = tile_routing.PARALLEL_TILE_SIZE
 
 
 cdef int is_close(double x, double y):
     return abs(x-y) <= (1e-8+1e-05*abs(y))
 
-# this is a least recently used cache written in C++ in an external file,
-# exposing here so _ManagedRaster can use it
-cdef extern from "LRUCache.h" nogil:
-    cdef cppclass LRUCache[KEY_T, VAL_T]:
-        LRUCache(int)
-        void put(KEY_T&, VAL_T&, clist[pair[KEY_T,VAL_T]]&)
-        clist[pair[KEY_T,VAL_T]].iterator begin()
-        clist[pair[KEY_T,VAL_T]].iterator end()
-        bint exist(KEY_T &)
-        VAL_T get(KEY_T &)
-
-# this ctype is used to store the block ID and the block buffer as one object
-# inside Managed Raster
-ctypedef pair[int, double*] BlockBufferPair
-
-# a class to allow fast random per-pixel access to a raster for both setting
-# and reading pixels.  Copied from src/pygeoprocessing/routing/routing.pyx,
-# revision 891288683889237cfd3a3d0a1f09483c23489fca.
-cdef class _ManagedRaster:
-    cdef LRUCache[int, double*]* lru_cache
-    cdef cset[int] dirty_blocks
-    cdef int block_xsize
-    cdef int block_ysize
-    cdef int block_xmod
-    cdef int block_ymod
-    cdef int block_xbits
-    cdef int block_ybits
-    cdef long raster_x_size
-    cdef long raster_y_size
-    cdef int block_nx
-    cdef int block_ny
-    cdef int write_mode
-    cdef bytes raster_path
-    cdef int band_id
-    cdef int closed
-
-    def __cinit__(self, raster_path, band_id, write_mode):
-        """Create new instance of Managed Raster.
 
-        Parameters:
-            raster_path (char*): path to raster that has block sizes that are
-                powers of 2. If not, an exception is raised.
-            band_id (int): which band in `raster_path` to index. Uses GDAL
-                notation that starts at 1.
-            write_mode (boolean): if true, this raster is writable and dirty
-                memory blocks will be written back to the raster as blocks
-                are swapped out of the cache or when the object deconstructs.
+@cython.cdivision(True)
+cdef inline float _flow_fraction(int flow_val, int flow_weight) nogil:
+    """Fraction of the flow in `flow_val` that goes in a `flow_weight` dir."""
+    cdef float flow_sum = 0.0
+    cdef int k
+    for k in range(8):
+        flow_sum += (flow_val >> (k*4)) & 0xF
+    return flow_weight / flow_sum
 
-        Returns:
-            None.
-        """
-        raster_info = pygeoprocessing.get_raster_info(raster_path)
-        self.raster_x_size, self.raster_y_size = raster_info['raster_size']
-        self.block_xsize, self.block_ysize = raster_info['block_size']
-        self.block_xmod = self.block_xsize-1
-        self.block_ymod = self.block_ysize-1
-
-        if not (1 <= band_id <= raster_info['n_bands']):
-            err_msg = (
-                "Error: band ID (%s) is not a valid band number. "
-                "This exception is happening in Cython, so it will cause a "
-                "hard seg-fault, but it's otherwise meant to be a "
-                "ValueError." % (band_id))
-            print(err_msg)
-            raise ValueError(err_msg)
-        self.band_id = band_id
-
-        if (self.block_xsize & (self.block_xsize - 1) != 0) or (
-                self.block_ysize & (self.block_ysize - 1) != 0):
-            # If inputs are not a power of two, this will at least print
-            # an error message. Unfortunately with Cython, the exception will
-            # present itself as a hard seg-fault, but I'm leaving the
-            # ValueError in here at least for readability.
-            err_msg = (
-                "Error: Block size is not a power of two: "
-                "block_xsize: %d, %d, %s. This exception is happening"
-                "in Cython, so it will cause a hard seg-fault, but it's"
-                "otherwise meant to be a ValueError." % (
-                    self.block_xsize, self.block_ysize, raster_path))
-            print(err_msg)
-            raise ValueError(err_msg)
-
-        self.block_xbits = numpy.log2(self.block_xsize)
-        self.block_ybits = numpy.log2(self.block_ysize)
-        self.block_nx = (
-            self.raster_x_size + (self.block_xsize) - 1) // self.block_xsize
-        self.block_ny = (
-            self.raster_y_size + (self.block_ysize) - 1) // self.block_ysize
-
-        self.lru_cache = new LRUCache[int, double*](MANAGED_RASTER_N_BLOCKS)
-        self.raster_path = <bytes> raster_path
-        self.write_mode = write_mode
-        self.closed = 0
-
-    def __dealloc__(self):
-        """Deallocate _ManagedRaster.
-
-        This operation manually frees memory from the LRUCache and writes any
-        dirty memory blocks back to the raster if `self.write_mode` is True.
-        """
-        self.close()
-
-    def close(self):
-        """Close the _ManagedRaster and free up resources.
-
-            This call writes any dirty blocks to disk, frees up the memory
-            allocated as part of the cache, and frees all GDAL references.
-
-            Any subsequent calls to any other functions in _ManagedRaster will
-            have undefined behavior.
-        """
-        if self.closed:
-            return
-        self.closed = 1
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize))
-        cdef double *double_buffer
-        cdef int block_xi
-        cdef int block_yi
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize
-        cdef int win_ysize
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff
-        cdef int yoff
-
-        cdef clist[BlockBufferPair].iterator it = self.lru_cache.begin()
-        cdef clist[BlockBufferPair].iterator end = self.lru_cache.end()
-        if not self.write_mode:
-            while it != end:
-                # write the changed value back if desired
-                PyMem_Free(deref(it).second)
-                inc(it)
-            return
-
-        raster = gdal.OpenEx(
-            self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-
-        # if we get here, we're in write_mode
-        cdef cset[int].iterator dirty_itr
-        while it != end:
-            double_buffer = deref(it).second
-            block_index = deref(it).first
-
-            # write to disk if block is dirty
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr != self.dirty_blocks.end():
-                self.dirty_blocks.erase(dirty_itr)
-                block_xi = block_index % self.block_nx
-                block_yi = block_index / self.block_nx
-
-                # we need the offsets to subtract from global indexes for
-                # cached array
-                xoff = block_xi << self.block_xbits
-                yoff = block_yi << self.block_ybits
-
-                win_xsize = self.block_xsize
-                win_ysize = self.block_ysize
-
-                # clip window sizes if necessary
-                if xoff+win_xsize > self.raster_x_size:
-                    win_xsize = win_xsize - (
-                        xoff+win_xsize - self.raster_x_size)
-                if yoff+win_ysize > self.raster_y_size:
-                    win_ysize = win_ysize - (
-                        yoff+win_ysize - self.raster_y_size)
-
-                for xi_copy in xrange(win_xsize):
-                    for yi_copy in xrange(win_ysize):
-                        block_array[yi_copy, xi_copy] = (
-                            double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy])
-                raster_band.WriteArray(
-                    block_array[0:win_ysize, 0:win_xsize],
-                    xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            inc(it)
-        raster_band.FlushCache()
-        raster_band = None
-        raster = None
-
-    cdef inline void set(self, long xi, long yi, double value):
-        """Set the pixel at `xi,yi` to `value`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))] = value
-        if self.write_mode:
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr == self.dirty_blocks.end():
-                self.dirty_blocks.insert(block_index)
-
-    cdef inline double get(self, long xi, long yi):
-        """Return the value of the pixel at `xi,yi`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        return self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))]
-
-    cdef void _load_block(self, int block_index) except *:
-        cdef int block_xi = block_index % self.block_nx
-        cdef int block_yi = block_index // self.block_nx
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff = block_xi << self.block_xbits
-        cdef int yoff = block_yi << self.block_ybits
-
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array
-        cdef double *double_buffer
-        cdef clist[BlockBufferPair] removed_value_list
-
-        # determine the block aligned xoffset for read as array
-
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize = self.block_xsize
-        cdef int win_ysize = self.block_ysize
-
-        # load a new block
-        if xoff+win_xsize > self.raster_x_size:
-            win_xsize = win_xsize - (xoff+win_xsize - self.raster_x_size)
-        if yoff+win_ysize > self.raster_y_size:
-            win_ysize = win_ysize - (yoff+win_ysize - self.raster_y_size)
-
-        raster = gdal.OpenEx(self.raster_path, gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-        block_array = raster_band.ReadAsArray(
-            xoff=xoff, yoff=yoff, win_xsize=win_xsize,
-            win_ysize=win_ysize).astype(
-            numpy.float64)
-        raster_band = None
-        raster = None
-        double_buffer = <double*>PyMem_Malloc(
-            (sizeof(double) << self.block_xbits) * win_ysize)
-        for xi_copy in xrange(win_xsize):
-            for yi_copy in xrange(win_ysize):
-                double_buffer[(yi_copy<<self.block_xbits)+xi_copy] = (
-                    block_array[yi_copy, xi_copy])
-        self.lru_cache.put(
-            <int>block_index, <double*>double_buffer, removed_value_list)
-
-        if self.write_mode:
-            raster = gdal.OpenEx(
-                self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-            raster_band = raster.GetRasterBand(self.band_id)
-
-        block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize), dtype=numpy.double)
-        while not removed_value_list.empty():
-            # write the changed value back if desired
-            double_buffer = removed_value_list.front().second
-
-            if self.write_mode:
-                block_index = removed_value_list.front().first
-
-                # write back the block if it's dirty
-                dirty_itr = self.dirty_blocks.find(block_index)
-                if dirty_itr != self.dirty_blocks.end():
-                    self.dirty_blocks.erase(dirty_itr)
-
-                    block_xi = block_index % self.block_nx
-                    block_yi = block_index // self.block_nx
-
-                    xoff = block_xi << self.block_xbits
-                    yoff = block_yi << self.block_ybits
-
-                    win_xsize = self.block_xsize
-                    win_ysize = self.block_ysize
-
-                    if xoff+win_xsize > self.raster_x_size:
-                        win_xsize = win_xsize - (
-                            xoff+win_xsize - self.raster_x_size)
-                    if yoff+win_ysize > self.raster_y_size:
-                        win_ysize = win_ysize - (
-                            yoff+win_ysize - self.raster_y_size)
-
-                    for xi_copy in xrange(win_xsize):
-                        for yi_copy in xrange(win_ysize):
-                            block_array[yi_copy, xi_copy] = double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy]
-                    raster_band.WriteArray(
-                        block_array[0:win_ysize, 0:win_xsize],
-                        xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            removed_value_list.pop_front()
-
-        if self.write_mode:
-            raster_band = None
-            raster = None
+
+@cython.cdivision(True)
+cdef inline void _deposition_and_flux(
+        double e_prime_i, double f_j_weighted_sum, float sdr_i,
+        float downstream_sdr_weighted_sum, double *r_i, double *f_i) nogil:
+    """Calculate the deposition `r_i` and the flux `f_i` on a pixel.
+
+    This is the only per-pixel arithmetic that is not a weighted sum, so it's
+    shared by the serial and tiled routes to keep them bit-identical.
+    """
+    cdef double d_ri
+    if downstream_sdr_weighted_sum < sdr_i:
+        # i think this happens because of our low resolution
+        # flow direction, it's okay to zero out.
+        downstream_sdr_weighted_sum = sdr_i
+    d_ri = (downstream_sdr_weighted_sum - sdr_i) / (1 - sdr_i)
+    r_i[0] = d_ri * (e_prime_i + f_j_weighted_sum)
+    f_i[0] = (1-d_ri) * (e_prime_i + f_j_weighted_sum)
 
 
 def calculate_sediment_deposition(
         mfd_flow_direction_path, e_prime_path, f_path, sdr_path,
-        target_sediment_deposition_path):
+        target_sediment_deposition_path, cache_mb=None, n_workers=-1,
+        tile_size=PARALLEL_TILE_SIZE):
     """Calculate sediment deposition layer
 
         Parameters:
@@ -364,34 +95,69 @@ def calculate_sediment_deposition(
             e_prime_path (string): path to a raster that shows sources of
                 sediment that wash off a pixel but do not reach the stream.
             f_path (string): path to a raster that shows the sediment flux
-                on a pixel for sediment that does not reach the stream.
+                on a pixel for sediment that does not reach the stream.  If
+                this path ends in ``.bin`` it is created as an uncompressed
+                ENVI raster and accessed through a memory map.
             sdr_path (string): path to Sediment Delivery Ratio raster.
             target_sediment_deposition_path (string): path to created that
                 shows where the E' sources end up across the landscape.
+            cache_mb (number): optional memory budget in megabytes for the
+                raster block caches used by this function.  If not provided,
+                the ``NATCAP_INVEST_RASTER_CACHE_MB`` environment variable is
+                used if defined, otherwise a fixed number of blocks is cached
+                per raster.  Only used when routing serially.
+            n_workers (int): if 2 or more, the raster is split into tiles of
+                ``tile_size`` pixels on a side that are routed by this many
+                threads, otherwise the whole raster is routed serially.  Both
+                produce bit-identical results.
+            tile_size (int): the width and height of a tile when routing
+                with ``n_workers`` threads.
 
         Returns:
             None.
 
     """
     LOGGER.info('calculate sediment deposition')
-    cdef float sediment_deposition_nodata = -1.0
+    if n_workers is not None and n_workers >= 2:
+        _calculate_sediment_deposition_tiled(
+            mfd_flow_direction_path, e_prime_path, f_path, sdr_path,
+            target_sediment_deposition_path, n_workers, tile_size)
+    else:
+        _calculate_sediment_deposition_serial(
+            mfd_flow_direction_path, e_prime_path, f_path, sdr_path,
+            target_sediment_deposition_path, cache_mb)
+
+
+def _calculate_sediment_deposition_serial(
+        mfd_flow_direction_path, e_prime_path, f_path, sdr_path,
+        target_sediment_deposition_path, cache_mb):
+    """Route sediment deposition over the whole raster from one stack.
+
+    See ``calculate_sediment_deposition`` for the parameters.
+    """
+    cdef float sediment_deposition_nodata = SEDIMENT_DEPOSITION_NODATA
     pygeoprocessing.new_raster_from_base(
         mfd_flow_direction_path, target_sediment_deposition_path,
         gdal.GDT_Float32, [sediment_deposition_nodata])
     pygeoprocessing.new_raster_from_base(
         mfd_flow_direction_path, f_path,
-        gdal.GDT_Float32, [sediment_deposition_nodata])
+        gdal.GDT_Float32, [sediment_deposition_nodata],
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(f_path)))
 
+    raster_cache_mb = managed_raster.get_raster_cache_mb(5, cache_mb)
     cdef _ManagedRaster mfd_flow_direction_raster = _ManagedRaster(
-        mfd_flow_direction_path, 1, False)
+        mfd_flow_direction_path, 1, False, MANAGED_RASTER_N_BLOCKS,
+        raster_cache_mb)
     cdef _ManagedRaster e_prime_raster = _ManagedRaster(
-        e_prime_path, 1, False)
-    cdef _ManagedRaster sdr_raster = _ManagedRaster(sdr_path, 1, False)
-    cdef _ManagedRaster f_raster = _ManagedRaster(f_path, 1, True)
+        e_prime_path, 1, False, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
+    cdef _ManagedRaster sdr_raster = _ManagedRaster(
+        sdr_path, 1, False, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
+    cdef _ManagedRaster f_raster = _ManagedRaster(
+        f_path, 1, True, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
     cdef _ManagedRaster sediment_deposition_raster = _ManagedRaster(
-        target_sediment_deposition_path, 1, True)
-
-    cdef int *inflow_offsets = [4, 5, 6, 7, 0, 1, 2, 3]
+        target_sediment_deposition_path, 1, True, MANAGED_RASTER_N_BLOCKS,
+        raster_cache_mb)
 
     cdef int n_cols, n_rows
     flow_dir_info = pygeoprocessing.get_raster_info(mfd_flow_direction_path)
@@ -405,12 +171,13 @@ def calculate_sediment_deposition(
     cdef int global_col, global_row, flat_index, j, k
     cdef int seed_col = 0
     cdef int seed_row = 0
-    cdef int neighbor_row, neighbor_col
+    cdef int seed_pixel, upstream_neighbors_processed
+    cdef int neighbor_row, neighbor_col, ds_neighbor_row, ds_neighbor_col
     cdef int flow_val, neighbor_flow_val, ds_neighbor_flow_val
     cdef int flow_weight, neighbor_flow_weight
-    cdef float flow_sum, neighbor_flow_sum
     cdef float downstream_sdr_weighted_sum, sdr_i, sdr_j
     cdef float p_j, p_val
+    cdef double f_j, f_j_weighted_sum, e_prime_i, r_i, f_i
 
     for offset_dict in pygeoprocessing.iterblocks(
             (mfd_flow_direction_path, 1), offset_only=True, largest_block=0):
@@ -442,7 +209,7 @@ def calculate_sediment_deposition(
                     if neighbor_flow_val == 0:
                         continue
                     neighbor_flow_weight = (
-                        neighbor_flow_val >> (inflow_offsets[j]*4)) & 0xF
+                        neighbor_flow_val >> (INFLOW_OFFSETS[j]*4)) & 0xF
                     if neighbor_flow_weight > 0:
                         # neighbor flows in, not a seed
                         seed_pixel = 0
@@ -476,14 +243,11 @@ def calculate_sediment_deposition(
                             <int>mfd_flow_direction_raster.get(
                                 neighbor_col, neighbor_row))
                         neighbor_flow_weight = (
-                            neighbor_flow_val >> (inflow_offsets[j]*4)) & 0xF
+                            neighbor_flow_val >> (INFLOW_OFFSETS[j]*4)) & 0xF
                         if neighbor_flow_weight > 0:
                             f_j = f_raster.get(neighbor_col, neighbor_row)
-                            neighbor_flow_sum = 0
-                            for k in range(8):
-                                neighbor_flow_sum += (
-                                    neighbor_flow_val >> (k*4)) & 0xF
-                            p_val = neighbor_flow_weight / neighbor_flow_sum
+                            p_val = _flow_fraction(
+                                neighbor_flow_val, neighbor_flow_weight)
                             f_j_weighted_sum += p_val * f_j
 
                     # calculate the differential downstream change in sdr
@@ -491,9 +255,6 @@ def calculate_sediment_deposition(
                     downstream_sdr_weighted_sum = 0.0
                     flow_val = <int>mfd_flow_direction_raster.get(
                         global_col, global_row)
-                    flow_sum = 0.0
-                    for k in range(8):
-                        flow_sum += (flow_val >> (k*4)) & 0xF
 
                     for j in range(8):
                         neighbor_row = global_row + ROW_OFFSETS[j]
@@ -513,7 +274,7 @@ def calculate_sediment_deposition(
                                 sdr_j = 1.0
                             if sdr_j == sdr_nodata:
                                 sdr_j = 0.0
-                            p_j = flow_weight / flow_sum
+                            p_j = _flow_fraction(flow_val, flow_weight)
                             downstream_sdr_weighted_sum += sdr_j * p_j
 
                             # if there is a downstream neighbor it
@@ -522,7 +283,7 @@ def calculate_sediment_deposition(
                             # completed
                             upstream_neighbors_processed = 1
                             for k in range(8):
-                                if inflow_offsets[k] == j:
+                                if INFLOW_OFFSETS[k] == j:
                                     # we don't need to process the one
                                     # we're currently calculating
                                     continue
@@ -539,7 +300,7 @@ def calculate_sediment_deposition(
                                     <int>mfd_flow_direction_raster.get(
                                         ds_neighbor_col, ds_neighbor_row))
                                 if (ds_neighbor_flow_val >> (
-                                        inflow_offsets[k]*4)) & 0xF > 0:
+                                        INFLOW_OFFSETS[k]*4)) & 0xF > 0:
                                     if sediment_deposition_raster.get(
                                             ds_neighbor_col,
                                             ds_neighbor_row) == (
@@ -560,23 +321,279 @@ def calculate_sediment_deposition(
                     if e_prime_i == e_prime_nodata:
                         e_prime_i = 0.0
 
-                    if downstream_sdr_weighted_sum < sdr_i:
-                        # i think this happens because of our low resolution
-                        # flow direction, it's okay to zero out.
-                        downstream_sdr_weighted_sum = sdr_i
-                    d_ri = (downstream_sdr_weighted_sum - sdr_i) / (1 - sdr_i)
-                    r_i = d_ri * (e_prime_i + f_j_weighted_sum)
-                    f_i = (1-d_ri) * (e_prime_i + f_j_weighted_sum)
+                    _deposition_and_flux(
+                        e_prime_i, f_j_weighted_sum, sdr_i,
+                        downstream_sdr_weighted_sum, &r_i, &f_i)
+                    # values are rounded to the precision they're stored at
+                    # so that they don't depend on when a block is evicted
+                    # from the cache and so match the tiled route exactly
                     sediment_deposition_raster.set(
-                        global_col, global_row, r_i)
-                    f_raster.set(global_col, global_row, f_i)
+                        global_col, global_row, <float>r_i)
+                    f_raster.set(global_col, global_row, <float>f_i)
 
     LOGGER.info('100% complete')
     sediment_deposition_raster.close()
 
 
+def _calculate_sediment_deposition_tiled(
+        mfd_flow_direction_path, e_prime_path, f_path, sdr_path,
+        target_sediment_deposition_path, n_workers, tile_size):
+    """Route sediment deposition in tiles on a pool of threads.
+
+    Tiles are routed in rounds by ``tile_routing.route_tiles``.  Every
+    pixel is calculated from exactly the same upstream values as in the
+    serial route, so the results are identical.  The working deposition and
+    flux arrays are copied to ``target_sediment_deposition_path`` and
+    ``f_path`` at the end.
+
+    See ``calculate_sediment_deposition`` for the parameters.
+    """
+    flow_dir_info = pygeoprocessing.get_raster_info(mfd_flow_direction_path)
+    n_cols, n_rows = flow_dir_info['raster_size']
+    sdr_nodata = pygeoprocessing.get_raster_info(sdr_path)['nodata'][0]
+    e_prime_nodata = pygeoprocessing.get_raster_info(
+        e_prime_path)['nodata'][0]
+
+    working_dir = tempfile.mkdtemp(
+        prefix='sediment_deposition_',
+        dir=os.path.dirname(target_sediment_deposition_path))
+    try:
+        work_array_list = [
+            tile_routing.create_work_array(
+                working_dir, key, n_rows, n_cols, SEDIMENT_DEPOSITION_NODATA)
+            for key in ('f', 'sediment_deposition')]
+        tile_routing.route_tiles(
+            functools.partial(
+                _route_sediment_deposition_tile, mfd_flow_direction_path,
+                e_prime_path, sdr_path, work_array_list, n_cols, n_rows,
+                sdr_nodata, e_prime_nodata),
+            work_array_list, n_cols, n_rows, n_workers, tile_size=tile_size,
+            label='sediment deposition')
+
+        for work_array, target_path in zip(
+                work_array_list, (f_path, target_sediment_deposition_path)):
+            tile_routing.write_work_array(
+                work_array, mfd_flow_direction_path, target_path,
+                SEDIMENT_DEPOSITION_NODATA)
+        LOGGER.info('100% complete')
+    finally:
+        work_array_list = None
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def _route_sediment_deposition_tile(
+        mfd_flow_direction_path, e_prime_path, sdr_path, work_array_list,
+        n_cols, n_rows, sdr_nodata, e_prime_nodata, tile, halo_list):
+    """Route sediment deposition through as much of one tile as possible.
+
+    Parameters:
+        mfd_flow_direction_path, e_prime_path, sdr_path (string): paths to
+            the input rasters of ``calculate_sediment_deposition``.
+        work_array_list (list): the memory-mapped f and sediment deposition
+            working arrays.  Only the tile's own window is written.
+        n_cols, n_rows (int): the size of the raster.
+        sdr_nodata, e_prime_nodata (float): nodata values of the inputs.
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+        halo_list (list): (slice, [f array, sediment deposition array])
+            tuples holding the ring of pixels around the tile as they were
+            at the start of the round.
+
+    Returns:
+        A (n_processed, n_pending) tuple of the number of pixels routed in
+        this call and the number of pixels in the tile that are still
+        waiting on upstream pixels in other tiles.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    flow_dir_array = tile_routing.read_tile_window(
+        mfd_flow_direction_path, tile, n_cols, n_rows, numpy.int32)
+    e_prime_array = tile_routing.read_tile_window(
+        e_prime_path, tile, n_cols, n_rows, numpy.float64)
+    sdr_array = tile_routing.read_tile_window(
+        sdr_path, tile, n_cols, n_rows, numpy.float64)
+    f_array, sediment_deposition_array = (
+        tile_routing.load_tile_work_arrays(
+            work_array_list, tile, halo_list, SEDIMENT_DEPOSITION_NODATA))
+
+    cdef long n_pending = 0
+    cdef long n_processed = _route_sediment_deposition_window(
+        flow_dir_array, e_prime_array, sdr_array, f_array,
+        sediment_deposition_array, xoff, yoff, win_xsize, win_ysize, n_cols,
+        n_rows, sdr_nodata, e_prime_nodata, &n_pending)
+
+    if n_processed > 0:
+        tile_routing.store_tile_work_arrays(
+            work_array_list, [f_array, sediment_deposition_array], tile)
+    return n_processed, n_pending
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _pixel_state(
+        int[:, :] flow_dir, float[:, :] sediment_deposition,
+        int row, int col, int yoff, int xoff, int n_rows,
+        int n_cols) nogil:
+    """Classify a local pixel of a tile for routing.
+
+    Returns:
+        1 if every upstream neighbor has been routed, 0 if some have not,
+        or -1 if the pixel is never routed because it neither flows nor has
+        any inflow.
+    """
+    cdef int j, neighbor_row, neighbor_col
+    cdef int has_inflow = 0
+    for j in range(8):
+        neighbor_row = row + ROW_OFFSETS[j]
+        if neighbor_row+yoff-1 < 0 or neighbor_row+yoff-1 >= n_rows:
+            continue
+        neighbor_col = col + COL_OFFSETS[j]
+        if neighbor_col+xoff-1 < 0 or neighbor_col+xoff-1 >= n_cols:
+            continue
+        if (flow_dir[neighbor_row, neighbor_col] >> (
+                INFLOW_OFFSETS[j]*4)) & 0xF > 0:
+            has_inflow = 1
+            if (sediment_deposition[neighbor_row, neighbor_col] ==
+                    SEDIMENT_DEPOSITION_NODATA):
+                return 0
+    if has_inflow or flow_dir[row, col] != 0:
+        return 1
+    return -1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef long _route_sediment_deposition_window(
+        int[:, :] flow_dir, double[:, :] e_prime, double[:, :] sdr,
+        float[:, :] f, float[:, :] sediment_deposition,
+        int xoff, int yoff, int win_xsize, int win_ysize, int n_cols,
+        int n_rows, float sdr_nodata, float e_prime_nodata,
+        long *n_pending):
+    """Route sediment deposition through the pixels of one tile.
+
+    The arrays are the tile with a 1 pixel border in which ``f`` and
+    ``sediment_deposition`` hold the neighboring tiles' known values.  This
+    is the same calculation as ``_calculate_sediment_deposition_serial``
+    except that pixels downstream of the tile are left for its neighbor.
+
+    Returns:
+        The number of pixels routed; ``n_pending`` is set to the number of
+        pixels left waiting on upstream pixels outside of the tile.
+    """
+    cdef stack[int] processing_stack
+    cdef int local_cols = win_xsize + 2
+    cdef long n_processed = 0
+    cdef int row_index, col_index, row, col, j
+    cdef int neighbor_row, neighbor_col
+    cdef int flow_val, neighbor_flow_val, flow_weight, neighbor_flow_weight
+    cdef float downstream_sdr_weighted_sum, sdr_i, sdr_j, p_j, p_val
+    cdef double f_j, f_j_weighted_sum, e_prime_i, r_i, f_i
+
+    with nogil:
+        for row_index in range(1, win_ysize+1):
+            for col_index in range(1, win_xsize+1):
+                if (sediment_deposition[row_index, col_index] !=
+                        SEDIMENT_DEPOSITION_NODATA):
+                    continue
+                if _pixel_state(
+                        flow_dir, sediment_deposition, row_index,
+                        col_index, yoff, xoff, n_rows, n_cols) != 1:
+                    continue
+                processing_stack.push(row_index * local_cols + col_index)
+
+                while processing_stack.size() > 0:
+                    row = processing_stack.top() // local_cols
+                    col = processing_stack.top() % local_cols
+                    processing_stack.pop()
+
+                    f_j_weighted_sum = 0
+                    for j in range(8):
+                        neighbor_row = row + ROW_OFFSETS[j]
+                        if (neighbor_row+yoff-1 < 0 or
+                                neighbor_row+yoff-1 >= n_rows):
+                            continue
+                        neighbor_col = col + COL_OFFSETS[j]
+                        if (neighbor_col+xoff-1 < 0 or
+                                neighbor_col+xoff-1 >= n_cols):
+                            continue
+                        neighbor_flow_val = flow_dir[
+                            neighbor_row, neighbor_col]
+                        neighbor_flow_weight = (
+                            neighbor_flow_val >> (INFLOW_OFFSETS[j]*4)) & 0xF
+                        if neighbor_flow_weight > 0:
+                            f_j = f[neighbor_row, neighbor_col]
+                            p_val = _flow_fraction(
+                                neighbor_flow_val, neighbor_flow_weight)
+                            f_j_weighted_sum += p_val * f_j
+
+                    downstream_sdr_weighted_sum = 0.0
+                    flow_val = flow_dir[row, col]
+                    for j in range(8):
+                        neighbor_row = row + ROW_OFFSETS[j]
+                        if (neighbor_row+yoff-1 < 0 or
+                                neighbor_row+yoff-1 >= n_rows):
+                            continue
+                        neighbor_col = col + COL_OFFSETS[j]
+                        if (neighbor_col+xoff-1 < 0 or
+                                neighbor_col+xoff-1 >= n_cols):
+                            continue
+                        flow_weight = (flow_val >> (j*4)) & 0xF
+                        if flow_weight > 0:
+                            sdr_j = sdr[neighbor_row, neighbor_col]
+                            if sdr_j == 0.0:
+                                sdr_j = 1.0
+                            if sdr_j == sdr_nodata:
+                                sdr_j = 0.0
+                            p_j = _flow_fraction(flow_val, flow_weight)
+                            downstream_sdr_weighted_sum += sdr_j * p_j
+
+                    sdr_i = sdr[row, col]
+                    if sdr_i == sdr_nodata:
+                        sdr_i = 0.0
+                    e_prime_i = e_prime[row, col]
+                    if e_prime_i == e_prime_nodata:
+                        e_prime_i = 0.0
+
+                    _deposition_and_flux(
+                        e_prime_i, f_j_weighted_sum, sdr_i,
+                        downstream_sdr_weighted_sum, &r_i, &f_i)
+                    sediment_deposition[row, col] = <float>r_i
+                    f[row, col] = <float>f_i
+                    n_processed += 1
+
+                    # push the downstream pixels in this tile that are now
+                    # ready, the rest are picked up by their own tile
+                    for j in range(8):
+                        if (flow_val >> (j*4)) & 0xF == 0:
+                            continue
+                        neighbor_row = row + ROW_OFFSETS[j]
+                        neighbor_col = col + COL_OFFSETS[j]
+                        if (neighbor_row < 1 or neighbor_row > win_ysize or
+                                neighbor_col < 1 or
+                                neighbor_col > win_xsize):
+                            continue
+                        if (sediment_deposition[neighbor_row, neighbor_col]
+                                != SEDIMENT_DEPOSITION_NODATA):
+                            continue
+                        if _pixel_state(
+                                flow_dir, sediment_deposition, neighbor_row,
+                                neighbor_col, yoff, xoff, n_rows,
+                                n_cols) == 1:
+                            processing_stack.push(
+                                neighbor_row * local_cols + neighbor_col)
+
+        n_pending[0] = 0
+        for row_index in range(1, win_ysize+1):
+            for col_index in range(1, win_xsize+1):
+                if (sediment_deposition[row_index, col_index] ==
+                        SEDIMENT_DEPOSITION_NODATA and _pixel_state(
+                            flow_dir, sediment_deposition, row_index,
+                            col_index, yoff, xoff, n_rows, n_cols) == 0):
+                    n_pending[0] += 1
+    return n_processed
+
+
 def calculate_average_aspect(
-    mfd_flow_direction_path, target_average_aspect_path):
+    mfd_flow_direction_path, target_average_aspect_path, cache_mb=None):
     """Calculate the Weighted Average Aspect Ratio from MFD.
 
     Calculates the average aspect ratio weighted by proportional flow
@@ -587,6 +604,8 @@ def calculate_average_aspect(
             raster.
         target_average_aspect_path (string): The path to where the calculated
             weighted average aspect raster should be written.
+        cache_mb (number): optional memory budget in megabytes for the raster
+            block caches used by this function.
 
     Returns:
         ``None``.
@@ -605,11 +624,14 @@ def calculate_average_aspect(
     cdef int n_cols, n_rows
     n_cols, n_rows = flow_direction_info['raster_size']
 
+    raster_cache_mb = managed_raster.get_raster_cache_mb(2, cache_mb)
     cdef _ManagedRaster mfd_flow_direction_raster = _ManagedRaster(
-        mfd_flow_direction_path, 1, False)
+        mfd_flow_direction_path, 1, False, MANAGED_RASTER_N_BLOCKS,
+        raster_cache_mb)
 
     cdef _ManagedRaster average_aspect_raster = _ManagedRaster(
-        target_average_aspect_path, 1, True)
+        target_average_aspect_path, 1, True, MANAGED_RASTER_N_BLOCKS,
+        raster_cache_mb)
 
     cdef int seed_row = 0
     cdef int seed_col = 0
@@ -13,6 +13,7 @@ import pygeoprocessing
 import pygeoprocessing.routing
 import taskgraph
 
+from .. import managed_raster
 from .. import utils
 from .. import validation
 
@@ -23,6 +24,7 @@ gdal.SetCacheMax(2**26)
 LOGGER = logging.getLogger(__name__)
 
 TARGET_NODATA = -1
+_KC_NODATA = -1  # a reasonable nodata value
 N_MONTHS = 12
 MONTH_ID_TO_LABEL = [
     'jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct',
@@ -459,6 +461,19 @@ def _execute(args):
         [(_OUTPUT_BASE_FILES, output_dir),
          (_INTERMEDIATE_BASE_FILES, intermediate_output_dir),
          (_TMP_BASE_FILES, cache_dir)], file_suffix)
+    # the local recharge core is the only reader of the monthly Kc rasters
+    # and of the climate rasters it is handed, so these may be uncompressed
+    # memory-mapped scratch rasters; the aligned climate rasters themselves
+    # are also read by the quickflow calculation and stay GeoTIFFs
+    file_registry['kc_path_list'] = [
+        managed_raster.get_scratch_path(path)
+        for path in file_registry['kc_path_list']]
+    for aligned_key, core_key in [
+            ('precip_path_aligned_list', 'precip_path_core_list'),
+            ('et0_path_aligned_list', 'et0_path_core_list')]:
+        file_registry[core_key] = [
+            managed_raster.get_scratch_path(path)
+            for path in file_registry[aligned_key]]
 
     LOGGER.info('Checking that the AOI is not the output aggregate vector')
     if (os.path.normpath(args['aoi_path']) ==
@@ -684,27 +699,45 @@ def _execute(args):
             kc_lookup = dict([
                 (lucode, biophysical_table[lucode]['kc_%d' % (month_index+1)])
                 for lucode in biophysical_table])
-            kc_nodata = -1  # a reasonable nodata value
+            kc_path = file_registry['kc_path_list'][month_index]
             kc_task = task_graph.add_task(
-                func=pygeoprocessing.reclassify_raster,
-                args=(
-                    (file_registry['lulc_aligned_path'], 1), kc_lookup,
-                    file_registry['kc_path_list'][month_index],
-                    gdal.GDT_Float32, kc_nodata),
-                target_path_list=[file_registry['kc_path_list'][month_index]],
+                func=_calculate_monthly_kc,
+                args=(file_registry['lulc_aligned_path'], kc_lookup, kc_path),
+                target_path_list=(
+                    [kc_path] + managed_raster.get_sidecar_path_list(kc_path)),
                 dependent_task_list=[align_task],
                 hash_algorithm='md5',
                 copy_duplicate_artifact=True,
                 task_name='classify kc month %d' % month_index)
             kc_task_list.append(kc_task)
 
+        core_copy_task_list = []
+        for aligned_key, core_key in [
+                ('precip_path_aligned_list', 'precip_path_core_list'),
+                ('et0_path_aligned_list', 'et0_path_core_list')]:
+            for aligned_path, core_path in zip(
+                    file_registry[aligned_key], file_registry[core_key]):
+                if core_path == aligned_path:
+                    # not in raw scratch mode, the core reads the original
+                    continue
+                core_copy_task = task_graph.add_task(
+                    func=_copy_to_scratch,
+                    args=(aligned_path, core_path),
+                    target_path_list=(
+                        [core_path] +
+                        managed_raster.get_sidecar_path_list(core_path)),
+                    dependent_task_list=[align_task],
+                    task_name='copy %s to scratch' % os.path.basename(
+                        aligned_path))
+                core_copy_task_list.append(core_copy_task)
+
         # call through to a cython function that does the necessary routing
         # between AET and L.sum.avail in equation [7], [4], and [3]
         calculate_local_recharge_task = task_graph.add_task(
             func=seasonal_water_yield_core.calculate_local_recharge,
             args=(
-                file_registry['precip_path_aligned_list'],
-                file_registry['et0_path_aligned_list'],
+                file_registry['precip_path_core_list'],
+                file_registry['et0_path_core_list'],
                 file_registry['qfm_path_list'],
                 file_registry['flow_dir_mfd_path'],
                 file_registry['kc_path_list'],
@@ -714,6 +747,7 @@ def _execute(args):
                 file_registry['l_avail_path'],
                 file_registry['l_sum_avail_path'],
                 file_registry['aet_path']),
+            kwargs={'n_workers': n_workers},
             target_path_list=[
                 file_registry['l_path'],
                 file_registry['l_avail_path'],
@@ -721,7 +755,8 @@ def _execute(args):
                 file_registry['aet_path']],
             dependent_task_list=[
                 align_task, flow_dir_task, stream_threshold_task,
-                fill_pit_task, qf_task] + quick_flow_task_list,
+                fill_pit_task, qf_task] + quick_flow_task_list +
+            kc_task_list + core_copy_task_list,
             task_name='calculate local recharge')
 
     #calculate Qb as the sum of local_recharge_avail over the AOI, Eq [9]
@@ -831,6 +866,79 @@ def _calculate_vri(l_path, target_vri_path):
         li_nodata)
 
 
+def _calculate_monthly_kc(lulc_path, kc_lookup, target_kc_path):
+    """Map the LULC codes of a raster to a month's crop factor.
+
+    Parameters:
+        lulc_path (str): path to the aligned LULC raster.
+        kc_lookup (dict): maps each LULC code to its Kc for the month.
+        target_kc_path (str): path to the Kc raster created by this call.
+            A raw scratch path is written in the raw scratch format.
+
+    Returns:
+        None.
+
+    Raises:
+        ValueError if a valid LULC code is missing from ``kc_lookup``.
+
+    """
+    lulc_nodata = pygeoprocessing.get_raster_info(lulc_path)['nodata'][0]
+    lucode_array = numpy.array(sorted(kc_lookup))
+    kc_array = numpy.array(
+        [kc_lookup[lucode] for lucode in lucode_array], dtype=numpy.float32)
+
+    def kc_op(lulc_array):
+        """Look up the Kc of each valid LULC pixel."""
+        result = numpy.empty(lulc_array.shape, dtype=numpy.float32)
+        result[:] = _KC_NODATA
+        if lulc_nodata is not None:
+            valid_mask = lulc_array != lulc_nodata
+        else:
+            valid_mask = numpy.ones(lulc_array.shape, dtype=bool)
+        valid_lulc_array = lulc_array[valid_mask]
+        index_array = numpy.searchsorted(
+            lucode_array, valid_lulc_array).clip(max=len(lucode_array)-1)
+        missing_mask = lucode_array[index_array] != valid_lulc_array
+        if missing_mask.any():
+            raise ValueError(
+                'The following LULC codes are missing from the biophysical '
+                'table: %s' % sorted(set(
+                    valid_lulc_array[missing_mask].tolist())))
+        result[valid_mask] = kc_array[index_array]
+        return result
+
+    pygeoprocessing.raster_calculator(
+        [(lulc_path, 1)], kc_op, target_kc_path, gdal.GDT_Float32,
+        _KC_NODATA,
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(target_kc_path)))
+
+
+def _copy_to_scratch(base_raster_path, target_raster_path):
+    """Copy the first band of a raster to a raw scratch raster.
+
+    Parameters:
+        base_raster_path (str): path to the raster to copy.
+        target_raster_path (str): path to the raw scratch raster created by
+            this call, with the same type and nodata as the base.
+
+    Returns:
+        None.
+
+    """
+    base_info = pygeoprocessing.get_raster_info(base_raster_path)
+
+    def identity_op(base_array):
+        """Pass the block through unchanged."""
+        return base_array
+
+    pygeoprocessing.raster_calculator(
+        [(base_raster_path, 1)], identity_op, target_raster_path,
+        base_info['datatype'], base_info['nodata'][0],
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(target_raster_path)))
+
+
 def _calculate_annual_qfi(qfm_path_list, target_qf_path):
     """Calculate annual quickflow.
 
@@ -3,8 +3,11 @@
 import logging
 import os
 import collections
+import functools
+import shutil
 import sys
 import gc
+import tempfile
 import pygeoprocessing
 
 import numpy
@@ -13,34 +16,23 @@ cimport cython
 from osgeo import gdal
 from osgeo import ogr
 from osgeo import osr
-from cython.operator cimport dereference as deref
 
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
-from cython.operator cimport dereference as deref
-from cython.operator cimport preincrement as inc
-from libcpp.list cimport list as clist
-from libcpp.set cimport set as cset
 from libcpp.pair cimport pair
 from libcpp.stack cimport stack
 from libcpp.queue cimport queue
 
+from natcap.invest.managed_raster cimport _ManagedRaster
+from .. import managed_raster
+from .. import tile_routing
+
+from libc.math cimport fabs
 from libc.time cimport time as ctime
 cdef extern from "time.h" nogil:
     ctypedef int time_t
     time_t time(time_t*)
 
-cdef int is_close(double x, double y):
-    return abs(x-y) <= (1e-8+1e-05*abs(y))
-
-cdef extern from "LRUCache.h":
-    cdef cppclass LRUCache[KEY_T, VAL_T]:
-        LRUCache(int)
-        void put(KEY_T&, VAL_T&, clist[pair[KEY_T,VAL_T]]&)
-        clist[pair[KEY_T,VAL_T]].iterator begin()
-        clist[pair[KEY_T,VAL_T]].iterator end()
-        bint exist(KEY_T &)
-        VAL_T get(KEY_T &)
-
+cdef inline int is_close(double x, double y) nogil:
+    return fabs(x-y) <= (1e-8+1e-05*fabs(y))
 
 LOGGER = logging.getLogger(__name__)
 
@@ -69,311 +61,36 @@ cdef int* NEIGHBOR_OFFSET_ARRAY = [
 # cell.
 cdef int* FLOW_DIR_REVERSE_DIRECTION = [4, 5, 6, 7, 0, 1, 2, 3]
 
-# this ctype is used to store the block ID and the block buffer as one object
-# inside Managed Raster
-ctypedef pair[int, double*] BlockBufferPair
-
 # Number of raster blocks to hold in memory at once per Managed Raster
 cdef int MANAGED_RASTER_N_BLOCKS = 2**4
 
-# a class to allow fast random per-pixel access to a raster for both setting
-# and reading pixels.  Copied from src/pygeoprocessing/routing/routing.pyx,
-# revision 891288683889237cfd3a3d0a1f09483c23489fca.
-cdef class _ManagedRaster:
-    cdef LRUCache[int, double*]* lru_cache
-    cdef cset[int] dirty_blocks
-    cdef int block_xsize
-    cdef int block_ysize
-    cdef int block_xmod
-    cdef int block_ymod
-    cdef int block_xbits
-    cdef int block_ybits
-    cdef long raster_x_size
-    cdef long raster_y_size
-    cdef int block_nx
-    cdef int block_ny
-    cdef int write_mode
-    cdef bytes raster_path
-    cdef int band_id
-    cdef int closed
-
-    def __cinit__(self, raster_path, band_id, write_mode):
-        """Create new instance of Managed Raster.
-
-        Parameters:
-            raster_path (char*): path to raster that has block sizes that are
-                powers of 2. If not, an exception is raised.
-            band_id (int): which band in `raster_path` to index. Uses GDAL
-                notation that starts at 1.
-            write_mode (boolean): if true, this raster is writable and dirty
-                memory blocks will be written back to the raster as blocks
-                are swapped out of the cache or when the object deconstructs.
+cdef double LOCAL_RECHARGE_NODATA = -1e32
+# Width and height in pixels of a tile when local recharge is routed in
+# parallel.  Smaller than the sediment deposition tiles because each tile
+# holds all 12 months of 4 monthly inputs.
+PARALLEL_TILE_SIZE = 2**9
 
-        Returns:
-            None.
-        """
-        raster_info = pygeoprocessing.get_raster_info(raster_path)
-        self.raster_x_size, self.raster_y_size = raster_info['raster_size']
-        self.block_xsize, self.block_ysize = raster_info['block_size']
-        self.block_xmod = self.block_xsize-1
-        self.block_ymod = self.block_ysize-1
-
-        if not (1 <= band_id <= raster_info['n_bands']):
-            err_msg = (
-                "Error: band ID (%s) is not a valid band number. "
-                "This exception is happening in Cython, so it will cause a "
-                "hard seg-fault, but it's otherwise meant to be a "
-                "ValueError." % (band_id))
-            print(err_msg)
-            raise ValueError(err_msg)
-        self.band_id = band_id
-
-        if (self.block_xsize & (self.block_xsize - 1) != 0) or (
-                self.block_ysize & (self.block_ysize - 1) != 0):
-            # If inputs are not a power of two, this will at least print
-            # an error message. Unfortunately with Cython, the exception will
-            # present itself as a hard seg-fault, but I'm leaving the
-            # ValueError in here at least for readability.
-            err_msg = (
-                "Error: Block size is not a power of two: "
-                "block_xsize: %d, %d, %s. This exception is happening"
-                "in Cython, so it will cause a hard seg-fault, but it's"
-                "otherwise meant to be a ValueError." % (
-                    self.block_xsize, self.block_ysize, raster_path))
-            print(err_msg)
-            raise ValueError(err_msg)
-
-        self.block_xbits = numpy.log2(self.block_xsize)
-        self.block_ybits = numpy.log2(self.block_ysize)
-        self.block_nx = (
-            self.raster_x_size + (self.block_xsize) - 1) / self.block_xsize
-        self.block_ny = (
-            self.raster_y_size + (self.block_ysize) - 1) / self.block_ysize
-
-        self.lru_cache = new LRUCache[int, double*](MANAGED_RASTER_N_BLOCKS)
-        self.raster_path = <bytes> raster_path
-        self.write_mode = write_mode
-        self.closed = 0
-
-    def __dealloc__(self):
-        """Deallocate _ManagedRaster.
-
-        This operation manually frees memory from the LRUCache and writes any
-        dirty memory blocks back to the raster if `self.write_mode` is True.
-        """
-        self.close()
-
-    def close(self):
-        """Close the _ManagedRaster and free up resources.
-
-            This call writes any dirty blocks to disk, frees up the memory
-            allocated as part of the cache, and frees all GDAL references.
-
-            Any subsequent calls to any other functions in _ManagedRaster will
-            have undefined behavior.
-        """
-        if self.closed:
-            return
-        self.closed = 1
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize))
-        cdef double *double_buffer
-        cdef int block_xi
-        cdef int block_yi
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize
-        cdef int win_ysize
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff
-        cdef int yoff
-
-        cdef clist[BlockBufferPair].iterator it = self.lru_cache.begin()
-        cdef clist[BlockBufferPair].iterator end = self.lru_cache.end()
-        if not self.write_mode:
-            while it != end:
-                # write the changed value back if desired
-                PyMem_Free(deref(it).second)
-                inc(it)
-            return
-
-        raster = gdal.OpenEx(
-            self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-
-        # if we get here, we're in write_mode
-        cdef cset[int].iterator dirty_itr
-        while it != end:
-            double_buffer = deref(it).second
-            block_index = deref(it).first
-
-            # write to disk if block is dirty
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr != self.dirty_blocks.end():
-                self.dirty_blocks.erase(dirty_itr)
-                block_xi = block_index % self.block_nx
-                block_yi = block_index / self.block_nx
-
-                # we need the offsets to subtract from global indexes for
-                # cached array
-                xoff = block_xi << self.block_xbits
-                yoff = block_yi << self.block_ybits
-
-                win_xsize = self.block_xsize
-                win_ysize = self.block_ysize
-
-                # clip window sizes if necessary
-                if xoff+win_xsize > self.raster_x_size:
-                    win_xsize = win_xsize - (
-                        xoff+win_xsize - self.raster_x_size)
-                if yoff+win_ysize > self.raster_y_size:
-                    win_ysize = win_ysize - (
-                        yoff+win_ysize - self.raster_y_size)
-
-                for xi_copy in xrange(win_xsize):
-                    for yi_copy in xrange(win_ysize):
-                        block_array[yi_copy, xi_copy] = (
-                            double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy])
-                raster_band.WriteArray(
-                    block_array[0:win_ysize, 0:win_xsize],
-                    xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            inc(it)
-        raster_band.FlushCache()
-        raster_band = None
-        raster = None
-
-    cdef inline void set(self, long xi, long yi, double value):
-        """Set the pixel at `xi,yi` to `value`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))] = value
-        if self.write_mode:
-            dirty_itr = self.dirty_blocks.find(block_index)
-            if dirty_itr == self.dirty_blocks.end():
-                self.dirty_blocks.insert(block_index)
-
-    cdef inline double get(self, long xi, long yi):
-        """Return the value of the pixel at `xi,yi`."""
-        cdef int block_xi = xi >> self.block_xbits
-        cdef int block_yi = yi >> self.block_ybits
-        # this is the flat index for the block
-        cdef int block_index = block_yi * self.block_nx + block_xi
-        if not self.lru_cache.exist(block_index):
-            self._load_block(block_index)
-        return self.lru_cache.get(
-            block_index)[
-                ((yi & (self.block_ymod))<<self.block_xbits) +
-                (xi & (self.block_xmod))]
-
-    cdef void _load_block(self, int block_index) except *:
-        cdef int block_xi = block_index % self.block_nx
-        cdef int block_yi = block_index / self.block_nx
-
-        # we need the offsets to subtract from global indexes for cached array
-        cdef int xoff = block_xi << self.block_xbits
-        cdef int yoff = block_yi << self.block_ybits
-
-        cdef int xi_copy, yi_copy
-        cdef numpy.ndarray[double, ndim=2] block_array
-        cdef double *double_buffer
-        cdef clist[BlockBufferPair] removed_value_list
-
-        # determine the block aligned xoffset for read as array
-
-        # initially the win size is the same as the block size unless
-        # we're at the edge of a raster
-        cdef int win_xsize = self.block_xsize
-        cdef int win_ysize = self.block_ysize
-
-        # load a new block
-        if xoff+win_xsize > self.raster_x_size:
-            win_xsize = win_xsize - (xoff+win_xsize - self.raster_x_size)
-        if yoff+win_ysize > self.raster_y_size:
-            win_ysize = win_ysize - (yoff+win_ysize - self.raster_y_size)
-
-        raster = gdal.OpenEx(self.raster_path, gdal.OF_RASTER)
-        raster_band = raster.GetRasterBand(self.band_id)
-        block_array = raster_band.ReadAsArray(
-            xoff=xoff, yoff=yoff, win_xsize=win_xsize,
-            win_ysize=win_ysize).astype(
-            numpy.float64)
-        raster_band = None
-        raster = None
-        double_buffer = <double*>PyMem_Malloc(
-            (sizeof(double) << self.block_xbits) * win_ysize)
-        for xi_copy in xrange(win_xsize):
-            for yi_copy in xrange(win_ysize):
-                double_buffer[(yi_copy<<self.block_xbits)+xi_copy] = (
-                    block_array[yi_copy, xi_copy])
-        self.lru_cache.put(
-            <int>block_index, <double*>double_buffer, removed_value_list)
-
-        if self.write_mode:
-            raster = gdal.OpenEx(
-                self.raster_path, gdal.GA_Update | gdal.OF_RASTER)
-            raster_band = raster.GetRasterBand(self.band_id)
-
-        block_array = numpy.empty(
-            (self.block_ysize, self.block_xsize), dtype=numpy.double)
-        while not removed_value_list.empty():
-            # write the changed value back if desired
-            double_buffer = removed_value_list.front().second
-
-            if self.write_mode:
-                block_index = removed_value_list.front().first
-
-                # write back the block if it's dirty
-                dirty_itr = self.dirty_blocks.find(block_index)
-                if dirty_itr != self.dirty_blocks.end():
-                    self.dirty_blocks.erase(dirty_itr)
-
-                    block_xi = block_index % self.block_nx
-                    block_yi = block_index / self.block_nx
-
-                    xoff = block_xi << self.block_xbits
-                    yoff = block_yi << self.block_ybits
-
-                    win_xsize = self.block_xsize
-                    win_ysize = self.block_ysize
-
-                    if xoff+win_xsize > self.raster_x_size:
-                        win_xsize = win_xsize - (
-                            xoff+win_xsize - self.raster_x_size)
-                    if yoff+win_ysize > self.raster_y_size:
-                        win_ysize = win_ysize - (
-                            yoff+win_ysize - self.raster_y_size)
-
-                    for xi_copy in xrange(win_xsize):
-                        for yi_copy in xrange(win_ysize):
-                            block_array[yi_copy, xi_copy] = double_buffer[
-                                (yi_copy << self.block_xbits) + xi_copy]
-                    raster_band.WriteArray(
-                        block_array[0:win_ysize, 0:win_xsize],
-                        xoff=xoff, yoff=yoff)
-            PyMem_Free(double_buffer)
-            removed_value_list.pop_front()
-
-        if self.write_mode:
-            raster_band = None
-            raster = None
-
-
-cpdef calculate_local_recharge(
+
+cdef inline double _monthly_aet(
+        float pet_m, float p_m, float qf_m, float alpha_beta_m,
+        double l_sum_avail_i) nogil:
+    """Calculate the actual evapotranspiration of one month (Equation 4/5).
+
+    ``alpha_beta_m`` is alpha_m * beta_i.  The arithmetic is shared by the
+    serial and tiled local recharge so that both give identical results.
+    """
+    cdef double available_m = p_m - qf_m + alpha_beta_m*l_sum_avail_i
+    if available_m < pet_m:
+        return available_m
+    return pet_m
+
+
+def calculate_local_recharge(
         precip_path_list, et0_path_list, qf_m_path_list, flow_dir_mfd_path,
         kc_path_list, alpha_month_map, float beta_i, float gamma, stream_path,
         target_li_path, target_li_avail_path, target_l_sum_avail_path,
-        target_aet_path):
+        target_aet_path, cache_mb=None, n_workers=-1,
+        tile_size=PARALLEL_TILE_SIZE):
     """
     Calculate the rasters defined by equations [3]-[7].
 
@@ -406,10 +123,45 @@ cpdef calculate_local_recharge(
             upstream accumulation of target_li_avail_path.
         target_aet_path (str): created by this call, the annual actual
             evapotranspiration.
+        cache_mb (number): optional memory budget in megabytes for the raster
+            block caches used by this function.  If not provided, the
+            ``NATCAP_INVEST_RASTER_CACHE_MB`` environment variable is used if
+            defined, otherwise a fixed number of blocks is cached per raster.
+            Only used when routing serially.
+        n_workers (int): if 2 or more, the raster is split into tiles of
+            ``tile_size`` pixels on a side that are routed by this many
+            threads, reading the 12 months of each monthly input of a tile
+            at once.  Otherwise the whole raster is routed serially.  Both
+            produce identical results.
+        tile_size (int): the width and height of a tile when routing with
+            ``n_workers`` threads.
 
         Returns:
             None.
 
+    """
+    if n_workers is not None and n_workers >= 2:
+        _calculate_local_recharge_tiled(
+            precip_path_list, et0_path_list, qf_m_path_list,
+            flow_dir_mfd_path, kc_path_list, alpha_month_map, beta_i, gamma,
+            target_li_path, target_li_avail_path, target_l_sum_avail_path,
+            target_aet_path, n_workers, tile_size)
+    else:
+        _calculate_local_recharge_serial(
+            precip_path_list, et0_path_list, qf_m_path_list,
+            flow_dir_mfd_path, kc_path_list, alpha_month_map, beta_i, gamma,
+            target_li_path, target_li_avail_path, target_l_sum_avail_path,
+            target_aet_path, cache_mb)
+
+
+def _calculate_local_recharge_serial(
+        precip_path_list, et0_path_list, qf_m_path_list, flow_dir_mfd_path,
+        kc_path_list, alpha_month_map, float beta_i, float gamma,
+        target_li_path, target_li_avail_path, target_l_sum_avail_path,
+        target_aet_path, cache_mb):
+    """Route local recharge serially through the whole raster.
+
+    See ``calculate_local_recharge`` for the parameters.
     """
     cdef int i_n, flow_dir_nodata, flow_dir_mfd
     cdef int peak_pixel
@@ -419,6 +171,8 @@ cpdef calculate_local_recharge(
     cdef int raster_x_size, raster_y_size
     cdef float pet_m, p_m, qf_m, et0_m, aet_i, p_i, qf_i, l_i, l_avail_i
     cdef float et0_nodata, precip_nodata, qf_nodata, kc_nodata
+    cdef double kc_m, l_sum_avail_i, l_sum_avail_j, l_avail_j
+    cdef int upstream_defined
 
     cdef int j_neighbor_end_index, mfd_dir_sum
     cdef float mfd_direction_array[8]
@@ -439,60 +193,68 @@ cpdef calculate_local_recharge(
     flow_dir_raster_info = pygeoprocessing.get_raster_info(flow_dir_mfd_path)
     flow_dir_nodata = flow_dir_raster_info['nodata'][0]
     raster_x_size, raster_y_size = flow_dir_raster_info['raster_size']
-    cdef _ManagedRaster flow_raster = _ManagedRaster(flow_dir_mfd_path, 1, 0)
+    raster_cache_mb = managed_raster.get_raster_cache_mb(
+        5 + len(et0_path_list) + len(precip_path_list) +
+        len(qf_m_path_list) + len(kc_path_list), cache_mb)
+    cdef _ManagedRaster flow_raster = _ManagedRaster(
+        flow_dir_mfd_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
     et0_m_raster_list = []
     et0_m_nodata_list = []
     for et0_path in et0_path_list:
-        et0_m_raster_list.append(_ManagedRaster(et0_path, 1, 0))
+        et0_m_raster_list.append(_ManagedRaster(
+            et0_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
         et0_m_nodata_list.append(
             pygeoprocessing.get_raster_info(et0_path)['nodata'][0])
 
     precip_m_raster_list = []
     precip_m_nodata_list = []
     for precip_m_path in precip_path_list:
-        precip_m_raster_list.append(_ManagedRaster(precip_m_path, 1, 0))
+        precip_m_raster_list.append(_ManagedRaster(
+            precip_m_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
         precip_m_nodata_list.append(
             pygeoprocessing.get_raster_info(precip_m_path)['nodata'][0])
 
     qf_m_raster_list = []
     qf_m_nodata_list = []
     for qf_m_path in qf_m_path_list:
-        qf_m_raster_list.append(_ManagedRaster(qf_m_path, 1, 0))
+        qf_m_raster_list.append(_ManagedRaster(
+            qf_m_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
         qf_m_nodata_list.append(
             pygeoprocessing.get_raster_info(qf_m_path)['nodata'][0])
 
     kc_m_raster_list = []
     kc_m_nodata_list = []
     for kc_m_path in kc_path_list:
-        kc_m_raster_list.append(_ManagedRaster(kc_m_path, 1, 0))
+        kc_m_raster_list.append(_ManagedRaster(
+            kc_m_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb))
         kc_m_nodata_list.append(
             pygeoprocessing.get_raster_info(kc_m_path)['nodata'][0])
 
-    target_nodata = -1e32
+    target_nodata = LOCAL_RECHARGE_NODATA
     pygeoprocessing.new_raster_from_base(
         flow_dir_mfd_path, target_li_path, gdal.GDT_Float32, [target_nodata],
         fill_value_list=[target_nodata])
     cdef _ManagedRaster target_li_raster = _ManagedRaster(
-        target_li_path, 1, 1)
+        target_li_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
     pygeoprocessing.new_raster_from_base(
         flow_dir_mfd_path, target_li_avail_path, gdal.GDT_Float32,
         [target_nodata], fill_value_list=[target_nodata])
     cdef _ManagedRaster target_li_avail_raster = _ManagedRaster(
-        target_li_avail_path, 1, 1)
+        target_li_avail_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
     pygeoprocessing.new_raster_from_base(
         flow_dir_mfd_path, target_l_sum_avail_path, gdal.GDT_Float32,
         [target_nodata], fill_value_list=[target_nodata])
     cdef _ManagedRaster target_l_sum_avail_raster = _ManagedRaster(
-        target_l_sum_avail_path, 1, 1)
+        target_l_sum_avail_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
     pygeoprocessing.new_raster_from_base(
         flow_dir_mfd_path, target_aet_path, gdal.GDT_Float32, [target_nodata],
         fill_value_list=[target_nodata])
     cdef _ManagedRaster target_aet_raster = _ManagedRaster(
-        target_aet_path, 1, 1)
+        target_aet_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
 
     for offset_dict in pygeoprocessing.iterblocks(
@@ -597,7 +359,10 @@ cpdef calculate_local_recharge(
                             for index in range(j_neighbor_end_index):
                                 l_sum_avail_i += mfd_direction_array[index]
                             l_sum_avail_i /= <float>mfd_dir_sum
-                        target_l_sum_avail_raster.set(xi, yi, l_sum_avail_i)
+                        # stored as it's written to disk, so the result
+                        # doesn't depend on when the block is flushed
+                        target_l_sum_avail_raster.set(
+                            xi, yi, <float>l_sum_avail_i)
                     else:
                         # if not defined, we'll get it on another pass
                         continue
@@ -643,10 +408,9 @@ cpdef calculate_local_recharge(
                             pet_m = kc_m * et0_m
 
                         # Equation 4/5
-                        aet_i += min(
-                            pet_m,
-                            p_m - qf_m +
-                            alpha_month_array[m_index]*beta_i*l_sum_avail_i)
+                        aet_i += _monthly_aet(
+                            pet_m, p_m, qf_m,
+                            alpha_month_array[m_index]*beta_i, l_sum_avail_i)
 
                     target_aet_raster.set(xi, yi, aet_i)
                     l_i = (p_i - qf_i - aet_i)
@@ -670,9 +434,310 @@ cpdef calculate_local_recharge(
                         work_queue.push(pair[int, int](xi_n, yi_n))
 
 
+def _calculate_local_recharge_tiled(
+        precip_path_list, et0_path_list, qf_m_path_list, flow_dir_mfd_path,
+        kc_path_list, alpha_month_map, beta_i, gamma, target_li_path,
+        target_li_avail_path, target_l_sum_avail_path, target_aet_path,
+        n_workers, tile_size):
+    """Route local recharge in tiles on a pool of threads.
+
+    Tiles are routed in rounds by ``tile_routing.route_tiles``.  Each tile
+    reads its window of the 12 monthly rasters of each input into one
+    (rows, cols, 12) array, so a pixel's month loop reads contiguous memory
+    rather than 48 raster caches, and is routed with the GIL released.  The
+    working arrays are copied to the target rasters at the end.
+
+    See ``calculate_local_recharge`` for the parameters.
+    """
+    flow_dir_raster_info = pygeoprocessing.get_raster_info(flow_dir_mfd_path)
+    n_cols, n_rows = flow_dir_raster_info['raster_size']
+    flow_dir_nodata = flow_dir_raster_info['nodata'][0]
+
+    # alpha_m * beta_i as calculated in float precision by the serial route
+    alpha_beta_array = numpy.array(
+        [x[1] for x in sorted(alpha_month_map.items())],
+        dtype=numpy.float32) * numpy.float32(beta_i)
+    monthly_path_lists = (
+        precip_path_list, qf_m_path_list, kc_path_list, et0_path_list)
+    monthly_nodata_arrays = []
+    for path_list in monthly_path_lists:
+        nodata_list = [
+            pygeoprocessing.get_raster_info(path)['nodata'][0]
+            for path in path_list]
+        monthly_nodata_arrays.append(numpy.array(
+            [IMPROBABLE_FLOAT_NOATA if nodata is None else nodata
+             for nodata in nodata_list], dtype=numpy.float32))
+
+    working_dir = tempfile.mkdtemp(
+        prefix='local_recharge_', dir=os.path.dirname(target_li_path))
+    try:
+        # only L_sum_avail and L_avail are read by neighboring tiles
+        work_array_list = [
+            tile_routing.create_work_array(
+                working_dir, key, n_rows, n_cols, LOCAL_RECHARGE_NODATA)
+            for key in ('l_sum_avail', 'li_avail', 'li', 'aet')]
+        tile_routing.route_tiles(
+            functools.partial(
+                _route_local_recharge_tile, flow_dir_mfd_path,
+                monthly_path_lists, monthly_nodata_arrays, alpha_beta_array,
+                gamma, flow_dir_nodata, work_array_list, n_cols, n_rows),
+            work_array_list[:2], n_cols, n_rows, n_workers,
+            tile_size=tile_size, label='local recharge')
+
+        for work_array, target_path in zip(work_array_list, (
+                target_l_sum_avail_path, target_li_avail_path,
+                target_li_path, target_aet_path)):
+            tile_routing.write_work_array(
+                work_array, flow_dir_mfd_path, target_path,
+                LOCAL_RECHARGE_NODATA)
+    finally:
+        work_array_list = None
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def _route_local_recharge_tile(
+        flow_dir_mfd_path, monthly_path_lists, monthly_nodata_arrays,
+        alpha_beta_array, gamma, flow_dir_nodata, work_array_list, n_cols,
+        n_rows, tile, halo_list):
+    """Route local recharge through as much of one tile as possible.
+
+    Parameters:
+        flow_dir_mfd_path (str): path to the MFD flow direction raster.
+        monthly_path_lists (tuple): the precipitation, quickflow, crop
+            factor and ET0 lists of 12 monthly raster paths.
+        monthly_nodata_arrays (list): float32 arrays of the 12 nodata
+            values of each list in ``monthly_path_lists``.
+        alpha_beta_array (numpy.ndarray): float32 alpha_m * beta_i by month.
+        gamma (float): the fraction of pixel recharge that is available to
+            downgradient pixels.
+        flow_dir_nodata (int): nodata value of the flow direction raster.
+        work_array_list (list): the memory-mapped L_sum_avail, L_avail, L
+            and AET working arrays.  Only the tile's own window is written.
+        n_cols, n_rows (int): the size of the raster.
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+        halo_list (list): (slice, [L_sum_avail array, L_avail array])
+            tuples holding the ring of pixels around the tile as they were
+            at the start of the round.
+
+    Returns:
+        A (n_processed, n_pending) tuple of the number of pixels routed in
+        this call and the number of pixels in the tile that are still
+        waiting on upstream pixels in other tiles.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    tile_slice = (slice(yoff, yoff+win_ysize), slice(xoff, xoff+win_xsize))
+    flow_dir_array = tile_routing.read_tile_window(
+        flow_dir_mfd_path, tile, n_cols, n_rows, numpy.int32)
+    # the crop factor is kept in double precision as in the serial route
+    monthly_stack_list = []
+    for path_list, dtype in zip(monthly_path_lists, (
+            numpy.float32, numpy.float32, numpy.float64, numpy.float32)):
+        monthly_stack = numpy.empty(
+            (win_ysize, win_xsize, len(path_list)), dtype=dtype)
+        for month_index, path in enumerate(path_list):
+            monthly_stack[:, :, month_index] = tile_routing.read_tile_window(
+                path, tile, n_cols, n_rows, dtype, halo=False)
+        monthly_stack_list.append(monthly_stack)
+    l_sum_avail_array, li_avail_array = tile_routing.load_tile_work_arrays(
+        work_array_list[:2], tile, halo_list, LOCAL_RECHARGE_NODATA)
+    li_array = numpy.array(work_array_list[2][tile_slice])
+    aet_array = numpy.array(work_array_list[3][tile_slice])
+
+    cdef long n_pending = 0
+    cdef long n_processed = _route_local_recharge_window(
+        flow_dir_array, monthly_stack_list[0], monthly_stack_list[1],
+        monthly_stack_list[2], monthly_stack_list[3],
+        monthly_nodata_arrays[0], monthly_nodata_arrays[1],
+        monthly_nodata_arrays[2], monthly_nodata_arrays[3],
+        alpha_beta_array, gamma, flow_dir_nodata, l_sum_avail_array,
+        li_avail_array, li_array, aet_array, xoff, yoff, win_xsize,
+        win_ysize, n_cols, n_rows, &n_pending)
+
+    if n_processed > 0:
+        tile_routing.store_tile_work_arrays(
+            work_array_list[:2], [l_sum_avail_array, li_avail_array], tile)
+        work_array_list[2][tile_slice] = li_array
+        work_array_list[3][tile_slice] = aet_array
+    return n_processed, n_pending
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _local_recharge_pixel_state(
+        int[:, :] flow_dir, float[:, :] l_sum_avail, int row, int col,
+        int yoff, int xoff, int n_rows, int n_cols,
+        int flow_dir_nodata) nogil:
+    """Classify a local pixel of a tile for routing.
+
+    Returns:
+        1 if every upstream neighbor has been routed, 0 if some have not,
+        or -1 if the pixel is never routed because it is nodata and has no
+        inflow.
+    """
+    cdef int n_dir, xj, yj
+    cdef int has_inflow = 0
+    for n_dir in range(8):
+        xj = col+NEIGHBOR_OFFSET_ARRAY[2*n_dir]
+        yj = row+NEIGHBOR_OFFSET_ARRAY[2*n_dir+1]
+        if (xj+xoff-1 < 0 or xj+xoff-1 >= n_cols or
+                yj+yoff-1 < 0 or yj+yoff-1 >= n_rows):
+            continue
+        if (flow_dir[yj, xj] >> (
+                4 * FLOW_DIR_REVERSE_DIRECTION[n_dir])) & 0xF:
+            has_inflow = 1
+            if is_close(l_sum_avail[yj, xj], LOCAL_RECHARGE_NODATA):
+                return 0
+    if has_inflow or flow_dir[row, col] != flow_dir_nodata:
+        return 1
+    return -1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef long _route_local_recharge_window(
+        int[:, :] flow_dir, float[:, :, :] precip, float[:, :, :] qf,
+        double[:, :, :] kc, float[:, :, :] et0, float[:] precip_nodata,
+        float[:] qf_nodata, float[:] kc_nodata, float[:] et0_nodata,
+        float[:] alpha_beta, float gamma, int flow_dir_nodata,
+        float[:, :] l_sum_avail, float[:, :] li_avail, float[:, :] li,
+        float[:, :] aet, int xoff, int yoff, int win_xsize, int win_ysize,
+        int n_cols, int n_rows, long *n_pending):
+    """Route local recharge through the pixels of one tile.
+
+    ``flow_dir``, ``l_sum_avail`` and ``li_avail`` are the tile with a 1
+    pixel border holding the neighboring tiles' known values; the monthly
+    stacks, ``li`` and ``aet`` are the tile alone.  This is the same
+    calculation as ``_calculate_local_recharge_serial`` except that pixels
+    downstream of the tile are left for its neighbor.
+
+    Returns:
+        The number of pixels routed; ``n_pending`` is set to the number of
+        pixels left waiting on upstream pixels outside of the tile.
+    """
+    cdef stack[int] processing_stack
+    cdef int local_cols = win_xsize + 2
+    cdef long n_processed = 0
+    cdef int row_index, col_index, row, col, n_dir, m_index
+    cdef int xj, yj, p_ij_base, mfd_dir_sum, n_upstream, flow_dir_mfd
+    cdef float p_m, qf_m, et0_m, pet_m, aet_i, p_i, qf_i, l_i, l_avail_i
+    cdef double kc_m, l_sum_avail_i
+
+    with nogil:
+        for row_index in range(1, win_ysize+1):
+            for col_index in range(1, win_xsize+1):
+                if not is_close(
+                        l_sum_avail[row_index, col_index],
+                        LOCAL_RECHARGE_NODATA):
+                    continue
+                if _local_recharge_pixel_state(
+                        flow_dir, l_sum_avail, row_index, col_index, yoff,
+                        xoff, n_rows, n_cols, flow_dir_nodata) != 1:
+                    continue
+                processing_stack.push(row_index * local_cols + col_index)
+
+                while processing_stack.size() > 0:
+                    row = processing_stack.top() // local_cols
+                    col = processing_stack.top() % local_cols
+                    processing_stack.pop()
+
+                    # Equation 7, every upstream neighbor is defined
+                    l_sum_avail_i = 0.0
+                    mfd_dir_sum = 0
+                    n_upstream = 0
+                    for n_dir in range(8):
+                        xj = col+NEIGHBOR_OFFSET_ARRAY[2*n_dir]
+                        yj = row+NEIGHBOR_OFFSET_ARRAY[2*n_dir+1]
+                        if (xj+xoff-1 < 0 or xj+xoff-1 >= n_cols or
+                                yj+yoff-1 < 0 or yj+yoff-1 >= n_rows):
+                            continue
+                        p_ij_base = (flow_dir[yj, xj] >> (
+                            4 * FLOW_DIR_REVERSE_DIRECTION[n_dir])) & 0xF
+                        if p_ij_base:
+                            mfd_dir_sum += p_ij_base
+                            l_sum_avail_i += <float>((
+                                <double>l_sum_avail[yj, xj] +
+                                <double>li_avail[yj, xj]) * p_ij_base)
+                            n_upstream += 1
+                    if n_upstream > 0:
+                        l_sum_avail_i /= <float>mfd_dir_sum
+
+                    aet_i = 0
+                    p_i = 0
+                    qf_i = 0
+                    for m_index in range(12):
+                        p_m = precip[row-1, col-1, m_index]
+                        if not is_close(p_m, precip_nodata[m_index]):
+                            p_i += p_m
+                        else:
+                            p_m = 0
+
+                        qf_m = qf[row-1, col-1, m_index]
+                        if not is_close(qf_m, qf_nodata[m_index]):
+                            qf_i += qf_m
+                        else:
+                            qf_m = 0
+
+                        kc_m = kc[row-1, col-1, m_index]
+                        pet_m = 0
+                        et0_m = et0[row-1, col-1, m_index]
+                        if not (
+                                is_close(kc_m, kc_nodata[m_index]) or
+                                is_close(et0_m, et0_nodata[m_index])):
+                            # Equation 6
+                            pet_m = kc_m * et0_m
+
+                        # Equation 4/5
+                        aet_i += _monthly_aet(
+                            pet_m, p_m, qf_m, alpha_beta[m_index],
+                            l_sum_avail_i)
+
+                    l_i = (p_i - qf_i - aet_i)
+                    # Equation 8
+                    l_avail_i = min(gamma*l_i, l_i)
+
+                    l_sum_avail[row, col] = <float>l_sum_avail_i
+                    li_avail[row, col] = l_avail_i
+                    li[row-1, col-1] = l_i
+                    aet[row-1, col-1] = aet_i
+                    n_processed += 1
+
+                    # push the downstream pixels in this tile that are now
+                    # ready, the rest are picked up by their own tile
+                    flow_dir_mfd = flow_dir[row, col]
+                    for n_dir in range(8):
+                        if ((flow_dir_mfd >> (n_dir * 4)) & 0xF) == 0:
+                            continue
+                        xj = col+NEIGHBOR_OFFSET_ARRAY[2*n_dir]
+                        yj = row+NEIGHBOR_OFFSET_ARRAY[2*n_dir+1]
+                        if (xj < 1 or xj > win_xsize or
+                                yj < 1 or yj > win_ysize):
+                            continue
+                        if not is_close(
+                                l_sum_avail[yj, xj], LOCAL_RECHARGE_NODATA):
+                            continue
+                        if _local_recharge_pixel_state(
+                                flow_dir, l_sum_avail, yj, xj, yoff, xoff,
+                                n_rows, n_cols, flow_dir_nodata) == 1:
+                            processing_stack.push(yj * local_cols + xj)
+
+        n_pending[0] = 0
+        for row_index in range(1, win_ysize+1):
+            for col_index in range(1, win_xsize+1):
+                if is_close(
+                        l_sum_avail[row_index, col_index],
+                        LOCAL_RECHARGE_NODATA) and (
+                            _local_recharge_pixel_state(
+                                flow_dir, l_sum_avail, row_index, col_index,
+                                yoff, xoff, n_rows, n_cols,
+                                flow_dir_nodata) == 0):
+                    n_pending[0] += 1
+    return n_processed
+
+
 def route_baseflow_sum(
         flow_dir_mfd_path, l_path, l_avail_path, l_sum_path,
-        stream_path, target_b_path, target_b_sum_path):
+        stream_path, target_b_path, target_b_sum_path, cache_mb=None):
     """Route Baseflow through MFD as described in Equation 11.
 
     Parameters:
@@ -687,6 +752,8 @@ def route_baseflow_sum(
         target_b_path (string): path to created raster for per-pixel baseflow.
         target_b_sum_path (string): path to created raster for per-pixel
             upstream sum of baseflow.
+        cache_mb (number): optional memory budget in megabytes for the raster
+            block caches used by this function.
 
 `    Returns:
         None.
@@ -721,17 +788,22 @@ def route_baseflow_sum(
         flow_dir_mfd_path, target_b_path, gdal.GDT_Float32,
         [target_nodata], fill_value_list=[target_nodata])
 
+    raster_cache_mb = managed_raster.get_raster_cache_mb(7, cache_mb)
     cdef _ManagedRaster target_b_sum_raster = _ManagedRaster(
-        target_b_sum_path, 1, 1)
+        target_b_sum_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
     cdef _ManagedRaster target_b_raster = _ManagedRaster(
-        target_b_path, 1, 1)
-    cdef _ManagedRaster l_raster = _ManagedRaster(l_path, 1, 0)
-    cdef _ManagedRaster l_avail_raster = _ManagedRaster(l_avail_path, 1, 0)
-    cdef _ManagedRaster l_sum_raster = _ManagedRaster(l_sum_path, 1, 0)
+        target_b_path, 1, 1, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
+    cdef _ManagedRaster l_raster = _ManagedRaster(
+        l_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
+    cdef _ManagedRaster l_avail_raster = _ManagedRaster(
+        l_avail_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
+    cdef _ManagedRaster l_sum_raster = _ManagedRaster(
+        l_sum_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
     cdef _ManagedRaster flow_dir_mfd_raster = _ManagedRaster(
-        flow_dir_mfd_path, 1, 0)
+        flow_dir_mfd_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
-    cdef _ManagedRaster stream_raster = _ManagedRaster(stream_path, 1, 0)
+    cdef _ManagedRaster stream_raster = _ManagedRaster(
+        stream_path, 1, 0, MANAGED_RASTER_N_BLOCKS, raster_cache_mb)
 
     current_pixel = 0
     for offset_dict in pygeoprocessing.iterblocks(
@@ -0,0 +1,290 @@
+"""Round-based routing of raster tiles on a pool of threads.
+
+The routing cores calculate a pixel once all of its upstream neighbors are
+known.  To route in parallel the raster is split into square tiles that each
+route every pixel they can, reading the ring of pixels just outside of the
+tile from a snapshot of its neighbors taken at the start of the round.  Rounds
+are repeated on the tiles next to a tile that made progress until no tile can
+make any, so flow paths that cross tile seams are picked up in a later round.
+
+The working arrays are memory-mapped ``.npy`` files so that tiles can write
+their own window without a lock; the per-tile kernels release the GIL.
+"""
+import concurrent.futures
+import logging
+import os
+
+import numpy
+import pygeoprocessing
+from osgeo import gdal
+
+from . import managed_raster
+
+LOGGER = logging.getLogger(__name__)
+
+PARALLEL_TILE_SIZE = 2**10
+
+# row and column offsets of the 8 neighbors of a pixel or of a tile
+_ROW_OFFSETS = [0, -1, -1, -1, 0, 1, 1, 1]
+_COL_OFFSETS = [1, 1, 0, -1, -1, -1, 0, 1]
+
+
+def create_work_array(working_dir, name, n_rows, n_cols, fill_value):
+    """Create a memory-mapped float32 working array.
+
+    Parameters:
+        working_dir (string): directory to create ``<name>.npy`` in.
+        name (string): base name of the array file.
+        n_rows, n_cols (int): the shape of the array.
+        fill_value (float): the initial value of every element.
+
+    Returns:
+        A writable ``numpy.memmap``.
+
+    """
+    work_array = numpy.lib.format.open_memmap(
+        os.path.join(working_dir, '%s.npy' % name), mode='w+',
+        dtype=numpy.float32, shape=(n_rows, n_cols))
+    work_array[:] = fill_value
+    return work_array
+
+
+def write_work_array(work_array, base_raster_path, target_path, nodata):
+    """Copy a working array to a new float32 raster.
+
+    Parameters:
+        work_array (numpy.ndarray): array the same shape as the base raster.
+        base_raster_path (string): raster to take the geotransform,
+            projection and block layout from.
+        target_path (string): path to the raster to create.  If this path
+            ends in ``.bin`` it is created as an uncompressed ENVI raster.
+        nodata (float): the nodata value of the target raster.
+
+    Returns:
+        None.
+
+    """
+    pygeoprocessing.new_raster_from_base(
+        base_raster_path, target_path, gdal.GDT_Float32, [nodata],
+        raster_driver_creation_tuple=(
+            managed_raster.get_driver_creation_tuple(target_path)))
+    target_raster = gdal.OpenEx(target_path, gdal.OF_RASTER | gdal.GA_Update)
+    target_band = target_raster.GetRasterBand(1)
+    for offset_dict in pygeoprocessing.iterblocks(
+            (base_raster_path, 1), offset_only=True):
+        target_band.WriteArray(
+            work_array[
+                offset_dict['yoff']:
+                offset_dict['yoff']+offset_dict['win_ysize'],
+                offset_dict['xoff']:
+                offset_dict['xoff']+offset_dict['win_xsize']],
+            xoff=offset_dict['xoff'], yoff=offset_dict['yoff'])
+    target_band = None
+    target_raster = None
+
+
+def halo_slice_list(tile, n_cols, n_rows):
+    """List the slices of the 1 pixel ring around a tile.
+
+    Parameters:
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+        n_cols, n_rows (int): the size of the raster.
+
+    Returns:
+        A list of (row slice, col slice) tuples in raster coordinates that
+        cover the parts of the ring that are inside the raster.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    x_min = max(0, xoff-1)
+    x_max = min(n_cols, xoff+win_xsize+1)
+    y_min = max(0, yoff-1)
+    y_max = min(n_rows, yoff+win_ysize+1)
+    slice_list = [
+        (slice(y_min, yoff), slice(x_min, x_max)),
+        (slice(yoff+win_ysize, y_max), slice(x_min, x_max)),
+        (slice(yoff, yoff+win_ysize), slice(x_min, xoff)),
+        (slice(yoff, yoff+win_ysize), slice(xoff+win_xsize, x_max))]
+    return [
+        (row_slice, col_slice) for row_slice, col_slice in slice_list
+        if row_slice.stop > row_slice.start and
+        col_slice.stop > col_slice.start]
+
+
+def read_tile_window(raster_path, tile, n_cols, n_rows, dtype, halo=True):
+    """Read the window of a tile from a raster.
+
+    Parameters:
+        raster_path (string): path to a single band raster.
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+        n_cols, n_rows (int): the size of the raster.
+        dtype (numpy.dtype): type of the returned array.
+        halo (bool): if True, the array has a 1 pixel border holding the
+            ring of pixels around the tile, or 0 outside of the raster, so
+            that local index = global index - offset + 1.
+
+    Returns:
+        A numpy array of the window.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    raster = gdal.OpenEx(raster_path, gdal.OF_RASTER)
+    band = raster.GetRasterBand(1)
+    if not halo:
+        window = band.ReadAsArray(
+            xoff=xoff, yoff=yoff, win_xsize=win_xsize,
+            win_ysize=win_ysize).astype(dtype)
+    else:
+        x_min = max(0, xoff-1)
+        x_max = min(n_cols, xoff+win_xsize+1)
+        y_min = max(0, yoff-1)
+        y_max = min(n_rows, yoff+win_ysize+1)
+        local_y = y_min - (yoff-1)
+        local_x = x_min - (xoff-1)
+        window = numpy.zeros((win_ysize+2, win_xsize+2), dtype=dtype)
+        window[
+            local_y:local_y+y_max-y_min,
+            local_x:local_x+x_max-x_min] = band.ReadAsArray(
+                xoff=x_min, yoff=y_min, win_xsize=x_max-x_min,
+                win_ysize=y_max-y_min)
+    band = None
+    raster = None
+    return window
+
+
+def load_tile_work_arrays(work_array_list, tile, halo_list, fill_value):
+    """Copy a tile of the working arrays into local arrays with a border.
+
+    Parameters:
+        work_array_list (list): the memory-mapped working arrays.
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+        halo_list (list): (slice, [array, ...]) tuples as passed to the
+            ``route_tile_func`` of ``route_tiles``.
+        fill_value (float): value of the border outside of the raster.
+
+    Returns:
+        A list of float32 arrays of shape (win_ysize+2, win_xsize+2), one
+        per working array.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    local_array_list = []
+    for work_array in work_array_list:
+        local_array = numpy.full(
+            (win_ysize+2, win_xsize+2), fill_value, dtype=numpy.float32)
+        local_array[1:win_ysize+1, 1:win_xsize+1] = work_array[
+            yoff:yoff+win_ysize, xoff:xoff+win_xsize]
+        local_array_list.append(local_array)
+    for (row_slice, col_slice), halo_array_list in halo_list:
+        local_slice = (
+            slice(row_slice.start-yoff+1, row_slice.stop-yoff+1),
+            slice(col_slice.start-xoff+1, col_slice.stop-xoff+1))
+        for local_array, halo_array in zip(
+                local_array_list, halo_array_list):
+            local_array[local_slice] = halo_array
+    return local_array_list
+
+
+def store_tile_work_arrays(work_array_list, local_array_list, tile):
+    """Copy the tile of local arrays back to the working arrays.
+
+    Parameters:
+        work_array_list (list): the memory-mapped working arrays.
+        local_array_list (list): arrays returned by
+            ``load_tile_work_arrays``.
+        tile (tuple): the (xoff, yoff, win_xsize, win_ysize) of the tile.
+
+    Returns:
+        None.
+
+    """
+    xoff, yoff, win_xsize, win_ysize = tile
+    for work_array, local_array in zip(work_array_list, local_array_list):
+        work_array[yoff:yoff+win_ysize, xoff:xoff+win_xsize] = (
+            local_array[1:win_ysize+1, 1:win_xsize+1])
+
+
+def route_tiles(
+        route_tile_func, work_array_list, n_cols, n_rows, n_workers,
+        tile_size=PARALLEL_TILE_SIZE, label='routing'):
+    """Route a raster in tiles on a pool of threads.
+
+    Parameters:
+        route_tile_func (callable): called as ``route_tile_func(tile,
+            halo_list)`` to route as much of a tile as possible, where
+            ``tile`` is the (xoff, yoff, win_xsize, win_ysize) of the tile
+            and ``halo_list`` is a list of (slice, [array, ...]) tuples
+            holding the ring of pixels around the tile of each array in
+            ``work_array_list`` as they were at the start of the round.  It
+            must only write to the tile's own window and return a
+            (n_processed, n_pending) tuple of the number of pixels routed and
+            the number still waiting on pixels outside of the tile.
+        work_array_list (list): the working arrays that tiles read their
+            neighbors' values from.
+        n_cols, n_rows (int): the size of the raster.
+        n_workers (int): number of threads to route tiles on.
+        tile_size (int): the width and height of a tile.
+        label (string): name of the calculation used in log messages.
+
+    Returns:
+        None.
+
+    """
+    tile_list = [
+        (xoff, yoff, min(tile_size, n_cols - xoff),
+         min(tile_size, n_rows - yoff))
+        for yoff in range(0, n_rows, tile_size)
+        for xoff in range(0, n_cols, tile_size)]
+    n_tile_cols = (n_cols + tile_size - 1) // tile_size
+    n_tile_rows = (n_rows + tile_size - 1) // tile_size
+    n_pending = dict((tile_index, 1) for tile_index in range(len(tile_list)))
+    scheduled_tiles = list(range(len(tile_list)))
+    round_index = 0
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        while scheduled_tiles:
+            # halos are read before any tile of this round writes, so a tile
+            # never sees a neighbor that's partly written
+            halo_map = dict(
+                (tile_index, [
+                    (halo_slice, [
+                        numpy.array(work_array[halo_slice])
+                        for work_array in work_array_list])
+                    for halo_slice in halo_slice_list(
+                        tile_list[tile_index], n_cols, n_rows)])
+                for tile_index in scheduled_tiles)
+            future_map = dict(
+                (executor.submit(
+                    route_tile_func, tile_list[tile_index],
+                    halo_map.pop(tile_index)), tile_index)
+                for tile_index in scheduled_tiles)
+            progressed_tiles = set()
+            for future in concurrent.futures.as_completed(future_map):
+                tile_index = future_map[future]
+                n_processed, n_pending[tile_index] = future.result()
+                if n_processed > 0:
+                    progressed_tiles.add(tile_index)
+            LOGGER.info(
+                '%s round %d: %d of %d tiles made progress, %d tiles '
+                'waiting on neighbors', label, round_index,
+                len(progressed_tiles), len(scheduled_tiles),
+                sum(1 for n in n_pending.values() if n > 0))
+
+            # only a neighbor's progress can unblock a waiting tile
+            scheduled_tiles = []
+            for tile_index, pending in sorted(n_pending.items()):
+                if pending == 0:
+                    continue
+                tile_row = tile_index // n_tile_cols
+                tile_col = tile_index % n_tile_cols
+                for row_offset, col_offset in zip(
+                        _ROW_OFFSETS, _COL_OFFSETS):
+                    neighbor_row = tile_row + row_offset
+                    neighbor_col = tile_col + col_offset
+                    if not (0 <= neighbor_row < n_tile_rows and
+                            0 <= neighbor_col < n_tile_cols):
+                        continue
+                    if (neighbor_row * n_tile_cols + neighbor_col in
+                            progressed_tiles):
+                        scheduled_tiles.append(tile_index)
+                        break
+            round_index += 1
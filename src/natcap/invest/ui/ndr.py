@@ -123,6 +123,16 @@ class Nutrient(model.InVESTModel):
             label='Subsurface Maximum Retention Efficiency (Phosphorous)',
             validator=self.validator)
         self.add_input(self.subsurface_eff_p)
+        self.partition_by_watershed = inputs.Checkbox(
+            args_key='partition_by_watershed',
+            helptext=(
+                "If selected, effective retention is calculated separately "
+                "for each watershed, in parallel when n_workers is at least "
+                "1, and the results are mosaicked together.  Flow that "
+                "leaves a watershed is treated as draining at its boundary, "
+                "and where watersheds overlap the largest one is used."),
+            label='Partition effective retention by watershed')
+        self.add_input(self.partition_by_watershed)
 
         # Set interactivity, requirement as input sufficiency changes
         self.calc_n.sufficiency_changed.connect(
@@ -155,6 +165,8 @@ class Nutrient(model.InVESTModel):
                 self.subsurface_critical_length_p.value(),
             self.subsurface_eff_n.args_key: self.subsurface_eff_n.value(),
             self.subsurface_eff_p.args_key: self.subsurface_eff_p.value(),
+            self.partition_by_watershed.args_key:
+                self.partition_by_watershed.value(),
         }
 
         return args
@@ -80,6 +80,16 @@ class ScenarioGenProximity(model.InVESTModel):
             label='Number of Steps in Conversion',
             validator=self.validator)
         self.add_input(self.n_fragmentation_steps)
+        self.incremental_distance_update = inputs.Checkbox(
+            args_key='incremental_distance_update',
+            helptext=(
+                "If selected, the distance transform is only recalculated "
+                "near the pixels converted on the previous step, and only "
+                "those distances are smoothed again, rather than over the "
+                "whole landscape on every step.  Steps that change too much "
+                "of the landscape are recalculated in full."),
+            label='Update distances incrementally')
+        self.add_input(self.incremental_distance_update)
 
     def assemble_args(self):
         args = {
@@ -99,6 +109,8 @@ class ScenarioGenProximity(model.InVESTModel):
                 self.convert_nearest_to_edge.value(),
             self.n_fragmentation_steps.args_key:
                 self.n_fragmentation_steps.value(),
+            self.incremental_distance_update.args_key:
+                self.incremental_distance_update.value(),
         }
 
         return args
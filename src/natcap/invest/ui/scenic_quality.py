@@ -69,6 +69,15 @@ class ScenicQuality(model.InVESTModel):
             label='Refractivity Coefficient (Required)',
             validator=self.validator)
         self.general_tab.add_input(self.refraction)
+        self.save_per_viewpoint_rasters = inputs.Checkbox(
+            args_key='save_per_viewpoint_rasters',
+            helptext=(
+                "If selected, the visibility raster of each viewpoint, and "
+                "its value raster if valuation is enabled, are saved to the "
+                "intermediate folder.  Otherwise only the sums over all "
+                "viewpoints are written."),
+            label='Save per-viewpoint rasters')
+        self.general_tab.add_input(self.save_per_viewpoint_rasters)
         self.valuation_container = inputs.Container(
             args_key='do_valuation',
             expandable=True,
@@ -119,6 +128,8 @@ class ScenicQuality(model.InVESTModel):
             self.structure_path.args_key: self.structure_path.value(),
             self.dem_path.args_key: self.dem_path.value(),
             self.refraction.args_key: self.refraction.value(),
+            self.save_per_viewpoint_rasters.args_key:
+                self.save_per_viewpoint_rasters.value(),
             self.valuation_container.args_key: self.valuation_container.value(),
             self.valuation_function.args_key: self.valuation_function.value(),
             self.a_coefficient.args_key: self.a_coefficient.value(),
@@ -1,16 +1,21 @@
 """InVEST specific code utils."""
 import codecs
+import collections.abc
+import csv
+import hashlib
 import math
 import os
 import contextlib
 import logging
 import tempfile
 import shutil
+import pickle
 from datetime import datetime
 import time
 
 import pandas
 import numpy
+import scipy.spatial
 from osgeo import gdal
 from osgeo import osr
 import pygeoprocessing
@@ -32,6 +37,16 @@ GDAL_ERROR_LEVELS = {
     gdal.CE_Fatal: logging.CRITICAL,
 }
 
+# number of equally near points ``nearest_neighbors`` breaks ties between
+_NEAREST_NEIGHBOR_TIES = 8
+
+# Environment variable that may hold a directory to cache parsed CSV tables in.
+TABLE_CACHE_DIR_ENV_VAR = 'NATCAP_INVEST_TABLE_CACHE_DIR'
+
+# Changed whenever the pickled ``LookupTable`` changes, so that tables cached
+# by another version are parsed again.
+_TABLE_CACHE_VERSION = 1
+
 
 @contextlib.contextmanager
 def capture_gdal_logging():
@@ -430,34 +445,193 @@ def build_file_registry(base_file_path_list, file_suffix):
     return f_reg
 
 
-def build_lookup_from_csv(
-        table_path, key_field, to_lower=True, warn_if_missing=True):
-    """Read a CSV table into a dictionary indexed by `key_field`.
+class LookupTable(collections.abc.Mapping):
+    """A CSV table held by column and indexed by the values of a key column.
 
-    Creates a dictionary from a CSV whose keys are unique entries in the CSV
-    table under the column named by `key_field` and values are dictionaries
-    indexed by the other columns in `table_path` including `key_field` whose
-    values are the values on that row of the CSV table.
+    The table is a read-only mapping from each key to a dictionary of the
+    values on that key's row, the same as the dictionaries returned by
+    ``build_lookup_from_csv``, while ``column`` returns a whole column as a
+    numpy array for vectorized lookups.  Row dictionaries are built when
+    they are requested; ``to_dict`` builds all of them at once.
+    """
+
+    def __init__(self, header_list, column_list, key_field):
+        """Create a lookup table from its columns.
+
+        Parameters:
+            header_list (list): the header of each column.
+            column_list (list): a numpy array of the values of each column,
+                all the same length, with missing values as ``NaN``.
+            key_field (string): the header of the column whose values
+                index the rows.
+
+        Returns:
+            None
+        """
+        self.header_list = list(header_list)
+        self._column_list = list(column_list)
+        self.key_field = key_field
+        # rows hold a single type if every column is numeric, the same as
+        # a row of ``pandas.DataFrame.values``
+        dtype_list = [column.dtype for column in self._column_list]
+        if all(dtype.kind in 'iuf' for dtype in dtype_list):
+            self._row_dtype = numpy.result_type(*dtype_list)
+        else:
+            self._row_dtype = numpy.dtype(object)
+        self._null_array = numpy.column_stack([
+            pandas.isnull(column) for column in self._column_list])
+        key_list = self._row_value_lists(
+            numpy.arange(len(self._null_array)), key_only=True)
+        # a repeated key refers to the last row that has it
+        self._row_index_map = dict(
+            (key, row_index) for row_index, key in enumerate(key_list))
+
+    def _row_value_lists(self, row_index_array, key_only=False):
+        """List the values of rows with missing values as empty strings.
+
+        Parameters:
+            row_index_array (numpy.ndarray): the indexes of the rows.
+            key_only (bool): if True, list only the value of the key field
+                on each row rather than a list of every value.
+
+        Returns:
+            list of the python values of each row.
+        """
+        column_index_list = list(range(len(self._column_list)))
+        if key_only:
+            column_index_list = [self.header_list.index(self.key_field)]
+        row_array = numpy.empty(
+            (len(row_index_array), len(column_index_list)),
+            dtype=self._row_dtype)
+        for local_index, column_index in enumerate(column_index_list):
+            row_array[:, local_index] = (
+                self._column_list[column_index][row_index_array])
+        row_value_lists = row_array.tolist()
+        null_array = self._null_array[
+            row_index_array[:, None], column_index_list]
+        for local_index in numpy.nonzero(null_array.any(axis=1))[0]:
+            row_value_lists[local_index] = [
+                '' if is_null else value for value, is_null in zip(
+                    row_value_lists[local_index], null_array[local_index])]
+        if key_only:
+            return [row_values[0] for row_values in row_value_lists]
+        return row_value_lists
+
+    def column(self, header):
+        """Get a column of the table.
+
+        Parameters:
+            header (string): the header of the column.  If more than one
+                column has this header, the last one is returned, as it is
+                the one found in the row dictionaries.
+
+        Returns:
+            numpy array of the column's values in row order, with missing
+            values as ``NaN``.
+
+        Raises:
+            KeyError if there is no column with this header.
+        """
+        for column_header, column in reversed(list(zip(
+                self.header_list, self._column_list))):
+            if column_header == header:
+                return column
+        raise KeyError(header)
+
+    def to_dict(self):
+        """Build the dictionary of every row of the table.
+
+        Returns:
+            a dictionary of the form returned by ``build_lookup_from_csv``.
+        """
+        key_index_list = list(self._row_index_map)
+        row_index_array = numpy.array(
+            [self._row_index_map[key] for key in key_index_list],
+            dtype=numpy.int64)
+        return dict(
+            (key, dict(zip(self.header_list, row_values)))
+            for key, row_values in zip(
+                key_index_list, self._row_value_lists(row_index_array)))
+
+    def __getitem__(self, key):
+        """Build the dictionary of the values on the row of `key`."""
+        row_index = self._row_index_map[key]
+        return dict(zip(self.header_list, self._row_value_lists(
+            numpy.array([row_index], dtype=numpy.int64))[0]))
+
+    def __iter__(self):
+        """Iterate over the keys of the table in row order."""
+        return iter(self._row_index_map)
+
+    def __len__(self):
+        """Return the number of keys in the table."""
+        return len(self._row_index_map)
+
+    def __repr__(self):
+        """Describe the table by its key field and headers."""
+        return '%s(key_field=%r, header_list=%r, n_keys=%d)' % (
+            type(self).__name__, self.key_field, self.header_list,
+            len(self))
+
+
+def _sniff_delimiter(first_line, encoding):
+    """Guess the delimiter of a CSV table from its first line.
 
     Parameters:
-        table_path (string): path to a CSV file containing at
-            least the header key_field
-        key_field: (string): a column in the CSV file at `table_path` that
-            can uniquely identify each row in the table.
-        to_lower (bool): if True, converts all unicode in the CSV,
-            including headers and values to lowercase, otherwise uses raw
-            string values.
-        warn_if_missing (bool): If True, warnings are logged if there are
-            empty headers or value rows.
+        first_line (bytes): the first line of the table.
+        encoding (string): the encoding of the table, or None for UTF-8.
 
     Returns:
-        lookup_dict (dict): a dictionary of the form {
-                key_field_0: {csv_header_0: value0, csv_header_1: value1...},
-                key_field_1: {csv_header_0: valuea, csv_header_1: valueb...}
-            }
+        the delimiter character, or ``','`` if one could not be guessed.
+    """
+    first_line = first_line.decode(encoding or 'utf-8', errors='replace')
+    try:
+        return csv.Sniffer().sniff(first_line).delimiter
+    except csv.Error:
+        return ','
 
-        if `to_lower` all strings including key_fields and values are
-        converted to lowercase unicode.
+
+def _get_table_cache_path(table_path, key_field, to_lower, cache_dir):
+    """Get the path of the cached parse of a table.
+
+    The cache is keyed by a hash of the contents of the table and of the
+    arguments that change how it is parsed, so an edited table is parsed
+    again regardless of its path or modification time.
+
+    Parameters:
+        table_path (string): path to the CSV table.
+        key_field (string): the key field the table is indexed by.
+        to_lower (bool): whether the table's strings are lowercased.
+        cache_dir (string): directory of the cached tables.
+
+    Returns:
+        path to the cache file for this table, which may not exist.
+    """
+    table_hash = hashlib.sha256()
+    table_hash.update(repr((
+        _TABLE_CACHE_VERSION, key_field, to_lower,
+        pandas.__version__)).encode('utf-8'))
+    with open(table_path, 'rb') as table_file:
+        for chunk in iter(lambda: table_file.read(2**20), b''):
+            table_hash.update(chunk)
+    return os.path.join(cache_dir, '%s.pickle' % table_hash.hexdigest())
+
+
+def _parse_lookup_table(table_path, key_field, to_lower):
+    """Parse a CSV table into a ``LookupTable``.
+
+    Parameters:
+        table_path (string): path to the CSV table.
+        key_field (string): the column that indexes the table's rows.
+        to_lower (bool): if True, lowercase the headers and string values.
+
+    Returns:
+        a (lookup_table, blank_line_list) tuple, where ``blank_line_list``
+        holds the line number of each entirely blank row that was left out
+        of the table.
+
+    Raises:
+        ValueError if `key_field` is not a column of the table.
     """
     # Check if the file encoding is UTF-8 BOM first
     encoding = None
@@ -465,8 +639,12 @@ def build_lookup_from_csv(
         first_line = file_obj.readline()
         if first_line.startswith(codecs.BOM_UTF8):
             encoding = 'utf-8-sig'
+            first_line = first_line[len(codecs.BOM_UTF8):]
+    # the delimiter is sniffed from the first line, as the python engine
+    # does for ``sep=None``, so the table can be read by the C engine
     table = pandas.read_csv(
-        table_path, sep=None, engine='python', encoding=encoding)
+        table_path, sep=_sniff_delimiter(first_line, encoding), engine='c',
+        encoding=encoding, float_precision='round_trip')
     header_row = list(table)
 
     if to_lower:
@@ -479,26 +657,131 @@ def build_lookup_from_csv(
         raise ValueError(
             '%s expected in %s for the CSV file at %s' % (
                 key_field, header_row, table_path))
-    if warn_if_missing and '' in header_row:
+
+    blank_row_mask = table.isnull().values.all(axis=1)
+    blank_line_list = [
+        index+2 for index in table.index[blank_row_mask]]
+    table = table[~blank_row_mask]
+    column_list = []
+    for column_index in range(len(header_row)):
+        column = table.iloc[:, column_index]
+        if to_lower and column.dtype.kind not in 'biufcmM':
+            # values that aren't strings are lowercased to NaN
+            lower_column = column.str.lower()
+            column = lower_column.where(lower_column.notnull(), column)
+        column_list.append(column.to_numpy())
+    return LookupTable(header_row, column_list, key_field), blank_line_list
+
+
+def read_lookup_table(
+        table_path, key_field, to_lower=True, warn_if_missing=True,
+        cache_dir=None):
+    """Read a CSV table into a ``LookupTable`` indexed by `key_field`.
+
+    Parameters:
+        table_path (string): path to a CSV file containing at
+            least the header key_field
+        key_field: (string): a column in the CSV file at `table_path` that
+            can uniquely identify each row in the table.
+        to_lower (bool): if True, converts all unicode in the CSV,
+            including headers and values to lowercase, otherwise uses raw
+            string values.
+        warn_if_missing (bool): If True, warnings are logged if there are
+            empty headers or value rows.
+        cache_dir (string): if not None, a directory to keep parsed tables
+            in, so that a table with the same contents is parsed only once.
+            If None, the ``NATCAP_INVEST_TABLE_CACHE_DIR`` environment
+            variable is used if it is defined, otherwise tables are not
+            cached.
+
+    Returns:
+        a ``LookupTable`` mapping each value of `key_field` to the values on
+        its row.  If `to_lower` all strings including key_fields and values
+        are converted to lowercase unicode.
+
+    Raises:
+        ValueError if `key_field` is not a column of the table.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(TABLE_CACHE_DIR_ENV_VAR, None)
+
+    lookup_table = None
+    if cache_dir:
+        cache_path = _get_table_cache_path(
+            table_path, key_field, to_lower, cache_dir)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                lookup_table, blank_line_list = pickle.load(cache_file)
+            LOGGER.debug('Loaded %s from %s', table_path, cache_path)
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError):
+            LOGGER.warning(
+                'Ignoring unreadable table cache %s', cache_path)
+
+    if lookup_table is None:
+        lookup_table, blank_line_list = _parse_lookup_table(
+            table_path, key_field, to_lower)
+        if cache_dir:
+            try:
+                make_directories([cache_dir])
+                # written to a temporary file first so that another process
+                # never loads a partly written cache
+                cache_fd, cache_temp_path = tempfile.mkstemp(
+                    dir=cache_dir, suffix='.pickle')
+                with os.fdopen(cache_fd, 'wb') as cache_file:
+                    pickle.dump(
+                        (lookup_table, blank_line_list), cache_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_temp_path, cache_path)
+            except OSError:
+                LOGGER.warning(
+                    'Could not cache %s in %s', table_path, cache_dir)
+
+    if warn_if_missing and '' in lookup_table.header_list:
         LOGGER.warn(
             "There are empty strings in the header row at %s", table_path)
+    for line_number in blank_line_list:
+        LOGGER.warn(
+            "Encountered an entirely blank row on line %d", line_number)
+    return lookup_table
+
+
+def build_lookup_from_csv(
+        table_path, key_field, to_lower=True, warn_if_missing=True,
+        cache_dir=None):
+    """Read a CSV table into a dictionary indexed by `key_field`.
+
+    Creates a dictionary from a CSV whose keys are unique entries in the CSV
+    table under the column named by `key_field` and values are dictionaries
+    indexed by the other columns in `table_path` including `key_field` whose
+    values are the values on that row of the CSV table.
 
-    key_index = header_row.index(key_field)
-    lookup_dict = {}
-    for index, row in table.iterrows():
-        if to_lower:
-            row = pandas.Series([
-                x if not isinstance(x, str) else x.lower()
-                for x in row])
-        # check if every single element in the row is null
-        if row.isnull().values.all():
-            LOGGER.warn(
-                "Encountered an entirely blank row on line %d", index+2)
-            continue
-        if row.isnull().values.any():
-            row = row.fillna('')
-        lookup_dict[row[key_index]] = dict(zip(header_row, row))
-    return lookup_dict
+    Parameters:
+        table_path (string): path to a CSV file containing at
+            least the header key_field
+        key_field: (string): a column in the CSV file at `table_path` that
+            can uniquely identify each row in the table.
+        to_lower (bool): if True, converts all unicode in the CSV,
+            including headers and values to lowercase, otherwise uses raw
+            string values.
+        warn_if_missing (bool): If True, warnings are logged if there are
+            empty headers or value rows.
+        cache_dir (string): if not None, a directory to keep parsed tables
+            in.  See ``read_lookup_table``.
+
+    Returns:
+        lookup_dict (dict): a dictionary of the form {
+                key_field_0: {csv_header_0: value0, csv_header_1: value1...},
+                key_field_1: {csv_header_0: valuea, csv_header_1: valueb...}
+            }
+
+        if `to_lower` all strings including key_fields and values are
+        converted to lowercase unicode.
+    """
+    return read_lookup_table(
+        table_path, key_field, to_lower=to_lower,
+        warn_if_missing=warn_if_missing, cache_dir=cache_dir).to_dict()
 
 
 def make_directories(directory_list):
@@ -539,3 +822,51 @@ def mean_pixel_size_and_area(pixel_size_tuple):
                 pixel_size_tuple))
 
     return (x_size, x_size*y_size)
+
+
+def nearest_neighbors(query_xy_array, base_xy_array):
+    """Find the nearest base point to each query point.
+
+    The base points are indexed in a ``scipy.spatial.cKDTree`` so the search
+    takes O((N + M) log M) time rather than the O(N * M) of comparing every
+    pair of points.
+
+    Parameters:
+        query_xy_array (numpy.ndarray): an (N, 2) array of [x, y] points to
+            find the nearest base point to.
+        base_xy_array (numpy.ndarray or scipy.spatial.cKDTree): an (M, 2)
+            array of [x, y] points, or a ``cKDTree`` already built over
+            them so that several queries can share one tree.
+
+    Returns:
+        tuple of (distance array, index array), the euclidean distance from
+        each query point to its nearest base point and the index of that
+        point in ``base_xy_array``.  If several base points are equally
+        near, the lowest index is returned, as with ``numpy.argmin``.
+
+    Raises:
+        ValueError if ``base_xy_array`` is an array with no points.
+
+    """
+    query_xy_array = numpy.asarray(
+        query_xy_array, dtype=numpy.float64).reshape((-1, 2))
+    if isinstance(base_xy_array, scipy.spatial.cKDTree):
+        kd_tree = base_xy_array
+    else:
+        base_xy_array = numpy.asarray(
+            base_xy_array, dtype=numpy.float64).reshape((-1, 2))
+        if base_xy_array.shape[0] == 0:
+            raise ValueError(
+                'There are no base points to find the nearest of.')
+        kd_tree = scipy.spatial.cKDTree(base_xy_array)
+    n_base_points = kd_tree.n
+    # a few extra neighbors are found so that ties can go to the lowest index
+    n_neighbors = min(_NEAREST_NEIGHBOR_TIES, n_base_points)
+    distance_array, index_array = kd_tree.query(
+        query_xy_array, k=n_neighbors)
+    if n_neighbors == 1:
+        return distance_array, index_array
+    tied_mask = distance_array == distance_array[:, :1]
+    index_array = numpy.where(tied_mask, index_array, n_base_points).min(
+        axis=1)
+    return distance_array[:, 0], index_array
@@ -2,8 +2,7 @@
 import math
 import os
 import logging
-import struct
-import itertools
+import collections.abc
 import shutil
 import tempfile
 
@@ -389,8 +388,6 @@ def execute(args):
     analysis_area_path = args['analysis_area_path']
     # Use the analysis area String to get the path's to the wave seastate data,
     # the wave point shapefile, and the polygon extract shapefile
-    wave_seastate_bins = _binary_wave_data_to_dict(
-        analysis_dict[analysis_area_path]['ww3_path'])
     analysis_area_points_path = analysis_dict[analysis_area_path][
         'point_vector']
     analysis_area_extract_path = analysis_dict[analysis_area_path][
@@ -415,6 +412,9 @@ def execute(args):
         # not corrupted when we clip the vector
         _copy_vector_or_raster(analysis_area_points_path, wave_vector_path)
 
+        # All of the wave points are used
+        ij_bounding_box = None
+
         # The path to a polygon shapefile that specifies the broader AOI
         aoi_vector_path = analysis_area_extract_path
 
@@ -470,6 +470,12 @@ def execute(args):
         target_pixel_size = _pixel_size_helper(wave_vector_path, coord_trans,
                                                coord_trans_opposite, dem_path)
 
+        # Only the wave points in the AOI are read from the WW3 data
+        ij_bounding_box = _get_ij_bounding_box(wave_vector_path)
+
+    wave_seastate_bins = _binary_wave_data_to_dict(
+        analysis_dict[analysis_area_path]['ww3_path'], ij_bounding_box)
+
     LOGGER.debug('target_pixel_size: %s, target_projection: %s',
                  target_pixel_size, aoi_sr_wkt)
 
@@ -1083,10 +1089,9 @@ def _get_points_geometries(base_vector_path):
 def _calculate_min_distances(xy_1, xy_2):
     """Calculate the shortest distances and indexes of points in xy_1 to xy_2.
 
-    For all points in xy_1, this function calculates the distance from point
-    xy_1 to various points in xy_2, and stores the shortest distances found in
-    a list min_dist. The function also stores the index from which ever point
-    in xy_2 was closest, as an id in a list that corresponds to min_dist.
+    For all points in xy_1, this function finds the closest point in xy_2
+    with ``utils.nearest_neighbors`` and returns the distance to it and its
+    index in xy_2.
 
     Parameters:
         xy_1 (numpy.array): An array of points in the form [x,y]
@@ -1099,29 +1104,75 @@ def _calculate_min_distances(xy_1, xy_2):
             of shortest distances (min_dist).
 
     """
-    # Create two numpy array of zeros with length set to as many points in xy_1
-    min_dist = numpy.zeros(len(xy_1))
-    min_id = numpy.zeros(len(xy_1))
+    return utils.nearest_neighbors(xy_1, xy_2)
+
 
-    # For all points xy_point in xy_1 calculate the distance from xy_point to
-    # xy_2 and save the shortest distance found.
-    for idx, xy_point in enumerate(xy_1):
-        dists = numpy.sqrt(numpy.sum((xy_point - xy_2)**2, axis=1))
-        min_dist[idx], min_id[idx] = dists.min(), dists.argmin()
+class _WaveBinMatrix(collections.abc.Mapping):
+    """Read-only mapping of (I,J) keys to the seastate matrices of WW3 points.
 
-    return min_dist, min_id
+    The matrices are views into a memory-mapped WW3 binary file, so a
+    point's matrix is only read from disk when it is used.
+    """
 
+    def __init__(self, point_array, ij_bounding_box=None):
+        """Index the points of a WW3 point array by their (I,J) key.
 
-def _binary_wave_data_to_dict(wave_file_path):
-    """Convert a pickled binary WW3 text file into a dictionary.
+        Parameters:
+            point_array (numpy.ndarray): structured array with 'i', 'j' and
+                'bins' fields, as mapped by ``_binary_wave_data_to_dict``.
+            ij_bounding_box (list): if not None, only points with
+                ``i_min <= I <= i_max`` and ``j_min <= J <= j_max`` are in the
+                mapping, where this is ``[i_min, j_min, i_max, j_max]``.
 
-    The dictionary's keys are the corresponding (I,J) values and the value is
-    a two-dimensional array representing a matrix of the number of hours a
-    seastate occurs over a 5 year period. The row and column fields are
-    extracted once and stored in the dictionary as well.
+        Returns:
+            None
+
+        """
+        self._point_array = point_array
+        i_array = numpy.array(point_array['i'])
+        j_array = numpy.array(point_array['j'])
+        if ij_bounding_box is None:
+            index_array = numpy.arange(i_array.size)
+        else:
+            index_array = numpy.flatnonzero(
+                (i_array >= ij_bounding_box[0]) &
+                (j_array >= ij_bounding_box[1]) &
+                (i_array <= ij_bounding_box[2]) &
+                (j_array <= ij_bounding_box[3]))
+        # a later point with the same key replaces an earlier one
+        self._index_map = dict(zip(
+            zip(i_array[index_array].tolist(),
+                j_array[index_array].tolist()),
+            index_array.tolist()))
+
+    def __getitem__(self, key):
+        """Return the (n_rows, n_cols) seastate matrix of a point."""
+        return self._point_array[self._index_map[key]]['bins']
+
+    def __iter__(self):
+        """Iterate over the (I,J) keys of the points."""
+        return iter(self._index_map)
+
+    def __len__(self):
+        """Return the number of points."""
+        return len(self._index_map)
+
+
+def _binary_wave_data_to_dict(wave_file_path, ij_bounding_box=None):
+    """Memory-map a binary WW3 file as a dictionary.
+
+    The file has a header of the number of columns and rows (int32) followed
+    by the periods and heights (float32), then for each point its I and J
+    (int32) and its rows by columns matrix of the number of hours a seastate
+    occurs over a 5 year period (float32).  The points are mapped as a
+    structured numpy array rather than parsed, so loading the file does not
+    read the matrices.
 
     Parameters:
         wave_file_path (str): path to a pickled binary WW3 file.
+        ij_bounding_box (list): if not None, ``[i_min, j_min, i_max, j_max]``
+            of the points to include in 'bin_matrix'; points with an I or J
+            outside of these are never read.
 
     Returns:
         wave_dict (dict): a dictionary of matrices representing hours of
@@ -1135,59 +1186,80 @@ def _binary_wave_data_to_dict(wave_file_path):
                                 (in, jn): [[2,5,3,2,...], [6,3,4,1,...],...]
                               }
                }
+            where 'bin_matrix' is a read-only ``_WaveBinMatrix`` mapping.
 
-    """
-    LOGGER.info('Extrapolating wave data from text to a dictionary')
-    wave_file = open(wave_file_path, 'rb')
-    wave_dict = {}
-    # Create a key that hosts another dictionary where the matrix
-    # representation of the seastate bins will be saved
-    wave_dict['bin_matrix'] = {}
-    wave_array = None
-    wave_periods = []
-    wave_heights = []
-    key = None
+    Raises:
+        ValueError if the size of the file does not match its header.
 
+    """
+    LOGGER.info('Memory-mapping wave data from %s', wave_file_path)
     # get rows,cols
-    row_col_bin = wave_file.read(8)
-    n_cols, n_rows = struct.unpack('ii', row_col_bin)
-
+    n_cols, n_rows = numpy.memmap(
+        wave_file_path, dtype=numpy.int32, mode='r', shape=(2,)).tolist()
     # get the periods and heights
-    line = wave_file.read(n_cols * 4)
-
-    wave_periods = list(struct.unpack('f' * n_cols, line))
-    line = wave_file.read(n_rows * 4)
-    wave_heights = list(struct.unpack('f' * n_rows, line))
-
-    key = None
-    while True:
-        line = wave_file.read(8)
-        if not line:
-            # end of file
-            wave_dict['bin_matrix'][key] = numpy.array(wave_array)
-            break
+    wave_periods = numpy.array(numpy.memmap(
+        wave_file_path, dtype=numpy.float32, mode='r', offset=8,
+        shape=(n_cols,)))
+    wave_heights = numpy.array(numpy.memmap(
+        wave_file_path, dtype=numpy.float32, mode='r',
+        offset=8 + 4 * n_cols, shape=(n_rows,)))
+
+    point_type = numpy.dtype([
+        ('i', numpy.int32), ('j', numpy.int32),
+        ('bins', numpy.float32, (n_rows, n_cols))])
+    point_offset = 8 + 4 * (n_cols + n_rows)
+    n_point_bytes = os.path.getsize(wave_file_path) - point_offset
+    if n_point_bytes < 0 or n_point_bytes % point_type.itemsize != 0:
+        raise ValueError(
+            '%s has %d bytes of points, which is not a multiple of the %d '
+            'bytes of a point with a %d by %d seastate matrix.' % (
+                wave_file_path, n_point_bytes, point_type.itemsize, n_rows,
+                n_cols))
+    n_points = n_point_bytes // point_type.itemsize
+    if n_points == 0:
+        # numpy can't map an empty range of a file
+        point_array = numpy.empty(0, dtype=point_type)
+    else:
+        point_array = numpy.memmap(
+            wave_file_path, dtype=point_type, mode='r', offset=point_offset,
+            shape=(n_points,))
+
+    wave_dict = {
+        'bin_matrix': _WaveBinMatrix(point_array, ij_bounding_box),
+        'periods': wave_periods,
+        'heights': wave_heights,
+    }
+    # Add row/col field to dictionary
+    LOGGER.debug('WaveData col %s', wave_periods)
+    LOGGER.debug('WaveData row %s', wave_heights)
+    LOGGER.info(
+        'Mapped %d of %d wave points.', len(wave_dict['bin_matrix']),
+        n_points)
+    return wave_dict
 
-        if key is not None:
-            wave_dict['bin_matrix'][key] = numpy.array(wave_array)
 
-        # Clear out array
-        wave_array = []
+def _get_ij_bounding_box(base_wave_vector_path):
+    """Get the range of the I and J fields of the points in a wave vector.
 
-        key = struct.unpack('ii', line)
+    Parameters:
+        base_wave_vector_path (str): path to a wave point vector with 'I' and
+            'J' fields.
 
-        for _ in itertools.repeat(None, n_rows):
-            line = wave_file.read(n_cols * 4)
-            array = list(struct.unpack('f' * n_cols, line))
-            wave_array.append(array)
+    Returns:
+        ``[i_min, j_min, i_max, j_max]`` of the points, or None if the vector
+        has no points.
 
-    wave_file.close()
-    # Add row/col field to dictionary
-    LOGGER.debug('WaveData col %s', wave_periods)
-    wave_dict['periods'] = numpy.array(wave_periods, dtype='f')
-    LOGGER.debug('WaveData row %s', wave_heights)
-    wave_dict['heights'] = numpy.array(wave_heights, dtype='f')
-    LOGGER.info('Finished extrapolating wave data to dictionary.')
-    return wave_dict
+    """
+    base_wave_vector = gdal.OpenEx(base_wave_vector_path, gdal.OF_VECTOR)
+    base_wave_layer = base_wave_vector.GetLayer()
+    ij_list = [
+        (feat.GetField('I'), feat.GetField('J')) for feat in base_wave_layer]
+    base_wave_layer = None
+    base_wave_vector = None
+    if not ij_list:
+        return None
+    i_list, j_list = zip(*ij_list)
+    return [min(i_list), min(j_list), max(i_list), max(j_list)]
 
 
 def _machine_csv_to_dict(machine_csv_path):
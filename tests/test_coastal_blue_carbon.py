@@ -624,6 +624,34 @@ class TestModel(unittest.TestCase):
         numpy.testing.assert_array_almost_equal(
             npv_array, npv_test, decimal=4)
 
+    def test_model_run_n_workers(self):
+        """Coastal Blue Carbon: Test main model on worker processes."""
+        from natcap.invest.coastal_blue_carbon \
+            import coastal_blue_carbon as cbc
+
+        self.args['lulc_baseline_year'] = 2000
+        self.args['lulc_transition_years_list'] = [2005, 2010]
+        self.args['analysis_year'] = None
+        self.args['n_workers'] = 2
+
+        cbc.execute(self.args)
+        netseq_array = _read_array(os.path.join(
+            self.args['workspace_dir'],
+            'outputs_core/total_net_carbon_sequestration_test.tif'))
+        npv_array = _read_array(os.path.join(
+            self.args['workspace_dir'],
+            'outputs_core/net_present_value_at_2010_test.tif'))
+
+        # the same results as ``test_model_run``
+        numpy.testing.assert_array_almost_equal(
+            netseq_array,
+            numpy.array([[cbc.NODATA_FLOAT, 31.], [31., 31.]]), decimal=4)
+        numpy.testing.assert_array_almost_equal(
+            npv_array,
+            numpy.array(
+                [[cbc.NODATA_FLOAT, 60.27801514],
+                 [60.27801514, 60.27801514]]), decimal=4)
+
     def test_model_run_2(self):
         """Coastal Blue Carbon: Test CBC without analysis year."""
         from natcap.invest.coastal_blue_carbon \
@@ -964,6 +992,123 @@ class CBCRefactorTest(unittest.TestCase):
 
         numpy.testing.assert_almost_equal(reclassified_array, expected_array)
 
+    def test_reclass_transition(self):
+        """Coastal Blue Carbon: verify reclassification of transitions."""
+        from natcap.invest.coastal_blue_carbon \
+            import coastal_blue_carbon as cbc
+
+        lulc_nodata = 255
+        prev_lulc_matrix = numpy.array([
+            [1, 1, 2],
+            [2, 3, 255]], numpy.uint8)
+        next_lulc_matrix = numpy.array([
+            [1, 2, 1],
+            [3, 3, 1]], numpy.uint8)
+
+        transition_map = {
+            (1, 1): 0.0,
+            (1, 2): 0.5,
+            (2, 1): 0.25,
+            (3, 3): 0.75,
+        }
+
+        reclassified_array = cbc.reclass_transition(
+            prev_lulc_matrix, next_lulc_matrix, transition_map,
+            out_dtype=numpy.float32, nodata_mask=lulc_nodata)
+
+        # the transition from 2 to 3 isn't in the map, so it's masked
+        expected_array = numpy.ma.masked_array(numpy.array([
+            [0.0, 0.5, 0.25],
+            [0.0, 0.75, numpy.nan]], numpy.float32), mask=[
+                [False, False, False],
+                [True, False, False]])
+        numpy.testing.assert_array_equal(
+            numpy.ma.getmaskarray(reclassified_array), expected_array.mask)
+        numpy.testing.assert_almost_equal(
+            reclassified_array.data, expected_array.data)
+
+
+    def test_calculate_block_long_analysis(self):
+        """Coastal Blue Carbon: block outputs of a long analysis period."""
+        from unittest import mock
+        from natcap.invest.coastal_blue_carbon \
+            import coastal_blue_carbon as cbc
+
+        # transitions in 2005 and 2010 and an analysis year 30 years after
+        # the last transition, so the last snapshot is at the final timestep
+        # and the disturbed carbon decays over a long tail
+        snapshot_years = [2000, 2005, 2010, 2040]
+        n_snapshots = len(snapshot_years)
+        code_list = [1, 2, 3]
+        d = {
+            'timesteps': 40,
+            'transitions': 3,
+            'snapshot_years': snapshot_years,
+            'transition_years': [2005, 2010],
+            'lulc_to_Sb': {1: 10.0, 2: 5.0, 3: 0.0},
+            'lulc_to_Ss': {1: 100.0, 2: 50.0, 3: 20.0},
+            'lulc_to_L': {1: 1.0, 2: 0.5, 3: 0.0},
+            'lulc_to_Yb': {1: 0.5, 2: 0.2, 3: 0.0},
+            'lulc_to_Ys': {1: 2.0, 2: 1.0, 3: 0.1},
+            'lulc_trans_to_Db': dict(
+                ((prev_code, next_code),
+                 0.0 if prev_code == next_code else 0.5)
+                for prev_code in code_list for next_code in code_list),
+            'lulc_trans_to_Ds': dict(
+                ((prev_code, next_code),
+                 0.0 if prev_code == next_code else 0.25 * prev_code)
+                for prev_code in code_list for next_code in code_list),
+            'do_economic_analysis': True,
+            'price_t': 10.0 / 1.05 ** numpy.arange(41),
+            'File_Registry': {
+                'T_s_rasters': ['T_s'] * n_snapshots,
+                'A_r_rasters': ['A_r'] * (n_snapshots - 1),
+                'E_r_rasters': ['E_r'] * (n_snapshots - 1),
+                'N_r_rasters': ['N_r'] * (n_snapshots - 1),
+                'N_total_raster': 'N_total',
+                'NPV_transition_rasters': ['NPV'] * n_snapshots,
+            },
+        }
+        lulc_nodata = -1
+        block_args = (
+            {'xoff': 0, 'yoff': 0, 'win_xsize': 4, 'win_ysize': 1},
+            numpy.array([[1, 2, 3, -1]], dtype=numpy.int32),
+            [numpy.array([[2, 2, 1, -1]], dtype=numpy.int32),
+             numpy.array([[3, 1, 1, -1]], dtype=numpy.int32)])
+
+        with mock.patch.dict(cbc._BLOCK_STATE):
+            cbc._init_block_calculator(d, lulc_nodata)
+            offset_dict, output_array_list = cbc._calculate_block(block_args)
+        self.assertEqual(block_args[0], offset_dict)
+
+        # values of the valid pixels of each output, in the order of
+        # _get_output_raster_paths
+        expected_value_list = [
+            [111.0, 55.5, 20.0],  # T_s
+            [87.4375, 61.5, 18.96875],
+            [44.418938, 44.953125, 31.014648],
+            [46.031219, 119.000008, 106.0],
+            [6.0, 6.0, 12.5],  # A_r
+            [0.5, 12.5, 12.5],
+            [2.999999, 75.0, 75.0],
+            [29.0625, 0.0, 14.53125],  # E_r
+            [43.018555, 29.546875, 0.454102],
+            [1.387695, 0.953125, 0.014648],
+            [-23.062498, 6.0, -2.03125],  # N_r
+            [-42.518559, -17.046875, 12.045898],
+            [1.612305, 74.046875, 74.985352],
+            [-63.968765, 63.0, 85.0],  # N_total
+            [-138.0, 12.0, -50.0],  # NPV
+            [-663.02771, 54.551407, -266.473816],
+            [-1064.374512, 95.012444, -436.086731],
+            [-2133.616699, 234.180420, -900.852051],
+        ]
+        self.assertEqual(len(expected_value_list), len(output_array_list))
+        for output_array, expected_values in zip(
+                output_array_list, expected_value_list):
+            numpy.testing.assert_allclose(
+                output_array[0, :3], expected_values, rtol=1e-6, atol=1e-6)
+            self.assertEqual(output_array[0, 3], cbc.NODATA_FLOAT)
 
 class CBCValidationTests(unittest.TestCase):
     """Tests for Coastal Blue Carbon Model ARGS_SPEC and validation."""
@@ -728,6 +728,22 @@ class CoastalVulnerabilityTests(unittest.TestCase):
         result = coastal_vulnerability._geometric_mean(array)
         self.assertTrue(numpy.isnan(result))
 
+    def test_ray_segment_distances(self):
+        """CV: test rays stop at the nearest line segment they cross."""
+        origin_array = numpy.array([[0, 0], [0, 0], [0, 0], [5, 5]])
+        direction_array = numpy.array(
+            [[1, 0], [0, 1], [-1, 0], [1, 0]], dtype=numpy.float64)
+        segment_array = numpy.array([
+            [3, -1, 3, 1],  # crosses the first ray
+            [2, -1, 2, 0],  # touches the first ray at its end
+            [-1, 4, 1, 4],  # crosses the second ray
+            [-20, -1, -20, 1],  # beyond the end of the third ray
+            [6, 5, 9, 5],  # parallel to the last ray
+        ], dtype=numpy.float64)
+        distance_array = coastal_vulnerability._ray_segment_distances(
+            origin_array, direction_array, 10, segment_array)
+        numpy.testing.assert_allclose(distance_array, [2, 4, 10, 10])
+
     def test_final_risk_calc_with_missing_data(self):
         """CV: test missing data at feature propogates to empty field in output."""
         target_vector_path = os.path.join(self.workspace_dir, 'target.gpkg')
@@ -57,6 +57,53 @@ class ForestCarbonEdgeTests(unittest.TestCase):
                 args['workspace_dir'], 'aggregated_carbon_stocks.shp'),
             os.path.join(REGRESSION_DATA, 'agg_results_base.shp'))
 
+    def test_carbon_full_n_workers(self):
+        """Forest Carbon Edge: process pool matches in-process results."""
+        from natcap.invest import forest_carbon_edge_effect
+
+        args = {
+            'aoi_vector_path': os.path.join(
+                REGRESSION_DATA, 'input', 'small_aoi.shp'),
+            'biomass_to_carbon_conversion_factor': '0.47',
+            'biophysical_table_path': os.path.join(
+                REGRESSION_DATA, 'input', 'forest_edge_carbon_lu_table.csv'),
+            'compute_forest_edge_effects': True,
+            'lulc_raster_path': os.path.join(
+                REGRESSION_DATA, 'input', 'small_lulc.tif'),
+            'n_nearest_model_points': 10,
+            'pools_to_calculate': 'all',
+            'tropical_forest_edge_carbon_model_vector_path': os.path.join(
+                REGRESSION_DATA, 'input', 'core_data',
+                'forest_carbon_edge_regression_model_parameters.shp'),
+        }
+        raster_list_by_n_workers = {}
+        for n_workers in [-1, 2]:
+            args['workspace_dir'] = os.path.join(
+                self.workspace_dir, 'workspace_%d' % n_workers)
+            args['n_workers'] = n_workers
+            forest_carbon_edge_effect.execute(args)
+
+            raster_list_by_n_workers[n_workers] = []
+            for raster_path in [
+                    os.path.join(
+                        args['workspace_dir'], 'intermediate_outputs',
+                        'tropical_forest_edge_carbon_stocks.tif'),
+                    os.path.join(args['workspace_dir'], 'carbon_map.tif')]:
+                raster = gdal.OpenEx(raster_path, gdal.OF_RASTER)
+                raster_list_by_n_workers[n_workers].append(
+                    raster.GetRasterBand(1).ReadAsArray())
+                raster = None
+
+        for in_process_array, pool_array in zip(
+                raster_list_by_n_workers[-1], raster_list_by_n_workers[2]):
+            numpy.testing.assert_array_equal(pool_array, in_process_array)
+
+        # the pooled run matches the regression results too
+        self._assert_vector_results_close(
+            args['workspace_dir'], 'id', ['c_sum', 'c_ha_mean'], os.path.join(
+                args['workspace_dir'], 'aggregated_carbon_stocks.shp'),
+            os.path.join(REGRESSION_DATA, 'agg_results_base.shp'))
+
     def test_carbon_dup_output(self):
         """Forest Carbon Edge: test for existing output overlap."""
         from natcap.invest import forest_carbon_edge_effect
@@ -662,6 +662,146 @@ class HabitatQualityTests(unittest.TestCase):
         # Raster nodata is 255 and should NOT appear in this list.
         self.assertTrue(': 2, 3.' in actual_message, actual_message)
 
+    def test_habitat_quality_rerun_sensitivity_change(self):
+        """Habitat Quality: editing sensitivity doesn't redo convolutions."""
+        from natcap.invest import habitat_quality
+
+        args = {
+            'half_saturation_constant': '0.5',
+            'workspace_dir': self.workspace_dir,
+            'n_workers': -1,
+        }
+
+        args['lulc_cur_path'] = os.path.join(args['workspace_dir'],
+                                             'lc_samp_cur_b.tif')
+        make_lulc_raster(args['lulc_cur_path'], 2)
+
+        args['sensitivity_table_path'] = os.path.join(args['workspace_dir'],
+                                                      'sensitivity_samp.csv')
+        make_sensitivity_samp_csv(args['sensitivity_table_path'])
+
+        args['threat_raster_folder'] = args['workspace_dir']
+        make_threats_raster(args['threat_raster_folder'])
+
+        args['threats_table_path'] = os.path.join(args['workspace_dir'],
+                                                  'threats_samp.csv')
+        make_threats_csv(args['threats_table_path'])
+
+        habitat_quality.execute(args)
+
+        filtered_path_list = [
+            os.path.join(args['workspace_dir'], 'intermediate',
+                         'filtered_%s_c.tif' % threat)
+            for threat in ['threat_1', 'threat_2']]
+        filtered_mtime_list = [
+            os.path.getmtime(path) for path in filtered_path_list]
+        deg_sum_path = os.path.join(
+            args['workspace_dir'], 'output', 'deg_sum_c.tif')
+        deg_sum_raster = gdal.OpenEx(deg_sum_path, gdal.OF_RASTER)
+        base_deg_sum = deg_sum_raster.GetRasterBand(1).ReadAsArray().sum()
+        deg_sum_raster = None
+
+        # Make lulc 2 less sensitive to the second threat.
+        with open(args['sensitivity_table_path'], 'w') as open_table:
+            open_table.write('LULC,NAME,HABITAT,L_threat_1,L_threat_2\n')
+            open_table.write('1,"lulc 1",1,1,1\n')
+            open_table.write('2,"lulc 2",0.5,0.5,0.5\n')
+            open_table.write('3,"lulc 3",0,0.3,1\n')
+
+        habitat_quality.execute(args)
+
+        self.assertEqual(
+            [os.path.getmtime(path) for path in filtered_path_list],
+            filtered_mtime_list)
+        deg_sum_raster = gdal.OpenEx(deg_sum_path, gdal.OF_RASTER)
+        self.assertLess(
+            deg_sum_raster.GetRasterBand(1).ReadAsArray().sum(),
+            base_deg_sum)
+        deg_sum_raster = None
+
+    def test_habitat_quality_rarity_nodata(self):
+        """Habitat Quality: rarity is nodata where the baseline is nodata."""
+        from natcap.invest import habitat_quality
+
+        args = {
+            'half_saturation_constant': '0.5',
+            'workspace_dir': self.workspace_dir,
+        }
+
+        scenarios = ['_bas_', '_cur_', '_fut_']
+        for lulc_val, scenario in enumerate(scenarios, start=1):
+            path = os.path.join(
+                args['workspace_dir'], 'lc_samp' + scenario + 'b.tif')
+            args['lulc' + scenario + 'path'] = path
+            make_lulc_raster(path, lulc_val)
+
+            # Use a nodata value other than the model's nodata.
+            raster = gdal.OpenEx(path, gdal.OF_RASTER | gdal.GA_Update)
+            band = raster.GetRasterBand(1)
+            band.SetNoDataValue(255)
+            if scenario == '_bas_':
+                current_array = band.ReadAsArray()
+                current_array[0][0] = 255
+                band.WriteArray(current_array)
+            band = None
+            raster = None
+
+        args['sensitivity_table_path'] = os.path.join(args['workspace_dir'],
+                                                      'sensitivity_samp.csv')
+        make_sensitivity_samp_csv(args['sensitivity_table_path'])
+
+        args['threat_raster_folder'] = args['workspace_dir']
+        make_threats_raster(args['threat_raster_folder'])
+
+        args['threats_table_path'] = os.path.join(args['workspace_dir'],
+                                                  'threats_samp.csv')
+        make_threats_csv(args['threats_table_path'])
+
+        habitat_quality.execute(args)
+
+        for lulc_key in ['_c', '_f']:
+            rarity_raster = gdal.OpenEx(
+                os.path.join(args['workspace_dir'], 'output',
+                             'rarity%s.tif' % lulc_key), gdal.OF_RASTER)
+            rarity_band = rarity_raster.GetRasterBand(1)
+            rarity_nodata = rarity_band.GetNoDataValue()
+            rarity_array = rarity_band.ReadAsArray()
+            rarity_band = None
+            rarity_raster = None
+            self.assertEqual(rarity_array[0][0], rarity_nodata)
+            self.assertEqual(
+                numpy.count_nonzero(rarity_array == rarity_nodata), 1)
+            self.assertFalse(os.path.exists(
+                os.path.join(args['workspace_dir'], 'intermediate',
+                             'new_cover%s.tif' % lulc_key)))
+
+    def test_compute_rarity_unlisted_codes(self):
+        """Habitat Quality: rarity counts codes missing from the tables."""
+        from natcap.invest import habitat_quality
+
+        # 0 is like the fill value alignment may add and 7 is only in the
+        # current landcover; neither is in a sensitivity table
+        base_path = os.path.join(self.workspace_dir, 'lulc_b.tif')
+        make_raster_from_array(
+            numpy.array([[1, 1, 2], [0, 0, 2], [-1, 1, 1]], dtype=numpy.int8),
+            base_path)
+        lulc_path = os.path.join(self.workspace_dir, 'lulc_c.tif')
+        make_raster_from_array(
+            numpy.array([[1, 0, 7], [2, 2, 2], [1, -1, 1]], dtype=numpy.int8),
+            lulc_path)
+        rarity_path = os.path.join(self.workspace_dir, 'rarity_c.tif')
+
+        habitat_quality._compute_rarity(base_path, [lulc_path], [rarity_path])
+
+        nodata = habitat_quality._RARITY_NODATA
+        expected_array = numpy.array([
+            [0.5, 0.5, 0.0], [-0.5, -0.5, -0.5], [nodata, nodata, 0.5]],
+            dtype=numpy.float32)
+        rarity_raster = gdal.OpenEx(rarity_path, gdal.OF_RASTER)
+        numpy.testing.assert_array_equal(
+            rarity_raster.GetRasterBand(1).ReadAsArray(), expected_array)
+        rarity_raster = None
+
     def test_habitat_quality_validate(self):
         """Habitat Quality: validate raise exception as expected."""
         from natcap.invest import habitat_quality
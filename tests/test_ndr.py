@@ -243,6 +243,96 @@ class NDRTests(unittest.TestCase):
         if mismatch_list:
             raise RuntimeError("results not expected: %s" % mismatch_list)
 
+    def test_partition_by_watershed(self):
+        """NDR: watershed-partitioned effective retention matches the full.
+
+        The watersheds are the whole raster and a nested watershed inside
+        of it, so the largest watershed should win everywhere and reproduce
+        the unpartitioned result exactly.
+        """
+        from natcap.invest.ndr import ndr
+        from natcap.invest.ndr import ndr_core
+        from osgeo import osr
+        import pygeoprocessing.routing
+        import pygeoprocessing.testing
+
+        n_rows, n_cols = 40, 50
+        numpy.random.seed(1)
+        row_index, col_index = numpy.mgrid[0:n_rows, 0:n_cols]
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(26910)
+        origin = (461261, 4923265)
+        pixel_size = (30, -30)
+
+        path_map = {}
+        for name, array, nodata in [
+                ('dem', (
+                    numpy.abs(col_index - n_cols // 2) + 0.5 * row_index +
+                    numpy.random.random((n_rows, n_cols))), -1.0),
+                ('eff', 0.8 * numpy.random.random((n_rows, n_cols)), -1.0),
+                ('crit_len', numpy.full((n_rows, n_cols), 150.0), -1.0)]:
+            path_map[name] = os.path.join(self.workspace_dir, name + '.tif')
+            pygeoprocessing.testing.create_raster_on_disk(
+                [array.astype(numpy.float32)], origin, srs.ExportToWkt(),
+                nodata, pixel_size, filename=path_map[name])
+        path_map['flow_dir'] = os.path.join(self.workspace_dir, 'mfd.tif')
+        pygeoprocessing.routing.flow_dir_mfd(
+            (path_map['dem'], 1), path_map['flow_dir'])
+        path_map['flow_accum'] = os.path.join(
+            self.workspace_dir, 'flow_accum.tif')
+        pygeoprocessing.routing.flow_accumulation_mfd(
+            (path_map['flow_dir'], 1), path_map['flow_accum'])
+        path_map['stream'] = os.path.join(self.workspace_dir, 'stream.tif')
+        pygeoprocessing.routing.extract_streams_mfd(
+            (path_map['flow_accum'], 1), (path_map['flow_dir'], 1), 50,
+            path_map['stream'])
+
+        watersheds_path = os.path.join(self.workspace_dir, 'watersheds.gpkg')
+        vector = ogr.GetDriverByName('GPKG').CreateDataSource(
+            watersheds_path)
+        layer = vector.CreateLayer('watersheds', srs, ogr.wkbPolygon)
+        for min_x, max_x, min_y, max_y in [
+                (origin[0], origin[0] + n_cols * pixel_size[0],
+                 origin[1] + n_rows * pixel_size[1], origin[1]),
+                (origin[0] + 300, origin[0] + 600,
+                 origin[1] - 600, origin[1] - 300)]:
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for x, y in [
+                    (min_x, min_y), (min_x, max_y), (max_x, max_y),
+                    (max_x, min_y), (min_x, min_y)]:
+                ring.AddPoint(x, y)
+            polygon = ogr.Geometry(ogr.wkbPolygon)
+            polygon.AddGeometry(ring)
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(polygon)
+            layer.CreateFeature(feature)
+        fid_list = [feature.GetFID() for feature in layer]
+        layer = None
+        vector = None
+
+        expected_path = os.path.join(self.workspace_dir, 'expected.tif')
+        ndr_core.ndr_eff_calculation(
+            path_map['flow_dir'], path_map['stream'], path_map['eff'],
+            path_map['crit_len'], expected_path)
+
+        watershed_path_list = []
+        # the nested watershed is smaller, so it's mosaicked first
+        for ws_fid in reversed(fid_list):
+            watershed_path = os.path.join(
+                self.workspace_dir, 'eff_ret_ws%d.tif' % ws_fid)
+            ndr._calculate_watershed_effective_retention(
+                watersheds_path, ws_fid, path_map['flow_dir'],
+                path_map['stream'], path_map['eff'], path_map['crit_len'],
+                watershed_path, self.workspace_dir)
+            watershed_path_list.append(watershed_path)
+        actual_path = os.path.join(self.workspace_dir, 'actual.tif')
+        ndr._mosaic_rasters(
+            watershed_path_list, path_map['flow_dir'], actual_path)
+
+        numpy.testing.assert_array_equal(
+            gdal.OpenEx(expected_path).ReadAsArray(),
+            gdal.OpenEx(actual_path).ReadAsArray())
+
     def test_validation(self):
         """NDR test argument validation."""
         from natcap.invest.ndr import ndr
@@ -12,6 +12,7 @@ import functools
 import logging
 import json
 import queue
+import collections
 
 import Pyro4
 import pygeoprocessing
@@ -136,6 +137,79 @@ class TestBufferedNumpyDiskMap(unittest.TestCase):
             file_manager.read(1234)
 
 
+class TestColumnarPointStore(unittest.TestCase):
+    """Tests for ColumnarPointStore."""
+
+    def setUp(self):
+        """Setup workspace."""
+        self.workspace_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Delete workspace."""
+        shutil.rmtree(self.workspace_dir)
+
+    @staticmethod
+    def _make_points(n_points, user_hash):
+        """Make a structured point array with ``n_points`` rows."""
+        from natcap.invest.recreation import columnar_point_store
+        point_array = numpy.empty(
+            n_points,
+            dtype=columnar_point_store.ColumnarPointStore._ARRAY_TUPLE_TYPE)
+        point_array['f0'] = (
+            numpy.datetime64('2010-01-01') + numpy.arange(n_points))
+        point_array['f1'] = user_hash
+        point_array['f2'] = numpy.arange(n_points)
+        point_array['f3'] = -numpy.arange(n_points)
+        return point_array
+
+    def test_basic_operation(self):
+        """Recreation test columnar point store append, read and delete."""
+        from natcap.invest.recreation import columnar_point_store
+        point_store = columnar_point_store.ColumnarPointStore(
+            os.path.join(self.workspace_dir, 'test'), 0)
+
+        points_a = self._make_points(3, b'aaaa')
+        points_b = self._make_points(4, b'bbbb')
+        point_store.append(1234, points_a)
+        point_store.append(4321, points_b)
+        point_store.append(1234, points_a)
+
+        numpy.testing.assert_equal(
+            point_store.read(1234), numpy.concatenate([points_a, points_a]))
+        numpy.testing.assert_equal(point_store.read(4321), points_b)
+
+        point_store.delete(1234)
+        self.assertEqual(point_store.read(1234).size, 0)
+
+    def test_flush_and_pickle(self):
+        """Recreation test columnar point store packs and reloads."""
+        import pickle
+        from natcap.invest.recreation import columnar_point_store
+        point_store = columnar_point_store.ColumnarPointStore(
+            os.path.join(self.workspace_dir, 'test'), 2**20)
+
+        points_a = self._make_points(5, b'aaaa')
+        points_b = self._make_points(2, b'bbbb')
+        point_store.append(1, points_a)
+        point_store.append(2, points_b)
+        point_store._write_buffer()
+        point_store.append(1, points_b)
+        point_store.append(3, points_a)
+        point_store.delete(3)
+        point_store.flush()
+
+        # deleted points are dropped and every node is one range
+        self.assertEqual(point_store.n_rows, 9)
+        self.assertEqual(point_store.array_ranges[1], [(0, 7)])
+
+        loaded_store = pickle.loads(pickle.dumps(point_store))
+        column_list = loaded_store.read_columns(1)
+        self.assertIsInstance(column_list[0], numpy.memmap)
+        numpy.testing.assert_equal(
+            loaded_store.read(1), numpy.concatenate([points_a, points_b]))
+        numpy.testing.assert_equal(loaded_store.read(2), points_b)
+
+
 class TestRecServer(unittest.TestCase):
     """Tests that set up local rec server on a port and call through."""
 
@@ -182,6 +256,72 @@ class TestRecServer(unittest.TestCase):
                 self.resampled_data_path,
                 2014, 2005, os.path.join(self.workspace_dir, 'server_cache'))
 
+    @_timeout(30.0)
+    def test_chunked_transfer(self):
+        """Recreation test chunked AOI upload and PUD table download."""
+        from natcap.invest.recreation import recmodel_server
+        from natcap.invest.recreation import recmodel_client
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        sock = None
+
+        server_args = {
+            'hostname': 'localhost',
+            'port': port,
+            'raw_csv_point_data_path': self.resampled_data_path,
+            'cache_workspace': self.workspace_dir,
+            'min_year': 2005,
+            'max_year': 2014,
+        }
+        server_thread = threading.Thread(
+            target=recmodel_server.execute, args=(server_args,))
+        server_thread.daemon = True
+        server_thread.start()
+
+        recreation_server = Pyro4.Proxy(
+            "PYRO:natcap.invest.recreation@localhost:%s" % port)
+        aoi_path = os.path.join(SAMPLE_DATA, 'test_aoi_for_subset.shp')
+        basename = os.path.splitext(aoi_path)[0]
+        aoi_archive_path = os.path.join(
+            self.workspace_dir, 'aoi_zipped.zip')
+        with zipfile.ZipFile(aoi_archive_path, 'w') as myzip:
+            for filename in glob.glob(basename + '.*'):
+                myzip.write(filename, os.path.basename(filename))
+
+        workspace_id = recreation_server.start_upload()
+        recmodel_client.upload_file(
+            recreation_server, aoi_archive_path, workspace_id,
+            chunk_size=2**10)
+        # sending a chunk again, as a resumed upload would, is harmless
+        with open(aoi_archive_path, 'rb') as aoi_archive:
+            recreation_server.upload_chunk(
+                workspace_id, 0, aoi_archive.read(2**10))
+        self.assertEqual(
+            os.path.getsize(aoi_archive_path),
+            recreation_server.get_upload_size(workspace_id))
+
+        result_sizes = recreation_server.calc_photo_user_days_in_upload(
+            workspace_id, ('2005-01-01', '2014-12-31'))
+        pud_table_path = os.path.join(self.workspace_dir, 'pud_table.npy')
+        recmodel_client.download_file(
+            recreation_server, workspace_id, 'pud_table.npy',
+            pud_table_path, chunk_size=2**8)
+        self.assertEqual(
+            result_sizes['pud_table.npy'], os.path.getsize(pud_table_path))
+        pud_table = numpy.load(pud_table_path)
+        # same annual average PUD as the single threaded regression
+        self.assertEqual(
+            83.2, pud_table['pud'][pud_table['fid'] == 0][0][0])
+
+        # only the workspace's result files can be downloaded
+        with self.assertRaises(ValueError):
+            recreation_server.download_chunk(
+                workspace_id, '../server_cache', 0, 2**8)
+        recreation_server._pyroRelease()
+
     @_timeout(30.0)
     def test_workspace_fetcher(self):
         """Recreation test workspace fetcher on a local Pyro4 empty server."""
@@ -369,6 +509,59 @@ class TestRecServer(unittest.TestCase):
             aoi_path,
             os.path.join(out_workspace_dir, 'test_aoi_for_subset.shp'), 1E-6)
 
+    def test_local_aggregate_points_cached(self):
+        """Recreation test repeated AOI queries use the result cache."""
+        from natcap.invest.recreation import recmodel_server
+
+        recreation_server = recmodel_server.RecModel(
+            self.resampled_data_path, 2005, 2014,
+            os.path.join(self.workspace_dir, 'server_cache'))
+
+        aoi_path = os.path.join(SAMPLE_DATA, 'test_aoi_for_subset.shp')
+        basename = os.path.splitext(aoi_path)[0]
+        aoi_archive_path = os.path.join(
+            self.workspace_dir, 'aoi_zipped.zip')
+        with zipfile.ZipFile(aoi_archive_path, 'w') as myzip:
+            for filename in glob.glob(basename + '.*'):
+                myzip.write(filename, os.path.basename(filename))
+        zip_file_binary = open(aoi_archive_path, 'rb').read()
+
+        date_range = (('2005-01-01'), ('2014-12-31'))
+        out_vector_filename = 'test_aoi_for_subset_pud.shp'
+        for run_index in range(2):
+            zip_result, _ = recreation_server.calc_photo_user_days_in_aoi(
+                zip_file_binary, date_range, out_vector_filename)
+            run_dir = os.path.join(self.workspace_dir, 'run_%d' % run_index)
+            result_zip_path = os.path.join(run_dir, 'pud_result.zip')
+            os.makedirs(run_dir)
+            open(result_zip_path, 'wb').write(zip_result)
+            zipfile.ZipFile(result_zip_path, 'r').extractall(run_dir)
+
+        cache_stats = recreation_server.get_result_cache_stats()
+        self.assertEqual(1, cache_stats['hits'])
+        self.assertEqual(1, cache_stats['misses'])
+        self.assertEqual(1, cache_stats['n_results'])
+
+        expected_vector_path = os.path.join(
+            REGRESSION_DATA, 'test_aoi_for_subset_pud.shp')
+        pygeoprocessing.testing.assert_vectors_equal(
+            expected_vector_path,
+            os.path.join(self.workspace_dir, 'run_1', out_vector_filename),
+            1E-6)
+        with open(os.path.join(
+                self.workspace_dir, 'run_0', 'monthly_table.csv')) as table:
+            expected_table = table.read()
+        with open(os.path.join(
+                self.workspace_dir, 'run_1', 'monthly_table.csv')) as table:
+            self.assertEqual(expected_table, table.read())
+
+        # a different date range is a different result
+        recreation_server.calc_photo_user_days_in_aoi(
+            zip_file_binary, ('2006-01-01', '2014-12-31'),
+            out_vector_filename)
+        self.assertEqual(2, recreation_server.get_result_cache_stats()[
+            'misses'])
+
     def test_local_calc_poly_pud(self):
         """Recreation test single threaded local PUD calculation."""
         from natcap.invest.recreation import recmodel_server
@@ -424,18 +617,202 @@ class TestRecServer(unittest.TestCase):
         self.assertEqual(
             83.2, pud_poly_feature_queue.get()[1][0])
 
-    def test_parse_input_csv(self):
-        """Recreation test parsing raw CSV."""
+    def test_resume_interrupted_quadtree_build(self):
+        """Recreation quadtree build resumes from its last checkpoint."""
+        import pickle
+        from unittest import mock
+        from natcap.invest.recreation import recmodel_server
+
+        with open(self.resampled_data_path, 'r') as resampled_file:
+            n_csv_points = len(resampled_file.readlines()) - 1
+        bounding_box = [-180, -90, 180, 90]
+        max_points_per_node = 50
+
+        def build_quadtree(cache_dir):
+            """Build a quadtree of the resampled points in `cache_dir`."""
+            os.makedirs(cache_dir, exist_ok=True)
+            return recmodel_server._build_userday_quadtree(
+                bounding_box, [self.resampled_data_path], cache_dir,
+                max_points_per_node, os.path.join(cache_dir, 'qt.pickle'),
+                None)
+
+        original_checkpoint_subtrees = recmodel_server._checkpoint_subtrees
+
+        def checkpoint_then_interrupt(*args):
+            """Interrupt the build on its second checkpoint."""
+            if checkpoint_mock.call_count == 2:
+                raise RuntimeError('interrupted quadtree build')
+            return original_checkpoint_subtrees(*args)
+
+        # small blocks and checkpoints so the csv takes several checkpoints
+        with mock.patch.object(recmodel_server, 'BLOCKSIZE', 2**10), \
+                mock.patch.object(recmodel_server, 'CHECKPOINT_BLOCKS', 1):
+            expected_qt = build_quadtree(
+                os.path.join(self.workspace_dir, 'uninterrupted'))
+
+            cache_dir = os.path.join(self.workspace_dir, 'interrupted')
+            with mock.patch.object(
+                    recmodel_server, '_checkpoint_subtrees',
+                    side_effect=checkpoint_then_interrupt) as checkpoint_mock:
+                with self.assertRaises(RuntimeError):
+                    build_quadtree(cache_dir)
+
+            build_state_path = recmodel_server._build_state_path(
+                os.path.join(cache_dir, 'qt'))
+            with open(build_state_path, 'r') as build_state_file:
+                build_state = json.load(build_state_file)
+            self.assertEqual(1, build_state['checkpoint_index'])
+            self.assertEqual(0, build_state['csv_index'])
+            self.assertIsNotNone(build_state['offset'])
+
+            resumed_qt = build_quadtree(cache_dir)
+
+        self.assertEqual(n_csv_points, expected_qt.n_points())
+        self.assertEqual(expected_qt.n_points(), resumed_qt.n_points())
+        self.assertEqual(expected_qt.n_nodes(), resumed_qt.n_nodes())
+        with open(os.path.join(cache_dir, 'qt.pickle'), 'rb') as qt_file:
+            self.assertEqual(n_csv_points, pickle.load(qt_file).n_points())
+        self.assertFalse(os.path.exists(build_state_path))
+        self.assertEqual(
+            [], glob.glob(os.path.join(cache_dir, 'qt_q*_*.pickle')))
+
+    def test_intersecting_point_columns_in_polygon(self):
+        """Recreation quadtree point columns match its structured points."""
+        import shapely.geometry
+        from natcap.invest.recreation import recmodel_server
+
+        cache_dir = os.path.join(self.workspace_dir, 'cache')
+        os.makedirs(cache_dir)
+        local_qt = recmodel_server._build_userday_quadtree(
+            [-180, -90, 180, 90], [self.resampled_data_path], cache_dir, 50,
+            os.path.join(cache_dir, 'qt.pickle'), None)
+
+        for shapely_polygon in [
+                shapely.geometry.box(-180, -90, 180, 90),
+                shapely.geometry.box(-100, -20, 30, 60),
+                shapely.geometry.Polygon([(-90, -45), (90, 0), (0, 45)]),
+                shapely.geometry.box(170, 80, 171, 81)]:
+            point_array = local_qt.get_intersecting_points_in_polygon(
+                shapely_polygon)
+            point_columns = (
+                local_qt.get_intersecting_point_columns_in_polygon(
+                    shapely_polygon))
+            self.assertEqual(
+                sorted(point_array.dtype.names), sorted(point_columns))
+            for field_name in point_array.dtype.names:
+                self.assertEqual(
+                    point_array.dtype[field_name],
+                    point_columns[field_name].dtype)
+                numpy.testing.assert_array_equal(
+                    point_array[field_name], point_columns[field_name])
+
+        self.assertEqual(
+            local_qt.n_points(),
+            local_qt.get_intersecting_point_columns_in_polygon(
+                shapely.geometry.box(-180, -90, 180, 90))['f0'].size)
+
+    def test_local_calc_added_points(self):
+        """Recreation local PUD calculation on a quadtree with added CSVs."""
+        import pickle
+        from natcap.invest.recreation import recmodel_server
+
+        # split the points into a base csv and a csv of added points
+        with open(self.resampled_data_path, 'r') as resampled_file:
+            header_line = resampled_file.readline()
+            line_list = resampled_file.readlines()
+        csv_path_list = []
+        for csv_index, csv_line_list in enumerate([
+                line_list[:len(line_list) // 2],
+                line_list[len(line_list) // 2:]]):
+            csv_path = os.path.join(
+                self.workspace_dir, 'points_%d.csv' % csv_index)
+            with open(csv_path, 'w') as csv_file:
+                csv_file.write(header_line)
+                csv_file.writelines(csv_line_list)
+            csv_path_list.append(csv_path)
+
+        cache_workspace = os.path.join(self.workspace_dir, 'server_cache')
+        base_server = recmodel_server.RecModel(
+            csv_path_list[:1], 2005, 2014, cache_workspace)
+        # the base quadtree is updated with the points of the added csv
+        recreation_server = recmodel_server.RecModel(
+            csv_path_list, 2005, 2014, cache_workspace)
+        self.assertNotEqual(
+            base_server.qt_pickle_filename,
+            recreation_server.qt_pickle_filename)
+
+        with open(recreation_server.qt_pickle_filename, 'rb') as qt_file:
+            self.assertEqual(len(line_list), pickle.load(qt_file).n_points())
+        with open(base_server.qt_pickle_filename, 'rb') as qt_file:
+            self.assertEqual(
+                len(line_list) // 2, pickle.load(qt_file).n_points())
+
+        date_range = (
+            numpy.datetime64('2005-01-01'),
+            numpy.datetime64('2014-12-31'))
+
+        poly_test_queue = queue.Queue()
+        poly_test_queue.put(0)
+        poly_test_queue.put('STOP')
+        pud_poly_feature_queue = queue.Queue()
+        recmodel_server._calc_poly_pud(
+            recreation_server.qt_pickle_filename,
+            os.path.join(SAMPLE_DATA, 'test_aoi_for_subset.shp'),
+            date_range, poly_test_queue, pud_poly_feature_queue)
+
+        # assert annual average PUD is the same as from a single csv
+        self.assertEqual(
+            83.2, pud_poly_feature_queue.get()[1][0])
+
+    def test_count_user_days(self):
+        """Recreation test user day counts match a set of user days."""
+        from natcap.invest.recreation import recmodel_server
+        from natcap.invest.recreation import out_of_core_quadtree
+
+        random_state = numpy.random.RandomState(0)
+        n_points = 1000
+        point_array = numpy.empty(
+            n_points, dtype=out_of_core_quadtree._ARRAY_TUPLE_TYPE)
+        point_array['f0'] = (
+            numpy.datetime64('2004-06-01') +
+            random_state.randint(0, 365 * 4, n_points))
+        # include hashes with null bytes since they're compared as bytes
+        user_hash_list = [b'%03d' % index for index in range(20)] + [
+            b'ab\x00\x00', b'\x00\x00ab']
+        point_array['f1'] = [
+            user_hash_list[index] for index in random_state.randint(
+                0, len(user_hash_list), n_points)]
+        date_range = (
+            numpy.datetime64('2005-01-01'), numpy.datetime64('2007-12-31'))
+
+        expected_set = set()
+        expected_monthly_sets = collections.defaultdict(set)
+        for point_date, user_hash, _, _ in point_array:
+            if date_range[0] <= point_date <= date_range[1]:
+                point_date = point_date.tolist()
+                user_day = (user_hash, point_date)
+                expected_set.add(user_day)
+                expected_monthly_sets[str(point_date.month)].add(user_day)
+                expected_monthly_sets['%d-%d' % (
+                    point_date.year, point_date.month)].add(user_day)
+
+        n_user_days, monthly_counts = recmodel_server._count_user_days(
+            point_array, date_range)
+        self.assertEqual(len(expected_set), n_user_days)
+        self.assertEqual(
+            dict((key, len(user_day_set)) for key, user_day_set in
+                 expected_monthly_sets.items()), monthly_counts)
+
+        self.assertEqual(
+            (0, {}), recmodel_server._count_user_days(
+                point_array[:0], date_range))
+
+    def test_parse_csv_block(self):
+        """Recreation test parsing a block of raw CSV."""
         from natcap.invest.recreation import recmodel_server
 
-        block_offset_size_queue = queue.Queue()
-        block_offset_size_queue.put((0, 2**10))
-        block_offset_size_queue.put('STOP')
-        numpy_array_queue = queue.Queue()
-        recmodel_server._parse_input_csv(
-            block_offset_size_queue, self.resampled_data_path,
-            numpy_array_queue)
-        val = numpy_array_queue.get()
+        val = recmodel_server._parse_csv_block(
+            self.resampled_data_path, 0, 2**10)
         # we know what the first date is
         self.assertEqual(val[0][0], datetime.date(2013, 3, 16))
 
@@ -105,6 +105,185 @@ class ScenarioProximityTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             scenario_gen_proximity.execute(args)
 
+    def test_incremental_distance_update(self):
+        """Scenario Gen Proximity: incremental distances match a full EDT."""
+        import numpy
+        import scipy.ndimage
+        from natcap.invest import scenario_gen_proximity
+
+        def _full_distance(class_array):
+            """Combined distance transform of a whole class array."""
+            focal_mask = class_array == scenario_gen_proximity._FOCAL_CLASS
+            non_focal_mask = (
+                class_array == scenario_gen_proximity._NON_FOCAL_CLASS)
+            return numpy.where(
+                non_focal_mask,
+                scipy.ndimage.distance_transform_edt(~focal_mask),
+                scipy.ndimage.distance_transform_edt(
+                    ~non_focal_mask)).astype(numpy.float32)
+
+        # smooth patches of focal (2) and non-focal (1) landcover with a
+        # nodata (0) border, spanning several tiles
+        rng = numpy.random.RandomState(5)
+        lulc_array = 1 + (scipy.ndimage.gaussian_filter(
+            rng.random_sample((600, 700)), 6) > 0.5).astype(numpy.int32)
+        lulc_array[:5, :] = 0
+        class_array = scenario_gen_proximity._classify_landcover(
+            lulc_array, [2], 0)
+        distance_array = _full_distance(class_array)
+        tile_max_array = scenario_gen_proximity._calculate_tile_max(
+            distance_array)
+
+        for _ in range(3):
+            # convert the focal pixels nearest to the edge
+            focal_indexes = numpy.nonzero(
+                class_array.ravel() ==
+                scenario_gen_proximity._FOCAL_CLASS)[0]
+            changed_flat_indexes = focal_indexes[numpy.argsort(
+                distance_array.ravel()[focal_indexes],
+                kind='mergesort')[:2000]]
+            class_array.ravel()[changed_flat_indexes] = (
+                scenario_gen_proximity._NON_FOCAL_CLASS)
+            base_distance_array = distance_array.copy()
+
+            dirty_tiles = scenario_gen_proximity._update_distance_from_edge(
+                class_array, distance_array, tile_max_array,
+                changed_flat_indexes)
+            expected_distance_array = _full_distance(class_array)
+            numpy.testing.assert_allclose(
+                distance_array, expected_distance_array, rtol=1e-6)
+            numpy.testing.assert_allclose(
+                tile_max_array, scenario_gen_proximity._calculate_tile_max(
+                    expected_distance_array))
+            changed_rows, changed_cols = numpy.nonzero(
+                base_distance_array != expected_distance_array)
+            tile_size = scenario_gen_proximity._DISTANCE_TILE_SIZE
+            self.assertTrue(dirty_tiles[
+                changed_rows // tile_size, changed_cols // tile_size].all())
+
+    def test_incremental_distance_update_regression(self):
+        """Scenario Gen Proximity: incremental steps match full passes."""
+        from unittest import mock
+        import numpy
+        import scipy.ndimage
+        from osgeo import gdal
+        from osgeo import osr
+        from natcap.invest import scenario_gen_proximity
+
+        # smooth patches of focal (2) and non-focal (1) landcover with a
+        # nodata (0) border
+        rng = numpy.random.RandomState(7)
+        lulc_array = 1 + (scipy.ndimage.gaussian_filter(
+            rng.random_sample((300, 400)), 6) > 0.5).astype(numpy.int32)
+        lulc_array[:5, :] = 0
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(26910)  # UTM Zone 10N
+        lulc_path = os.path.join(self.workspace_dir, 'lulc.tif')
+        pygeoprocessing.testing.create_raster_on_disk(
+            [lulc_array], (1180000, 690000), srs.ExportToWkt(), 0, (30, -30),
+            datatype=gdal.GDT_Int32, filename=lulc_path)
+
+        workspace_list = []
+        # small tiles so that steps only update part of the landscape
+        with mock.patch.object(
+                scenario_gen_proximity, '_DISTANCE_TILE_SIZE', 2**5), \
+                mock.patch.object(
+                    scenario_gen_proximity, '_update_convertible_distances',
+                    wraps=scenario_gen_proximity._update_convertible_distances
+                    ) as update_mock:
+            for incremental_update in (False, True):
+                workspace_dir = os.path.join(
+                    self.workspace_dir, str(incremental_update))
+                scenario_gen_proximity.execute({
+                    'base_lulc_path': lulc_path,
+                    'workspace_dir': workspace_dir,
+                    'area_to_convert': '270.0',
+                    'convertible_landcover_codes': '2',
+                    'focal_landcover_codes': '2',
+                    'n_fragmentation_steps': '5',
+                    'replacment_lucode': '1',
+                    'convert_farthest_from_edge': True,
+                    'convert_nearest_to_edge': True,
+                    'incremental_distance_update': incremental_update,
+                    'n_workers': '-1',
+                })
+                workspace_list.append(workspace_dir)
+        # some steps updated their distances incrementally
+        self.assertTrue(update_mock.called)
+
+        for basename in ('farthest_from_edge', 'nearest_to_edge'):
+            landscape_array_list = []
+            for workspace_dir in workspace_list:
+                landscape_raster = gdal.OpenEx(
+                    os.path.join(workspace_dir, basename + '.tif'),
+                    gdal.OF_RASTER)
+                landscape_array_list.append(
+                    landscape_raster.GetRasterBand(1).ReadAsArray())
+                landscape_raster = None
+            numpy.testing.assert_array_equal(*landscape_array_list)
+            pandas.testing.assert_frame_equal(*[
+                pandas.read_csv(os.path.join(workspace_dir, basename + '.csv'))
+                for workspace_dir in workspace_list])
+
+    def test_sort_to_disk_merges_runs(self):
+        """Scenario Gen Proximity: sorted runs merge by score then index."""
+        import unittest.mock
+        import numpy
+        from osgeo import gdal
+        from natcap.invest import scenario_gen_proximity
+
+        # small tiles so a lowered block size splits the raster into many
+        # runs, and few distinct scores so most pixels tie across runs
+        rng = numpy.random.RandomState(3)
+        score_array = rng.randint(0, 8, size=(200, 200)).astype(
+            numpy.float32)
+        score_array[rng.random_sample(score_array.shape) < 0.1] = -1
+        raster_path = os.path.join(self.workspace_dir, 'scores.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        raster = driver.Create(
+            raster_path, 200, 200, 1, gdal.GDT_Float32,
+            options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+        raster.SetGeoTransform([0, 1, 0, 0, 0, -1])
+        band = raster.GetRasterBand(1)
+        band.SetNoDataValue(-1)
+        band.WriteArray(score_array)
+        band = None
+        raster = None
+
+        working_dir = os.path.join(self.workspace_dir, 'sort_working_dir')
+        os.makedirs(working_dir)
+        valid_indexes = numpy.nonzero(score_array.ravel() != -1)[0]
+        for score_weight in [1.0, -1.0]:
+            valid_scores = (
+                score_array.ravel()[valid_indexes] *
+                numpy.float32(score_weight))
+            expected_order = numpy.lexsort((valid_indexes, valid_scores))
+
+            with unittest.mock.patch.object(
+                    scenario_gen_proximity, '_BLOCK_SIZE', 2**12):
+                batch_list = list(scenario_gen_proximity._sort_to_disk(
+                    raster_path, score_weight=score_weight,
+                    working_dir=working_dir))
+            # the runs are longer than the merge window, so they're merged
+            # in more than one batch
+            self.assertGreater(len(batch_list), 1)
+            numpy.testing.assert_array_equal(
+                numpy.concatenate([scores for scores, _ in batch_list]),
+                valid_scores[expected_order])
+            numpy.testing.assert_array_equal(
+                numpy.concatenate([indexes for _, indexes in batch_list]),
+                valid_indexes[expected_order])
+            self.assertEqual(os.listdir(working_dir), [])
+
+        # the runs are also removed when the merge is stopped early
+        with unittest.mock.patch.object(
+                scenario_gen_proximity, '_BLOCK_SIZE', 2**12):
+            sorted_batches = scenario_gen_proximity._sort_to_disk(
+                raster_path, working_dir=working_dir)
+            next(sorted_batches)
+            sorted_batches.close()
+        self.assertEqual(os.listdir(working_dir), [])
+
     @staticmethod
     def _test_same_files(base_list_path, directory_path):
         """Assert files in `base_list_path` are in `directory_path`.
@@ -321,6 +321,7 @@ class ScenicQualityTests(unittest.TestCase):
             'b_coef': 0,
             'max_valuation_radius': 10.0,
             'n_workers': -1,
+            'save_per_viewpoint_rasters': True,
         }
 
         # Simulate a run where the clipped structures vector already exists.
@@ -1001,6 +1002,125 @@ class ViewshedTests(unittest.TestCase):
             [[1, 1, 0, 1]], dtype=numpy.uint8)
         numpy.testing.assert_equal(visibility_matrix, expected_visibility)
 
+    def test_viewshed_batch(self):
+        """SQ Viewshed: batched viewsheds sum the individual viewsheds."""
+        from natcap.invest.scenic_quality.viewshed import viewshed
+        from natcap.invest.scenic_quality.viewshed import viewshed_batch
+        numpy.random.seed(1)
+        matrix = numpy.random.uniform(0, 10, (20, 20))
+        matrix[8:10, 4:16] = -1
+
+        dem_filepath = os.path.join(self.workspace_dir, 'dem.tif')
+        ViewshedTests.create_dem(matrix, dem_filepath)
+        viewpoint_list = [
+            ((3, 3), None, 1.0, 5.0),
+            ((15, 10), 6.0, 2.5, 0.0),
+            ((10, 17), 4.0, 0.5, 2.0)]
+        valuation_nodata = -99999
+
+        def _valuation_op(distance, visibility, weight):
+            valuation = numpy.full(distance.shape, valuation_nodata,
+                                   dtype=numpy.float64)
+            valuation[visibility != 255] = 0
+            visible = (visibility == 1)
+            valuation[visible] = (1 + 0.5*distance[visible]) * weight
+            return valuation
+
+        expected_visibility_sum = numpy.where(matrix != -1, 0, -1.0)
+        expected_valuation_sum = numpy.where(matrix != -1, 0, -1.0)
+        visibility_path_list = []
+        for index, (viewpoint, max_distance, weight, height) in enumerate(
+                viewpoint_list):
+            visibility_filepath = os.path.join(
+                self.workspace_dir, 'visibility_%d.tif' % index)
+            viewshed((dem_filepath, 1), viewpoint, visibility_filepath,
+                     viewpoint_height=height, max_distance=max_distance)
+            visibility_matrix = gdal.OpenEx(
+                visibility_filepath, gdal.OF_RASTER).ReadAsArray()
+            visible = (matrix != -1) & (visibility_matrix == 1)
+            expected_visibility_sum[visible] += weight
+
+            iy_matrix, ix_matrix = numpy.indices(matrix.shape)
+            distance = numpy.hypot(ix_matrix - viewpoint[0],
+                                   iy_matrix - viewpoint[1])
+            valuation = _valuation_op(distance, visibility_matrix, weight)
+            valid = (matrix != -1) & (valuation != valuation_nodata)
+            expected_valuation_sum[valid] += valuation[valid]
+            visibility_path_list.append(os.path.join(
+                self.workspace_dir, 'batch_visibility_%d.tif' % index))
+
+        visibility_sum_path = os.path.join(
+            self.workspace_dir, 'visibility_sum.tif')
+        valuation_sum_path = os.path.join(
+            self.workspace_dir, 'valuation_sum.tif')
+        viewshed_batch(
+            (dem_filepath, 1), viewpoint_list, visibility_sum_path,
+            valuation_op=_valuation_op,
+            target_valuation_sum_path=valuation_sum_path,
+            valuation_nodata=valuation_nodata,
+            visibility_path_list=visibility_path_list,
+            working_dir=self.workspace_dir)
+
+        for index, visibility_path in enumerate(visibility_path_list):
+            numpy.testing.assert_equal(
+                gdal.OpenEx(visibility_path, gdal.OF_RASTER).ReadAsArray(),
+                gdal.OpenEx(os.path.join(
+                    self.workspace_dir, 'visibility_%d.tif' % index),
+                    gdal.OF_RASTER).ReadAsArray())
+        numpy.testing.assert_almost_equal(
+            gdal.OpenEx(visibility_sum_path, gdal.OF_RASTER).ReadAsArray(),
+            expected_visibility_sum)
+        valuation_sum = gdal.OpenEx(
+            valuation_sum_path, gdal.OF_RASTER).ReadAsArray()
+        numpy.testing.assert_almost_equal(
+            valuation_sum[matrix != -1],
+            expected_valuation_sum[matrix != -1])
+        numpy.testing.assert_equal(
+            valuation_sum[matrix == -1], valuation_nodata)
+
+    def test_viewshed_batch_valuation_distance(self):
+        """SQ Viewshed: batch valuation bounded by the valuation distance."""
+        from natcap.invest.scenic_quality.viewshed import viewshed_batch
+        numpy.random.seed(2)
+        matrix = numpy.random.uniform(0, 10, (40, 40))
+
+        dem_filepath = os.path.join(self.workspace_dir, 'dem.tif')
+        ViewshedTests.create_dem(matrix, dem_filepath)
+        viewpoint_list = [
+            ((5, 5), None, 1.0, 5.0),
+            ((30, 20), 12.0, 2.0, 1.0)]
+        valuation_nodata = -99999
+
+        def _valuation_op(distance, visibility, weight):
+            valuation = numpy.full(distance.shape, valuation_nodata,
+                                   dtype=numpy.float64)
+            valuation[visibility != 255] = 0
+            visible = (visibility == 1) & (distance <= 7)
+            valuation[visible] = (7 - distance[visible]) * weight
+            return valuation
+
+        valuation_sum_list = []
+        for max_valuation_distance in (None, 7):
+            visibility_sum_path = os.path.join(
+                self.workspace_dir, 'visibility_sum_%s.tif' %
+                max_valuation_distance)
+            valuation_sum_path = os.path.join(
+                self.workspace_dir, 'valuation_sum_%s.tif' %
+                max_valuation_distance)
+            viewshed_batch(
+                (dem_filepath, 1), viewpoint_list, visibility_sum_path,
+                valuation_op=_valuation_op,
+                target_valuation_sum_path=valuation_sum_path,
+                valuation_nodata=valuation_nodata,
+                max_valuation_distance=max_valuation_distance,
+                working_dir=self.workspace_dir)
+            valuation_sum_list.append(gdal.OpenEx(
+                valuation_sum_path, gdal.OF_RASTER).ReadAsArray())
+
+        self.assertTrue((valuation_sum_list[0] > 0).any())
+        numpy.testing.assert_equal(
+            valuation_sum_list[0], valuation_sum_list[1])
+
     def test_block_size_check(self):
         """SQ Viewshed: exception raised when blocks not equal, power of 2."""
         from natcap.invest.scenic_quality.viewshed import viewshed
@@ -1254,3 +1374,43 @@ class ViewshedTests(unittest.TestCase):
         visibility_band = visibility_raster.GetRasterBand(1)
         visibility_matrix = visibility_band.ReadAsArray()
         numpy.testing.assert_equal(visibility_matrix, expected_visibility)
+
+    def test_cache_budget(self):
+        """SQ Viewshed: a small block cache does not change the viewshed."""
+        from natcap.invest import managed_raster
+        from natcap.invest.scenic_quality.viewshed import viewshed
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        numpy.random.seed(0)
+        dem_filepath = os.path.join(self.workspace_dir, 'dem.tif')
+        pygeoprocessing.testing.create_raster_on_disk(
+            [numpy.random.randint(0, 10, (100, 100))], (0, 0),
+            projection_wkt=srs.ExportToWkt(), nodata=-1, pixel_size=(1, -1),
+            raster_driver_creation_tuple=(
+                'GTIFF', ('TILED=YES', 'BIGTIFF=YES', 'COMPRESS=LZW',
+                          'BLOCKXSIZE=16', 'BLOCKYSIZE=16')),
+            filename=dem_filepath)
+
+        visibility_matrices = []
+        for cache_mb in (None, 0.001):
+            managed_raster.reset_cache_stats()
+            visibility_filepath = os.path.join(
+                self.workspace_dir, 'visibility_%s.tif' % cache_mb)
+            viewshed((dem_filepath, 1), (50, -50), visibility_filepath,
+                     refraction_coeff=1.0, cache_mb=cache_mb,
+                     aux_filepath=os.path.join(
+                         self.workspace_dir, 'auxiliary.tif'))
+            visibility_raster = gdal.OpenEx(
+                visibility_filepath, gdal.OF_RASTER)
+            visibility_matrices.append(
+                visibility_raster.GetRasterBand(1).ReadAsArray())
+            visibility_raster = None
+            cache_stats = managed_raster.get_cache_stats()
+            self.assertTrue(cache_stats['hits'] > 0)
+            self.assertTrue(cache_stats['misses'] > 0)
+
+        # a 1KB budget caches a single 16x16 block per raster, which
+        # forces evictions but must not affect the result.
+        self.assertTrue(cache_stats['evictions'] > 0)
+        numpy.testing.assert_equal(*visibility_matrices)
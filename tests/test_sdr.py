@@ -225,6 +225,86 @@ class SDRTests(unittest.TestCase):
             args['workspace_dir'], 'watershed_results_sdr.shp')
         assert_expected_results_in_vector(expected_results, vector_path)
 
+    def test_raw_scratch_regression(self):
+        """SDR: raw scratch intermediates give the base regression results."""
+        from unittest import mock
+        from natcap.invest import managed_raster
+        from natcap.invest.sdr import sdr
+
+        args = SDRTests.generate_base_args(self.workspace_dir)
+        with mock.patch.dict(
+                os.environ, {managed_raster.RAW_SCRATCH_ENV_VAR: '1'}):
+            sdr.execute(args)
+
+        intermediate_dir = os.path.join(
+            args['workspace_dir'], 'intermediate_outputs')
+        for scratch_name in ('e_prime.bin', 'f.bin'):
+            self.assertTrue(os.path.exists(
+                os.path.join(intermediate_dir, scratch_name)))
+            self.assertFalse(os.path.exists(os.path.join(
+                intermediate_dir,
+                os.path.splitext(scratch_name)[0] + '.tif')))
+
+        expected_results = {
+            'usle_tot': 12.69931602478,
+            'sed_retent': 402704.96875,
+            'sed_export': 0.7930983305,
+            'sed_dep': 8.58807754517,
+        }
+        vector_path = os.path.join(
+            args['workspace_dir'], 'watershed_results_sdr.shp')
+        assert_expected_results_in_vector(expected_results, vector_path)
+
+    def test_tiled_sediment_deposition(self):
+        """SDR: tiled sediment deposition is identical to the serial route."""
+        from natcap.invest.sdr import sdr_core
+        import pygeoprocessing.routing
+        import pygeoprocessing.testing
+
+        n_rows, n_cols = 97, 113
+        numpy.random.seed(0)
+        row_index, col_index = numpy.mgrid[0:n_rows, 0:n_cols]
+        dem_array = (
+            5 * numpy.sin(col_index / 7.) + 5 * numpy.cos(row_index / 5.) +
+            0.3 * col_index + 3 * numpy.random.random((n_rows, n_cols)))
+        e_prime_array = 10 * numpy.random.random((n_rows, n_cols))
+        sdr_array = 0.8 * numpy.random.random((n_rows, n_cols))
+        sdr_array[numpy.random.random((n_rows, n_cols)) < 0.05] = 0.0
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(26910)
+        path_map = {}
+        for name, array in [
+                ('dem', dem_array), ('e_prime', e_prime_array),
+                ('sdr', sdr_array)]:
+            path_map[name] = os.path.join(self.workspace_dir, name + '.tif')
+            pygeoprocessing.testing.create_raster_on_disk(
+                [array.astype(numpy.float32)], (461261, 4923265),
+                srs.ExportToWkt(), -1.0, (1, -1), filename=path_map[name])
+        flow_dir_path = os.path.join(self.workspace_dir, 'flow_dir.tif')
+        pygeoprocessing.routing.flow_dir_mfd(
+            (path_map['dem'], 1), flow_dir_path)
+
+        result_map = {}
+        for n_workers, tile_size in [(-1, None), (4, 16), (3, 29)]:
+            f_path = os.path.join(self.workspace_dir, 'f%d.tif' % n_workers)
+            deposition_path = os.path.join(
+                self.workspace_dir, 'deposition%d.tif' % n_workers)
+            kwargs = {'n_workers': n_workers}
+            if tile_size is not None:
+                kwargs['tile_size'] = tile_size
+            sdr_core.calculate_sediment_deposition(
+                flow_dir_path, path_map['e_prime'], f_path, path_map['sdr'],
+                deposition_path, **kwargs)
+            result_map[n_workers] = [
+                gdal.OpenEx(path).ReadAsArray()
+                for path in (f_path, deposition_path)]
+
+        for n_workers in (4, 3):
+            for serial_array, tiled_array in zip(
+                    result_map[-1], result_map[n_workers]):
+                numpy.testing.assert_array_equal(serial_array, tiled_array)
+
     def test_regression_with_undefined_nodata(self):
         """SDR base regression test with undefined nodata values.
 
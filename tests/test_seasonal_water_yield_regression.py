@@ -3,6 +3,7 @@ import unittest
 import tempfile
 import shutil
 import os
+import logging
 
 import numpy
 from osgeo import gdal
@@ -10,6 +11,8 @@ from osgeo import ogr
 from osgeo import osr
 import pygeoprocessing.testing
 
+LOGGER = logging.getLogger(__name__)
+
 REGRESSION_DATA = os.path.join(
     os.path.dirname(__file__), '..', 'data', 'invest-test-data',
     'seasonal_water_yield')
@@ -303,6 +306,83 @@ def make_agg_results_csv(result_csv_path,
             open_table.write('0,1.0,51.359875\n')
 
 
+def make_local_recharge_inputs(workspace_dir, n_rows, n_cols):
+    """Make synthetic inputs for ``calculate_local_recharge``.
+
+    The DEM is a tilted surface with ridges so flow paths converge and cross
+    each other, and the monthly rasters vary by pixel and month with a few
+    nodata pixels.  Rasters are written in strips so large sizes can be made
+    without holding a whole raster in memory.
+
+    Parameters:
+        workspace_dir (str): directory to write the rasters to.
+        n_rows, n_cols (int): the size of the rasters.
+
+    Returns:
+        A dict of the ``precip_path_list``, ``et0_path_list``,
+        ``qf_m_path_list``, ``flow_dir_mfd_path`` and ``kc_path_list``
+        arguments of ``calculate_local_recharge``.
+
+    """
+    import pygeoprocessing.routing
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(26910)  # UTM Zone 10N
+    driver = gdal.GetDriverByName('GTiff')
+    strip_size = 256
+
+    def _make_raster(path, value_op, nodata):
+        raster = driver.Create(
+            path, n_cols, n_rows, 1, gdal.GDT_Float32,
+            options=('TILED=YES', 'BIGTIFF=YES', 'BLOCKXSIZE=256',
+                     'BLOCKYSIZE=256'))
+        raster.SetProjection(srs.ExportToWkt())
+        raster.SetGeoTransform([1180000, 1, 0, 690000, 0, -1])
+        band = raster.GetRasterBand(1)
+        band.SetNoDataValue(nodata)
+        for yoff in range(0, n_rows, strip_size):
+            row_array, col_array = numpy.mgrid[
+                yoff:min(yoff+strip_size, n_rows), 0:n_cols]
+            band.WriteArray(
+                value_op(row_array, col_array).astype(numpy.float32),
+                yoff=yoff)
+        band = None
+        raster = None
+
+    dem_path = os.path.join(workspace_dir, 'dem.tif')
+    _make_raster(dem_path, lambda row, col: (
+        numpy.sin(col / 7.0) * 5 + numpy.cos(row / 5.0) * 5 + col * 0.3 +
+        (row * 7919 + col * 104729) % 13 / 4.0), -1)
+    filled_dem_path = os.path.join(workspace_dir, 'filled_dem.tif')
+    pygeoprocessing.routing.fill_pits((dem_path, 1), filled_dem_path)
+    flow_dir_mfd_path = os.path.join(workspace_dir, 'flow_dir_mfd.tif')
+    pygeoprocessing.routing.flow_dir_mfd(
+        (filled_dem_path, 1), flow_dir_mfd_path)
+
+    def _monthly_op(scale, month, nodata):
+        def _op(row, col):
+            result = scale * (
+                1.0 + numpy.sin((row + 3 * col) / 11.0 + month)) / 2.0
+            result[(row * 31 + col * 17 + month) % 97 == 0] = nodata
+            return result
+        return _op
+
+    input_args = {'flow_dir_mfd_path': flow_dir_mfd_path}
+    for key, scale, nodata in [
+            ('precip_path_list', 100.0, -1.0),
+            ('et0_path_list', 80.0, -1.0),
+            ('qf_m_path_list', 20.0, -1.0),
+            ('kc_path_list', 1.2, -9999.0)]:
+        input_args[key] = []
+        for month_index in range(12):
+            path = os.path.join(
+                workspace_dir, '%s_%d.tif' % (key, month_index))
+            _make_raster(
+                path, _monthly_op(scale, month_index, nodata), nodata)
+            input_args[key].append(path)
+    return input_args
+
+
 class SeasonalWaterYieldUnusualDataTests(unittest.TestCase):
     """Tests for InVEST Seasonal Water Yield model that cover cases where
     input data are in an unusual corner case"""
@@ -652,6 +732,40 @@ class SeasonalWaterYieldRegressionTests(unittest.TestCase):
             os.path.join(args['workspace_dir'], 'aggregated_results.shp'),
             agg_results_csv_path)
 
+    def test_raw_scratch_regression(self):
+        """SWY: raw scratch core inputs give the same recharge results."""
+        from unittest import mock
+        from natcap.invest import managed_raster
+        from natcap.invest.seasonal_water_yield import seasonal_water_yield
+
+        workspace_list = []
+        for raw_scratch in ('', '1'):
+            args = SeasonalWaterYieldRegressionTests.generate_base_args(
+                os.path.join(
+                    self.workspace_dir, 'raw' if raw_scratch else 'base'))
+            args['user_defined_climate_zones'] = False
+            args['user_defined_local_recharge'] = False
+            args['monthly_alpha'] = False
+            args['results_suffix'] = ''
+            with mock.patch.dict(
+                    os.environ,
+                    {managed_raster.RAW_SCRATCH_ENV_VAR: raw_scratch}):
+                seasonal_water_yield.execute(args)
+            workspace_list.append(args['workspace_dir'])
+
+        cache_dir = os.path.join(workspace_list[1], 'cache_dir')
+        for scratch_name in ('kc_0.bin', 'prcp_a0.bin', 'et0_a0.bin'):
+            self.assertTrue(os.path.exists(
+                os.path.join(cache_dir, scratch_name)))
+        self.assertFalse(os.path.exists(os.path.join(cache_dir, 'kc_0.tif')))
+
+        for output_name in ('L.tif', 'L_avail.tif', 'B.tif', 'Vri.tif'):
+            numpy.testing.assert_array_equal(
+                gdal.OpenEx(os.path.join(
+                    workspace_list[0], output_name)).ReadAsArray(),
+                gdal.OpenEx(os.path.join(
+                    workspace_list[1], output_name)).ReadAsArray())
+
     def test_bad_biophysical_table(self):
         """SWY bad biophysical table with non-numerical values."""
         from natcap.invest.seasonal_water_yield import seasonal_water_yield
@@ -820,6 +934,90 @@ class SeasonalWaterYieldRegressionTests(unittest.TestCase):
         result_vector = None
 
 
+class SeasonalWaterYieldLocalRechargeTests(unittest.TestCase):
+    """Tests for the Seasonal Water Yield local recharge core."""
+
+    def setUp(self):
+        """Make a temporary workspace."""
+        self.workspace_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary workspace."""
+        shutil.rmtree(self.workspace_dir)
+
+    def _calculate_local_recharge(self, input_args, suffix, **kwargs):
+        """Run ``calculate_local_recharge`` and return its 4 outputs."""
+        from natcap.invest.seasonal_water_yield import (
+            seasonal_water_yield_core)
+
+        target_path_list = [
+            os.path.join(self.workspace_dir, '%s%s.tif' % (name, suffix))
+            for name in ('L', 'L_avail', 'L_sum_avail', 'aet')]
+        seasonal_water_yield_core.calculate_local_recharge(
+            input_args['precip_path_list'], input_args['et0_path_list'],
+            input_args['qf_m_path_list'], input_args['flow_dir_mfd_path'],
+            input_args['kc_path_list'],
+            dict((month, 1/12.) for month in range(1, 13)), 0.9, 0.7, None,
+            *target_path_list, **kwargs)
+        return target_path_list
+
+    def test_tiled_local_recharge(self):
+        """SWY: tiled local recharge matches the serial route exactly."""
+        input_args = make_local_recharge_inputs(self.workspace_dir, 71, 93)
+        serial_path_list = self._calculate_local_recharge(
+            input_args, '_serial')
+        for tile_size, n_workers in [(16, 4), (29, 3)]:
+            tiled_path_list = self._calculate_local_recharge(
+                input_args, '_tiled_%d' % tile_size, n_workers=n_workers,
+                tile_size=tile_size)
+            for serial_path, tiled_path in zip(
+                    serial_path_list, tiled_path_list):
+                numpy.testing.assert_array_equal(
+                    gdal.OpenEx(serial_path).ReadAsArray(),
+                    gdal.OpenEx(tiled_path).ReadAsArray())
+
+    @unittest.skipUnless(
+        os.environ.get('NATCAP_INVEST_BENCHMARK'),
+        'set NATCAP_INVEST_BENCHMARK to run benchmarks')
+    def test_benchmark_local_recharge(self):
+        """SWY: benchmark tiled against serial local recharge.
+
+        Runs on a synthetic ``NATCAP_INVEST_BENCHMARK_SIZE`` (default 20000)
+        pixel square DEM with ``NATCAP_INVEST_BENCHMARK_WORKERS`` (default
+        the number of CPUs) threads.  The workspace needs roughly 80 bytes
+        of disk per pixel.
+        """
+        import multiprocessing
+        import time
+
+        size = int(os.environ.get('NATCAP_INVEST_BENCHMARK_SIZE', 20000))
+        n_workers = int(os.environ.get(
+            'NATCAP_INVEST_BENCHMARK_WORKERS', multiprocessing.cpu_count()))
+        input_args = make_local_recharge_inputs(
+            self.workspace_dir, size, size)
+
+        start_time = time.time()
+        serial_path_list = self._calculate_local_recharge(
+            input_args, '_serial')
+        serial_time = time.time() - start_time
+
+        start_time = time.time()
+        tiled_path_list = self._calculate_local_recharge(
+            input_args, '_tiled', n_workers=n_workers)
+        tiled_time = time.time() - start_time
+
+        LOGGER.info(
+            'local recharge on %dx%d pixels: serial %.1fs, %d workers %.1fs, '
+            '%.2fx speedup', size, size, serial_time, n_workers, tiled_time,
+            serial_time / tiled_time)
+        for serial_path, tiled_path in zip(
+                serial_path_list, tiled_path_list):
+            for (_, serial_block), (_, tiled_block) in zip(
+                    pygeoprocessing.iterblocks((serial_path, 1)),
+                    pygeoprocessing.iterblocks((tiled_path, 1))):
+                numpy.testing.assert_array_equal(serial_block, tiled_block)
+
+
 class SWYValidationTests(unittest.TestCase):
     """Tests for the SWY Model ARGS_SPEC and validation."""
 
@@ -11,6 +11,8 @@ import re
 import glob
 import textwrap
 
+import numpy
+import numpy.testing
 from pygeoprocessing.testing import scm
 import pygeoprocessing.testing
 from osgeo import gdal
@@ -429,6 +431,51 @@ class MakeDirectoryTests(unittest.TestCase):
             utils.make_directories(self.workspace_dir)
 
 
+class NearestNeighborsTests(unittest.TestCase):
+    """Tests for natcap.invest.utils.nearest_neighbors."""
+
+    def test_nearest_neighbors(self):
+        """utils: test nearest neighbors match a brute force search."""
+        from natcap.invest import utils
+        random_state = numpy.random.RandomState(0)
+        # integer coordinates so that some points are equally near
+        query_xy_array = random_state.randint(0, 20, (500, 2))
+        base_xy_array = random_state.randint(0, 20, (30, 2))
+        distance_array, index_array = utils.nearest_neighbors(
+            query_xy_array, base_xy_array)
+
+        pairwise_distances = numpy.sqrt(numpy.sum(
+            (query_xy_array[:, numpy.newaxis, :] -
+             base_xy_array[numpy.newaxis, :, :])**2, axis=2))
+        numpy.testing.assert_allclose(
+            distance_array, pairwise_distances.min(axis=1))
+        numpy.testing.assert_array_equal(
+            index_array, pairwise_distances.argmin(axis=1))
+
+    def test_nearest_neighbors_prebuilt_tree(self):
+        """utils: test a prebuilt tree gives the same nearest neighbors."""
+        import scipy.spatial
+        from natcap.invest import utils
+        random_state = numpy.random.RandomState(1)
+        base_xy_array = random_state.randint(0, 20, (30, 2))
+        kd_tree = scipy.spatial.cKDTree(base_xy_array.astype(numpy.float64))
+        for _ in range(3):
+            query_xy_array = random_state.randint(0, 20, (100, 2))
+            expected_distances, expected_indexes = utils.nearest_neighbors(
+                query_xy_array, base_xy_array)
+            distance_array, index_array = utils.nearest_neighbors(
+                query_xy_array, kd_tree)
+            numpy.testing.assert_array_equal(
+                distance_array, expected_distances)
+            numpy.testing.assert_array_equal(index_array, expected_indexes)
+
+    def test_nearest_neighbors_no_base_points(self):
+        """utils: test ValueError raised if there are no base points."""
+        from natcap.invest import utils
+        with self.assertRaises(ValueError):
+            utils.nearest_neighbors([(0, 0)], numpy.empty((0, 2)))
+
+
 class GDALWarningsLoggingTests(unittest.TestCase):
     def setUp(self):
         self.workspace = tempfile.mkdtemp()
@@ -625,3 +672,44 @@ class BuildLookupFromCSVTests(unittest.TestCase):
         self.assertEqual(lookup_dict[4]['header 2'], 5)
         self.assertEqual(lookup_dict[4]['header 3'], 'foo')
         self.assertEqual(lookup_dict[1]['header 1'], 1)
+
+    def test_read_lookup_table_columns_and_cache(self):
+        """utils: test the columns of a lookup table and its cache."""
+        from natcap.invest import utils
+
+        csv_file = os.path.join(self.workspace, 'csv.csv')
+        with open(csv_file, 'w') as file_obj:
+            file_obj.write(textwrap.dedent(
+                """
+                lucode,Desc,value
+                1,Forest,0.5
+                ,,
+                2,AG,
+                """
+            ).strip())
+
+        cache_dir = os.path.join(self.workspace, 'table_cache')
+        lookup_table = utils.read_lookup_table(
+            csv_file, 'lucode', cache_dir=cache_dir)
+        self.assertEqual(list(lookup_table), [1, 2])
+        self.assertEqual(list(lookup_table.column('desc')), ['forest', 'ag'])
+        numpy.testing.assert_array_equal(
+            lookup_table.column('value'), [0.5, numpy.nan])
+        self.assertEqual(
+            lookup_table[2], {'lucode': 2, 'desc': 'ag', 'value': ''})
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # a table with the same contents is loaded from the cache, and the
+        # lookup dictionary is the same as the lookup table's rows
+        lookup_dict = utils.build_lookup_from_csv(
+            csv_file, 'lucode', cache_dir=cache_dir)
+        self.assertEqual(lookup_dict, lookup_table.to_dict())
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # an edited table is parsed again
+        with open(csv_file, 'a') as file_obj:
+            file_obj.write('\n3,Urban,1.5')
+        lookup_dict = utils.build_lookup_from_csv(
+            csv_file, 'lucode', cache_dir=cache_dir)
+        self.assertEqual(lookup_dict[3]['value'], 1.5)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
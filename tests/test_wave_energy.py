@@ -365,6 +365,22 @@ class WaveEnergyUnitTests(unittest.TestCase):
             numpy.testing.assert_array_equal(result['bin_matrix'][key],
                                              exp_res['bin_matrix'][key])
 
+    def test_binary_wave_data_to_dict_bounding_box(self):
+        """WaveEnergy: testing '_binary_wave_data_to_dict' I,J filter."""
+        from natcap.invest import wave_energy
+
+        wave_file_path = os.path.join(REGRESSION_DATA, 'example_ww3_binary.bin')
+
+        result = wave_energy._binary_wave_data_to_dict(
+            wave_file_path, ij_bounding_box=[102, 371, 102, 371])
+
+        self.assertEqual(list(result['bin_matrix']), [(102, 371)])
+        numpy.testing.assert_array_equal(
+            result['bin_matrix'][(102, 371)],
+            numpy.array([[0, 0, 0, 0], [0, 0, 3, 27]], dtype=numpy.float32))
+        with self.assertRaises(KeyError):
+            result['bin_matrix'][(102, 370)]
+
 
 class WaveEnergyRegressionTests(unittest.TestCase):
     """Regression tests for the Wave Energy module."""
@@ -91,7 +91,7 @@ class WindEnergyUnitTests(unittest.TestCase):
         tmp_dist_final_path = os.path.join(self.workspace_dir, 'dist_final.tif')
         # Call function to test given testing inputs
         wind_energy._calculate_distances_land_grid(
-            land_shape_path, harvested_masked_path, tmp_dist_final_path, '')
+            land_shape_path, harvested_masked_path, tmp_dist_final_path)
 
         # Compare the results
         result = gdal.Open(tmp_dist_final_path)
@@ -175,6 +175,58 @@ class WindEnergyUnitTests(unittest.TestCase):
         }
         self.assertDictEqual(expected_result, result)
 
+    def test_integrate_wind_energy_block(self):
+        """WindEnergy: testing vectorized Weibull integrals against quad."""
+        from scipy import integrate
+        from natcap.invest import wind_energy
+
+        random_state = numpy.random.RandomState(0)
+        # include sharply peaked and long tailed distributions at the
+        # corners of the range of parameters
+        shape_array = numpy.append(
+            random_state.uniform(1, 4, 20), [0.5, 10, 10, 10, 0.5, 0.5])
+        scale_array = numpy.append(
+            random_state.uniform(1, 20, 20), [8, 8, 1, 2, 1, 20])
+        v_in, v_rate, v_out, exp_pwr_curve = 4.0, 12.5, 25.0, 2
+
+        density_array, harvested_array = (
+            wind_energy._integrate_wind_energy_block(
+                (shape_array, scale_array, v_in, v_rate, v_out,
+                 exp_pwr_curve)))
+
+        def _weibull(v_speed, k_shape, l_scale):
+            return ((k_shape / l_scale) * (v_speed / l_scale)**(k_shape - 1) *
+                    numpy.exp(-(v_speed / l_scale)**k_shape))
+
+        def _quad(func, lower_bound, upper_bound, l_scale):
+            # tell quad where the peak is so it isn't missed
+            points = None
+            if lower_bound < l_scale < upper_bound:
+                points = [l_scale]
+            return integrate.quad(
+                func, lower_bound, upper_bound, points=points, limit=500,
+                epsabs=0, epsrel=1e-12)[0]
+
+        for index, (k_shape, l_scale) in enumerate(
+                zip(shape_array, scale_array)):
+            expected_density = _quad(
+                lambda v: _weibull(v, k_shape, l_scale) * v**3, 0, 50,
+                l_scale)
+            expected_harvested = _quad(
+                lambda v: (
+                    (v**exp_pwr_curve - v_in**exp_pwr_curve) /
+                    (v_rate**exp_pwr_curve - v_in**exp_pwr_curve) *
+                    _weibull(v, k_shape, l_scale)), v_in, v_rate, l_scale)
+            expected_harvested += _quad(
+                lambda v: _weibull(v, k_shape, l_scale), v_rate, v_out,
+                l_scale)
+            numpy.testing.assert_allclose(
+                density_array[index], expected_density, rtol=1e-6,
+                atol=1e-12)
+            numpy.testing.assert_allclose(
+                harvested_array[index], expected_harvested, rtol=1e-6,
+                atol=1e-12)
+
     def test_calculate_grid_dist_on_raster(self):
         """WindEnergy: testing 'calculate_distances_grid' function."""
         from natcap.invest import wind_energy